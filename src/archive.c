@@ -13,9 +13,10 @@
 #include "utils/thread.h"
 #include "instr_time.h"
 
-static int push_file_internal_uncompressed(const char *wal_file_name, const char *pg_xlog_dir,
-								  const char *archive_dir, bool overwrite, bool no_sync,
-								  uint32 archive_timeout);
+static int push_file_internal(const char *wal_file_name, const char *pg_xlog_dir,
+							  const char *archive_dir, bool overwrite, bool no_sync,
+							  CompressAlg compress_alg, int compress_level,
+							  uint32 archive_timeout);
 #ifdef HAVE_LIBZ
 static int push_file_internal_gz(const char *wal_file_name, const char *pg_xlog_dir,
 									 const char *archive_dir, bool overwrite, bool no_sync,
@@ -27,6 +28,8 @@ static bool get_wal_file(const char *filename, const char *from_path, const char
 													bool prefetch_mode);
 static int get_wal_file_internal(const char *from_path, const char *to_path, FILE *out,
 								 bool is_decompress);
+static int get_wal_file_stream(const char *from_fullpath, const char *suffix,
+							   const char *to_fullpath, FILE *out, char **errmsg);
 #ifdef HAVE_LIBZ
 static const char *get_gz_error(gzFile gzf, int errnum);
 #endif
@@ -96,7 +99,7 @@ typedef struct WALSegno
 static int push_file(WALSegno *xlogfile, const char *archive_status_dir,
 								   const char *pg_xlog_dir, const char *archive_dir,
 								   bool overwrite, bool no_sync, uint32 archive_timeout,
-								   bool no_ready_rename, bool is_compress,
+								   bool no_ready_rename, CompressAlg compress_alg,
 								   int compress_level);
 
 static parray *setup_push_filelist(const char *archive_status_dir,
@@ -171,6 +174,9 @@ do_archive_push(InstanceConfig *instance, char *wal_file_path,
 	if (instance->compress_alg == ZLIB_COMPRESS)
 		is_compress = true;
 #endif
+	/* zstd and lz4 segments are compressed as a single stream */
+	if (compress_stream_supported(instance->compress_alg))
+		is_compress = true;
 
 	/*  Setup filelist and locks */
 	batch_files = setup_push_filelist(archive_status_dir, wal_file_name, batch_size);
@@ -183,15 +189,16 @@ do_archive_push(InstanceConfig *instance, char *wal_file_path,
 					"threads: %i/%i, batch: %lu/%i, compression: %s",
 						wal_file_name, n_threads, num_threads,
 						parray_num(batch_files), batch_size,
-						is_compress ? "zlib" : "none");
+						is_compress ? deparse_compress_alg(instance->compress_alg) : "none");
 
 	num_threads = n_threads;
 
 	/* Single-thread push
 	 * We don`t want to start multi-thread push, if number of threads in equal to 1,
 	 * or the number of files ready to push is small.
-	 * Multithreading in remote mode isn`t cheap,
-	 * establishing ssh connection can take 100-200ms, so running and terminating
+	 * Multithreading in remote mode isn`t cheap, even though agents of all
+	 * threads share one ssh connection, starting a new session still takes
+	 * a round trip or two, so running and terminating
 	 * one thread using generic multithread approach can take
 	 * almost as much time as copying itself.
 	 * TODO: maybe we should be more conservative and force single thread
@@ -210,7 +217,8 @@ do_archive_push(InstanceConfig *instance, char *wal_file_path,
 						   overwrite, no_sync,
 						   instance->archive_timeout,
 						   no_ready_rename || (strcmp(xlogfile->name, wal_file_name) == 0) ? true : false,
-						   is_compress && IsXLogFileName(xlogfile->name) ? true : false,
+						   is_compress && IsXLogFileName(xlogfile->name) ?
+								instance->compress_alg : NONE_COMPRESS,
 						   instance->compress_level);
 			if (rc == 0)
 				n_total_pushed++;
@@ -279,6 +287,13 @@ do_archive_push(InstanceConfig *instance, char *wal_file_path,
 	 * time-sensetive operation, so we skip freeing stuff.
 	 */
 
+	/*
+	 * Overwritten files keep their names, so cached list of WAL files
+	 * may contain their old sizes.
+	 */
+	if (overwrite && n_total_pushed > 0)
+		catalog_drop_index(instance->name, true);
+
 push_done:
 	fio_disconnect();
 	/* calculate elapsed time */
@@ -332,7 +347,8 @@ push_files(void *arg)
 					   args->overwrite, args->no_sync,
 					   args->archive_timeout, no_ready_rename,
 					   /* do not compress .backup, .partial and .history files */
-					   args->compress && IsXLogFileName(xlogfile->name) ? true : false,
+					   args->compress && IsXLogFileName(xlogfile->name) ?
+							args->compress_alg : NONE_COMPRESS,
 					   args->compress_level);
 
 		if (rc == 0)
@@ -352,7 +368,7 @@ int
 push_file(WALSegno *xlogfile, const char *archive_status_dir,
 		  const char *pg_xlog_dir, const char *archive_dir,
 		  bool overwrite, bool no_sync, uint32 archive_timeout,
-		  bool no_ready_rename, bool is_compress,
+		  bool no_ready_rename, CompressAlg compress_alg,
 		  int compress_level)
 {
 	int     rc;
@@ -362,17 +378,18 @@ push_file(WALSegno *xlogfile, const char *archive_status_dir,
 
 	elog(LOG, "pushing file \"%s\"", xlogfile->name);
 
-	/* If compression is not required, then just copy it as is */
-	if (!is_compress)
-		rc = push_file_internal_uncompressed(xlogfile->name, pg_xlog_dir,
-											 archive_dir, overwrite, no_sync,
-											 archive_timeout);
 #ifdef HAVE_LIBZ
-	else
+	if (compress_alg == ZLIB_COMPRESS)
 		rc = push_file_internal_gz(xlogfile->name, pg_xlog_dir, archive_dir,
 								   overwrite, no_sync, compress_level,
 								   archive_timeout);
+	else
 #endif
+	/* copy it as is or apply streaming compression */
+		rc = push_file_internal(xlogfile->name, pg_xlog_dir,
+								archive_dir, overwrite, no_sync,
+								compress_alg, compress_level,
+								archive_timeout);
 
 	/* take '--no-ready-rename' flag into account */
 	if (!no_ready_rename)
@@ -397,18 +414,27 @@ push_file(WALSegno *xlogfile, const char *archive_status_dir,
 	return rc;
 }
 
+/* Write callback for compression stream, used by push_file_internal() */
+static size_t
+push_stream_write(void *arg, const void *buf, size_t size)
+{
+	return fio_write_async(*(int *) arg, buf, size);
+}
+
 /*
- * Copy non WAL file, such as .backup or .history file, into WAL archive.
- * Such files are not compressed.
+ * Copy file into WAL archive as is, or apply zstd or lz4 streaming
+ * compression to it. Non WAL files, such as .backup or .history files,
+ * are never compressed.
  * Returns:
  *  0 - file was successfully pushed
  *  1 - push was skipped because file already exists in the archive and
  *      has the same checksum
  */
 int
-push_file_internal_uncompressed(const char *wal_file_name, const char *pg_xlog_dir,
-								const char *archive_dir, bool overwrite, bool no_sync,
-								uint32 archive_timeout)
+push_file_internal(const char *wal_file_name, const char *pg_xlog_dir,
+				   const char *archive_dir, bool overwrite, bool no_sync,
+				   CompressAlg compress_alg, int compress_level,
+				   uint32 archive_timeout)
 {
 	FILE	   *in = NULL;
 	int			out = -1;
@@ -423,6 +449,9 @@ push_file_internal_uncompressed(const char *wal_file_name, const char *pg_xlog_d
 	bool		partial_is_stale = true;
 	/* remote agent error message */
 	char       *errmsg = NULL;
+	/* streaming compression */
+	CompressStream *cs = NULL;
+	const char *cs_errmsg = NULL;
 
 	/* from path */
 	join_path_components(from_fullpath, pg_xlog_dir, wal_file_name);
@@ -431,6 +460,11 @@ push_file_internal_uncompressed(const char *wal_file_name, const char *pg_xlog_d
 	join_path_components(to_fullpath, archive_dir, wal_file_name);
 	canonicalize_path(to_fullpath);
 
+	/* destination file with .zst or .lz4 suffix */
+	if (compress_stream_suffix(compress_alg))
+		snprintf(to_fullpath + strlen(to_fullpath), MAXPGPATH - strlen(to_fullpath),
+				 ".%s", compress_stream_suffix(compress_alg));
+
 	/* Open source file for read */
 	in = fopen(from_fullpath, PG_BINARY_R);
 	if (in == NULL)
@@ -538,7 +572,8 @@ part_opened:
 		pg_crc32 crc32_dst;
 
 		crc32_src = fio_get_crc32(from_fullpath, FIO_DB_HOST, false);
-		crc32_dst = fio_get_crc32(to_fullpath, FIO_BACKUP_HOST, false);
+		crc32_dst = fio_get_crc32(to_fullpath, FIO_BACKUP_HOST,
+								  compress_alg != NONE_COMPRESS);
 
 		if (crc32_src == crc32_dst)
 		{
@@ -567,6 +602,18 @@ part_opened:
 		}
 	}
 
+	if (compress_alg != NONE_COMPRESS)
+	{
+		cs = compress_stream_init(compress_alg, compress_level, false,
+								  push_stream_write, &out, &cs_errmsg);
+		if (cs == NULL)
+		{
+			fio_unlink(to_fullpath_part, FIO_BACKUP_HOST);
+			elog(ERROR, "Cannot compress WAL file \"%s\": %s",
+						from_fullpath, cs_errmsg);
+		}
+	}
+
 	/* copy content */
 	for (;;)
 	{
@@ -581,7 +628,25 @@ part_opened:
 						from_fullpath, strerror(errno));
 		}
 
-		if (read_len > 0 && fio_write_async(out, buf, read_len) != read_len)
+		if (cs)
+		{
+			/* compress read data, end of source file is end of the frame */
+			int rc = compress_stream_process(cs, buf, read_len, feof(in) != 0, &cs_errmsg);
+
+			if (rc == ZLIB_ERROR)
+			{
+				fio_unlink(to_fullpath_part, FIO_BACKUP_HOST);
+				elog(ERROR, "Cannot compress WAL file \"%s\": %s",
+							from_fullpath, cs_errmsg);
+			}
+			else if (rc != SEND_OK)
+			{
+				fio_unlink(to_fullpath_part, FIO_BACKUP_HOST);
+				elog(ERROR, "Cannot write to destination temp file \"%s\": %s",
+							to_fullpath_part, strerror(errno));
+			}
+		}
+		else if (read_len > 0 && fio_write_async(out, buf, read_len) != read_len)
 		{
 			fio_unlink(to_fullpath_part, FIO_BACKUP_HOST);
 			elog(ERROR, "Cannot write to destination temp file \"%s\": %s",
@@ -594,6 +659,7 @@ part_opened:
 
 	/* close source file */
 	fclose(in);
+	compress_stream_free(cs);
 
 	/* Writing is asynchronous in case of push in remote mode, so check agent status */
 	if (fio_check_error_fd(out, &errmsg))
@@ -1214,6 +1280,77 @@ get_done:
 				wal_file_name, pretty_time_str);
 }
 
+/*
+ * Read segments of WAL archive, which were not read yet, and save their
+ * summaries: first and last record, ranges of xids and commit timestamps.
+ * Later validate and restore to a recovery target use the summaries to skip
+ * segments, which cannot contain the target, instead of reading them.
+ *
+ * The last record of a segment may continue in the next one, so a segment is
+ * indexed only when the next segment is archived.
+ */
+void
+do_index_wal(InstanceConfig *instance)
+{
+	parray	   *timelines;
+	instr_time	start_time, end_time;
+	char		pretty_time_str[20];
+	size_t		n_indexed = 0;
+	bool		failed = false;
+	int			i, j;
+
+	INSTR_TIME_SET_CURRENT(start_time);
+
+	timelines = catalog_get_timelines(instance);
+
+	for (i = 0; i < parray_num(timelines); i++)
+	{
+		timelineInfo *tlinfo = (timelineInfo *) parray_get(timelines, i);
+		time_t		min_time;
+		time_t		max_time;
+
+		for (j = 0; j < parray_num(tlinfo->xlog_ranges); j++)
+		{
+			xlogRange  *range = (xlogRange *) parray_get(tlinfo->xlog_ranges, j);
+			xlogRange  *next = NULL;
+			XLogSegNo	end_segno = range->end_segno;
+
+			if (j + 1 < parray_num(tlinfo->xlog_ranges))
+				next = (xlogRange *) parray_get(tlinfo->xlog_ranges, j + 1);
+
+			if (next == NULL || next->begin_segno > range->end_segno + 1)
+			{
+				if (end_segno == range->begin_segno)
+					continue;
+				end_segno--;
+			}
+
+			if (!summarize_wal(instance->arclog_path, tlinfo->tli,
+							   instance->xlog_seg_size, range->begin_segno,
+							   end_segno))
+				failed = true;
+		}
+
+		get_wal_summary_range(instance->arclog_path, tlinfo->tli,
+							  &n_indexed, &min_time, &max_time);
+		elog(INFO, "Timeline %u: %lu of %lu WAL segments are indexed",
+			 tlinfo->tli, (unsigned long) n_indexed,
+			 (unsigned long) tlinfo->n_xlog_files);
+	}
+
+	INSTR_TIME_SET_CURRENT(end_time);
+	INSTR_TIME_SUBTRACT(end_time, start_time);
+	pretty_time_interval(INSTR_TIME_GET_DOUBLE(end_time), pretty_time_str,
+						 lengthof(pretty_time_str));
+
+	if (failed)
+		elog(ERROR, "Some WAL segments of instance '%s' cannot be read, time elapsed: %s",
+			 instance->name, pretty_time_str);
+
+	elog(INFO, "WAL archive of instance '%s' is indexed, time elapsed: %s",
+		 instance->name, pretty_time_str);
+}
+
 /*
  * Copy batch_size of regular WAL segments into prefetch directory,
  * starting with first_file.
@@ -1400,8 +1537,11 @@ get_wal_file(const char *filename, const char *from_fullpath,
 		/* If requested file is regular WAL segment, then try to open it with '.gz' suffix... */
 		if (IsXLogFileName(filename))
 			rc = fio_send_file_gz(from_fullpath_gz, to_fullpath, out, &errmsg);
-		if (rc == FILE_MISSING)
 #endif
+		/* ... or with '.zst' and '.lz4' suffixes ... */
+		if (rc == FILE_MISSING && IsXLogFileName(filename))
+			rc = get_wal_file_stream(from_fullpath, "", to_fullpath, out, &errmsg);
+		if (rc == FILE_MISSING)
 			/* ... failing that, use uncompressed */
 			rc = fio_send_file(from_fullpath, to_fullpath, out, NULL, &errmsg);
 
@@ -1414,8 +1554,11 @@ get_wal_file(const char *filename, const char *from_fullpath,
 			/* '.gz.partial' goes first ... */
 			snprintf(from_partial, sizeof(from_partial), "%s.gz.partial", from_fullpath);
 			rc = fio_send_file_gz(from_partial, to_fullpath, out, &errmsg);
-			if (rc == FILE_MISSING)
 #endif
+			/* ... then '.zst.partial' and '.lz4.partial' ... */
+			if (rc == FILE_MISSING)
+				rc = get_wal_file_stream(from_fullpath, ".partial", to_fullpath, out, &errmsg);
+			if (rc == FILE_MISSING)
 			{
 				/* ... failing that, use '.partial' */
 				snprintf(from_partial, sizeof(from_partial), "%s.partial", from_fullpath);
@@ -1442,8 +1585,11 @@ get_wal_file(const char *filename, const char *from_fullpath,
 		/* If requested file is regular WAL segment, then try to open it with '.gz' suffix... */
 		if (IsXLogFileName(filename))
 			rc = get_wal_file_internal(from_fullpath_gz, to_fullpath, out, true);
-		if (rc == FILE_MISSING)
 #endif
+		/* ... or with '.zst' and '.lz4' suffixes ... */
+		if (rc == FILE_MISSING && IsXLogFileName(filename))
+			rc = get_wal_file_stream(from_fullpath, "", to_fullpath, out, NULL);
+		if (rc == FILE_MISSING)
 			/* ... failing that, use uncompressed */
 			rc = get_wal_file_internal(from_fullpath, to_fullpath, out, false);
 
@@ -1456,8 +1602,11 @@ get_wal_file(const char *filename, const char *from_fullpath,
 			/* '.gz.partial' goes first ... */
 			snprintf(from_partial, sizeof(from_partial), "%s.gz.partial", from_fullpath);
 			rc = get_wal_file_internal(from_partial, to_fullpath, out, true);
-			if (rc == FILE_MISSING)
 #endif
+			/* ... then '.zst.partial' and '.lz4.partial' ... */
+			if (rc == FILE_MISSING)
+				rc = get_wal_file_stream(from_fullpath, ".partial", to_fullpath, out, NULL);
+			if (rc == FILE_MISSING)
 			{
 				/* ... failing that, use '.partial' */
 				snprintf(from_partial, sizeof(from_partial), "%s.partial", from_fullpath);
@@ -1642,6 +1791,63 @@ cleanup:
 	return exit_code;
 }
 
+/* Write callback for decompression stream, used by get_wal_file_stream() */
+static size_t
+get_stream_write(void *arg, const void *buf, size_t size)
+{
+	return fwrite(buf, 1, size, (FILE *) arg);
+}
+
+/*
+ * Copy WAL segment, compressed with zstd or lz4 streaming compression,
+ * from archive. All streaming algorithms supported by this build are tried
+ * in turn, 'suffix' is appended after compression suffix, e.g. '.partial'.
+ * Return codes are the same as for get_wal_file_internal().
+ * errmsg is used only in remote mode.
+ */
+int
+get_wal_file_stream(const char *from_fullpath, const char *suffix,
+					const char *to_fullpath, FILE *out, char **errmsg)
+{
+	int			i;
+	int			rc = FILE_MISSING;
+	CompressAlg	algs[] = {ZSTD_COMPRESS, LZ4_COMPRESS};
+
+	for (i = 0; i < lengthof(algs) && rc == FILE_MISSING; i++)
+	{
+		char		from_path[MAXPGPATH];
+		const char *cs_errmsg = NULL;
+
+		if (!compress_stream_supported(algs[i]))
+			continue;
+
+		snprintf(from_path, sizeof(from_path), "%s.%s%s", from_fullpath,
+				 compress_stream_suffix(algs[i]), suffix);
+
+		if (fio_is_remote(FIO_BACKUP_HOST))
+		{
+			rc = fio_send_file_stream(from_path, to_fullpath, out, algs[i], errmsg);
+			continue;
+		}
+
+		elog(VERBOSE, "Attempting to open compressed WAL file '%s'", from_path);
+
+		rc = decompress_file_stream(from_path, algs[i], get_stream_write, out, &cs_errmsg);
+
+		if (rc == WRITE_FAILED)
+			elog(WARNING, "Cannot write to WAL file '%s': %s",
+				 to_fullpath, strerror(errno));
+		else if (rc == OPEN_FAILED)
+			elog(WARNING, "Cannot open compressed WAL file \"%s\": %s",
+				 from_path, cs_errmsg);
+		else if (rc != SEND_OK && rc != FILE_MISSING)
+			elog(WARNING, "Cannot read compressed WAL file \"%s\": %s",
+				 from_path, cs_errmsg);
+	}
+
+	return rc;
+}
+
 bool next_wal_segment_exists(TimeLineID tli, XLogSegNo segno, const char *prefetch_dir, uint32 wal_seg_size)
 {
 	char        next_wal_filename[MAXFNAMELEN];
@@ -40,6 +40,9 @@ static bool backup_in_progress = false;
 /* Is pg_stop_backup() was sent */
 static bool pg_stop_backup_is_sent = false;
 
+/* Interrupted backup being resumed, NULL for new backup */
+static pgBackup *resumed_backup = NULL;
+
 /*
  * Backup routines
  */
@@ -53,6 +56,17 @@ static void pg_start_backup(const char *label, bool smooth, pgBackup *backup,
 							PGNodeInfo *nodeInfo, PGconn *conn);
 static void pg_switch_wal(PGconn *conn);
 static void pg_stop_backup(pgBackup *backup, PGconn *pg_startbackup_conn, PGNodeInfo *nodeInfo);
+#if PG_VERSION_NUM >= 90600
+static XLogRecPtr get_start_checkpoint_location(PGconn *conn, XLogRecPtr redo_lsn);
+#endif
+
+/* resume routines */
+static void init_resumed_backup(void);
+static void resume_backup_filelist(parray *files, const char *external_prefix);
+static bool check_resumed_file(pgFile *file, const char *to_fullpath,
+							   HeaderMap *hdr_map, uint32 checksum_version);
+static XLogRecPtr get_resumed_stream_lsn(const char *stream_dir);
+static char *make_resumed_backup_label(const char *label);
 
 static XLogRecPtr wait_wal_lsn(XLogRecPtr lsn, bool is_start_lsn, TimeLineID tli,
 								bool in_prev_segment, bool segment_only,
@@ -103,10 +117,18 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 	/* arrays with meta info for multi threaded backup */
 	pthread_t	*threads;
 	backup_files_arg *threads_args;
+	FileQueue  *queue;
 	bool		backup_isok = true;
 
 	pgBackup   *prev_backup = NULL;
 	parray	   *prev_backup_filelist = NULL;
+	pgBackup   *dedup_backup = NULL;
+	parray	   *dedup_backup_filelist = NULL;
+	bool		dedup_external_dirs = false;
+	int			n_dedup_files = 0;
+	int64		dedup_bytes = 0;
+	int			n_resumed_files = 0;
+	int64		resumed_bytes = 0;
 	parray	   *backup_list = NULL;
 	parray	   *external_dirs = NULL;
 	parray	   *database_map = NULL;
@@ -146,6 +168,29 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 	current.tli = get_current_timeline_from_control(false);
 #endif
 
+	if (resumed_backup)
+	{
+		if (current.tli != resumed_backup->tli)
+			elog(ERROR, "Backup %s was started on timeline %u, but current timeline is %u. "
+				 "Backup cannot be resumed",
+				 base36enc(current.start_time), resumed_backup->tli, current.tli);
+
+		elog(INFO, "Backup is resumed at %X/%X, WAL replay will start at %X/%X",
+			 (uint32) (current.start_lsn >> 32), (uint32) (current.start_lsn),
+			 (uint32) (resumed_backup->start_lsn >> 32),
+			 (uint32) (resumed_backup->start_lsn));
+
+		/*
+		 * Files copied before interruption are consistent only if WAL
+		 * is replayed from the start of the interrupted backup.
+		 */
+		current.start_lsn = resumed_backup->start_lsn;
+	}
+#if PG_VERSION_NUM >= 90600
+	else if (!exclusive_backup)
+		current.checkpoint_lsn = get_start_checkpoint_location(backup_conn, current.start_lsn);
+#endif
+
 	/*
 	 * In incremental backup mode ensure that already-validated
 	 * backup on current timeline exists and get its filelist.
@@ -196,6 +241,10 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 
 		elog(INFO, "Parent backup: %s", base36enc(prev_backup->start_time));
 
+		if (resumed_backup && resumed_backup->parent_backup != prev_backup->start_time)
+			elog(ERROR, "Backup %s was started with another parent backup. "
+				 "Backup cannot be resumed", base36enc(current.start_time));
+
 		/* Files of previous backup needed by DELTA backup */
 		prev_backup_filelist = get_backup_filelist(prev_backup, true);
 
@@ -206,6 +255,53 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 		write_backup(&current, true);
 	}
 
+	/*
+	 * In FULL backup mode unchanged non-data files can be shared
+	 * with the latest valid FULL backup instead of being copied.
+	 */
+	if (current.backup_mode == BACKUP_MODE_FULL && dedup_mode != DEDUP_NONE)
+	{
+		backup_list = catalog_get_backup_list(instance_name, INVALID_BACKUP_ID);
+
+		/* backup list is sorted in order of descending ID */
+		for (i = 0; i < parray_num(backup_list); i++)
+		{
+			pgBackup   *backup = (pgBackup *) parray_get(backup_list, i);
+
+			if (backup->backup_mode == BACKUP_MODE_FULL &&
+				(backup->status == BACKUP_STATUS_OK ||
+				 backup->status == BACKUP_STATUS_DONE))
+			{
+				dedup_backup = backup;
+				break;
+			}
+		}
+
+		/* protect shared files from deletion until backup is done */
+		if (dedup_backup && !lock_backup(dedup_backup, true, false))
+		{
+			elog(WARNING, "Cannot lock backup %s, unchanged files will be copied",
+				 base36enc(dedup_backup->start_time));
+			dedup_backup = NULL;
+		}
+
+		if (dedup_backup)
+		{
+			elog(INFO, "Unchanged files are taken from backup %s",
+				 base36enc(dedup_backup->start_time));
+
+			dedup_backup_filelist = get_backup_filelist(dedup_backup, true);
+			parray_qsort(dedup_backup_filelist, pgFileCompareRelPathWithExternal);
+
+			/* external directories are numbered in order of external_dir_str */
+			if (current.external_dir_str && dedup_backup->external_dir_str)
+				dedup_external_dirs = strcmp(current.external_dir_str,
+											 dedup_backup->external_dir_str) == 0;
+		}
+		else
+			elog(WARNING, "Valid FULL backup is not found, unchanged files will be copied");
+	}
+
 	/*
 	 * It`s illegal to take PTRACK backup if LSN from ptrack_control() is not
 	 * equal to start_lsn of previous backup.
@@ -274,11 +370,17 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 	/* start stream replication */
 	if (stream_wal)
 	{
+		XLogRecPtr	stream_start_lsn = current.start_lsn;
+
 		join_path_components(dst_backup_path, current.database_dir, PG_XLOG_DIR);
 		fio_mkdir(dst_backup_path, DIR_PERMISSION, FIO_BACKUP_HOST);
 
+		/* keep WAL streamed before the backup was interrupted */
+		if (resumed_backup)
+			stream_start_lsn = get_resumed_stream_lsn(dst_backup_path);
+
 		start_WAL_streaming(backup_conn, dst_backup_path, &instance_config.conn_opt,
-							current.start_lsn, current.tli);
+							stream_start_lsn, current.tli);
 	}
 
 	/* initialize backup's file list */
@@ -287,7 +389,7 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 
 	/* list files with the logical path. omit $PGDATA */
 	fio_list_dir(backup_files_list, instance_config.pgdata,
-				 true, true, false, backup_logs, true, 0);
+				 true, true, false, backup_logs, true, 0, FIO_DB_HOST);
 
 	/*
 	 * Get database_map (name to oid) for use in partial restore feature.
@@ -305,12 +407,8 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 		{
 			/* External dirs numeration starts with 1.
 			 * 0 value is not external dir */
-			if (fio_is_remote(FIO_DB_HOST))
-				fio_list_dir(backup_files_list, parray_get(external_dirs, i),
-							 false, true, false, false, true, i+1);
-			else
-				dir_list_file(backup_files_list, parray_get(external_dirs, i),
-							  false, true, false, false, true, i+1, FIO_LOCAL_HOST);
+			fio_list_dir(backup_files_list, parray_get(external_dirs, i),
+						 false, true, false, false, true, i+1, FIO_DB_HOST);
 		}
 	}
 
@@ -420,7 +518,7 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 	}
 
 	/*
-	 * Make directories before backup and setup threads at the same time
+	 * Make directories before backup
 	 */
 	for (i = 0; i < parray_num(backup_files_list); i++)
 	{
@@ -444,17 +542,16 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 			elog(VERBOSE, "Create directory '%s'", dirpath);
 			fio_mkdir(dirpath, DIR_PERMISSION, FIO_BACKUP_HOST);
 		}
-
-		/* setup threads */
-		pg_atomic_clear_flag(&file->lock);
 	}
 
-	/* Sort by size for load balancing */
-	parray_qsort(backup_files_list, pgFileCompareSize);
 	/* Sort the array for binary search */
 	if (prev_backup_filelist)
 		parray_qsort(prev_backup_filelist, pgFileCompareRelPathWithExternal);
 
+	/* Pick up files copied before the backup was interrupted */
+	if (resumed_backup)
+		resume_backup_filelist(backup_files_list, external_prefix);
+
 	/* write initial backup_content.control file and update backup.control  */
 	write_backup_filelist(&current, backup_files_list,
 						  instance_config.pgdata, external_dirs, true);
@@ -463,9 +560,15 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 	/* Init backup page header map */
 	init_header_map(&current);
 
+	/* Headers of files copied before interruption are kept */
+	if (resumed_backup)
+		reopen_header_map(&(current.hdr_map), false);
+
 	/* init thread args with own file lists */
 	threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
 	threads_args = (backup_files_arg *) palloc(sizeof(backup_files_arg)*num_threads);
+	/* largest files go first for load balancing */
+	queue = file_queue_init(backup_files_list, num_threads);
 
 	for (i = 0; i < num_threads; i++)
 	{
@@ -477,11 +580,20 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 		arg->external_prefix = external_prefix;
 		arg->external_dirs = external_dirs;
 		arg->files_list = backup_files_list;
+		arg->queue = queue;
 		arg->prev_filelist = prev_backup_filelist;
 		arg->prev_start_lsn = prev_backup_start_lsn;
 		arg->conn_arg.conn = NULL;
 		arg->conn_arg.cancel_conn = NULL;
 		arg->hdr_map = &(current.hdr_map);
+		memset(&arg->stage_stats, 0, sizeof(BackupStageStats));
+		arg->dedup_backup = dedup_backup;
+		arg->dedup_filelist = dedup_backup_filelist;
+		arg->dedup_external_dirs = dedup_external_dirs;
+		arg->n_dedup_files = 0;
+		arg->dedup_bytes = 0;
+		arg->n_resumed_files = 0;
+		arg->resumed_bytes = 0;
 		arg->thread_num = i+1;
 		/* By default there are some error */
 		arg->ret = 1;
@@ -505,6 +617,40 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 		pthread_join(threads[i], NULL);
 		if (threads_args[i].ret == 1)
 			backup_isok = false;
+
+		n_dedup_files += threads_args[i].n_dedup_files;
+		dedup_bytes += threads_args[i].dedup_bytes;
+		n_resumed_files += threads_args[i].n_resumed_files;
+		resumed_bytes += threads_args[i].resumed_bytes;
+	}
+
+	file_queue_report(queue, "backed up");
+
+	if (n_dedup_files > 0)
+	{
+		pretty_size(dedup_bytes, pretty_bytes, lengthof(pretty_bytes));
+		elog(INFO, "%d unchanged files (%s) are shared with backup %s",
+			 n_dedup_files, pretty_bytes, base36enc(dedup_backup->start_time));
+	}
+
+	if (n_resumed_files > 0)
+	{
+		pretty_size(resumed_bytes, pretty_bytes, lengthof(pretty_bytes));
+		elog(INFO, "%d files (%s) copied before the backup was interrupted are reused",
+			 n_resumed_files, pretty_bytes);
+	}
+	file_queue_free(queue);
+
+	/* time spent by stages of data files backup, useful for tuning of --threads */
+	for (i = 0; i < num_threads; i++)
+	{
+		BackupStageStats *stats = &(threads_args[i].stage_stats);
+
+		elog(LOG, "Thread [%d]: read %.2f sec, compress %.2f sec, write %.2f sec, "
+			 "waiting for compression %.2f sec, waiting for reads %.2f sec, "
+			 "pipelined %d files",
+			 i + 1, stats->read_time, stats->compress_time, stats->write_time,
+			 stats->read_stall, stats->write_stall, stats->n_pipelined);
 	}
 
 	time(&end_time);
@@ -524,13 +670,20 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 		parray_free(prev_backup_filelist);
 	}
 
+	if (dedup_backup_filelist)
+	{
+		parray_walk(dedup_backup_filelist, pgFileFree);
+		parray_free(dedup_backup_filelist);
+	}
+
 	/* Notify end of backup */
 	pg_stop_backup(&current, backup_conn, nodeInfo);
 
-	/* In case of backup from replica >= 9.6 we must fix minRecPoint,
+	/* In case of backup from replica >= 9.6 or resumed backup we must fix
+	 * minRecPoint, so recovery does not end before stop_lsn.
 	 * First we must find pg_control in backup_files_list.
 	 */
-	if (current.from_replica && !exclusive_backup)
+	if ((current.from_replica || resumed_backup) && !exclusive_backup)
 	{
 		pgFile	   *pg_control = NULL;
 
@@ -550,7 +703,8 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 			elog(ERROR, "Failed to find file \"%s\" in backup filelist.",
 							XLOG_CONTROL_FILE);
 
-		set_min_recovery_point(pg_control, current.database_dir, current.stop_lsn);
+		set_min_recovery_point(pg_control, current.database_dir, current.stop_lsn,
+							   current.tli);
 	}
 
 	/* close and sync page header map */
@@ -725,7 +879,7 @@ pgdata_basic_setup(ConnectionOptions conn_opt, PGNodeInfo *nodeInfo)
  */
 int
 do_backup(pgSetBackupParams *set_backup_params,
-		  bool no_validate, bool no_sync, bool backup_logs)
+		  bool no_validate, bool no_sync, bool backup_logs, bool resume)
 {
 	PGconn		*backup_conn = NULL;
 	PGNodeInfo	nodeInfo;
@@ -734,13 +888,19 @@ do_backup(pgSetBackupParams *set_backup_params,
 	/* Initialize PGInfonode */
 	pgNodeInit(&nodeInfo);
 
-	/* Save list of external directories */
-	if (instance_config.external_dir_str &&
-		(pg_strcasecmp(instance_config.external_dir_str, "none") != 0))
-		current.external_dir_str = instance_config.external_dir_str;
+	if (resume)
+		/* Take metainfo and directory of the interrupted backup */
+		init_resumed_backup();
+	else
+	{
+		/* Save list of external directories */
+		if (instance_config.external_dir_str &&
+			(pg_strcasecmp(instance_config.external_dir_str, "none") != 0))
+			current.external_dir_str = instance_config.external_dir_str;
 
-	/* Create backup directory and BACKUP_CONTROL_FILE */
-	pgBackupCreateDir(&current, backup_instance_path);
+		/* Create backup directory and BACKUP_CONTROL_FILE */
+		pgBackupCreateDir(&current, backup_instance_path);
+	}
 
 	if (!instance_config.pgdata)
 		elog(ERROR, "required parameter not specified: PGDATA "
@@ -748,13 +908,21 @@ do_backup(pgSetBackupParams *set_backup_params,
 
 	/* Update backup status and other metainfo. */
 	current.status = BACKUP_STATUS_RUNNING;
-	current.start_time = current.backup_id;
 
-	StrNCpy(current.program_version, PROGRAM_VERSION,
-			sizeof(current.program_version));
+	if (!resume)
+	{
+		current.start_time = current.backup_id;
 
-	current.compress_alg = instance_config.compress_alg;
-	current.compress_level = instance_config.compress_level;
+		StrNCpy(current.program_version, PROGRAM_VERSION,
+				sizeof(current.program_version));
+
+		current.compress_alg = instance_config.compress_alg;
+		current.compress_level = instance_config.compress_level;
+
+		/* only FULL backup shares files with the previous one */
+		if (current.backup_mode == BACKUP_MODE_FULL)
+			current.dedup_mode = dedup_mode;
+	}
 
 	elog(INFO, "Backup start, pg_probackup version: %s, instance: %s, backup ID: %s, backup mode: %s, "
 			"wal mode: %s, remote: %s, compress-algorithm: %s, compress-level: %i",
@@ -781,6 +949,11 @@ do_backup(pgSetBackupParams *set_backup_params,
 	if (current.from_replica)
 		elog(INFO, "Backup %s is going to be taken from standby", base36enc(current.backup_id));
 
+	if (resume && current.from_replica != resumed_backup->from_replica)
+		elog(ERROR, "Backup %s was started from %s. Backup cannot be resumed",
+			 base36enc(current.backup_id),
+			 resumed_backup->from_replica ? "standby" : "master");
+
 	/* TODO, print PostgreSQL full version */
 	//elog(INFO, "PostgreSQL version: %s", nodeInfo.server_version_str);
 
@@ -1098,6 +1271,51 @@ pg_switch_wal(PGconn *conn)
 	PQclear(res);
 }
 
+#if PG_VERSION_NUM >= 90600
+/*
+ * Get location of the checkpoint record with redo point at 'redo_lsn',
+ * which is the start of the backup. It is needed to resume the backup if
+ * it is interrupted. Returns InvalidXLogRecPtr if a newer checkpoint has
+ * already been taken.
+ */
+static XLogRecPtr
+get_start_checkpoint_location(PGconn *conn, XLogRecPtr redo_lsn)
+{
+	PGresult   *res;
+	uint32		lsn_hi;
+	uint32		lsn_lo;
+	XLogRecPtr	checkpoint_redo;
+	XLogRecPtr	checkpoint_lsn = InvalidXLogRecPtr;
+
+#if PG_VERSION_NUM >= 100000
+	res = pgut_execute(conn,
+					   "SELECT checkpoint_lsn, redo_lsn FROM pg_catalog.pg_control_checkpoint()",
+					   0, NULL);
+#else
+	res = pgut_execute(conn,
+					   "SELECT checkpoint_location, redo_location FROM pg_catalog.pg_control_checkpoint()",
+					   0, NULL);
+#endif
+
+	XLogDataFromLSN(PQgetvalue(res, 0, 1), &lsn_hi, &lsn_lo);
+	checkpoint_redo = ((uint64) lsn_hi) << 32 | lsn_lo;
+
+	if (checkpoint_redo == redo_lsn)
+	{
+		XLogDataFromLSN(PQgetvalue(res, 0, 0), &lsn_hi, &lsn_lo);
+		checkpoint_lsn = ((uint64) lsn_hi) << 32 | lsn_lo;
+	}
+	else
+		elog(LOG, "Checkpoint with redo point at %X/%X is not the latest one, "
+			 "backup cannot be resumed if it is interrupted",
+			 (uint32) (redo_lsn >> 32), (uint32) redo_lsn);
+
+	PQclear(res);
+
+	return checkpoint_lsn;
+}
+#endif
+
 /*
  * Check if the instance is PostgresPro fork.
  */
@@ -1277,6 +1495,8 @@ wait_wal_lsn(XLogRecPtr target_lsn, bool is_start_lsn, TimeLineID tli,
 #ifdef HAVE_LIBZ
 	char		gz_wal_segment_path[MAXPGPATH];
 #endif
+	CompressAlg	stream_algs[] = {ZSTD_COMPRESS, LZ4_COMPRESS};
+	int			i;
 
 	/* Compute the name of the WAL file containing requested LSN */
 	GetXLogSegNo(target_lsn, targetSegNo, instance_config.xlog_seg_size);
@@ -1337,6 +1557,21 @@ wait_wal_lsn(XLogRecPtr target_lsn, bool is_start_lsn, TimeLineID tli,
 				if (file_exists)
 					elog(LOG, "Found compressed WAL segment: %s", wal_segment_path);
 #endif
+				/* ... or WAL file with streaming compression */
+				for (i = 0; i < lengthof(stream_algs) && !file_exists; i++)
+				{
+					char		cmp_wal_segment_path[MAXPGPATH];
+
+					if (!compress_stream_supported(stream_algs[i]))
+						continue;
+
+					snprintf(cmp_wal_segment_path, sizeof(cmp_wal_segment_path), "%s.%s",
+							 wal_segment_path, compress_stream_suffix(stream_algs[i]));
+
+					file_exists = fileExists(cmp_wal_segment_path, FIO_BACKUP_HOST);
+					if (file_exists)
+						elog(LOG, "Found compressed WAL segment: %s", cmp_wal_segment_path);
+				}
 			}
 			else
 				elog(LOG, "Found WAL segment: %s", wal_segment_path);
@@ -1452,6 +1687,7 @@ pg_stop_backup(pgBackup *backup, PGconn *pg_startbackup_conn,
 	pgFile		*file;
 	size_t		len;
 	char	   *val = NULL;
+	char	   *label_content = NULL;
 	char	   *stop_backup_query = NULL;
 	bool		stop_lsn_exists = false;
 	XLogRecPtr	stop_backup_lsn_tmp = InvalidXLogRecPtr;
@@ -1783,12 +2019,22 @@ pg_stop_backup(pgBackup *backup, PGconn *pg_startbackup_conn,
 				elog(ERROR, "can't open backup label file \"%s\": %s",
 					 backup_label, strerror(errno));
 
-			len = strlen(PQgetvalue(res, 0, 3));
-			if (fio_fwrite(fp, PQgetvalue(res, 0, 3), len) != len ||
+			/*
+			 * Resumed backup must be recovered starting from
+			 * the checkpoint of the interrupted backup.
+			 */
+			if (resumed_backup)
+				label_content = make_resumed_backup_label(PQgetvalue(res, 0, 3));
+			else
+				label_content = pg_strdup(PQgetvalue(res, 0, 3));
+
+			len = strlen(label_content);
+			if (fio_fwrite(fp, label_content, len) != len ||
 				fio_fflush(fp) != 0 ||
 				fio_fclose(fp))
 				elog(ERROR, "can't write backup label file \"%s\": %s",
 					 backup_label, strerror(errno));
+			pg_free(label_content);
 
 			/*
 			 * It's vital to check if backup_files_list is initialized,
@@ -1928,6 +2174,312 @@ backup_cleanup(bool fatal, void *userdata)
 	}
 }
 
+/*
+ * Reinitialize current backup with metainfo of the interrupted backup
+ * current.backup_id, which is going to be resumed.
+ */
+static void
+init_resumed_backup(void)
+{
+	parray	   *backup_list;
+	pgBackup   *backup;
+
+	backup_list = catalog_get_backup_list(instance_name, current.backup_id);
+	if (parray_num(backup_list) != 1)
+		elog(ERROR, "Backup %s is not found", base36enc(current.backup_id));
+
+	backup = (pgBackup *) parray_get(backup_list, 0);
+	parray_free(backup_list);
+
+	if (backup->status != BACKUP_STATUS_RUNNING &&
+		backup->status != BACKUP_STATUS_ERROR)
+		elog(ERROR, "Backup %s has status %s, only interrupted backups with status "
+			 "RUNNING or ERROR can be resumed",
+			 base36enc(backup->start_time), status2str(backup->status));
+
+	if (strcmp(backup->program_version, PROGRAM_VERSION) != 0)
+		elog(ERROR, "Backup %s was started by pg_probackup %s, it can be resumed "
+			 "only by the same version of pg_probackup",
+			 base36enc(backup->start_time), backup->program_version);
+
+	if (backup->checkpoint_lsn == InvalidXLogRecPtr)
+		elog(ERROR, "Checkpoint location of backup %s is unknown. "
+			 "Backup cannot be resumed", base36enc(backup->start_time));
+
+	if (current.backup_mode != BACKUP_MODE_INVALID &&
+		current.backup_mode != backup->backup_mode)
+		elog(ERROR, "Backup %s was started in %s mode",
+			 base36enc(backup->start_time), pgBackupGetBackupMode(backup));
+
+	current.backup_id = backup->start_time;
+	current.start_time = backup->start_time;
+	current.backup_mode = backup->backup_mode;
+	current.tli = backup->tli;
+	current.start_lsn = backup->start_lsn;
+	current.checkpoint_lsn = backup->checkpoint_lsn;
+	current.end_time = 0;
+	current.expire_time = backup->expire_time;
+	current.stream = backup->stream;
+	current.compress_alg = backup->compress_alg;
+	current.compress_level = backup->compress_level;
+	current.dedup_mode = backup->dedup_mode;
+	current.parent_backup = backup->parent_backup;
+	current.external_dir_str = backup->external_dir_str;
+	current.note = backup->note;
+	current.root_dir = backup->root_dir;
+	current.database_dir = backup->database_dir;
+	StrNCpy(current.program_version, backup->program_version,
+			sizeof(current.program_version));
+
+	/* file list was saved without sync, its checksum is not stored */
+	current.content_crc = 0;
+
+	init_header_map(&current);
+
+	/* the rest of the backup must be taken the same way */
+	stream_wal = backup->stream;
+	instance_config.compress_alg = backup->compress_alg;
+	instance_config.compress_level = backup->compress_level;
+	dedup_mode = backup->dedup_mode;
+
+	resumed_backup = backup;
+
+	elog(INFO, "Resuming backup %s, start LSN: %X/%X, checkpoint LSN: %X/%X",
+		 base36enc(backup->start_time),
+		 (uint32) (backup->start_lsn >> 32), (uint32) (backup->start_lsn),
+		 (uint32) (backup->checkpoint_lsn >> 32), (uint32) (backup->checkpoint_lsn));
+}
+
+/*
+ * Take metainfo of files copied before the backup was interrupted from
+ * its file list. Such files are verified by backup_files() and reused if
+ * they are intact. Copies of files which are no longer in PGDATA are removed.
+ * 'files' must be sorted by path.
+ */
+static void
+resume_backup_filelist(parray *files, const char *external_prefix)
+{
+	parray	   *resumed_files;
+	int			i;
+
+	resumed_files = get_backup_filelist(&current, true);
+
+	for (i = 0; i < parray_num(resumed_files); i++)
+	{
+		pgFile	   *resumed_file = (pgFile *) parray_get(resumed_files, i);
+		pgFile	  **file_tmp;
+		pgFile	   *file;
+
+		if (!S_ISREG(resumed_file->mode))
+			continue;
+
+		file_tmp = (pgFile **) parray_bsearch(files, resumed_file,
+											  pgFileCompareRelPathWithExternal);
+
+		if (file_tmp == NULL)
+		{
+			char		fullpath[MAXPGPATH];
+
+			if (resumed_file->external_dir_num == 0)
+				join_path_components(fullpath, current.database_dir,
+									 resumed_file->rel_path);
+			else
+			{
+				char		external_dst[MAXPGPATH];
+
+				makeExternalDirPathByNum(external_dst, external_prefix,
+										 resumed_file->external_dir_num);
+				join_path_components(fullpath, external_dst, resumed_file->rel_path);
+			}
+
+			elog(VERBOSE, "File \"%s\" is removed from PGDATA, remove its copy",
+				 resumed_file->rel_path);
+			pgFileDelete(resumed_file->mode, fullpath);
+			continue;
+		}
+
+		file = *file_tmp;
+
+		/* nothing was copied yet or there is nothing to copy */
+		if (!S_ISREG(file->mode) || file->size == 0 ||
+			resumed_file->write_size == 0)
+			continue;
+
+		/* file has been skipped as unchanged, which is legal only for incremental backup */
+		if (resumed_file->write_size == BYTES_INVALID &&
+			current.backup_mode == BACKUP_MODE_FULL)
+			continue;
+
+		if (file->is_datafile != resumed_file->is_datafile ||
+			file->is_cfs != resumed_file->is_cfs)
+			continue;
+
+		/* pg_control is always copied anew */
+		if (file->external_dir_num == 0 &&
+			strcmp(file->rel_path, XLOG_CONTROL_FILE) == 0)
+			continue;
+
+		file->resumed = true;
+		file->write_size = resumed_file->write_size;
+		file->crc = resumed_file->crc;
+		file->compress_alg = resumed_file->compress_alg;
+		file->n_blocks = resumed_file->n_blocks;
+		file->n_headers = resumed_file->n_headers;
+		file->hdr_crc = resumed_file->hdr_crc;
+		file->hdr_off = resumed_file->hdr_off;
+		file->hdr_size = resumed_file->hdr_size;
+
+		/* size before compression is not kept in file list, estimate it */
+		if (file->write_size == BYTES_INVALID)
+			file->uncompressed_size = 0;
+		else if (file->is_datafile && !file->is_cfs)
+			file->uncompressed_size = (size_t) file->n_headers * BLCKSZ;
+		else
+			file->uncompressed_size = file->write_size;
+	}
+
+	parray_walk(resumed_files, pgFileFree);
+	parray_free(resumed_files);
+}
+
+/*
+ * Check that the file copied before the backup was interrupted is complete
+ * and intact. If it is not, reset its metainfo, so it is copied again.
+ */
+static bool
+check_resumed_file(pgFile *file, const char *to_fullpath,
+				   HeaderMap *hdr_map, uint32 checksum_version)
+{
+	struct stat st;
+	bool		is_valid = false;
+
+	/* unchanged file has no copy in this backup */
+	if (file->write_size == BYTES_INVALID)
+		return true;
+
+	if (stat(to_fullpath, &st) == 0 && st.st_size == file->write_size)
+	{
+		/* page headers are written after the last page of data file */
+		if (file->is_datafile && !file->is_cfs)
+			is_valid = file->n_headers > 0 &&
+				validate_file_pages(file, to_fullpath, InvalidXLogRecPtr,
+									checksum_version,
+									parse_program_version(current.program_version),
+									hdr_map);
+		else
+			is_valid = pgFileGetCRC(to_fullpath, true, false) == file->crc;
+	}
+
+	if (!is_valid)
+	{
+		file->write_size = 0;
+		file->uncompressed_size = 0;
+		file->crc = 0;
+		file->compress_alg = NOT_DEFINED_COMPRESS;
+		file->n_blocks = BLOCKNUM_INVALID;
+		file->n_headers = 0;
+		file->hdr_crc = 0;
+		file->hdr_off = 0;
+		file->hdr_size = 0;
+	}
+
+	return is_valid;
+}
+
+/*
+ * Find the position to resume WAL streaming from. Segments streamed before
+ * the backup was interrupted are kept, the last of them may be incomplete
+ * and is streamed again.
+ */
+static XLogRecPtr
+get_resumed_stream_lsn(const char *stream_dir)
+{
+	XLogSegNo	segno;
+	XLogRecPtr	lsn;
+
+	GetXLogSegNo(current.start_lsn, segno, instance_config.xlog_seg_size);
+
+	for (;;)
+	{
+		char		wal_segment_name[MAXFNAMELEN];
+		char		wal_segment_path[MAXPGPATH];
+
+		GetXLogFileName(wal_segment_name, current.tli, segno + 1,
+						instance_config.xlog_seg_size);
+		join_path_components(wal_segment_path, stream_dir, wal_segment_name);
+
+		if (fio_access(wal_segment_path, F_OK, FIO_BACKUP_HOST) != 0)
+			break;
+
+		segno++;
+	}
+
+	GetXLogRecPtr(segno, 0, instance_config.xlog_seg_size, lsn);
+
+	if (lsn < current.start_lsn)
+		return current.start_lsn;
+
+	elog(INFO, "WAL streamed before the backup was interrupted is kept, "
+		 "streaming is resumed at %X/%X", (uint32) (lsn >> 32), (uint32) lsn);
+
+	return lsn;
+}
+
+/*
+ * Make backup_label for the resumed backup from the label returned by
+ * pg_stop_backup(). Recovery must start from the checkpoint of the
+ * interrupted backup, and it must not end before stop_lsn of the resumed
+ * one. The latter is achieved the same way as for backup from standby:
+ * minRecoveryPoint in pg_control is set to stop_lsn.
+ */
+static char *
+make_resumed_backup_label(const char *label)
+{
+	char	   *result;
+	char	   *out;
+	const char *line = label;
+
+	/* rewritten lines are never longer than 100 bytes */
+	result = pgut_malloc(strlen(label) + 3 * 100 + 1);
+	out = result;
+
+	while (*line)
+	{
+		const char *eol = strchr(line, '\n');
+		size_t		len = eol ? eol - line + 1 : strlen(line);
+
+		if (strncmp(line, "START WAL LOCATION:", strlen("START WAL LOCATION:")) == 0)
+		{
+			XLogSegNo	segno;
+			char		wal_segment_name[MAXFNAMELEN];
+
+			GetXLogSegNo(current.start_lsn, segno, instance_config.xlog_seg_size);
+			GetXLogFileName(wal_segment_name, current.tli, segno,
+							instance_config.xlog_seg_size);
+
+			out += sprintf(out, "START WAL LOCATION: %X/%X (file %s)\n",
+						   (uint32) (current.start_lsn >> 32),
+						   (uint32) current.start_lsn, wal_segment_name);
+		}
+		else if (strncmp(line, "CHECKPOINT LOCATION:", strlen("CHECKPOINT LOCATION:")) == 0)
+			out += sprintf(out, "CHECKPOINT LOCATION: %X/%X\n",
+						   (uint32) (current.checkpoint_lsn >> 32),
+						   (uint32) current.checkpoint_lsn);
+		else if (strncmp(line, "BACKUP FROM:", strlen("BACKUP FROM:")) == 0)
+			out += sprintf(out, "BACKUP FROM: standby\n");
+		else
+		{
+			memcpy(out, line, len);
+			out += len;
+		}
+
+		line += len;
+	}
+	*out = '\0';
+
+	return result;
+}
+
 /*
  * Take a backup of the PGDATA at a file level.
  * Copy all directories and files listed in backup_files_list.
@@ -1946,13 +2498,13 @@ backup_files(void *arg)
 
 	backup_files_arg *arguments = (backup_files_arg *) arg;
 	int 		n_backup_files_list = parray_num(arguments->files_list);
+	pgFile	   *file;
 
 	prev_time = current.start_time;
 
 	/* backup a file */
-	for (i = 0; i < n_backup_files_list; i++)
+	while ((file = file_queue_next(arguments->queue, arguments->thread_num, &i)) != NULL)
 	{
-		pgFile	*file = (pgFile *) parray_get(arguments->files_list, i);
 		pgFile	*prev_file = NULL;
 
 		/* We have already copied all directories */
@@ -1973,16 +2525,13 @@ backup_files(void *arg)
 			}
 		}
 
-		if (!pg_atomic_test_set_flag(&file->lock))
-			continue;
-
 		/* check for interrupt */
 		if (interrupted || thread_interrupted)
 			elog(ERROR, "interrupted during backup");
 
 		if (progress)
 			elog(INFO, "Progress: (%d/%d). Process file \"%s\"",
-				 i + 1, n_backup_files_list, file->rel_path);
+				 i, n_backup_files_list, file->rel_path);
 
 		/* Handle zero sized files */
 		if (file->size == 0)
@@ -2011,6 +2560,24 @@ backup_files(void *arg)
 			join_path_components(from_fullpath, external_path, file->rel_path);
 		}
 
+		/* Reuse the file copied before the backup was interrupted */
+		if (file->resumed)
+		{
+			if (check_resumed_file(file, to_fullpath, arguments->hdr_map,
+								   arguments->nodeInfo->checksum_version))
+			{
+				elog(VERBOSE, "File \"%s\" was copied before interruption", from_fullpath);
+
+				arguments->n_resumed_files++;
+				if (file->write_size > 0)
+					arguments->resumed_bytes += file->write_size;
+				continue;
+			}
+
+			elog(VERBOSE, "File \"%s\" was not completely copied before interruption, "
+				 "copying it again", from_fullpath);
+		}
+
 		/* Encountered some strange beast */
 		if (!S_ISREG(file->mode))
 			elog(WARNING, "Unexpected type %d of file \"%s\", skipping",
@@ -2030,6 +2597,48 @@ backup_files(void *arg)
 			}
 		}
 
+		/* Check that file exists in FULL backup to share it with */
+		if (arguments->dedup_filelist && !(file->is_datafile && !file->is_cfs) &&
+			(file->external_dir_num == 0 || arguments->dedup_external_dirs))
+		{
+			pgFile	**dedup_file_tmp = NULL;
+
+			dedup_file_tmp = (pgFile **) parray_bsearch(arguments->dedup_filelist,
+											file, pgFileCompareRelPathWithExternal);
+			if (dedup_file_tmp)
+			{
+				char		dedup_fullpath[MAXPGPATH];
+
+				if (file->external_dir_num == 0)
+					join_path_components(dedup_fullpath,
+										 arguments->dedup_backup->database_dir,
+										 file->rel_path);
+				else
+				{
+					char		external_prefix[MAXPGPATH];
+					char		external_dst[MAXPGPATH];
+
+					join_path_components(external_prefix,
+										 arguments->dedup_backup->root_dir, EXTERNAL_DIR);
+					makeExternalDirPathByNum(external_dst, external_prefix,
+											 file->external_dir_num);
+					join_path_components(dedup_fullpath, external_dst, file->rel_path);
+				}
+
+				if (dedup_non_data_file(file, *dedup_file_tmp, from_fullpath,
+										dedup_fullpath, to_fullpath,
+										arguments->dedup_backup->start_time,
+										dedup_mode))
+				{
+					elog(VERBOSE, "Sharing the unchanged file: \"%s\"", from_fullpath);
+
+					arguments->n_dedup_files++;
+					arguments->dedup_bytes += file->write_size;
+					continue;
+				}
+			}
+		}
+
 		/* backup file */
 		if (file->is_datafile && !file->is_cfs)
 		{
@@ -2041,7 +2650,8 @@ backup_files(void *arg)
 								 arguments->nodeInfo->checksum_version,
 								 arguments->nodeInfo->ptrack_version_num,
 								 arguments->nodeInfo->ptrack_schema,
-								 arguments->hdr_map, false);
+								 arguments->hdr_map, false,
+								 &(arguments->stage_stats));
 		}
 		else
 		{
@@ -23,6 +23,7 @@ static pgBackup* get_closest_backup(timelineInfo *tlinfo);
 static pgBackup* get_oldest_backup(timelineInfo *tlinfo);
 static const char *backupModes[] = {"", "PAGE", "PTRACK", "DELTA", "FULL"};
 static pgBackup *readBackupControlFile(const char *path);
+static pgBackup *parseBackupControl(const char *path, const char *content);
 static time_t create_backup_dir(pgBackup *backup, const char *backup_instance_path);
 
 static bool backup_lock_exit_hook_registered = false;
@@ -42,6 +43,7 @@ timelineInfoNew(TimeLineID tli)
 	tlinfo->switchpoint = InvalidXLogRecPtr;
 	tlinfo->parent_link = NULL;
 	tlinfo->xlog_filelist = parray_new();
+	tlinfo->xlog_ranges = parray_new();
 	tlinfo->anchor_lsn = InvalidXLogRecPtr;
 	tlinfo->anchor_tli = 0;
 	tlinfo->n_xlog_files = 0;
@@ -57,6 +59,9 @@ timelineInfoFree(void *tliInfo)
 	parray_walk(tli->xlog_filelist, pgFileFree);
 	parray_free(tli->xlog_filelist);
 
+	parray_walk(tli->xlog_ranges, pfree);
+	parray_free(tli->xlog_ranges);
+
 	if (tli->backups)
 	{
 		parray_walk(tli->backups, pgBackupFree);
@@ -735,6 +740,557 @@ catalog_get_instance_list(void)
 	return instances;
 }
 
+/*
+ * Catalog index.
+ *
+ * To avoid reading of every backup.control on each catalog_get_backup_list()
+ * call, content of control files is cached in BACKUP_INDEX_FILE together
+ * with inode, mtime and size of the control file. Cached content is used
+ * only if the control file was not changed since it was cached, so commands,
+ * which modify backups, do not have to care about the index.
+ *
+ * List of files in WAL archive is cached in WAL_INDEX_FILE. It is used as is
+ * if the archive directory was not modified since the index was written,
+ * otherwise the directory is read again, but only new files are stat'ed.
+ *
+ * Both indexes are located in backup instance directory, so writing them
+ * does not change mtime of the archive directory. Index is written into
+ * temp file and then renamed, so concurrent readers always see consistent
+ * index. Index is only a cache: failure to write it is not an error.
+ *
+ * Files modified less than CATALOG_INDEX_RACY_SECS seconds ago are not
+ * trusted, because their next modification may not change mtime.
+ */
+#define CATALOG_INDEX_RACY_SECS	2
+#define BACKUP_INDEX_MAGIC		"PBKBIDX 1"
+#define WAL_INDEX_MAGIC			"PBKWIDX 1"
+#define INDEX_BUFFER_SIZE		(1024 * 1024)
+
+typedef struct BackupIndexEntry
+{
+	char	   *name;		/* name of backup directory */
+	uint64		ino;		/* identity of backup.control */
+	int64		mtime;
+	int64		size;
+	char	   *content;	/* content of backup.control */
+	bool		used;
+} BackupIndexEntry;
+
+typedef struct IndexWriter
+{
+	FILE	   *out;
+	char		path[MAXPGPATH];
+	char	   *buf;
+	size_t		len;
+	bool		failed;
+} IndexWriter;
+
+static int
+BackupIndexEntryCompareName(const void *e1, const void *e2)
+{
+	BackupIndexEntry *e1p = *(BackupIndexEntry **) e1;
+	BackupIndexEntry *e2p = *(BackupIndexEntry **) e2;
+
+	return strcmp(e1p->name, e2p->name);
+}
+
+static void
+BackupIndexEntryFree(void *entry)
+{
+	BackupIndexEntry *e = (BackupIndexEntry *) entry;
+
+	pg_free(e->name);
+	pg_free(e->content);
+	pg_free(e);
+}
+
+static bool
+index_is_racy(time_t mtime)
+{
+	return mtime >= time(NULL) - CATALOG_INDEX_RACY_SECS;
+}
+
+static bool
+index_writer_open(IndexWriter *writer, const char *index_path)
+{
+	snprintf(writer->path, MAXPGPATH, "%s.tmp.%d", index_path, getpid());
+
+	writer->out = fio_fopen(writer->path, PG_BINARY_W, FIO_BACKUP_HOST);
+	if (writer->out == NULL)
+	{
+		elog(LOG, "Cannot open catalog index \"%s\": %s",
+			 writer->path, strerror(errno));
+		return false;
+	}
+
+	writer->buf = pgut_malloc(INDEX_BUFFER_SIZE);
+	writer->len = 0;
+	writer->failed = false;
+
+	return true;
+}
+
+static void
+index_writer_flush(IndexWriter *writer)
+{
+	if (writer->len > 0 && !writer->failed &&
+		fio_fwrite(writer->out, writer->buf, writer->len) != writer->len)
+		writer->failed = true;
+
+	writer->len = 0;
+}
+
+static void
+index_write(IndexWriter *writer, const char *data, size_t size)
+{
+	if (writer->len + size > INDEX_BUFFER_SIZE)
+		index_writer_flush(writer);
+
+	if (size > INDEX_BUFFER_SIZE)
+	{
+		if (!writer->failed && fio_fwrite(writer->out, data, size) != size)
+			writer->failed = true;
+		return;
+	}
+
+	memcpy(writer->buf + writer->len, data, size);
+	writer->len += size;
+}
+
+/* Finish writing of the index and install it */
+static void
+index_writer_close(IndexWriter *writer, const char *index_path)
+{
+	index_writer_flush(writer);
+	pg_free(writer->buf);
+
+	if (fio_fclose(writer->out) != 0)
+		writer->failed = true;
+
+	if (!writer->failed &&
+		fio_rename(writer->path, index_path, FIO_BACKUP_HOST) == 0)
+		return;
+
+	elog(LOG, "Cannot write catalog index \"%s\": %s",
+		 writer->path, strerror(errno));
+	fio_unlink(writer->path, FIO_BACKUP_HOST);
+}
+
+/*
+ * Read BACKUP_INDEX_FILE. Return list of entries sorted by name,
+ * which is empty if the index is missing or invalid.
+ */
+static parray *
+read_backup_index(const char *backup_instance_path)
+{
+	char		index_path[MAXPGPATH];
+	char		buf[MAXPGPATH * 2];
+	FILE	   *fp;
+	parray	   *entries = parray_new();
+
+	join_path_components(index_path, backup_instance_path, BACKUP_INDEX_FILE);
+
+	fp = fio_open_stream(index_path, FIO_BACKUP_HOST);
+	if (fp == NULL)
+		return entries;
+
+	if (!fgets(buf, lengthof(buf), fp) ||
+		strncmp(buf, BACKUP_INDEX_MAGIC "\n", sizeof(BACKUP_INDEX_MAGIC)) != 0)
+		goto invalid;
+
+	while (fgets(buf, lengthof(buf), fp))
+	{
+		BackupIndexEntry *entry;
+		uint64		ino;
+		int64		mtime;
+		int64		size;
+		int			name_off = 0;
+
+		if (sscanf(buf, UINT64_FORMAT " " INT64_FORMAT " " INT64_FORMAT " %n",
+				   &ino, &mtime, &size, &name_off) != 3 ||
+			name_off == 0 || size < 0 || size > INDEX_BUFFER_SIZE)
+			goto invalid;
+
+		buf[strcspn(buf, "\n")] = '\0';
+
+		entry = pgut_new(BackupIndexEntry);
+		entry->name = pgut_strdup(buf + name_off);
+		entry->ino = ino;
+		entry->mtime = mtime;
+		entry->size = size;
+		entry->used = false;
+		entry->content = pgut_malloc(size + 1);
+		parray_append(entries, entry);
+
+		/* content is followed by newline */
+		if (fread(entry->content, 1, size, fp) != size || fgetc(fp) != '\n')
+			goto invalid;
+		entry->content[size] = '\0';
+	}
+
+	if (ferror(fp))
+		goto invalid;
+
+	fio_close_stream(fp);
+	parray_qsort(entries, BackupIndexEntryCompareName);
+
+	return entries;
+
+invalid:
+	elog(LOG, "Ignore invalid catalog index \"%s\"", index_path);
+	fio_close_stream(fp);
+	parray_walk(entries, BackupIndexEntryFree);
+	parray_free(entries);
+
+	return parray_new();
+}
+
+static void
+write_backup_index(const char *backup_instance_path, parray *entries)
+{
+	char		index_path[MAXPGPATH];
+	char		buf[MAXPGPATH * 2];
+	IndexWriter	writer;
+	int			i;
+
+	join_path_components(index_path, backup_instance_path, BACKUP_INDEX_FILE);
+
+	if (!index_writer_open(&writer, index_path))
+		return;
+
+	index_write(&writer, BACKUP_INDEX_MAGIC "\n", strlen(BACKUP_INDEX_MAGIC "\n"));
+
+	for (i = 0; i < parray_num(entries); i++)
+	{
+		BackupIndexEntry *entry = (BackupIndexEntry *) parray_get(entries, i);
+		int			len;
+
+		len = snprintf(buf, lengthof(buf),
+					   UINT64_FORMAT " " INT64_FORMAT " " INT64_FORMAT " %s\n",
+					   entry->ino, entry->mtime, entry->size, entry->name);
+		index_write(&writer, buf, len);
+		index_write(&writer, entry->content, entry->size);
+		index_write(&writer, "\n", 1);
+	}
+
+	index_writer_close(&writer, index_path);
+}
+
+/*
+ * Read backup.control of backup in directory 'name', using content cached
+ * in the index, if the control file was not changed. Entries which are
+ * still valid are added to new_index. Set *changed if the index should
+ * be rewritten.
+ */
+static pgBackup *
+read_backup_control_cached(const char *backup_conf_path, const char *data_path,
+						   const char *name, struct stat *st,
+						   parray *index, parray *new_index, bool *changed)
+{
+	BackupIndexEntry key;
+	BackupIndexEntry *key_ptr = &key;
+	BackupIndexEntry **found;
+	BackupIndexEntry *entry;
+	pgBackup   *backup;
+	char	   *content;
+	size_t		len;
+
+	key.name = (char *) name;
+	found = (BackupIndexEntry **) parray_bsearch(index, &key_ptr,
+												 BackupIndexEntryCompareName);
+
+	if (found &&
+		(*found)->ino == (uint64) st->st_ino &&
+		(*found)->mtime == (int64) st->st_mtime &&
+		(*found)->size == (int64) st->st_size)
+	{
+		(*found)->used = true;
+		parray_append(new_index, *found);
+		return parseBackupControl(backup_conf_path, (*found)->content);
+	}
+
+	*changed = true;
+
+	content = slurpFile(data_path, BACKUP_CONTROL_FILE, &len, true, FIO_BACKUP_HOST);
+
+	/* control file is gone, report it in usual way */
+	if (content == NULL)
+		return readBackupControlFile(backup_conf_path);
+
+	backup = parseBackupControl(backup_conf_path, content);
+
+	/* do not cache invalid, recently modified or concurrently changed file */
+	if (backup == NULL || index_is_racy(st->st_mtime) ||
+		len != st->st_size || len > INDEX_BUFFER_SIZE)
+	{
+		pg_free(content);
+		return backup;
+	}
+
+	entry = pgut_new(BackupIndexEntry);
+	entry->name = pgut_strdup(name);
+	entry->ino = (uint64) st->st_ino;
+	entry->mtime = (int64) st->st_mtime;
+	entry->size = (int64) st->st_size;
+	entry->content = content;
+	entry->used = true;
+	parray_append(new_index, entry);
+
+	return backup;
+}
+
+/*
+ * Read WAL_INDEX_FILE. Return list of files sorted by name and
+ * identity of archive directory, or NULL if the index is missing or invalid.
+ */
+static parray *
+read_wal_index(const char *index_path, uint64 *dir_ino, int64 *dir_mtime)
+{
+	char		buf[MAXPGPATH * 2];
+	FILE	   *fp;
+	parray	   *files;
+
+	fp = fio_open_stream(index_path, FIO_BACKUP_HOST);
+	if (fp == NULL)
+		return NULL;
+
+	files = parray_new();
+
+	if (!fgets(buf, lengthof(buf), fp) ||
+		strncmp(buf, WAL_INDEX_MAGIC "\n", sizeof(WAL_INDEX_MAGIC)) != 0 ||
+		!fgets(buf, lengthof(buf), fp) ||
+		sscanf(buf, UINT64_FORMAT " " INT64_FORMAT, dir_ino, dir_mtime) != 2)
+		goto invalid;
+
+	while (fgets(buf, lengthof(buf), fp))
+	{
+		pgFile	   *file;
+		int64		size;
+		uint32		mode;
+		int			name_off = 0;
+
+		if (sscanf(buf, INT64_FORMAT " %u %n", &size, &mode, &name_off) != 2 ||
+			name_off == 0)
+			goto invalid;
+
+		buf[strcspn(buf, "\n")] = '\0';
+
+		file = pgFileInit(buf + name_off);
+		file->size = size;
+		file->mode = (mode_t) mode;
+		parray_append(files, file);
+	}
+
+	if (ferror(fp))
+		goto invalid;
+
+	fio_close_stream(fp);
+	parray_qsort(files, pgFileCompareName);
+
+	return files;
+
+invalid:
+	elog(LOG, "Ignore invalid catalog index \"%s\"", index_path);
+	fio_close_stream(fp);
+	parray_walk(files, pgFileFree);
+	parray_free(files);
+
+	return NULL;
+}
+
+static void
+write_wal_index(const char *index_path, struct stat *dir_st, parray *files)
+{
+	char		buf[MAXPGPATH * 2];
+	IndexWriter	writer;
+	int			len;
+	int			i;
+
+	if (!index_writer_open(&writer, index_path))
+		return;
+
+	/* zero mtime means that the list must be checked against directory */
+	len = snprintf(buf, lengthof(buf), WAL_INDEX_MAGIC "\n" UINT64_FORMAT " " INT64_FORMAT "\n",
+				   (uint64) dir_st->st_ino,
+				   index_is_racy(dir_st->st_mtime) ? (int64) 0 : (int64) dir_st->st_mtime);
+	index_write(&writer, buf, len);
+
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+
+		len = snprintf(buf, lengthof(buf), INT64_FORMAT " %u %s\n",
+					   file->size, (uint32) file->mode, file->name);
+		index_write(&writer, buf, len);
+	}
+
+	index_writer_close(&writer, index_path);
+}
+
+/*
+ * List files in WAL archive of the instance, using WAL_INDEX_FILE.
+ * The result is the same as of dir_list_file(), but files known
+ * from the index are not stat'ed.
+ */
+static parray *
+catalog_get_wal_files(const char *instance_name, const char *arclog_path)
+{
+	char		index_path[MAXPGPATH];
+	struct stat	dir_st;
+	parray	   *cached = NULL;
+	parray	   *files = parray_new();
+	uint64		dir_ino = 0;
+	int64		dir_mtime = 0;
+	DIR		   *dir;
+	struct dirent *dent;
+
+	sprintf(index_path, "%s/%s/%s/%s",
+			backup_path, BACKUPS_DIR, instance_name, WAL_INDEX_FILE);
+
+	/*
+	 * Remote archive is listed by the agent in one stream, which is cheaper
+	 * than a round trip per every directory entry.
+	 */
+	if (fio_is_remote(FIO_BACKUP_HOST))
+		goto fallback;
+
+	if (fio_stat(arclog_path, &dir_st, true, FIO_BACKUP_HOST) < 0 ||
+		!S_ISDIR(dir_st.st_mode) ||
+		(dir = fio_opendir(arclog_path, FIO_BACKUP_HOST)) == NULL)
+		goto fallback;
+
+	cached = read_wal_index(index_path, &dir_ino, &dir_mtime);
+
+	/* archive directory was not changed since the index was written */
+	if (cached && dir_mtime != 0 &&
+		dir_ino == (uint64) dir_st.st_ino && dir_mtime == (int64) dir_st.st_mtime)
+	{
+		fio_closedir(dir);
+		parray_free(files);
+		return cached;
+	}
+
+	if (cached == NULL)
+		cached = parray_new();
+
+	errno = 0;
+	while ((dent = fio_readdir(dir)))
+	{
+		char		child[MAXPGPATH];
+		pgFile		key;
+		pgFile	   *key_ptr = &key;
+		pgFile	  **found;
+		pgFile	   *file;
+
+		if (strcmp(dent->d_name, ".") == 0 || strcmp(dent->d_name, "..") == 0)
+			continue;
+
+		join_path_components(child, arclog_path, dent->d_name);
+
+		if (dent->d_name[0] == '.')
+		{
+			elog(WARNING, "Skip hidden file: '%s'", child);
+			continue;
+		}
+
+		key.name = dent->d_name;
+		found = (pgFile **) parray_bsearch(cached, &key_ptr, pgFileCompareName);
+
+		if (found)
+		{
+			file = pgFileInit((*found)->name);
+			file->size = (*found)->size;
+			file->mode = (*found)->mode;
+			parray_append(files, file);
+			continue;
+		}
+
+		file = pgFileNew(child, dent->d_name, false, 0, FIO_BACKUP_HOST);
+		if (file == NULL)
+			continue;
+
+		/* subdirectories are not expected, let dir_list_file() handle them */
+		if (S_ISDIR(file->mode))
+		{
+			pgFileFree(file);
+			fio_closedir(dir);
+			goto fallback;
+		}
+
+		if (!S_ISREG(file->mode))
+		{
+			elog(WARNING, "Skip '%s': unexpected file format", child);
+			pgFileFree(file);
+			continue;
+		}
+
+		parray_append(files, file);
+	}
+
+	if (errno && errno != ENOENT)
+	{
+		int			errno_tmp = errno;
+
+		fio_closedir(dir);
+		elog(ERROR, "Cannot read directory \"%s\": %s",
+			 arclog_path, strerror(errno_tmp));
+	}
+	fio_closedir(dir);
+
+	parray_walk(cached, pgFileFree);
+	parray_free(cached);
+
+	parray_qsort(files, pgFileCompareName);
+	write_wal_index(index_path, &dir_st, files);
+
+	return files;
+
+fallback:
+	if (cached)
+	{
+		parray_walk(cached, pgFileFree);
+		parray_free(cached);
+	}
+	parray_walk(files, pgFileFree);
+	parray_free(files);
+
+	files = parray_new();
+	dir_list_file(files, arclog_path, false, false, false, false, true, 0, FIO_BACKUP_HOST);
+
+	return files;
+}
+
+/*
+ * Remove catalog index of the instance. If 'wal_only' is true, only index
+ * and summaries of WAL archive are removed.
+ */
+void
+catalog_drop_index(const char *instance_name, bool wal_only)
+{
+	char		index_path[MAXPGPATH];
+
+	sprintf(index_path, "%s/%s/%s/%s",
+			backup_path, BACKUPS_DIR, instance_name, WAL_INDEX_FILE);
+	if (fio_unlink(index_path, FIO_BACKUP_HOST) != 0 && errno != ENOENT)
+		elog(WARNING, "Cannot remove catalog index \"%s\": %s",
+			 index_path, strerror(errno));
+
+	sprintf(index_path, "%s/%s/%s/%s",
+			backup_path, BACKUPS_DIR, instance_name, WAL_SUMMARY_FILE);
+	if (fio_unlink(index_path, FIO_BACKUP_HOST) != 0 && errno != ENOENT)
+		elog(WARNING, "Cannot remove catalog index \"%s\": %s",
+			 index_path, strerror(errno));
+
+	if (wal_only)
+		return;
+
+	sprintf(index_path, "%s/%s/%s/%s",
+			backup_path, BACKUPS_DIR, instance_name, BACKUP_INDEX_FILE);
+	if (fio_unlink(index_path, FIO_BACKUP_HOST) != 0 && errno != ENOENT)
+		elog(WARNING, "Cannot remove catalog index \"%s\": %s",
+			 index_path, strerror(errno));
+}
+
 /*
  * Create list of backups.
  * If 'requested_backup_id' is INVALID_BACKUP_ID, return list of all backups.
@@ -747,6 +1303,9 @@ catalog_get_backup_list(const char *instance_name, time_t requested_backup_id)
 	DIR		   *data_dir = NULL;
 	struct dirent *data_ent = NULL;
 	parray	   *backups = NULL;
+	parray	   *index = NULL;
+	parray	   *new_index = NULL;
+	bool		index_changed = false;
 	int			i;
 	char backup_instance_path[MAXPGPATH];
 
@@ -763,16 +1322,18 @@ catalog_get_backup_list(const char *instance_name, time_t requested_backup_id)
 	}
 
 	/* scan the directory and list backups */
+	index = read_backup_index(backup_instance_path);
+	new_index = parray_new();
 	backups = parray_new();
 	for (; (data_ent = fio_readdir(data_dir)) != NULL; errno = 0)
 	{
 		char		backup_conf_path[MAXPGPATH];
 		char		data_path[MAXPGPATH];
 		pgBackup   *backup = NULL;
+		struct stat	st;
 
-		/* skip not-directory entries and hidden entries */
-		if (!IsDir(backup_instance_path, data_ent->d_name, FIO_BACKUP_HOST)
-			|| data_ent->d_name[0] == '.')
+		/* skip hidden entries */
+		if (data_ent->d_name[0] == '.')
 			continue;
 
 		/* open subdirectory of specific backup */
@@ -780,7 +1341,22 @@ catalog_get_backup_list(const char *instance_name, time_t requested_backup_id)
 
 		/* read backup information from BACKUP_CONTROL_FILE */
 		snprintf(backup_conf_path, MAXPGPATH, "%s/%s", data_path, BACKUP_CONTROL_FILE);
-		backup = readBackupControlFile(backup_conf_path);
+
+		if (fio_stat(backup_conf_path, &st, true, FIO_BACKUP_HOST) == 0 &&
+			S_ISREG(st.st_mode))
+			backup = read_backup_control_cached(backup_conf_path, data_path,
+												data_ent->d_name, &st,
+												index, new_index, &index_changed);
+		else
+		{
+			errno = 0;
+
+			/* skip not-directory entries */
+			if (!IsDir(backup_instance_path, data_ent->d_name, FIO_BACKUP_HOST))
+				continue;
+
+			backup = readBackupControlFile(backup_conf_path);
+		}
 
 		if (!backup)
 		{
@@ -829,6 +1405,30 @@ catalog_get_backup_list(const char *instance_name, time_t requested_backup_id)
 	fio_closedir(data_dir);
 	data_dir = NULL;
 
+	/* entries of removed backups are dropped from the index */
+	if (parray_num(new_index) != parray_num(index))
+		index_changed = true;
+
+	if (index_changed)
+	{
+		parray_qsort(new_index, BackupIndexEntryCompareName);
+		write_backup_index(backup_instance_path, new_index);
+	}
+
+	for (i = 0; i < parray_num(index); i++)
+	{
+		BackupIndexEntry *entry = (BackupIndexEntry *) parray_get(index, i);
+
+		if (!entry->used)
+			BackupIndexEntryFree(entry);
+	}
+	parray_free(index);
+	index = NULL;
+
+	parray_walk(new_index, BackupIndexEntryFree);
+	parray_free(new_index);
+	new_index = NULL;
+
 	parray_qsort(backups, pgBackupCompareIdDesc);
 
 	/* Link incremental backups with their ancestors.*/
@@ -873,9 +1473,24 @@ get_backup_filelist(pgBackup *backup, bool strict)
 {
 	parray		*files = NULL;
 	char		backup_filelist_path[MAXPGPATH];
+	FileListReader *reader;
+	pgFile	   *file;
 
 	join_path_components(backup_filelist_path, backup->root_dir, DATABASE_FILE_LIST);
-	files = dir_read_file_list(NULL, NULL, backup_filelist_path, FIO_BACKUP_HOST, backup->content_crc);
+
+	reader = filelist_open(backup_filelist_path, FIO_BACKUP_HOST);
+	backup->binary_filelist = filelist_is_binary(reader);
+
+	files = parray_new();
+	while ((file = filelist_next(reader)) != NULL)
+		parray_append(files, file);
+
+	if (!filelist_close(reader, backup->content_crc))
+	{
+		parray_walk(files, pgFileFree);
+		parray_free(files);
+		files = NULL;
+	}
 
 	/* redundant sanity? */
 	if (!files)
@@ -884,6 +1499,20 @@ get_backup_filelist(pgBackup *backup, bool strict)
 	return files;
 }
 
+/*
+ * Get single file from backup filelist without loading the whole list.
+ * Returns NULL if the file is not found.
+ */
+pgFile *
+get_backup_file(pgBackup *backup, const char *rel_path, int external_dir_num)
+{
+	char		backup_filelist_path[MAXPGPATH];
+
+	join_path_components(backup_filelist_path, backup->root_dir, DATABASE_FILE_LIST);
+
+	return filelist_lookup(backup_filelist_path, rel_path, external_dir_num);
+}
+
 /*
  * Lock list of backups. Function goes in backward direction.
  */
@@ -1235,8 +1864,8 @@ create_backup_dir(pgBackup *backup, const char *backup_instance_path)
 parray *
 catalog_get_timelines(InstanceConfig *instance)
 {
-	int i,j,k;
-	parray *xlog_files_list = parray_new();
+	int i,j;
+	parray *xlog_files_list;
 	parray *timelineinfos;
 	parray *backups;
 	timelineInfo *tlinfo;
@@ -1248,7 +1877,7 @@ catalog_get_timelines(InstanceConfig *instance)
 
 	/* read all xlog files that belong to this archive */
 	sprintf(arclog_path, "%s/%s/%s", backup_path, "wal", instance->name);
-	dir_list_file(xlog_files_list, arclog_path, false, false, false, false, true, 0, FIO_BACKUP_HOST);
+	xlog_files_list = catalog_get_wal_files(instance->name, arclog_path);
 	parray_qsort(xlog_files_list, pgFileCompareName);
 
 	timelineinfos = parray_new();
@@ -1261,6 +1890,7 @@ catalog_get_timelines(InstanceConfig *instance)
 		TimeLineID tli;
 		parray *timelines;
 		xlogFile *wal_file = NULL;
+		xlogRange *range = NULL;
 
 		/*
 		 * Regular WAL file.
@@ -1305,7 +1935,6 @@ catalog_get_timelines(InstanceConfig *instance)
 					wal_file->file = *file;
 					wal_file->segno = segno;
 					wal_file->type = BACKUP_HISTORY_FILE;
-					wal_file->keep = false;
 					parray_append(tlinfo->xlog_filelist, wal_file);
 					continue;
 				}
@@ -1326,7 +1955,6 @@ catalog_get_timelines(InstanceConfig *instance)
 					wal_file->file = *file;
 					wal_file->segno = segno;
 					wal_file->type = PARTIAL_SEGMENT;
-					wal_file->keep = false;
 					parray_append(tlinfo->xlog_filelist, wal_file);
 					continue;
 				}
@@ -1347,12 +1975,13 @@ catalog_get_timelines(InstanceConfig *instance)
 					wal_file->file = *file;
 					wal_file->segno = segno;
 					wal_file->type = TEMP_SEGMENT;
-					wal_file->keep = false;
 					parray_append(tlinfo->xlog_filelist, wal_file);
 					continue;
 				}
-				/* we only expect compressed wal files with .gz suffix */
-				else if (strcmp(suffix, "gz") != 0)
+				/* we only expect compressed wal files with .gz, .zst or .lz4 suffix */
+				else if (strcmp(suffix, "gz") != 0 &&
+						 strcmp(suffix, "zst") != 0 &&
+						 strcmp(suffix, "lz4") != 0)
 				{
 					elog(WARNING, "unexpected WAL file name \"%s\"", file->name);
 					continue;
@@ -1404,13 +2033,36 @@ catalog_get_timelines(InstanceConfig *instance)
 			tlinfo->n_xlog_files++;
 			tlinfo->size += file->size;
 
-			/* append file to xlog file list */
-			wal_file = palloc(sizeof(xlogFile));
-			wal_file->file = *file;
-			wal_file->segno = segno;
-			wal_file->type = SEGMENT;
-			wal_file->keep = false;
-			parray_append(tlinfo->xlog_filelist, wal_file);
+			/*
+			 * Extend the last range of segments or start a new one.
+			 * Segments are not kept as separate objects, their names
+			 * can be constructed from the range.
+			 */
+			if (result < 4)
+				suffix[0] = '\0';
+
+			range = NULL;
+			if (parray_num(tlinfo->xlog_ranges) > 0)
+				range = (xlogRange *) parray_get(tlinfo->xlog_ranges,
+												 parray_num(tlinfo->xlog_ranges) - 1);
+
+			if (range && range->end_segno + 1 == segno &&
+				strcmp(range->suffix, suffix) == 0)
+			{
+				range->end_segno = segno;
+				range->size += file->size;
+			}
+			else
+			{
+				range = palloc(sizeof(xlogRange));
+				range->begin_segno = segno;
+				range->end_segno = segno;
+				range->size = file->size;
+				strncpy(range->suffix, suffix, sizeof(range->suffix));
+				parray_append(tlinfo->xlog_ranges, range);
+			}
+
+			pgFileFree(file);
 		}
 		/* timeline history file */
 		else if (IsTLHistoryFileName(file->name))
@@ -1451,6 +2103,9 @@ catalog_get_timelines(InstanceConfig *instance)
 			elog(WARNING, "unexpected WAL file name \"%s\"", file->name);
 	}
 
+	/* segments are freed above, other files are now owned by timelines */
+	parray_free(xlog_files_list);
+
 	/* save information about backups belonging to each timeline */
 	backups = catalog_get_backup_list(instance->name, INVALID_BACKUP_ID);
 
@@ -1774,62 +2429,54 @@ catalog_get_timelines(InstanceConfig *instance)
 		}
 	}
 
-	/*
-	 * Protect WAL segments from deletion by setting 'keep' flag.
-	 * We must keep all WAL segments after anchor_lsn (including), and also segments
-	 * required by ARCHIVE backups for consistency - WAL between [start_lsn, stop_lsn].
-	 */
-	for (i = 0; i < parray_num(timelineinfos); i++)
-	{
-		XLogSegNo   anchor_segno = 0;
-		timelineInfo *tlinfo = parray_get(timelineinfos, i);
+	return timelineinfos;
+}
 
-		/*
-		 * At this point invalid anchor_lsn can be only in one case:
-		 * timeline is going to be purged by regular WAL purge rules.
-		 */
-		if (XLogRecPtrIsInvalid(tlinfo->anchor_lsn))
-			continue;
+/*
+ * Check if WAL segment must be protected from deletion.
+ * We must keep all WAL segments after anchor_lsn (including), and also segments
+ * required by ARCHIVE backups for consistency - WAL between [start_lsn, stop_lsn].
+ */
+bool
+timelineKeepsSegment(timelineInfo *tlinfo, XLogSegNo segno, uint32 xlog_seg_size)
+{
+	XLogSegNo   anchor_segno = 0;
+	int			i;
 
-		/*
-		 * anchor_lsn is located in another timeline, it means that the timeline
-		 * will be protected from purge entirely.
-		 */
-		if (tlinfo->anchor_tli > 0 && tlinfo->anchor_tli != tlinfo->tli)
-			continue;
+	/*
+	 * Invalid anchor_lsn can be only in one case:
+	 * timeline is going to be purged by regular WAL purge rules.
+	 */
+	if (XLogRecPtrIsInvalid(tlinfo->anchor_lsn))
+		return false;
 
-		GetXLogSegNo(tlinfo->anchor_lsn, anchor_segno, instance->xlog_seg_size);
+	/*
+	 * anchor_lsn is located in another timeline, it means that the timeline
+	 * will be protected from purge entirely.
+	 */
+	if (tlinfo->anchor_tli > 0 && tlinfo->anchor_tli != tlinfo->tli)
+		return false;
 
-		for (j = 0; j < parray_num(tlinfo->xlog_filelist); j++)
-		{
-			xlogFile *wal_file = (xlogFile *) parray_get(tlinfo->xlog_filelist, j);
+	GetXLogSegNo(tlinfo->anchor_lsn, anchor_segno, xlog_seg_size);
 
-			if (wal_file->segno >= anchor_segno)
-			{
-				wal_file->keep = true;
-				continue;
-			}
+	if (segno >= anchor_segno)
+		return true;
 
-			/* no keep segments */
-			if (!tlinfo->keep_segments)
-				continue;
+	/* no keep segments */
+	if (!tlinfo->keep_segments)
+		return false;
 
-			/* Protect segments belonging to one of the keep invervals */
-			for (k = 0; k < parray_num(tlinfo->keep_segments); k++)
-			{
-				xlogInterval *keep_segments = (xlogInterval *) parray_get(tlinfo->keep_segments, k);
+	/* Protect segments belonging to one of the keep invervals */
+	for (i = 0; i < parray_num(tlinfo->keep_segments); i++)
+	{
+		xlogInterval *keep_segments = (xlogInterval *) parray_get(tlinfo->keep_segments, i);
 
-				if ((wal_file->segno >= keep_segments->begin_segno) &&
-					wal_file->segno <= keep_segments->end_segno)
-				{
-					wal_file->keep = true;
-					break;
-				}
-			}
-		}
+		if ((segno >= keep_segments->begin_segno) &&
+			segno <= keep_segments->end_segno)
+			return true;
 	}
 
-	return timelineinfos;
+	return false;
 }
 
 /*
@@ -2053,6 +2700,8 @@ pgBackupWriteControl(FILE *out, pgBackup *backup, bool utc)
 	fio_fprintf(out, "compress-alg = %s\n",
 			deparse_compress_alg(backup->compress_alg));
 	fio_fprintf(out, "compress-level = %d\n", backup->compress_level);
+	if (backup->dedup_mode != DEDUP_NONE)
+		fio_fprintf(out, "dedup = %s\n", deparse_dedup_mode(backup->dedup_mode));
 	fio_fprintf(out, "from-replica = %s\n", backup->from_replica ? "true" : "false");
 
 	fio_fprintf(out, "\n#Compatibility\n");
@@ -2074,6 +2723,11 @@ pgBackupWriteControl(FILE *out, pgBackup *backup, bool utc)
 	fio_fprintf(out, "stop-lsn = %X/%X\n",
 			(uint32) (backup->stop_lsn >> 32),
 			(uint32) backup->stop_lsn);
+	/* checkpoint record required to resume the backup */
+	if (backup->checkpoint_lsn != InvalidXLogRecPtr)
+		fio_fprintf(out, "checkpoint-lsn = %X/%X\n",
+				(uint32) (backup->checkpoint_lsn >> 32),
+				(uint32) backup->checkpoint_lsn);
 
 	time2iso(timestamp, lengthof(timestamp), backup->start_time, utc);
 	fio_fprintf(out, "start-time = '%s'\n", timestamp);
@@ -2203,6 +2857,92 @@ write_backup(pgBackup *backup, bool strict)
 			 path_temp, path, strerror(errno));
 }
 
+/*
+ * Write file list in binary format (see FileListHeader) and return its CRC.
+ * Files are expected to be sorted by pgFileCompareRelPathWithExternal.
+ */
+static pg_crc32
+write_binary_filelist(FILE *out, parray *files, const char *control_path)
+{
+	FileListHeader header;
+	uint64	   *index;
+	uint64		offset = sizeof(FileListHeader);
+	pg_crc32	crc;
+	size_t		i;
+
+	index = pgut_malloc(sizeof(uint64) * Max(parray_num(files), 1));
+
+	/* header is rewritten when CRC and index offset are known */
+	MemSet(&header, 0, sizeof(header));
+	if (fwrite(&header, 1, sizeof(header), out) != sizeof(header))
+		elog(ERROR, "Cannot write file list \"%s\": %s",
+			 control_path, strerror(errno));
+
+	INIT_FILE_CRC32(true, crc);
+
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+		FileListEntry entry;
+
+		MemSet(&entry, 0, sizeof(entry));
+		entry.write_size = file->write_size;
+		entry.mode = file->mode;
+		entry.is_datafile = file->is_datafile ? 1 : 0;
+		entry.is_cfs = file->is_cfs ? 1 : 0;
+		entry.crc = file->crc;
+		entry.compress_alg = (uint8) file->compress_alg;
+		entry.external_dir_num = file->external_dir_num;
+		entry.dbOid = file->dbOid;
+		entry.segno = file->segno;
+		entry.n_blocks = file->n_blocks;
+		entry.n_headers = file->n_headers;
+		entry.hdr_crc = file->hdr_crc;
+		entry.hdr_off = file->hdr_off;
+		entry.hdr_size = file->hdr_size;
+		entry.path_len = strlen(file->rel_path);
+		entry.linked_len = file->linked ? strlen(file->linked) : 0;
+
+		index[i] = offset;
+
+		COMP_FILE_CRC32(true, crc, &entry, sizeof(entry));
+		COMP_FILE_CRC32(true, crc, file->rel_path, entry.path_len);
+		if (entry.linked_len > 0)
+			COMP_FILE_CRC32(true, crc, file->linked, entry.linked_len);
+
+		if (fwrite(&entry, 1, sizeof(entry), out) != sizeof(entry) ||
+			fwrite(file->rel_path, 1, entry.path_len, out) != entry.path_len ||
+			(entry.linked_len > 0 &&
+			 fwrite(file->linked, 1, entry.linked_len, out) != entry.linked_len))
+			elog(ERROR, "Cannot write file list \"%s\": %s",
+				 control_path, strerror(errno));
+
+		offset += sizeof(entry) + entry.path_len + entry.linked_len;
+	}
+
+	COMP_FILE_CRC32(true, crc, index, sizeof(uint64) * parray_num(files));
+	FIN_FILE_CRC32(true, crc);
+
+	if (fwrite(index, sizeof(uint64), parray_num(files), out) != parray_num(files))
+		elog(ERROR, "Cannot write file list \"%s\": %s",
+			 control_path, strerror(errno));
+
+	memcpy(header.magic, FILELIST_MAGIC, sizeof(FILELIST_MAGIC));
+	header.version = FILELIST_VERSION;
+	header.n_files = parray_num(files);
+	header.index_off = offset;
+	header.crc = crc;
+
+	if (fseek(out, 0, SEEK_SET) != 0 ||
+		fwrite(&header, 1, sizeof(header), out) != sizeof(header))
+		elog(ERROR, "Cannot write file list \"%s\": %s",
+			 control_path, strerror(errno));
+
+	pg_free(index);
+
+	return crc;
+}
+
 /*
  * Output the list of files to backup catalog DATABASE_FILE_LIST
  */
@@ -2219,6 +2959,7 @@ write_backup_filelist(pgBackup *backup, parray *files, const char *root,
 	int64 		backup_size_on_disk = 0;
 	int64 		uncompressed_size_on_disk = 0;
 	int64 		wal_size_on_disk = 0;
+	parray	   *binary_files = NULL;
 
 	join_path_components(control_path, backup->root_dir, DATABASE_FILE_LIST);
 	snprintf(control_path_temp, sizeof(control_path_temp), "%s.tmp", control_path);
@@ -2235,7 +2976,9 @@ write_backup_filelist(pgBackup *backup, parray *files, const char *root,
 	buf = pgut_malloc(BUFFERSZ);
 	setvbuf(out, buf, _IOFBF, BUFFERSZ);
 
-	if (sync)
+	if (backup->binary_filelist)
+		binary_files = parray_new();
+	else if (sync)
 		INIT_FILE_CRC32(true, backup->content_crc);
 
 	/* print each file in the list */
@@ -2271,6 +3014,12 @@ write_backup_filelist(pgBackup *backup, parray *files, const char *root,
 			}
 		}
 
+		if (binary_files)
+		{
+			parray_append(binary_files, file);
+			continue;
+		}
+
 		len = sprintf(line, "{\"path\":\"%s\", \"size\":\"" INT64_FORMAT "\", "
 					 "\"mode\":\"%u\", \"is_datafile\":\"%u\", "
 					 "\"is_cfs\":\"%u\", \"crc\":\"%u\", "
@@ -2309,7 +3058,17 @@ write_backup_filelist(pgBackup *backup, parray *files, const char *root,
 		fprintf(out, "%s", line);
 	}
 
-	if (sync)
+	if (binary_files)
+	{
+		pg_crc32	crc;
+
+		parray_qsort(binary_files, pgFileCompareRelPathWithExternal);
+		crc = write_binary_filelist(out, binary_files, control_path_temp);
+		if (sync)
+			backup->content_crc = crc;
+		parray_free(binary_files);
+	}
+	else if (sync)
 		FIN_FILE_CRC32(true, backup->content_crc);
 
 	if (fflush(out) != 0)
@@ -2345,17 +3104,29 @@ write_backup_filelist(pgBackup *backup, parray *files, const char *root,
  */
 static pgBackup *
 readBackupControlFile(const char *path)
+{
+	return parseBackupControl(path, NULL);
+}
+
+/*
+ * Create pgBackup from the content of BACKUP_CONTROL_FILE.
+ * If content is NULL, it is read from the file.
+ */
+static pgBackup *
+parseBackupControl(const char *path, const char *content)
 {
 	pgBackup   *backup = pgut_new(pgBackup);
 	char	   *backup_mode = NULL;
 	char	   *start_lsn = NULL;
 	char	   *stop_lsn = NULL;
+	char	   *checkpoint_lsn = NULL;
 	char	   *status = NULL;
 	char	   *parent_backup = NULL;
 	char	   *merge_dest_backup = NULL;
 	char	   *program_version = NULL;
 	char	   *server_version = NULL;
 	char	   *compress_alg = NULL;
+	char	   *dedup = NULL;
 	int			parsed_options;
 
 	ConfigOption options[] =
@@ -2364,6 +3135,7 @@ readBackupControlFile(const char *path)
 		{'u', 0, "timelineid",			&backup->tli, SOURCE_FILE_STRICT},
 		{'s', 0, "start-lsn",			&start_lsn, SOURCE_FILE_STRICT},
 		{'s', 0, "stop-lsn",			&stop_lsn, SOURCE_FILE_STRICT},
+		{'s', 0, "checkpoint-lsn",		&checkpoint_lsn, SOURCE_FILE_STRICT},
 		{'t', 0, "start-time",			&backup->start_time, SOURCE_FILE_STRICT},
 		{'t', 0, "merge-time",			&backup->merge_time, SOURCE_FILE_STRICT},
 		{'t', 0, "end-time",			&backup->end_time, SOURCE_FILE_STRICT},
@@ -2385,6 +3157,7 @@ readBackupControlFile(const char *path)
 		{'s', 0, "merge-dest-id",		&merge_dest_backup, SOURCE_FILE_STRICT},
 		{'s', 0, "compress-alg",		&compress_alg, SOURCE_FILE_STRICT},
 		{'u', 0, "compress-level",		&backup->compress_level, SOURCE_FILE_STRICT},
+		{'s', 0, "dedup",				&dedup, SOURCE_FILE_STRICT},
 		{'b', 0, "from-replica",		&backup->from_replica, SOURCE_FILE_STRICT},
 		{'s', 0, "primary-conninfo",	&backup->primary_conninfo, SOURCE_FILE_STRICT},
 		{'s', 0, "external-dirs",		&backup->external_dir_str, SOURCE_FILE_STRICT},
@@ -2394,14 +3167,20 @@ readBackupControlFile(const char *path)
 	};
 
 	pgBackupInit(backup);
-	if (fio_access(path, F_OK, FIO_BACKUP_HOST) != 0)
+
+	if (content)
+		parsed_options = config_read_opt_buffer(path, content, options, WARNING, true);
+	else
 	{
-		elog(WARNING, "Control file \"%s\" doesn't exist", path);
-		pgBackupFree(backup);
-		return NULL;
-	}
+		if (fio_access(path, F_OK, FIO_BACKUP_HOST) != 0)
+		{
+			elog(WARNING, "Control file \"%s\" doesn't exist", path);
+			pgBackupFree(backup);
+			return NULL;
+		}
 
-	parsed_options = config_read_opt(path, options, WARNING, true, true);
+		parsed_options = config_read_opt(path, options, WARNING, true, true);
+	}
 
 	if (parsed_options == 0)
 	{
@@ -2447,6 +3226,18 @@ readBackupControlFile(const char *path)
 		free(stop_lsn);
 	}
 
+	if (checkpoint_lsn)
+	{
+		uint32 xlogid;
+		uint32 xrecoff;
+
+		if (sscanf(checkpoint_lsn, "%X/%X", &xlogid, &xrecoff) == 2)
+			backup->checkpoint_lsn = (XLogRecPtr) ((uint64) xlogid << 32) | xrecoff;
+		else
+			elog(WARNING, "Invalid CHECKPOINT_LSN \"%s\"", checkpoint_lsn);
+		free(checkpoint_lsn);
+	}
+
 	if (status)
 	{
 		if (strcmp(status, "OK") == 0)
@@ -2503,6 +3294,12 @@ readBackupControlFile(const char *path)
 	if (compress_alg)
 		backup->compress_alg = parse_compress_alg(compress_alg);
 
+	if (dedup)
+	{
+		backup->dedup_mode = parse_dedup_mode(dedup);
+		free(dedup);
+	}
+
 	return backup;
 }
 
@@ -2551,6 +3348,37 @@ deparse_backup_mode(BackupMode mode)
 	return NULL;
 }
 
+DedupMode
+parse_dedup_mode(const char *value)
+{
+	if (pg_strcasecmp(value, "none") == 0)
+		return DEDUP_NONE;
+	else if (pg_strcasecmp(value, "reflink") == 0)
+		return DEDUP_REFLINK;
+	else if (pg_strcasecmp(value, "hardlink") == 0)
+		return DEDUP_HARDLINK;
+
+	/* Dedup mode is invalid, so leave with an error */
+	elog(ERROR, "invalid dedup mode \"%s\"", value);
+	return DEDUP_NONE;
+}
+
+const char *
+deparse_dedup_mode(DedupMode mode)
+{
+	switch (mode)
+	{
+		case DEDUP_NONE:
+			return "none";
+		case DEDUP_REFLINK:
+			return "reflink";
+		case DEDUP_HARDLINK:
+			return "hardlink";
+	}
+
+	return NULL;
+}
+
 CompressAlg
 parse_compress_alg(const char *arg)
 {
@@ -2568,6 +3396,10 @@ parse_compress_alg(const char *arg)
 		return ZLIB_COMPRESS;
 	else if (pg_strncasecmp("pglz", arg, len) == 0)
 		return PGLZ_COMPRESS;
+	else if (pg_strncasecmp("zstd", arg, len) == 0)
+		return ZSTD_COMPRESS;
+	else if (pg_strncasecmp("lz4", arg, len) == 0)
+		return LZ4_COMPRESS;
 	else if (pg_strncasecmp("none", arg, len) == 0)
 		return NONE_COMPRESS;
 	else
@@ -2588,6 +3420,10 @@ deparse_compress_alg(int alg)
 			return "zlib";
 		case PGLZ_COMPRESS:
 			return "pglz";
+		case ZSTD_COMPRESS:
+			return "zstd";
+		case LZ4_COMPRESS:
+			return "lz4";
 	}
 
 	return NULL;
@@ -2626,6 +3462,7 @@ pgBackupInit(pgBackup *backup)
 	backup->tli = 0;
 	backup->start_lsn = 0;
 	backup->stop_lsn = 0;
+	backup->checkpoint_lsn = 0;
 	backup->start_time = (time_t) 0;
 	backup->merge_time = (time_t) 0;
 	backup->end_time = (time_t) 0;
@@ -2640,6 +3477,7 @@ pgBackupInit(pgBackup *backup)
 
 	backup->compress_alg = COMPRESS_ALG_DEFAULT;
 	backup->compress_level = COMPRESS_LEVEL_DEFAULT;
+	backup->dedup_mode = DEDUP_NONE;
 
 	backup->block_size = BLCKSZ;
 	backup->wal_block_size = XLOG_BLCKSZ;
@@ -2659,6 +3497,7 @@ pgBackupInit(pgBackup *backup)
 	backup->files = NULL;
 	backup->note = NULL;
 	backup->content_crc = 0;
+	backup->binary_filelist = false;
 }
 
 /* free pgBackup object */
@@ -28,6 +28,8 @@ typedef struct
 {
 	/* list of files to validate */
 	parray	   *files_list;
+	/* queue of files shared by threads */
+	FileQueue  *queue;
 	/* if page checksums are enabled in this postgres instance? */
 	uint32 checksum_version;
 	/*
@@ -133,15 +135,14 @@ check_files(void *arg)
 	check_files_arg *arguments = (check_files_arg *) arg;
 	int			n_files_list = 0;
 	char		from_fullpath[MAXPGPATH];
+	pgFile	   *file;
 
 	if (arguments->files_list)
 		n_files_list = parray_num(arguments->files_list);
 
 	/* check a file */
-	for (i = 0; i < n_files_list; i++)
+	while ((file = file_queue_next(arguments->queue, arguments->thread_num, &i)) != NULL)
 	{
-		pgFile	   *file = (pgFile *) parray_get(arguments->files_list, i);
-
 		/* check for interrupt */
 		if (interrupted || thread_interrupted)
 			elog(ERROR, "interrupted during checkdb");
@@ -150,16 +151,13 @@ check_files(void *arg)
 		if (S_ISDIR(file->mode))
 			continue;
 
-		if (!pg_atomic_test_set_flag(&file->lock))
-			continue;
-
 		join_path_components(from_fullpath, arguments->from_root, file->rel_path);
 
 		elog(VERBOSE, "Checking file:  \"%s\" ", from_fullpath);
 
 		if (progress)
 			elog(INFO, "Progress: (%d/%d). Process file \"%s\"",
-				 i + 1, n_files_list, from_fullpath);
+				 i, n_files_list, from_fullpath);
 
 		if (S_ISREG(file->mode))
 		{
@@ -200,6 +198,7 @@ do_block_validation(char *pgdata, uint32 checksum_version)
 	/* arrays with meta info for multi threaded check */
 	pthread_t	*threads;
 	check_files_arg *threads_args;
+	FileQueue  *queue;
 	bool		check_isok = true;
 	parray *files_list = NULL;
 
@@ -221,25 +220,18 @@ do_block_validation(char *pgdata, uint32 checksum_version)
 	/* Extract information about files in pgdata parsing their names:*/
 	parse_filelist_filenames(files_list, pgdata);
 
-	/* setup threads */
-	for (i = 0; i < parray_num(files_list); i++)
-	{
-		pgFile	   *file = (pgFile *) parray_get(files_list, i);
-		pg_atomic_init_flag(&file->lock);
-	}
-
-	/* Sort by size for load balancing */
-	parray_qsort(files_list, pgFileCompareSize);
-
 	/* init thread args with own file lists */
 	threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
 	threads_args = (check_files_arg *) palloc(sizeof(check_files_arg)*num_threads);
+	/* largest files go first for load balancing */
+	queue = file_queue_init(files_list, num_threads);
 
 	for (i = 0; i < num_threads; i++)
 	{
 		check_files_arg *arg = &(threads_args[i]);
 
 		arg->files_list = files_list;
+		arg->queue = queue;
 		arg->checksum_version = checksum_version;
 		arg->from_root = pgdata;
 
@@ -271,6 +263,9 @@ do_block_validation(char *pgdata, uint32 checksum_version)
 			check_isok = false;
 	}
 
+	file_queue_report(queue, "checked");
+	file_queue_free(queue);
+
 	/* cleanup */
 	if (files_list)
 	{
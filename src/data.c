@@ -16,13 +16,45 @@
 #include "utils/file.h"
 
 #include <unistd.h>
+#include <fcntl.h>
 #include <sys/stat.h>
 
+#ifdef __linux__
+#include <sys/mman.h>
+#include <sys/sendfile.h>
+#include <sys/ioctl.h>
+#include <linux/fs.h>
+/* copy content of local files inside the kernel */
+#define HAVE_ZERO_COPY
+#if defined(__GLIBC__) && (__GLIBC__ > 2 || (__GLIBC__ == 2 && __GLIBC_MINOR__ >= 27))
+#define HAVE_COPY_FILE_RANGE
+#endif
+#endif
+
+/* files smaller than this are not worth the zero-copy path */
+#define ZERO_COPY_MIN_SIZE	CHUNK_SIZE
+/* amount of data copied by one system call */
+#define ZERO_COPY_CHUNK_SIZE	(16 * 1024 * 1024)
+
+/* number of blocks read at once by get_checksum_diff_map() */
+#define CHECKSUM_DIFF_READ_BLOCKS	128
+
 #ifdef HAVE_LIBZ
 #include <zlib.h>
 #endif
 
+#ifdef HAVE_LIBZSTD
+#include <zstd.h>
+#endif
+
+#ifdef HAVE_LIBLZ4
+#include <lz4.h>
+#include <lz4hc.h>
+#include <lz4frame.h>
+#endif
+
 #include "utils/thread.h"
+#include "instr_time.h"
 
 /* Union to ease operations on relation pages */
 typedef struct DataPage
@@ -58,6 +90,72 @@ zlib_decompress(void *dst, size_t dst_size, void const *src, size_t src_size)
 }
 #endif
 
+#ifdef HAVE_LIBZSTD
+/* Implementation of zstd compression method */
+static int32
+zstd_compress(void *dst, size_t dst_size, void const *src, size_t src_size,
+			  int level, const char **errormsg)
+{
+	size_t		rc = ZSTD_compress(dst, dst_size, src, src_size, level);
+
+	if (ZSTD_isError(rc))
+	{
+		if (errormsg)
+			*errormsg = ZSTD_getErrorName(rc);
+		return -1;
+	}
+
+	return rc;
+}
+
+/* Implementation of zstd decompression method */
+static int32
+zstd_decompress(void *dst, size_t dst_size, void const *src, size_t src_size,
+				const char **errormsg)
+{
+	size_t		rc = ZSTD_decompress(dst, dst_size, src, src_size);
+
+	if (ZSTD_isError(rc))
+	{
+		if (errormsg)
+			*errormsg = ZSTD_getErrorName(rc);
+		return -1;
+	}
+
+	return rc;
+}
+#endif
+
+#ifdef HAVE_LIBLZ4
+/*
+ * Implementation of lz4 compression method.
+ * Level 0 and 1 use the fast compressor, higher levels use LZ4HC.
+ */
+static int32
+lz4_compress(void *dst, size_t dst_size, void const *src, size_t src_size,
+			 int level)
+{
+	int			rc;
+
+	if (level <= 1)
+		rc = LZ4_compress_default(src, dst, src_size, dst_size);
+	else
+		rc = LZ4_compress_HC(src, dst, src_size, dst_size, level);
+
+	/* zero means that destination buffer is too small */
+	return rc > 0 ? rc : -1;
+}
+
+/* Implementation of lz4 decompression method */
+static int32
+lz4_decompress(void *dst, size_t dst_size, void const *src, size_t src_size)
+{
+	int			rc = LZ4_decompress_safe(src, dst, src_size, dst_size);
+
+	return rc >= 0 ? rc : -1;
+}
+#endif
+
 /*
  * Compresses source into dest using algorithm. Returns the number of bytes
  * written in the destination buffer, or -1 if compression fails.
@@ -80,9 +178,27 @@ do_compress(void* dst, size_t dst_size, void const* src, size_t src_size,
 					*errormsg = zError(ret);
 				return ret;
 			}
+#endif
+#ifdef HAVE_LIBZSTD
+		case ZSTD_COMPRESS:
+			return zstd_compress(dst, dst_size, src, src_size, level, errormsg);
+#endif
+#ifdef HAVE_LIBLZ4
+		case LZ4_COMPRESS:
+			{
+				int32		ret;
+				ret = lz4_compress(dst, dst_size, src, src_size, level);
+				if (ret < 0 && errormsg)
+					*errormsg = "lz4 compression failed";
+				return ret;
+			}
 #endif
 		case PGLZ_COMPRESS:
 			return pglz_compress(src, src_size, dst, PGLZ_strategy_always);
+		default:
+			if (errormsg)
+				*errormsg = "This build does not support requested compression algorithm";
+			return -1;
 	}
 
 	return -1;
@@ -120,11 +236,452 @@ do_decompress(void* dst, size_t dst_size, void const* src, size_t src_size,
 #else
 			return pglz_decompress(src, src_size, dst, dst_size);
 #endif
+#ifdef HAVE_LIBZSTD
+		case ZSTD_COMPRESS:
+			return zstd_decompress(dst, dst_size, src, src_size, errormsg);
+#endif
+#ifdef HAVE_LIBLZ4
+		case LZ4_COMPRESS:
+			{
+				int32		ret;
+				ret = lz4_decompress(dst, dst_size, src, src_size);
+				if (ret < 0 && errormsg)
+					*errormsg = "lz4 decompression failed, data is corrupted";
+				return ret;
+			}
+#endif
+		default:
+			if (errormsg)
+				*errormsg = "This build does not support requested compression algorithm";
+			return -1;
 	}
 
 	return -1;
 }
 
+/*
+ * Streaming compression.
+ *
+ * Unlike do_compress(), which compresses a single page, compression stream
+ * produces one zstd or lz4 frame for the whole file, fed by chunks of
+ * arbitrary size. It is used for WAL segments in archive, so they can be
+ * compressed and decompressed in large blocks without holding the whole
+ * segment in memory. Output is passed to write callback.
+ */
+struct CompressStream
+{
+	CompressAlg	alg;
+	bool		decompress;
+	/* true, if decompressor has reached the end of frame */
+	bool		frame_done;
+
+	compress_stream_write_cb write_cb;
+	void	   *write_arg;
+
+	char	   *out_buf;
+	size_t		out_size;
+
+#ifdef HAVE_LIBZSTD
+	ZSTD_CCtx  *zstd_cctx;
+	ZSTD_DCtx  *zstd_dctx;
+#endif
+#ifdef HAVE_LIBLZ4
+	LZ4F_cctx  *lz4_cctx;
+	LZ4F_dctx  *lz4_dctx;
+	LZ4F_preferences_t lz4_prefs;
+	bool		lz4_frame_begun;
+#endif
+};
+
+/*
+ * Return file suffix (without leading dot) used for WAL segments
+ * compressed with streaming algorithm, or NULL if algorithm cannot be
+ * used for streaming compression.
+ */
+const char *
+compress_stream_suffix(CompressAlg alg)
+{
+	switch (alg)
+	{
+		case ZSTD_COMPRESS:
+			return "zst";
+		case LZ4_COMPRESS:
+			return "lz4";
+		default:
+			return NULL;
+	}
+}
+
+/*
+ * Guess streaming compression algorithm by file name, e.g.
+ * 000000010000000000000001.zst or 000000010000000000000001.lz4.partial
+ */
+CompressAlg
+compress_stream_alg_by_name(const char *path)
+{
+	const char *fname = last_dir_separator(path);
+
+	fname = fname ? fname + 1 : path;
+
+	if (strstr(fname, ".zst") != NULL)
+		return ZSTD_COMPRESS;
+	else if (strstr(fname, ".lz4") != NULL)
+		return LZ4_COMPRESS;
+
+	return NONE_COMPRESS;
+}
+
+/* Is algorithm supported by this build for streaming compression? */
+bool
+compress_stream_supported(CompressAlg alg)
+{
+	switch (alg)
+	{
+#ifdef HAVE_LIBZSTD
+		case ZSTD_COMPRESS:
+			return true;
+#endif
+#ifdef HAVE_LIBLZ4
+		case LZ4_COMPRESS:
+			return true;
+#endif
+		default:
+			return false;
+	}
+}
+
+/*
+ * Create compression (or decompression) stream.
+ * Return NULL if algorithm is not supported.
+ */
+CompressStream *
+compress_stream_init(CompressAlg alg, int level, bool decompress,
+					 compress_stream_write_cb write_cb, void *write_arg,
+					 const char **errormsg)
+{
+	CompressStream *cs;
+
+	if (!compress_stream_supported(alg))
+	{
+		if (errormsg)
+			*errormsg = "This build does not support requested compression algorithm";
+		return NULL;
+	}
+
+	cs = pgut_new(CompressStream);
+	memset(cs, 0, sizeof(CompressStream));
+
+	cs->alg = alg;
+	cs->decompress = decompress;
+	cs->write_cb = write_cb;
+	cs->write_arg = write_arg;
+	cs->out_size = OUT_BUF_SIZE;
+
+#ifdef HAVE_LIBZSTD
+	if (alg == ZSTD_COMPRESS)
+	{
+		if (decompress)
+			cs->zstd_dctx = ZSTD_createDCtx();
+		else
+		{
+			cs->zstd_cctx = ZSTD_createCCtx();
+			if (cs->zstd_cctx)
+				ZSTD_CCtx_setParameter(cs->zstd_cctx, ZSTD_c_compressionLevel, level);
+		}
+
+		if (!cs->zstd_cctx && !cs->zstd_dctx)
+			elog(ERROR, "Out of memory");
+	}
+#endif
+#ifdef HAVE_LIBLZ4
+	if (alg == LZ4_COMPRESS)
+	{
+		LZ4F_errorCode_t rc;
+
+		if (decompress)
+			rc = LZ4F_createDecompressionContext(&cs->lz4_dctx, LZ4F_VERSION);
+		else
+		{
+			cs->lz4_prefs.compressionLevel = level;
+			cs->lz4_prefs.frameInfo.blockSizeID = LZ4F_max1MB;
+			cs->lz4_prefs.frameInfo.contentChecksumFlag = LZ4F_contentChecksumEnabled;
+
+			rc = LZ4F_createCompressionContext(&cs->lz4_cctx, LZ4F_VERSION);
+
+			/* output buffer must fit the worst case of compressing one chunk */
+			cs->out_size = Max(cs->out_size,
+							   LZ4F_compressBound(CHUNK_SIZE, &cs->lz4_prefs) +
+							   LZ4F_HEADER_SIZE_MAX);
+		}
+
+		if (LZ4F_isError(rc))
+			elog(ERROR, "Cannot create lz4 context: %s", LZ4F_getErrorName(rc));
+	}
+#endif
+
+	cs->out_buf = pgut_malloc(cs->out_size);
+
+	return cs;
+}
+
+/* Pass produced data to write callback */
+static int
+compress_stream_flush(CompressStream *cs, size_t len)
+{
+	if (len == 0)
+		return SEND_OK;
+
+	if (cs->write_cb(cs->write_arg, cs->out_buf, len) != len)
+		return WRITE_FAILED;
+
+	return SEND_OK;
+}
+
+/*
+ * Feed chunk of data into the stream. If 'finish' is true, this is the last
+ * chunk: compressor writes end of frame, decompressor checks that frame
+ * is complete.
+ *
+ * Return codes:
+ *   SEND_OK      (0)
+ *   WRITE_FAILED (-4) write callback failed, errno is set by it
+ *   ZLIB_ERROR   (-5) compression or decompression failed, errormsg is set
+ */
+int
+compress_stream_process(CompressStream *cs, const void *buf, size_t size,
+						bool finish, const char **errormsg)
+{
+	int			rc = SEND_OK;
+
+#ifdef HAVE_LIBZSTD
+	if (cs->alg == ZSTD_COMPRESS)
+	{
+		ZSTD_inBuffer in = {buf, size, 0};
+
+		for (;;)
+		{
+			ZSTD_outBuffer out = {cs->out_buf, cs->out_size, 0};
+			size_t		ret;
+
+			if (cs->decompress)
+				ret = ZSTD_decompressStream(cs->zstd_dctx, &out, &in);
+			else
+				ret = ZSTD_compressStream2(cs->zstd_cctx, &out, &in,
+										   finish ? ZSTD_e_end : ZSTD_e_continue);
+
+			if (ZSTD_isError(ret))
+			{
+				*errormsg = ZSTD_getErrorName(ret);
+				return ZLIB_ERROR;
+			}
+
+			rc = compress_stream_flush(cs, out.pos);
+			if (rc != SEND_OK)
+				return rc;
+
+			if (cs->decompress)
+			{
+				/* zero means that frame is completely decoded and flushed */
+				cs->frame_done = (ret == 0);
+
+				/* full output buffer means that there may be more data to flush */
+				if (in.pos == in.size && out.pos < out.size)
+					break;
+			}
+			else if (finish ? ret == 0 : in.pos == in.size)
+				break;
+		}
+	}
+#endif
+#ifdef HAVE_LIBLZ4
+	if (cs->alg == LZ4_COMPRESS && cs->decompress)
+	{
+		size_t		pos = 0;
+
+		for (;;)
+		{
+			size_t		src_size = size - pos;
+			size_t		dst_size = cs->out_size;
+			size_t		ret;
+
+			ret = LZ4F_decompress(cs->lz4_dctx, cs->out_buf, &dst_size,
+								  (const char *) buf + pos, &src_size, NULL);
+			if (LZ4F_isError(ret))
+			{
+				*errormsg = LZ4F_getErrorName(ret);
+				return ZLIB_ERROR;
+			}
+
+			pos += src_size;
+
+			rc = compress_stream_flush(cs, dst_size);
+			if (rc != SEND_OK)
+				return rc;
+
+			/* zero means that frame is completely decoded and flushed */
+			cs->frame_done = (ret == 0);
+
+			if (pos == size && dst_size < cs->out_size)
+				break;
+		}
+	}
+	else if (cs->alg == LZ4_COMPRESS)
+	{
+		size_t		pos = 0;
+		size_t		ret;
+
+		if (!cs->lz4_frame_begun)
+		{
+			ret = LZ4F_compressBegin(cs->lz4_cctx, cs->out_buf, cs->out_size,
+									 &cs->lz4_prefs);
+			if (LZ4F_isError(ret))
+			{
+				*errormsg = LZ4F_getErrorName(ret);
+				return ZLIB_ERROR;
+			}
+
+			rc = compress_stream_flush(cs, ret);
+			if (rc != SEND_OK)
+				return rc;
+
+			cs->lz4_frame_begun = true;
+		}
+
+		/* output buffer is large enough only for CHUNK_SIZE of input */
+		while (pos < size)
+		{
+			size_t		len = Min(CHUNK_SIZE, size - pos);
+
+			ret = LZ4F_compressUpdate(cs->lz4_cctx, cs->out_buf, cs->out_size,
+									  (const char *) buf + pos, len, NULL);
+			if (LZ4F_isError(ret))
+			{
+				*errormsg = LZ4F_getErrorName(ret);
+				return ZLIB_ERROR;
+			}
+
+			rc = compress_stream_flush(cs, ret);
+			if (rc != SEND_OK)
+				return rc;
+
+			pos += len;
+		}
+
+		if (finish)
+		{
+			ret = LZ4F_compressEnd(cs->lz4_cctx, cs->out_buf, cs->out_size, NULL);
+			if (LZ4F_isError(ret))
+			{
+				*errormsg = LZ4F_getErrorName(ret);
+				return ZLIB_ERROR;
+			}
+
+			rc = compress_stream_flush(cs, ret);
+			if (rc != SEND_OK)
+				return rc;
+		}
+	}
+#endif
+
+	if (finish && cs->decompress && !cs->frame_done)
+	{
+		*errormsg = "Unexpected end of compressed data";
+		return ZLIB_ERROR;
+	}
+
+	return rc;
+}
+
+void
+compress_stream_free(CompressStream *cs)
+{
+	if (!cs)
+		return;
+
+#ifdef HAVE_LIBZSTD
+	ZSTD_freeCCtx(cs->zstd_cctx);
+	ZSTD_freeDCtx(cs->zstd_dctx);
+#endif
+#ifdef HAVE_LIBLZ4
+	if (cs->lz4_cctx)
+		LZ4F_freeCompressionContext(cs->lz4_cctx);
+	if (cs->lz4_dctx)
+		LZ4F_freeDecompressionContext(cs->lz4_dctx);
+#endif
+
+	pg_free(cs->out_buf);
+	pg_free(cs);
+}
+
+/*
+ * Read local file compressed with streaming algorithm and pass
+ * decompressed content to write callback.
+ * Return codes:
+ *   SEND_OK       (0)
+ *   FILE_MISSING (-1)
+ *   OPEN_FAILED  (-2)
+ *   READ_FAILED  (-3)
+ *   WRITE_FAILED (-4)
+ *   ZLIB_ERROR   (-5)
+ *
+ * OPEN_FAILED, READ_FAILED and ZLIB_ERROR set errormsg.
+ */
+int
+decompress_file_stream(const char *path, CompressAlg alg,
+					   compress_stream_write_cb write_cb, void *write_arg,
+					   const char **errormsg)
+{
+	FILE	   *in;
+	char	   *buf;
+	CompressStream *cs;
+	int			rc = SEND_OK;
+
+	in = fopen(path, PG_BINARY_R);
+	if (in == NULL)
+	{
+		if (errno == ENOENT)
+			return FILE_MISSING;
+
+		*errormsg = strerror(errno);
+		return OPEN_FAILED;
+	}
+
+	/* disable stdio buffering */
+	setvbuf(in, NULL, _IONBF, BUFSIZ);
+
+	cs = compress_stream_init(alg, 0, true, write_cb, write_arg, errormsg);
+	if (cs == NULL)
+	{
+		fclose(in);
+		return OPEN_FAILED;
+	}
+
+	buf = pgut_malloc(CHUNK_SIZE);
+
+	for (;;)
+	{
+		size_t		read_len = fread(buf, 1, CHUNK_SIZE, in);
+
+		if (ferror(in))
+		{
+			*errormsg = strerror(errno);
+			rc = READ_FAILED;
+			break;
+		}
+
+		rc = compress_stream_process(cs, buf, read_len, feof(in) != 0, errormsg);
+
+		if (rc != SEND_OK || feof(in))
+			break;
+	}
+
+	compress_stream_free(cs);
+	pg_free(buf);
+	fclose(in);
+
+	return rc;
+}
+
 
 #define ZLIB_MAGIC 0x78
 
@@ -278,7 +835,7 @@ get_checksum_errormsg(Page page, char **errormsg, BlockNumber absolute_blkno)
 static int32
 prepare_page(ConnectionArgs *conn_arg,
 			 pgFile *file, XLogRecPtr prev_backup_start_lsn,
-			 BlockNumber blknum, FILE *in,
+			 BlockNumber blknum, fio_block_reader *in,
 			 BackupMode backup_mode,
 			 Page page, bool strict,
 			 uint32 checksum_version,
@@ -303,10 +860,14 @@ prepare_page(ConnectionArgs *conn_arg,
 	if (backup_mode != BACKUP_MODE_DIFF_PTRACK || ptrack_version_num >= 20)
 	{
 		int rc = 0;
+		bool reread = false;
+
 		while (!page_is_valid && try_again--)
 		{
-			/* read the block */
-			int read_len = fio_pread(in, page, blknum * BLCKSZ);
+			/* read the block, retries must bypass the read window */
+			int read_len = fio_block_read(in, blknum, page, reread);
+
+			reread = true;
 
 			/* The block could have been truncated. It is fine. */
 			if (read_len == 0)
@@ -471,23 +1032,23 @@ prepare_page(ConnectionArgs *conn_arg,
 	return PageIsOk;
 }
 
-/* split this function in two: compress() and backup() */
+/*
+ * Compress the page into write_buffer after BackupPageHeader and fill
+ * the header. If compression did not help, the page is copied as is.
+ * Returns the size of the page data in write_buffer.
+ */
 static int
-compress_and_backup_page(pgFile *file, BlockNumber blknum,
-						FILE *in, FILE *out, pg_crc32 *crc,
-						int page_state, Page page,
-						CompressAlg calg, int clevel,
-						const char *from_fullpath, const char *to_fullpath)
-{
-	int         compressed_size = 0;
-	size_t		write_buffer_size = 0;
-	char        write_buffer[BLCKSZ*2];  /* compressed page may require more space than uncompressed */
+compress_page(char *write_buffer, size_t buffer_size, BlockNumber blknum,
+			  Page page, CompressAlg calg, int clevel,
+			  const char *from_fullpath)
+{
+	int			compressed_size = 0;
 	BackupPageHeader* bph = (BackupPageHeader*)write_buffer;
 	const char *errormsg = NULL;
 
 	/* Compress the page */
 	compressed_size = do_compress(write_buffer + sizeof(BackupPageHeader),
-								  sizeof(write_buffer) - sizeof(BackupPageHeader),
+								  buffer_size - sizeof(BackupPageHeader),
 								  page, BLCKSZ, calg, clevel,
 								  &errormsg);
 	/* Something went wrong and errormsg was assigned, throw a warning */
@@ -495,8 +1056,6 @@ compress_and_backup_page(pgFile *file, BlockNumber blknum,
 		elog(WARNING, "An error occured during compressing block %u of file \"%s\": %s",
 			 blknum, from_fullpath, errormsg);
 
-	file->compress_alg = calg; /* TODO: wtf? why here? */
-
 	/* compression didn`t worked */
 	if (compressed_size <= 0 || compressed_size >= BLCKSZ)
 	{
@@ -506,9 +1065,21 @@ compress_and_backup_page(pgFile *file, BlockNumber blknum,
 	}
 	bph->block = blknum;
 	bph->compressed_size = compressed_size;
-	write_buffer_size = compressed_size + sizeof(BackupPageHeader);
 
-	/* Update CRC */
+	return compressed_size;
+}
+
+/*
+ * Write the page prepared by compress_page() to the backup file
+ * and update CRC and size summary of the file.
+ */
+static void
+backup_page(pgFile *file, BlockNumber blknum, FILE *out, pg_crc32 *crc,
+			char *write_buffer, int compressed_size, const char *to_fullpath)
+{
+	size_t		write_buffer_size = compressed_size + sizeof(BackupPageHeader);
+
+	/* Update CRC */
 	COMP_FILE_CRC32(true, *crc, write_buffer, write_buffer_size);
 
 	/* write data page */
@@ -518,8 +1089,6 @@ compress_and_backup_page(pgFile *file, BlockNumber blknum,
 
 	file->write_size += write_buffer_size;
 	file->uncompressed_size += BLCKSZ;
-
-	return compressed_size;
 }
 
 /*
@@ -529,6 +1098,8 @@ compress_and_backup_page(pgFile *file, BlockNumber blknum,
  * Not just copy file, but read it block by block (use bitmap in case of
  * incremental backup), validate checksum, optionally compress and write to
  * backup with special header.
+ * If stats is not NULL, time spent on reading, compressing and writing
+ * of local file is added to it.
  */
 void
 backup_data_file(ConnectionArgs* conn_arg, pgFile *file,
@@ -536,7 +1107,7 @@ backup_data_file(ConnectionArgs* conn_arg, pgFile *file,
 				 XLogRecPtr prev_backup_start_lsn, BackupMode backup_mode,
 				 CompressAlg calg, int clevel, uint32 checksum_version,
 				 int ptrack_version_num, const char *ptrack_schema,
-				 HeaderMap *hdr_map, bool is_merge)
+				 HeaderMap *hdr_map, bool is_merge, BackupStageStats *stats)
 {
 	int         rc;
 	bool        use_pagemap;
@@ -619,7 +1190,8 @@ backup_data_file(ConnectionArgs* conn_arg, pgFile *file,
 						backup_mode == BACKUP_MODE_DIFF_DELTA &&
 						file->exists_in_prev ? prev_backup_start_lsn : InvalidXLogRecPtr,
 						calg, clevel, checksum_version, use_pagemap,
-						&headers, backup_mode, ptrack_version_num, ptrack_schema);
+						&headers, backup_mode, ptrack_version_num, ptrack_schema,
+						stats);
 	}
 
 	/* check for errors */
@@ -729,6 +1301,123 @@ backup_non_data_file(pgFile *file, pgFile *prev_file,
 								  to_fullpath, file, missing_ok);
 }
 
+/*
+ * Take non-data file from FULL backup 'dedup_backup_time' instead of copying
+ * it from PGDATA, if it is not changed since that backup: it was not
+ * modified after the start of that backup, and has the same size and
+ * checksum. The backed up copy is shared with that backup according
+ * to 'mode'.
+ * Returns true if the file is taken from the previous backup.
+ */
+bool
+dedup_non_data_file(pgFile *file, pgFile *dedup_file,
+					const char *from_fullpath, const char *dedup_fullpath,
+					const char *to_fullpath, time_t dedup_backup_time,
+					DedupMode mode)
+{
+	pg_crc32	crc;
+
+	/* pg_control is always copied, see copy_pgcontrol_file() */
+	if (file->external_dir_num == 0 && strcmp(file->rel_path, XLOG_CONTROL_FILE) == 0)
+		return false;
+
+	/* non-data files are stored in backup as they are */
+	if (file->mtime > dedup_backup_time ||
+		dedup_file->write_size <= 0 ||
+		file->size != (size_t) dedup_file->write_size)
+		return false;
+
+	crc = fio_get_crc32(from_fullpath, FIO_DB_HOST, false);
+	if (!EQ_TRADITIONAL_CRC32(crc, dedup_file->crc))
+		return false;
+
+	if (!link_backup_file(dedup_fullpath, to_fullpath, mode))
+		return false;
+
+	file->crc = crc;
+	file->read_size = file->size;
+	file->write_size = (int64) file->size;
+	file->uncompressed_size = file->size;
+
+	return true;
+}
+
+/*
+ * Make local file 'to_fullpath' share the content of backup file
+ * 'from_fullpath' instead of copying it, by cloning the file or by
+ * making a hard link to it. Backup files are never modified in place,
+ * so they can be safely shared between backups.
+ * Returns false, if it is not supported by filesystem, so the file
+ * should be copied as usual.
+ */
+bool
+link_backup_file(const char *from_fullpath, const char *to_fullpath,
+				 DedupMode mode)
+{
+	/* file may be left from the previous attempt */
+	if (unlink(to_fullpath) < 0 && errno != ENOENT)
+		elog(ERROR, "Cannot remove file \"%s\": %s", to_fullpath,
+			 strerror(errno));
+
+	if (mode == DEDUP_HARDLINK)
+	{
+		if (link(from_fullpath, to_fullpath) < 0)
+		{
+			elog(VERBOSE, "Cannot create hard link \"%s\" to file \"%s\": %s",
+				 to_fullpath, from_fullpath, strerror(errno));
+			return false;
+		}
+		return true;
+	}
+	else if (mode == DEDUP_REFLINK)
+	{
+#ifdef FICLONE
+		int			in_fd;
+		int			out_fd;
+		int			save_errno;
+
+		in_fd = open(from_fullpath, O_RDONLY | PG_BINARY, 0);
+		if (in_fd < 0)
+		{
+			elog(VERBOSE, "Cannot open file \"%s\": %s", from_fullpath,
+				 strerror(errno));
+			return false;
+		}
+
+		out_fd = open(to_fullpath, O_WRONLY | O_CREAT | O_EXCL | PG_BINARY,
+					  FILE_PERMISSION);
+		if (out_fd < 0)
+		{
+			save_errno = errno;
+			close(in_fd);
+			elog(ERROR, "Cannot open destination file \"%s\": %s",
+				 to_fullpath, strerror(save_errno));
+		}
+
+		if (ioctl(out_fd, FICLONE, in_fd) < 0)
+		{
+			save_errno = errno;
+			close(in_fd);
+			close(out_fd);
+			unlink(to_fullpath);
+
+			elog(VERBOSE, "Cannot clone file \"%s\" to \"%s\": %s",
+				 from_fullpath, to_fullpath, strerror(save_errno));
+			return false;
+		}
+
+		close(in_fd);
+		if (close(out_fd) < 0)
+			elog(ERROR, "Cannot close file \"%s\": %s", to_fullpath,
+				 strerror(errno));
+
+		return true;
+#endif
+	}
+
+	return false;
+}
+
 /*
  * Iterate over parent backup chain and lookup given destination file in
  * filelist of every chain member starting with FULL backup.
@@ -736,7 +1425,7 @@ backup_non_data_file(pgFile *file, pgFile *prev_file,
  */
 size_t
 restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
-				  const char *to_fullpath, bool use_bitmap, PageState *checksum_map,
+				  const char *to_fullpath, bool use_bitmap,
 				  XLogRecPtr shift_lsn, datapagemap_t *lsn_map, bool use_headers)
 {
 	size_t total_write_len = 0;
@@ -833,7 +1522,7 @@ restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
 					  parse_program_version(backup->program_version),
 					  from_fullpath, to_fullpath, dest_file->n_blocks,
 					  use_bitmap ? &(dest_file)->pagemap : NULL,
-					  checksum_map, backup->checksum_version,
+					  backup->checksum_version,
 					  /* shiftmap can be used only if backup state precedes the shift */
 					  backup->stop_lsn <= shift_lsn ? lsn_map : NULL,
 					  headers);
@@ -851,6 +1540,128 @@ restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
 	return total_write_len;
 }
 
+/*
+ * Restore blocks from start_blk up to end_blk (not inclusive) of the data
+ * file, applying changes from every backup in parent chain.
+ *
+ * It allows to restore a big data file by several threads at once, every
+ * one of them with its own input and output files and its own bitmap of
+ * restored blocks. Page headers are used to find blocks of the range in
+ * backup files without reading them from the start, so every backup in the
+ * chain must have page headers, i.e. be taken by version 2.4.0 or newer.
+ * Incremental restore is not supported.
+ */
+size_t
+restore_data_file_range(parray *parent_chain, pgFile *dest_file, FILE *out,
+						const char *to_fullpath, bool use_bitmap,
+						BlockNumber start_blk, BlockNumber end_blk)
+{
+	size_t total_write_len = 0;
+	char  *in_buf = pgut_malloc(STDIO_BUFSIZE);
+	int    backup_seq = 0;
+	datapagemap_t map;
+
+	memset(&map, 0, sizeof(map));
+
+	/* see comments in restore_data_file() */
+	if (use_bitmap)
+		backup_seq = 0;
+	else
+		backup_seq = parray_num(parent_chain) - 1;
+
+	while (backup_seq >= 0 && backup_seq < parray_num(parent_chain))
+	{
+		char     from_root[MAXPGPATH];
+		char     from_fullpath[MAXPGPATH];
+		FILE    *in = NULL;
+
+		pgFile **res_file = NULL;
+		pgFile  *tmp_file = NULL;
+		pgFile   range_file;
+		int      first_hdr;
+		int      last_hdr;
+
+		/* page headers */
+		BackupPageHeader2 *headers = NULL;
+
+		pgBackup   *backup = (pgBackup *) parray_get(parent_chain, backup_seq);
+
+		if (use_bitmap)
+			backup_seq++;
+		else
+			backup_seq--;
+
+		/* lookup file in intermediate backup */
+		res_file =  parray_bsearch(backup->files, dest_file, pgFileCompareRelPathWithExternal);
+		tmp_file = (res_file) ? *res_file : NULL;
+
+		/* Destination file does not exist yet, or was not changed, or was truncated */
+		if (tmp_file == NULL || tmp_file->write_size == BYTES_INVALID ||
+			tmp_file->write_size == 0)
+			continue;
+
+		join_path_components(from_root, backup->root_dir, DATABASE_DIR);
+		join_path_components(from_fullpath, from_root, tmp_file->rel_path);
+
+		if (tmp_file->n_headers > 0)
+			headers = get_data_file_headers(&(backup->hdr_map), tmp_file,
+											parse_program_version(backup->program_version),
+											true);
+
+		if (!headers)
+			elog(ERROR, "Failed to get page headers for file \"%s\"", from_fullpath);
+
+		/* headers go in order of block numbers, find the ones of our range */
+		first_hdr = 0;
+		while (first_hdr < tmp_file->n_headers && headers[first_hdr].block < start_blk)
+			first_hdr++;
+
+		last_hdr = first_hdr;
+		while (last_hdr < tmp_file->n_headers && headers[last_hdr].block < end_blk)
+			last_hdr++;
+
+		/* nothing to restore from this backup */
+		if (last_hdr == first_hdr)
+		{
+			pg_free(headers);
+			continue;
+		}
+
+		in = fopen(from_fullpath, PG_BINARY_R);
+		if (in == NULL)
+			elog(ERROR, "Cannot open backup file \"%s\": %s", from_fullpath,
+				 strerror(errno));
+
+		/* set stdio buffering for input data file */
+		setvbuf(in, in_buf, _IOFBF, STDIO_BUFSIZE);
+
+		/*
+		 * Pretend that the file consists of blocks of the range only.
+		 * Header next to the last one of the range is still used
+		 * to calculate the size of the last block.
+		 */
+		range_file = *tmp_file;
+		range_file.n_headers = last_hdr - first_hdr;
+
+		total_write_len += restore_data_file_internal(in, out, &range_file,
+					  parse_program_version(backup->program_version),
+					  from_fullpath, to_fullpath, dest_file->n_blocks,
+					  use_bitmap ? &map : NULL, backup->checksum_version,
+					  NULL, headers + first_hdr);
+
+		if (fclose(in) != 0)
+			elog(ERROR, "Cannot close file \"%s\": %s", from_fullpath,
+				strerror(errno));
+
+		pg_free(headers);
+	}
+
+	pg_free(map.bitmap);
+	pg_free(in_buf);
+
+	return total_write_len;
+}
+
 /* Restore block from "in" file to "out" file.
  * If "nblocks" is greater than zero, then skip restoring blocks,
  * whose position if greater than "nblocks".
@@ -863,7 +1674,7 @@ restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
 size_t
 restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_version,
 					  const char *from_fullpath, const char *to_fullpath, int nblocks,
-					  datapagemap_t *map, PageState *checksum_map, int checksum_version,
+					  datapagemap_t *map, int checksum_version,
 					  datapagemap_t *lsn_map, BackupPageHeader2 *headers)
 {
 	BlockNumber	blknum = 0;
@@ -898,10 +1709,6 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 		int32		compressed_size = 0;
 		bool		is_compressed = false;
 
-		/* incremental restore vars */
-		uint16     page_crc = 0;
-		XLogRecPtr page_lsn = InvalidXLogRecPtr;
-
 		/* check for interrupt */
 		if (interrupted || thread_interrupted)
 			elog(ERROR, "Interrupted during data file restore");
@@ -914,8 +1721,6 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 				break;
 
 			blknum = headers[n_hdr].block;
-			page_lsn = headers[n_hdr].lsn;
-			page_crc = headers[n_hdr].checksum;
 			/* calculate payload size by comparing current and next page positions,
 			 * page header is not included */
 			compressed_size = headers[n_hdr+1].pos - headers[n_hdr].pos - sizeof(BackupPageHeader);
@@ -1006,21 +1811,6 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 		if (map && lsn_map && datapagemap_is_set(lsn_map, blknum))
 			datapagemap_add(map, blknum);
 
-		if (map && checksum_map && checksum_map[blknum].checksum != 0)
-		{
-			//elog(INFO, "HDR CRC: %u, MAP CRC: %u", page_crc, checksum_map[blknum].checksum);
-			/*
-			 * The heart of incremental restore in CHECKSUM mode
-			 * If page in backup has the same checksum and lsn as
-			 * page in backup, then page can be skipped.
-			 */
-			if (page_crc == checksum_map[blknum].checksum &&
-				page_lsn == checksum_map[blknum].lsn)
-			{
-				datapagemap_add(map, blknum);
-			}
-		}
-
 		/* if this page is marked as already restored, then skip it */
 		if (map && datapagemap_is_set(map, blknum))
 		{
@@ -1116,6 +1906,122 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 	return write_len;
 }
 
+/*
+ * Copy the rest of local file in_fd to out_fd inside the kernel, using
+ * copy_file_range() or sendfile(), which may also share the data blocks
+ * of the files, if the filesystem supports it.
+ * Returns the number of copied bytes, or -1 if the zero-copy is not
+ * supported for these files and nothing was copied, so the caller should
+ * copy the file through userspace buffer.
+ */
+static int64
+copy_file_zero_copy(int in_fd, int out_fd,
+					const char *from_fullpath, const char *to_fullpath)
+{
+#ifdef HAVE_ZERO_COPY
+	int64		copied = 0;
+#ifdef HAVE_COPY_FILE_RANGE
+	bool		use_sendfile = false;
+#else
+	bool		use_sendfile = true;
+#endif
+
+	for (;;)
+	{
+		ssize_t		rc;
+
+		/* check for interrupt */
+		if (interrupted || thread_interrupted)
+			elog(ERROR, "Interrupted during copying of file \"%s\"", from_fullpath);
+
+#ifdef HAVE_COPY_FILE_RANGE
+		if (!use_sendfile)
+			rc = copy_file_range(in_fd, NULL, out_fd, NULL, ZERO_COPY_CHUNK_SIZE, 0);
+		else
+#endif
+			rc = sendfile(out_fd, in_fd, NULL, ZERO_COPY_CHUNK_SIZE);
+
+		if (rc < 0)
+		{
+			if (errno == EINTR)
+				continue;
+
+			/* not supported by kernel or filesystem, try something else */
+			if (copied == 0 &&
+				(errno == ENOSYS || errno == EXDEV || errno == EINVAL ||
+				 errno == EOPNOTSUPP))
+			{
+				if (!use_sendfile)
+				{
+					use_sendfile = true;
+					continue;
+				}
+				return -1;
+			}
+
+			elog(ERROR, "Cannot copy file \"%s\" to \"%s\": %s",
+				 from_fullpath, to_fullpath, strerror(errno));
+		}
+
+		/* end of file */
+		if (rc == 0)
+			break;
+
+		copied += rc;
+	}
+
+	return copied;
+#else
+	return -1;
+#endif
+}
+
+/*
+ * Calculate CRC of the first 'size' bytes of local file by mapping
+ * it into memory, without copying the data into userspace buffer.
+ * Returns false if the file cannot be mapped.
+ */
+static bool
+file_crc32_mmap(int fd, int64 size, pg_crc32 *crc, const char *fullpath)
+{
+#ifdef HAVE_ZERO_COPY
+	char	   *data;
+	int64		offset;
+
+	if (size == 0)
+		return true;
+
+	data = mmap(NULL, size, PROT_READ, MAP_SHARED, fd, 0);
+	if (data == MAP_FAILED)
+	{
+		elog(VERBOSE, "Cannot map file \"%s\" into memory: %s",
+			 fullpath, strerror(errno));
+		return false;
+	}
+
+	(void) posix_madvise(data, size, POSIX_MADV_SEQUENTIAL);
+
+	for (offset = 0; offset < size; offset += CHUNK_SIZE)
+	{
+		/* check for interrupt */
+		if (interrupted || thread_interrupted)
+		{
+			munmap(data, size);
+			elog(ERROR, "Interrupted during CRC calculation of file \"%s\"", fullpath);
+		}
+
+		COMP_FILE_CRC32(true, *crc, data + offset, Min(CHUNK_SIZE, size - offset));
+	}
+
+	if (munmap(data, size) != 0)
+		elog(ERROR, "Cannot unmap file \"%s\": %s", fullpath, strerror(errno));
+
+	return true;
+#else
+	return false;
+#endif
+}
+
 /*
  * Copy file to backup.
  * We do not apply compression to these files, because
@@ -1126,7 +2032,32 @@ restore_non_data_file_internal(FILE *in, FILE *out, pgFile *file,
 					  const char *from_fullpath, const char *to_fullpath)
 {
 	size_t     read_len = 0;
-	char      *buf = pgut_malloc(STDIO_BUFSIZE); /* 64kB buffer */
+	char      *buf;
+
+	/*
+	 * Both files are local, let the kernel copy the content.
+	 * Flush the output stream first, so that stdio and file descriptor
+	 * positions are the same.
+	 */
+	if (!fio_is_remote_file(out) && file->write_size >= ZERO_COPY_MIN_SIZE)
+	{
+		int64		copied;
+
+		if (fflush(out) != 0)
+			elog(ERROR, "Cannot flush file \"%s\": %s", to_fullpath,
+				 strerror(errno));
+
+		copied = copy_file_zero_copy(fileno(in), fileno(out),
+									 from_fullpath, to_fullpath);
+		if (copied >= 0)
+		{
+			elog(VERBOSE, "Copied file \"%s\": " INT64_FORMAT " bytes",
+				 from_fullpath, copied);
+			return;
+		}
+	}
+
+	buf = pgut_malloc(STDIO_BUFSIZE); /* 64kB buffer */
 
 	/* copy content */
 	for (;;)
@@ -1311,8 +2242,16 @@ backup_non_data_file_internal(const char *from_fullpath,
 	file->write_size = 0;
 	file->uncompressed_size = 0;
 
-	/* open backup file for write  */
-	out = fopen(to_fullpath, PG_BINARY_W);
+	/*
+	 * File may be left from the interrupted backup and be shared with
+	 * the previous FULL backup, so never truncate it in place.
+	 */
+	if (unlink(to_fullpath) < 0 && errno != ENOENT)
+		elog(ERROR, "Cannot remove file \"%s\": %s", to_fullpath,
+			 strerror(errno));
+
+	/* open backup file for write, it may be read back for CRC calculation */
+	out = fopen(to_fullpath, "w+b");
 	if (out == NULL)
 		elog(ERROR, "Cannot open destination file \"%s\": %s",
 			 to_fullpath, strerror(errno));
@@ -1381,6 +2320,40 @@ backup_non_data_file_internal(const char *from_fullpath,
 		setvbuf(in, NULL, _IONBF, BUFSIZ);
 		setvbuf(out, NULL, _IONBF, BUFSIZ);
 
+		/*
+		 * Let the kernel copy big files and calculate CRC of the copy
+		 * by mapping it into memory, so the data is never copied through
+		 * userspace buffer. CRC of the destination is exactly the CRC
+		 * of the data in backup, even if the source is changed meanwhile.
+		 */
+		if (file->size >= ZERO_COPY_MIN_SIZE)
+		{
+			int64		copied = copy_file_zero_copy(fileno(in), fileno(out),
+													 from_fullpath, to_fullpath);
+
+			if (copied >= 0)
+			{
+				file->read_size = copied;
+
+				if (!file_crc32_mmap(fileno(out), copied, &file->crc, to_fullpath))
+				{
+					/* read the copy back */
+					buf = pgut_malloc(CHUNK_SIZE);
+					if (fseek(out, 0, SEEK_SET) != 0)
+						elog(ERROR, "Cannot seek in file \"%s\": %s", to_fullpath,
+							 strerror(errno));
+
+					while ((read_len = fread(buf, 1, CHUNK_SIZE, out)) > 0)
+						COMP_FILE_CRC32(true, file->crc, buf, read_len);
+
+					if (ferror(out))
+						elog(ERROR, "Cannot read from file \"%s\": %s", to_fullpath,
+							 strerror(errno));
+				}
+				goto done;
+			}
+		}
+
 		/* allocate 64kB buffer */
 		buf = pgut_malloc(CHUNK_SIZE);
 
@@ -1409,6 +2382,7 @@ backup_non_data_file_internal(const char *from_fullpath,
 		}
 	}
 
+done:
 	file->write_size = (int64) file->read_size;
 
 	if (file->write_size > 0)
@@ -1418,6 +2392,9 @@ cleanup:
 	/* finish CRC calculation and store into pgFile */
 	FIN_FILE_CRC32(true, file->crc);
 
+	if (in && io_mode != IO_MODE_BUFFERED)
+		fio_drop_cache(fileno(in), 0, 0);
+
 	if (in && fclose(in))
 		elog(ERROR, "Cannot close the file \"%s\": %s", from_fullpath, strerror(errno));
 
@@ -1524,14 +2501,14 @@ bool
 check_data_file(ConnectionArgs *arguments, pgFile *file,
 				const char *from_fullpath, uint32 checksum_version)
 {
-	FILE		*in;
+	fio_block_reader *in;
 	BlockNumber	blknum = 0;
 	BlockNumber	nblocks = 0;
 	int			page_state;
 	char		curr_page[BLCKSZ];
 	bool 		is_valid = true;
 
-	in = fopen(from_fullpath, PG_BINARY_R);
+	in = fio_block_reader_open(from_fullpath, io_mode, io_depth, NULL);
 	if (in == NULL)
 	{
 		/*
@@ -1580,18 +2557,96 @@ check_data_file(ConnectionArgs *arguments, pgFile *file,
 		}
 	}
 
-	fclose(in);
+	fio_block_reader_close(in);
 	return is_valid;
 }
 
-/* Valiate pages of datafile in backup one by one */
+/*
+ * Quick validation of datafile in backup: check that page headers,
+ * stored in header map, are consistent with the file and compute CRC
+ * of the whole file, reading it sequentially. Pages are not decompressed.
+ * Backups older than 2.4 have no header map, only file CRC is checked.
+ */
 bool
-validate_file_pages(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
-					uint32 checksum_version, uint32 backup_version, HeaderMap *hdr_map)
+validate_file_headers(pgFile *file, const char *fullpath,
+					  uint32 backup_version, HeaderMap *hdr_map)
 {
-	size_t		read_len = 0;
 	bool		is_valid = true;
-	FILE		*in;
+	pg_crc32	crc;
+	bool		use_crc32c = backup_version <= 20021 || backup_version >= 20025;
+	BackupPageHeader2 *headers = NULL;
+	int			n_hdr;
+
+	elog(VERBOSE, "Validate page headers for file \"%s\"", fullpath);
+
+	headers = get_data_file_headers(hdr_map, file, backup_version, false);
+
+	if (!headers && file->n_headers > 0)
+	{
+		elog(WARNING, "Cannot get page headers for file \"%s\"", fullpath);
+		return false;
+	}
+
+	if (headers)
+	{
+		if (headers[0].pos != 0)
+		{
+			elog(WARNING, "Invalid position of block %u of file \"%s\": %i. Expected 0",
+				 headers[0].block, fullpath, headers[0].pos);
+			is_valid = false;
+		}
+
+		for (n_hdr = 0; is_valid && n_hdr < file->n_headers; n_hdr++)
+		{
+			int			compressed_size;
+
+			compressed_size = headers[n_hdr+1].pos - headers[n_hdr].pos -
+				sizeof(BackupPageHeader);
+
+			if (compressed_size <= 0 || compressed_size > BLCKSZ ||
+				headers[n_hdr].block >= RELSEG_SIZE)
+			{
+				elog(WARNING, "Invalid header of block %u of file \"%s\": "
+					 "position %i, size %i",
+					 headers[n_hdr].block, fullpath, headers[n_hdr].pos,
+					 compressed_size);
+				is_valid = false;
+			}
+		}
+
+		if (is_valid && headers[file->n_headers].pos != file->write_size)
+		{
+			elog(WARNING, "Page headers of file \"%s\" describe %i bytes. Expected " INT64_FORMAT,
+				 fullpath, headers[file->n_headers].pos, file->write_size);
+			is_valid = false;
+		}
+
+		pg_free(headers);
+
+		if (!is_valid)
+			return false;
+	}
+
+	crc = pgFileGetCRC(fullpath, use_crc32c, false);
+
+	if (crc != file->crc)
+	{
+		elog(WARNING, "Invalid CRC of backup file \"%s\": %X. Expected %X",
+				fullpath, crc, file->crc);
+		is_valid = false;
+	}
+
+	return is_valid;
+}
+
+/* Valiate pages of datafile in backup one by one */
+bool
+validate_file_pages(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
+					uint32 checksum_version, uint32 backup_version, HeaderMap *hdr_map)
+{
+	size_t		read_len = 0;
+	bool		is_valid = true;
+	FILE		*in;
 	pg_crc32	crc;
 	bool		use_crc32c = backup_version <= 20021 || backup_version >= 20025;
 	BackupPageHeader2 *headers = NULL;
@@ -1613,6 +2668,7 @@ validate_file_pages(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
 	if (!headers && file->n_headers > 0)
 	{
 		elog(WARNING, "Cannot get page headers for file \"%s\"", fullpath);
+		fclose(in);
 		return false;
 	}
 
@@ -1777,6 +2833,9 @@ validate_file_pages(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
 	}
 
 	FIN_FILE_CRC32(use_crc32c, crc);
+
+	if (io_mode != IO_MODE_BUFFERED)
+		fio_drop_cache(fileno(in), 0, 0);
 	fclose(in);
 
 	if (crc != file->crc)
@@ -1791,73 +2850,158 @@ validate_file_pages(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
 	return is_valid;
 }
 
-/* read local data file and construct map with block checksums */
-PageState*
-get_checksum_map(const char *fullpath, uint32 checksum_version,
-							int n_blocks, XLogRecPtr dest_stop_lsn, BlockNumber segmentno)
+/*
+ * Construct array with checksums and LSNs of data file blocks as they
+ * are going to be restored from the backup chain: the newest copy of
+ * every block is taken. Blocks, missing from page headers of the chain,
+ * are left zeroed.
+ */
+PageState *
+get_checksum_map_from_headers(parray *parent_chain, pgFile *dest_file)
 {
-	PageState  *checksum_map = NULL;
-	FILE       *in = NULL;
-	BlockNumber blknum = 0;
-	char        read_buffer[BLCKSZ];
-	char        in_buf[STDIO_BUFSIZE];
+	PageState	   *checksum_map;
+	datapagemap_t	seen_map = {NULL, 0};
+	int				i;
 
-	/* open file */
-	in = fopen(fullpath, "r+b");
-	if (!in)
+	checksum_map = pgut_malloc(dest_file->n_blocks * sizeof(PageState));
+	memset(checksum_map, 0, dest_file->n_blocks * sizeof(PageState));
+
+	/* start with dest backup */
+	for (i = 0; i < parray_num(parent_chain); i++)
+	{
+		pgBackup   *backup = (pgBackup *) parray_get(parent_chain, i);
+		BackupPageHeader2 *headers;
+		pgFile	  **res_file;
+		pgFile	   *tmp_file;
+		int			n_hdr;
+
+		res_file = parray_bsearch(backup->files, dest_file, pgFileCompareRelPathWithExternal);
+		tmp_file = (res_file) ? *res_file : NULL;
+
+		/* file was not changed or not backed up at all */
+		if (tmp_file == NULL || tmp_file->write_size == BYTES_INVALID ||
+			tmp_file->write_size == 0 || tmp_file->n_headers <= 0)
+			continue;
+
+		headers = get_data_file_headers(&(backup->hdr_map), tmp_file,
+										parse_program_version(backup->program_version),
+										true);
+		if (!headers)
+			elog(ERROR, "Failed to get page headers for file \"%s\"", tmp_file->rel_path);
+
+		for (n_hdr = 0; n_hdr < tmp_file->n_headers; n_hdr++)
+		{
+			BlockNumber blknum = headers[n_hdr].block;
+
+			/* newer copy of the block is already taken */
+			if (blknum >= dest_file->n_blocks || datapagemap_is_set(&seen_map, blknum))
+				continue;
+
+			datapagemap_add(&seen_map, blknum);
+			checksum_map[blknum].checksum = headers[n_hdr].checksum;
+			checksum_map[blknum].lsn = headers[n_hdr].lsn;
+		}
+
+		pg_free(headers);
+	}
+
+	pg_free(seen_map.bitmap);
+
+	return checksum_map;
+}
+
+/*
+ * Compare blocks of local data file with their expected checksums and LSNs
+ * from 'checksum_map' and return bitmap of blocks, which must be rewritten
+ * by restore. The block is unchanged, if it is valid and has the same
+ * checksum and LSN, as expected. Blocks without expected checksum are
+ * rewritten without reading them.
+ * File is truncated to n_blocks beforehand. If checksum_map is NULL,
+ * the file is just truncated and NULL is returned.
+ */
+datapagemap_t *
+get_checksum_diff_map(const char *fullpath, uint32 checksum_version,
+					  int n_blocks, XLogRecPtr dest_stop_lsn, BlockNumber segmentno,
+					  const PageState *checksum_map)
+{
+	int				fd;
+	char		   *read_buffer;
+	datapagemap_t  *diff_map;
+	BlockNumber		blknum;
+
+	fd = open(fullpath, O_RDWR | PG_BINARY, 0);
+	if (fd < 0)
 		elog(ERROR, "Cannot open source file \"%s\": %s", fullpath, strerror(errno));
 
 	/* truncate up to blocks */
-	if (ftruncate(fileno(in), n_blocks * BLCKSZ) != 0)
+	if (ftruncate(fd, (off_t) n_blocks * BLCKSZ) != 0)
 		elog(ERROR, "Cannot truncate file to blknum %u \"%s\": %s",
 				n_blocks, fullpath, strerror(errno));
 
-	setvbuf(in, in_buf, _IOFBF, STDIO_BUFSIZE);
+	if (checksum_map == NULL)
+	{
+		close(fd);
+		return NULL;
+	}
 
-	/* initialize array of checksums */
-	checksum_map = pgut_malloc(n_blocks * sizeof(PageState));
-	memset(checksum_map, 0, n_blocks * sizeof(PageState));
+	diff_map = pgut_malloc(sizeof(datapagemap_t));
+	memset(diff_map, 0, sizeof(datapagemap_t));
 
-	for (blknum = 0; blknum < n_blocks;  blknum++)
+	read_buffer = pgut_malloc(CHECKSUM_DIFF_READ_BLOCKS * BLCKSZ);
+
+	for (blknum = 0; blknum < n_blocks; blknum += CHECKSUM_DIFF_READ_BLOCKS)
 	{
-		size_t read_len = fread(read_buffer, 1, BLCKSZ, in);
-		PageState page_st;
+		BlockNumber	n_read = Min(CHECKSUM_DIFF_READ_BLOCKS, n_blocks - blknum);
+		BlockNumber	first = InvalidBlockNumber;
+		BlockNumber	last = 0;
+		BlockNumber	i;
+		ssize_t		read_len = 0;
 
-		/* report error */
-		if (ferror(in))
-			elog(ERROR, "Cannot read block %u of \"%s\": %s",
-					blknum, fullpath, strerror(errno));
+		if (interrupted || thread_interrupted)
+			elog(ERROR, "Interrupted during page reading");
 
-		if (read_len == BLCKSZ)
+		/* read only the part of the chunk with blocks to compare */
+		for (i = 0; i < n_read; i++)
 		{
-			int rc = validate_one_page(read_buffer, segmentno + blknum,
-									   dest_stop_lsn, &page_st,
-									   checksum_version);
+			if (checksum_map[blknum + i].checksum == 0)
+				continue;
 
-			if (rc == PAGE_IS_VALID)
-			{
-//				if (checksum_version)
-//					checksum_map[blknum].checksum = ((PageHeader) read_buffer)->pd_checksum;
-//				else
-//					checksum_map[blknum].checksum = page_st.checksum;
-				checksum_map[blknum].checksum = page_st.checksum;
-				checksum_map[blknum].lsn = page_st.lsn;
-			}
+			if (first == InvalidBlockNumber)
+				first = i;
+			last = i;
 		}
-		else
-			elog(ERROR, "Failed to read blknum %u from file \"%s\"", blknum, fullpath);
 
-		if (feof(in))
-			break;
+		if (first != InvalidBlockNumber)
+		{
+			read_len = pread(fd, read_buffer, (last - first + 1) * BLCKSZ,
+							 (off_t) (blknum + first) * BLCKSZ);
+			if (read_len < 0)
+				elog(ERROR, "Cannot read block %u of \"%s\": %s",
+					 blknum + first, fullpath, strerror(errno));
+		}
 
-		if (interrupted)
-			elog(ERROR, "Interrupted during page reading");
+		for (i = 0; i < n_read; i++)
+		{
+			const PageState *expected = &checksum_map[blknum + i];
+			PageState	page_st;
+
+			if (expected->checksum != 0 &&
+				(off_t) (i - first + 1) * BLCKSZ <= read_len &&
+				validate_one_page(read_buffer + (i - first) * BLCKSZ,
+								  segmentno + blknum + i, dest_stop_lsn,
+								  &page_st, checksum_version) == PAGE_IS_VALID &&
+				page_st.checksum == expected->checksum &&
+				page_st.lsn == expected->lsn)
+				continue;
+
+			datapagemap_add(diff_map, blknum + i);
+		}
 	}
 
-	if (in)
-		fclose(in);
+	pg_free(read_buffer);
+	close(fd);
 
-	return checksum_map;
+	return diff_map;
 }
 
 /* return bitmap of valid blocks, bitmap is empty, then NULL is returned */
@@ -1991,29 +3135,247 @@ open_local_file_rw(const char *to_fullpath, char **out_buf, uint32 buf_size)
 	return out;
 }
 
-/* backup local file */
+/*
+ * Backup of a local data file is done by two stages: the reader reads and
+ * validates pages, the writer compresses them and writes to the backup file.
+ * For big files with compression enabled, the writer runs in its own thread,
+ * and the stages are connected by a ring of page batches, so reading from
+ * disk overlaps with compression. Small files and uncompressed backups are
+ * processed by a single thread, which is cheaper.
+ */
+#define PIPELINE_BATCH_BLOCKS	32		/* pages in one batch */
+#define PIPELINE_N_BATCHES		4		/* batches in the ring */
+#define PIPELINE_MIN_BLOCKS		(PIPELINE_BATCH_BLOCKS * PIPELINE_N_BATCHES)
+#define PIPELINE_WAIT_USEC		100		/* sleep while waiting for a batch */
+
+/* State of the writer stage */
+typedef struct PageWriter
+{
+	pgFile	   *file;
+	const char *from_fullpath;
+	const char *to_fullpath;
+	CompressAlg	calg;
+	int			clevel;
+
+	FILE	   *out;
+	char	   *out_buf;
+	BackupPageHeader2 *headers;
+	int			hdr_num;
+	off_t		cur_pos_out;
+
+	double		compress_time;
+	double		write_time;
+} PageWriter;
+
+typedef struct PageBatch
+{
+	int			n_pages;
+	BlockNumber	blknum[PIPELINE_BATCH_BLOCKS];
+	PageState	page_st[PIPELINE_BATCH_BLOCKS];
+	char		pages[PIPELINE_BATCH_BLOCKS][BLCKSZ];
+} PageBatch;
+
+typedef struct PagePipeline
+{
+	PageBatch	batches[PIPELINE_N_BATCHES];
+	int			head;		/* next batch to fill, used by reader only */
+	int			tail;		/* next batch to write, used by writer only */
+
+	/* protected by lock */
+	pthread_mutex_t lock;
+	int			n_filled;	/* number of filled batches in the ring */
+	bool		eof;		/* reader has filled the last batch */
+	bool		done;		/* writer has written all batches */
+
+	PageWriter	writer;
+	int			thread_num;
+	double		write_stall;	/* time writer waited for reader */
+} PagePipeline;
+
+/*
+ * Compress the page and write it to the backup file, open the file
+ * if it is not opened yet.
+ */
+static void
+page_writer_put(PageWriter *writer, BlockNumber blknum, Page page,
+				PageState *page_st)
+{
+	char		write_buffer[BLCKSZ*2];  /* compressed page may require more space than uncompressed */
+	int			compressed_size;
+	instr_time	start_time,
+				compress_time,
+				write_time;
+
+	/* lazily open backup file (useful for s3) */
+	if (!writer->out)
+		writer->out = open_local_file_rw(writer->to_fullpath, &writer->out_buf,
+										 STDIO_BUFSIZE);
+
+	writer->hdr_num++;
+
+	if (!writer->headers)
+		writer->headers = (BackupPageHeader2 *) pgut_malloc(sizeof(BackupPageHeader2));
+	else
+		writer->headers = (BackupPageHeader2 *) pgut_realloc(writer->headers,
+							(writer->hdr_num+1) * sizeof(BackupPageHeader2));
+
+	writer->headers[writer->hdr_num].block = blknum;
+	writer->headers[writer->hdr_num].pos = writer->cur_pos_out;
+	writer->headers[writer->hdr_num].lsn = page_st->lsn;
+	writer->headers[writer->hdr_num].checksum = page_st->checksum;
+
+	INSTR_TIME_SET_CURRENT(start_time);
+
+	compressed_size = compress_page(write_buffer, sizeof(write_buffer), blknum,
+									page, writer->calg, writer->clevel,
+									writer->from_fullpath);
+	writer->file->compress_alg = writer->calg;
+
+	INSTR_TIME_SET_CURRENT(compress_time);
+
+	backup_page(writer->file, blknum, writer->out, &(writer->file->crc),
+				write_buffer, compressed_size, writer->to_fullpath);
+
+	INSTR_TIME_SET_CURRENT(write_time);
+
+	INSTR_TIME_SUBTRACT(write_time, compress_time);
+	INSTR_TIME_SUBTRACT(compress_time, start_time);
+	writer->compress_time += INSTR_TIME_GET_DOUBLE(compress_time);
+	writer->write_time += INSTR_TIME_GET_DOUBLE(write_time);
+
+	writer->cur_pos_out += compressed_size + sizeof(BackupPageHeader);
+}
+
+/*
+ * Wait until there is a free batch in the ring for the reader, or a filled
+ * batch for the writer. The time spent waiting is added to *stall.
+ * Returns false if the writer should stop, because all batches are written
+ * or some thread has failed.
+ */
+static bool
+page_pipeline_wait(PagePipeline *pipeline, bool reader, double *stall)
+{
+	instr_time	start_time,
+				elapsed;
+	bool		result;
+
+	INSTR_TIME_SET_CURRENT(start_time);
+
+	for (;;)
+	{
+		bool		ready;
+		bool		finished = false;
+
+		pthread_lock(&pipeline->lock);
+		if (reader)
+			ready = pipeline->n_filled < PIPELINE_N_BATCHES;
+		else
+		{
+			ready = pipeline->n_filled > 0;
+			finished = pipeline->eof;
+		}
+		pthread_mutex_unlock(&pipeline->lock);
+
+		if (ready || finished)
+		{
+			result = ready;
+			break;
+		}
+
+		if (interrupted || thread_interrupted)
+		{
+			/* the writer exits silently, the error is reported by the failed thread */
+			if (reader)
+				elog(ERROR, "Interrupted during page reading");
+			result = false;
+			break;
+		}
+
+		pg_usleep(PIPELINE_WAIT_USEC);
+	}
+
+	INSTR_TIME_SET_CURRENT(elapsed);
+	INSTR_TIME_SUBTRACT(elapsed, start_time);
+	*stall += INSTR_TIME_GET_DOUBLE(elapsed);
+
+	return result;
+}
+
+/* Writer thread of the pipeline */
+static void *
+page_pipeline_writer(void *arg)
+{
+	PagePipeline *pipeline = (PagePipeline *) arg;
+
+	my_thread_num = pipeline->thread_num;
+
+	while (page_pipeline_wait(pipeline, false, &pipeline->write_stall))
+	{
+		PageBatch  *batch = &pipeline->batches[pipeline->tail];
+		int			i;
+
+		for (i = 0; i < batch->n_pages; i++)
+			page_writer_put(&pipeline->writer, batch->blknum[i],
+							batch->pages[i], &batch->page_st[i]);
+
+		pipeline->tail = (pipeline->tail + 1) % PIPELINE_N_BATCHES;
+
+		pthread_lock(&pipeline->lock);
+		pipeline->n_filled--;
+		pthread_mutex_unlock(&pipeline->lock);
+	}
+
+	pthread_lock(&pipeline->lock);
+	pipeline->done = pipeline->eof && pipeline->n_filled == 0;
+	pthread_mutex_unlock(&pipeline->lock);
+
+	return NULL;
+}
+
+/* Pass the filled batch to the writer */
+static void
+page_pipeline_push(PagePipeline *pipeline)
+{
+	pipeline->head = (pipeline->head + 1) % PIPELINE_N_BATCHES;
+
+	pthread_lock(&pipeline->lock);
+	pipeline->n_filled++;
+	pthread_mutex_unlock(&pipeline->lock);
+}
+
+/*
+ * backup local file
+ *
+ * If stats is not NULL, time spent by the stages is added to it.
+ */
 int
 send_pages(ConnectionArgs* conn_arg, const char *to_fullpath, const char *from_fullpath,
 		   pgFile *file, XLogRecPtr prev_backup_start_lsn, CompressAlg calg, int clevel,
 		   uint32 checksum_version, bool use_pagemap, BackupPageHeader2 **headers,
-		   BackupMode backup_mode, int ptrack_version_num, const char *ptrack_schema)
+		   BackupMode backup_mode, int ptrack_version_num, const char *ptrack_schema,
+		   BackupStageStats *stats)
 {
-	FILE *in = NULL;
-	FILE *out = NULL;
-	int   hdr_num = -1;
-	off_t  cur_pos_out = 0;
+	fio_block_reader *in = NULL;
 	char  curr_page[BLCKSZ];
 	int   n_blocks_read = 0;
 	BlockNumber blknum = 0;
 	datapagemap_iterator_t *iter = NULL;
-	int   compressed_size = 0;
+	PageWriter	local_writer;
+	PageWriter *writer = &local_writer;
+	PagePipeline *pipeline = NULL;
+	PageBatch  *batch = NULL;
+	pthread_t	writer_thread;
+	double		read_time = 0;
+	double		read_stall = 0;
 
-	/* stdio buffers */
-	char *in_buf = NULL;
-	char *out_buf = NULL;
-
-	/* open source file for read */
-	in = fopen(from_fullpath, PG_BINARY_R);
+	/*
+	 * Open source file for read. Read it ahead by chunks,
+	 * unless the pagemap is involved, which imply a lot
+	 * of random access. Reader gets its own iterator
+	 * to read the pagemap blocks ahead.
+	 */
+	in = fio_block_reader_open(from_fullpath, io_mode, io_depth,
+							   use_pagemap ? datapagemap_iterate(&file->pagemap) : NULL);
 	if (in == NULL)
 	{
 		/*
@@ -2026,58 +3388,87 @@ send_pages(ConnectionArgs* conn_arg, const char *to_fullpath, const char *from_f
 		elog(ERROR, "Cannot open file \"%s\": %s", from_fullpath, strerror(errno));
 	}
 
-	/*
-	 * Enable stdio buffering for local input file,
-	 * unless the pagemap is involved, which
-	 * imply a lot of random access.
-	 */
-
 	if (use_pagemap)
 	{
 		iter = datapagemap_iterate(&file->pagemap);
 		datapagemap_next(iter, &blknum); /* set first block */
-
-		setvbuf(in, NULL, _IONBF, BUFSIZ);
 	}
-	else
+
+	/*
+	 * Compress the pages in separate thread, if there is enough of them
+	 * to pay for it.
+	 */
+	if (calg != NONE_COMPRESS && calg != NOT_DEFINED_COMPRESS &&
+		!use_pagemap && file->n_blocks >= PIPELINE_MIN_BLOCKS)
 	{
-		in_buf = pgut_malloc(STDIO_BUFSIZE);
-		setvbuf(in, in_buf, _IOFBF, STDIO_BUFSIZE);
+		pipeline = (PagePipeline *) pgut_malloc(sizeof(PagePipeline));
+		memset(pipeline, 0, sizeof(PagePipeline));
+		pthread_mutex_init(&pipeline->lock, NULL);
+		pipeline->thread_num = my_thread_num;
+		writer = &pipeline->writer;
 	}
+	else
+		memset(writer, 0, sizeof(PageWriter));
+
+	writer->file = file;
+	writer->from_fullpath = from_fullpath;
+	writer->to_fullpath = to_fullpath;
+	writer->calg = calg;
+	writer->clevel = clevel;
+	writer->hdr_num = -1;
+
+	if (pipeline)
+		pthread_create(&writer_thread, NULL, page_pipeline_writer, pipeline);
 
 	while (blknum < file->n_blocks)
 	{
 		PageState page_st;
-		int rc = prepare_page(conn_arg, file, prev_backup_start_lsn,
-									  blknum, in, backup_mode, curr_page,
-									  true, checksum_version,
-									  ptrack_version_num, ptrack_schema,
-									  from_fullpath, &page_st);
+		Page		page = curr_page;
+		instr_time	start_time,
+					elapsed;
+		int			rc;
+
+		if (pipeline)
+		{
+			/* get free batch to fill */
+			if (!batch)
+			{
+				page_pipeline_wait(pipeline, true, &read_stall);
+				batch = &pipeline->batches[pipeline->head];
+				batch->n_pages = 0;
+			}
+			page = batch->pages[batch->n_pages];
+		}
+
+		INSTR_TIME_SET_CURRENT(start_time);
+		rc = prepare_page(conn_arg, file, prev_backup_start_lsn,
+						  blknum, in, backup_mode, page,
+						  true, checksum_version,
+						  ptrack_version_num, ptrack_schema,
+						  from_fullpath, &page_st);
+		INSTR_TIME_SET_CURRENT(elapsed);
+		INSTR_TIME_SUBTRACT(elapsed, start_time);
+		read_time += INSTR_TIME_GET_DOUBLE(elapsed);
+
 		if (rc == PageIsTruncated)
 			break;
 
 		else if (rc == PageIsOk)
 		{
-			/* lazily open backup file (useful for s3) */
-			if (!out)
-				out = open_local_file_rw(to_fullpath, &out_buf, STDIO_BUFSIZE);
-
-			hdr_num++;
+			if (pipeline)
+			{
+				batch->blknum[batch->n_pages] = blknum;
+				batch->page_st[batch->n_pages] = page_st;
+				batch->n_pages++;
 
-			if (!*headers)
-				*headers = (BackupPageHeader2 *) pgut_malloc(sizeof(BackupPageHeader2));
+				if (batch->n_pages == PIPELINE_BATCH_BLOCKS)
+				{
+					page_pipeline_push(pipeline);
+					batch = NULL;
+				}
+			}
 			else
-				*headers = (BackupPageHeader2 *) pgut_realloc(*headers, (hdr_num+1) * sizeof(BackupPageHeader2));
-
-			(*headers)[hdr_num].block = blknum;
-			(*headers)[hdr_num].pos = cur_pos_out;
-			(*headers)[hdr_num].lsn = page_st.lsn;
-			(*headers)[hdr_num].checksum = page_st.checksum;
-
-			compressed_size = compress_and_backup_page(file, blknum, in, out, &(file->crc),
-														rc, curr_page, calg, clevel,
-														from_fullpath, to_fullpath);
-			cur_pos_out += compressed_size + sizeof(BackupPageHeader);
+				page_writer_put(writer, blknum, page, &page_st);
 		}
 
 		n_blocks_read++;
@@ -2093,45 +3484,204 @@ send_pages(ConnectionArgs* conn_arg, const char *to_fullpath, const char *from_f
 			blknum++;
 	}
 
+	if (pipeline)
+	{
+		/* pass the last batch and wait for the writer */
+		if (batch && batch->n_pages > 0)
+			page_pipeline_push(pipeline);
+
+		pthread_lock(&pipeline->lock);
+		pipeline->eof = true;
+		pthread_mutex_unlock(&pipeline->lock);
+
+		pthread_join(writer_thread, NULL);
+
+		if (!pipeline->done)
+			elog(ERROR, "Failed to write backup file \"%s\"", to_fullpath);
+	}
+
 	/*
 	 * Add dummy header, so we can later extract the length of last header
 	 * as difference between their offsets.
 	 */
-	if (*headers)
+	if (writer->headers)
 	{
-		file->n_headers = hdr_num +1;
-		*headers = (BackupPageHeader2 *) pgut_realloc(*headers, (hdr_num+2) * sizeof(BackupPageHeader2));
-		(*headers)[hdr_num+1].pos = cur_pos_out;
+		file->n_headers = writer->hdr_num +1;
+		writer->headers = (BackupPageHeader2 *) pgut_realloc(writer->headers,
+							(writer->hdr_num+2) * sizeof(BackupPageHeader2));
+		writer->headers[writer->hdr_num+1].pos = writer->cur_pos_out;
+	}
+	*headers = writer->headers;
+
+	if (stats)
+	{
+		stats->read_time += read_time;
+		stats->compress_time += writer->compress_time;
+		stats->write_time += writer->write_time;
+		stats->read_stall += read_stall;
+		if (pipeline)
+		{
+			stats->write_stall += pipeline->write_stall;
+			stats->n_pipelined++;
+		}
 	}
 
 	/* cleanup */
-	if (in && fclose(in))
-		elog(ERROR, "Cannot close the source file \"%s\": %s",
-			 to_fullpath, strerror(errno));
+	fio_block_reader_close(in);
 
 	/* close local output file */
-	if (out && fclose(out))
+	if (writer->out && fclose(writer->out))
 		elog(ERROR, "Cannot close the backup file \"%s\": %s",
 			 to_fullpath, strerror(errno));
 
 	pg_free(iter);
-	pg_free(in_buf);
-	pg_free(out_buf);
+	pg_free(writer->out_buf);
+
+	if (pipeline)
+	{
+		pthread_mutex_destroy(&pipeline->lock);
+		pg_free(pipeline);
+	}
 
 	return n_blocks_read;
 }
 
+#define ZSTD_FRAME_MAGIC 0xFD2FB528
+
 /*
- * Attempt to open header file, read content and return as
- * array of headers.
- * TODO: some access optimizations would be great here:
- * less fseeks, buffering, descriptor sharing, etc.
+ * Page headers in header map are compressed either with zlib or with zstd,
+ * frame magic is enough to tell them apart.
+ */
+static CompressAlg
+header_map_compress_alg(const char *zheaders, size_t len)
+{
+	const unsigned char *magic = (const unsigned char *) zheaders;
+
+	if (len >= 4 &&
+		(uint32) magic[0] == (ZSTD_FRAME_MAGIC & 0xFF) &&
+		(uint32) magic[1] == ((ZSTD_FRAME_MAGIC >> 8) & 0xFF) &&
+		(uint32) magic[2] == ((ZSTD_FRAME_MAGIC >> 16) & 0xFF) &&
+		(uint32) magic[3] == ((ZSTD_FRAME_MAGIC >> 24) & 0xFF))
+		return ZSTD_COMPRESS;
+
+	return ZLIB_COMPRESS;
+}
+
+/*
+ * Every header map keeps a small LRU cache of decompressed page headers,
+ * so that headers of the same file are not read and decompressed again,
+ * e.g. when a big data file is restored by block ranges.
+ */
+#define HEADER_MAP_CACHE_ENTRIES	128
+#define HEADER_MAP_CACHE_SIZE		(8 * 1024 * 1024)
+
+typedef struct HeaderMapCacheEntry
+{
+	off_t		hdr_off;
+	int			hdr_size;
+	pg_crc32	hdr_crc;
+	size_t		len;		/* size of decompressed headers */
+	BackupPageHeader2 *headers;
+} HeaderMapCacheEntry;
+
+static void
+header_map_cache_entry_free(void *entry)
+{
+	pg_free(((HeaderMapCacheEntry *) entry)->headers);
+	pg_free(entry);
+}
+
+/*
+ * Lookup headers of the file in cache and return a copy of them,
+ * or NULL if headers are not cached.
+ */
+static BackupPageHeader2 *
+header_map_cache_get(HeaderMap *hdr_map, pgFile *file, size_t len)
+{
+	BackupPageHeader2 *headers = NULL;
+	size_t		i;
+
+	pthread_lock(&(hdr_map->mutex));
+
+	for (i = 0; hdr_map->cache && i < parray_num(hdr_map->cache); i++)
+	{
+		HeaderMapCacheEntry *entry = (HeaderMapCacheEntry *) parray_get(hdr_map->cache, i);
+
+		if (entry->hdr_off != file->hdr_off ||
+			entry->hdr_size != file->hdr_size ||
+			entry->hdr_crc != file->hdr_crc ||
+			entry->len != len)
+			continue;
+
+		headers = pgut_malloc(len);
+		memcpy(headers, entry->headers, len);
+
+		/* the most recently used entry goes first */
+		if (i > 0)
+		{
+			parray_remove(hdr_map->cache, i);
+			parray_insert(hdr_map->cache, 0, entry);
+		}
+		break;
+	}
+
+	pthread_mutex_unlock(&(hdr_map->mutex));
+
+	return headers;
+}
+
+/* Put a copy of the file headers in cache, evicting the least recently used ones */
+static void
+header_map_cache_put(HeaderMap *hdr_map, pgFile *file,
+					 BackupPageHeader2 *headers, size_t len)
+{
+	HeaderMapCacheEntry *entry;
+
+	/* do not let a single file to evict everything else */
+	if (len > HEADER_MAP_CACHE_SIZE / 2)
+		return;
+
+	entry = pgut_new(HeaderMapCacheEntry);
+	entry->hdr_off = file->hdr_off;
+	entry->hdr_size = file->hdr_size;
+	entry->hdr_crc = file->hdr_crc;
+	entry->len = len;
+	entry->headers = pgut_malloc(len);
+	memcpy(entry->headers, headers, len);
+
+	pthread_lock(&(hdr_map->mutex));
+
+	if (!hdr_map->cache)
+		hdr_map->cache = parray_new();
+
+	parray_insert(hdr_map->cache, 0, entry);
+	hdr_map->cache_size += len;
+
+	while (parray_num(hdr_map->cache) > HEADER_MAP_CACHE_ENTRIES ||
+		   hdr_map->cache_size > HEADER_MAP_CACHE_SIZE)
+	{
+		HeaderMapCacheEntry *victim = (HeaderMapCacheEntry *)
+			parray_remove(hdr_map->cache, parray_num(hdr_map->cache) - 1);
+
+		hdr_map->cache_size -= victim->len;
+		header_map_cache_entry_free(victim);
+	}
+
+	pthread_mutex_unlock(&(hdr_map->mutex));
+}
+
+/*
+ * Read content of header file for given file and return as array of headers.
+ * The header map is opened once and the descriptor is shared by all threads,
+ * which read from it with pread(). It is closed by cleanup_header_map().
+ * Caller is responsible for freeing the returned array.
  */
 BackupPageHeader2*
 get_data_file_headers(HeaderMap *hdr_map, pgFile *file, uint32 backup_version, bool strict)
 {
 	bool     success = false;
-	FILE    *in = NULL;
+	int      fd = -1;
+	int      open_errno = 0;
 	size_t   read_len = 0;
 	pg_crc32 hdr_crc;
 	BackupPageHeader2 *headers = NULL;
@@ -2146,35 +3696,37 @@ get_data_file_headers(HeaderMap *hdr_map, pgFile *file, uint32 backup_version, b
 	if (file->n_headers <= 0)
 		return NULL;
 
-	/* TODO: consider to make this descriptor thread-specific */
-	in = fopen(hdr_map->path, PG_BINARY_R);
+	/*
+	 * The actual number of headers in header file is n+1, last one is a dummy header,
+	 * used for calculation of read_len for actual last header.
+	 */
+	read_len = (file->n_headers+1) * sizeof(BackupPageHeader2);
 
-	if (!in)
+	headers = header_map_cache_get(hdr_map, file, read_len);
+	if (headers)
+		return headers;
+
+	pthread_lock(&(hdr_map->mutex));
+	if (hdr_map->read_fd < 0)
 	{
-		elog(strict ? ERROR : WARNING, "Cannot open header file \"%s\": %s", hdr_map->path, strerror(errno));
-		return NULL;
+		hdr_map->read_fd = open(hdr_map->path, O_RDONLY | PG_BINARY, 0);
+		open_errno = errno;
 	}
-	/* disable buffering for header file */
-	setvbuf(in, NULL, _IONBF, BUFSIZ);
+	fd = hdr_map->read_fd;
+	pthread_mutex_unlock(&(hdr_map->mutex));
 
-	if (fseek(in, file->hdr_off, SEEK_SET))
+	if (fd < 0)
 	{
-		elog(strict ? ERROR : WARNING, "Cannot seek to position %lu in page header map \"%s\": %s",
-			file->hdr_off, hdr_map->path, strerror(errno));
-		goto cleanup;
+		elog(strict ? ERROR : WARNING, "Cannot open header file \"%s\": %s",
+			 hdr_map->path, strerror(open_errno));
+		return NULL;
 	}
 
-	/*
-	 * The actual number of headers in header file is n+1, last one is a dummy header,
-	 * used for calculation of read_len for actual last header.
-	 */
-	read_len = (file->n_headers+1) * sizeof(BackupPageHeader2);
-
 	/* allocate memory for compressed headers */
 	zheaders = pgut_malloc(file->hdr_size);
 	memset(zheaders, 0, file->hdr_size);
 
-	if (fread(zheaders, 1, file->hdr_size, in) != file->hdr_size)
+	if (pread(fd, zheaders, file->hdr_size, file->hdr_off) != file->hdr_size)
 	{
 		elog(strict ? ERROR : WARNING, "Cannot read header file at offset: %li len: %i \"%s\": %s",
 			file->hdr_off, file->hdr_size, hdr_map->path, strerror(errno));
@@ -2186,7 +3738,8 @@ get_data_file_headers(HeaderMap *hdr_map, pgFile *file, uint32 backup_version, b
 	memset(headers, 0, read_len);
 
 	z_len = do_decompress(headers, read_len, zheaders, file->hdr_size,
-						  ZLIB_COMPRESS, &errormsg);
+						  header_map_compress_alg(zheaders, file->hdr_size),
+						  &errormsg);
 	if (z_len <= 0)
 	{
 		if (errormsg)
@@ -2212,13 +3765,12 @@ get_data_file_headers(HeaderMap *hdr_map, pgFile *file, uint32 backup_version, b
 		goto cleanup;
 	}
 
+	header_map_cache_put(hdr_map, file, headers, read_len);
 	success = true;
 
 cleanup:
 
 	pg_free(zheaders);
-	if (in && fclose(in))
-		elog(ERROR, "Cannot close file \"%s\"", hdr_map->path);
 
 	if (!success)
 	{
@@ -2256,9 +3808,17 @@ write_page_headers(BackupPageHeader2 *headers, pgFile *file, HeaderMap *hdr_map,
 	zheaders = pgut_malloc(read_len*2);
 	memset(zheaders, 0, read_len*2);
 
-	/* compress headers */
-	z_len = do_compress(zheaders, read_len*2, headers,
-					   read_len, ZLIB_COMPRESS, 1, &errormsg);
+	/*
+	 * Compress headers. Files compressed with zstd get their headers
+	 * compressed with zstd too, everything else uses zlib.
+	 */
+	z_len = do_compress(zheaders, read_len*2, headers, read_len,
+#ifdef HAVE_LIBZSTD
+						file->compress_alg == ZSTD_COMPRESS ? ZSTD_COMPRESS : ZLIB_COMPRESS,
+#else
+						ZLIB_COMPRESS,
+#endif
+						1, &errormsg);
 
 	/* writing to header map must be serialized */
 	pthread_lock(&(hdr_map->mutex)); /* what if we crash while trying to obtain mutex? */
@@ -2316,6 +3876,9 @@ init_header_map(pgBackup *backup)
 {
 	backup->hdr_map.fp = NULL;
 	backup->hdr_map.buf = NULL;
+	backup->hdr_map.read_fd = -1;
+	backup->hdr_map.cache = NULL;
+	backup->hdr_map.cache_size = 0;
 	join_path_components(backup->hdr_map.path, backup->root_dir, HEADER_MAP);
 	join_path_components(backup->hdr_map.path_tmp, backup->root_dir, HEADER_MAP_TMP);
 	backup->hdr_map.mutex = (pthread_mutex_t)PTHREAD_MUTEX_INITIALIZER;
@@ -2331,4 +3894,50 @@ cleanup_header_map(HeaderMap *hdr_map)
 	hdr_map->offset = 0;
 	pg_free(hdr_map->buf);
 	hdr_map->buf = NULL;
+
+	/* cleanup shared read descriptor and cached headers */
+	if (hdr_map->read_fd >= 0 && close(hdr_map->read_fd))
+		elog(ERROR, "Cannot close file \"%s\"", hdr_map->path);
+	hdr_map->read_fd = -1;
+
+	if (hdr_map->cache)
+	{
+		parray_walk(hdr_map->cache, header_map_cache_entry_free);
+		parray_free(hdr_map->cache);
+		hdr_map->cache = NULL;
+	}
+	hdr_map->cache_size = 0;
+}
+
+/*
+ * Open page header map of interrupted backup or merge for writing.
+ * New headers are appended, so headers of the files copied before
+ * interruption stay at their offsets.
+ */
+void
+reopen_header_map(HeaderMap *hdr_map, bool is_merge)
+{
+	struct stat st;
+	char	   *map_path = (is_merge) ? hdr_map->path_tmp : hdr_map->path;
+
+	if (stat(map_path, &st) == -1)
+	{
+		/* map will be created when the first headers are written */
+		if (errno == ENOENT)
+			return;
+
+		elog(ERROR, "Cannot stat header file \"%s\": %s",
+			 map_path, strerror(errno));
+	}
+
+	hdr_map->fp = fopen(map_path, PG_BINARY_A);
+	if (hdr_map->fp == NULL)
+		elog(ERROR, "Cannot open header file \"%s\": %s",
+			 map_path, strerror(errno));
+
+	/* enable buffering for header file */
+	hdr_map->buf = pgut_malloc(LARGE_CHUNK_SIZE);
+	setvbuf(hdr_map->fp, hdr_map->buf, _IOFBF, LARGE_CHUNK_SIZE);
+
+	hdr_map->offset = st.st_size;
 }
@@ -5,6 +5,11 @@
  *
  * This is a fairly simple bitmap.
  *
+ * For transfer, the map can be encoded either as a bitmap, as a list of
+ * blocks, or as a list of block ranges, whichever is the smallest.  A few
+ * changed blocks with big numbers take a few bytes instead of a bitmap
+ * covering the whole segment.
+ *
  * Copyright (c) 2013-2019, PostgreSQL Global Development Group
  *
  *-------------------------------------------------------------------------
@@ -13,11 +18,26 @@
 #include "postgres_fe.h"
 
 #include "datapagemap.h"
+#include "utils/logger.h"
+
+/* Formats of encoded map, the first byte of encoded data */
+#define DATAPAGEMAP_ENC_BITMAP	'b'		/* bitmap without trailing zeroes */
+#define DATAPAGEMAP_ENC_BLOCKS	'l'		/* list of uint32 block numbers */
+#define DATAPAGEMAP_ENC_RANGES	'r'		/* list of uint32 pairs: first block
+										 * and number of blocks */
 
 struct datapagemap_iterator
 {
 	datapagemap_t *map;
 	BlockNumber nextblkno;
+
+	/* encoded map */
+	datapagemap_t bitmap;		/* bitmap part of DATAPAGEMAP_ENC_BITMAP */
+	char		format;
+	const char *data;			/* list of blocks or ranges */
+	size_t		size;
+	size_t		pos;			/* offset of next item in the list */
+	BlockNumber	range_end;		/* block next to the end of current range */
 };
 
 /*****
@@ -80,6 +100,50 @@ datapagemap_iterate(datapagemap_t *map)
 	iter = pg_malloc(sizeof(datapagemap_iterator_t));
 	iter->map = map;
 	iter->nextblkno = 0;
+	iter->format = DATAPAGEMAP_ENC_BITMAP;
+
+	return iter;
+}
+
+/*
+ * Start iterating through the map encoded by datapagemap_encode().
+ * The encoded data must stay in place until the iteration is finished.
+ */
+datapagemap_iterator_t *
+datapagemap_iterate_encoded(const char *data, size_t size)
+{
+	datapagemap_iterator_t *iter;
+
+	iter = pg_malloc(sizeof(datapagemap_iterator_t));
+	iter->map = &iter->bitmap;
+	iter->nextblkno = 0;
+	iter->format = DATAPAGEMAP_ENC_BITMAP;
+	iter->bitmap.bitmap = NULL;
+	iter->bitmap.bitmapsize = 0;
+	iter->data = NULL;
+	iter->size = 0;
+	iter->pos = 0;
+	iter->range_end = 0;
+
+	if (size == 0)
+		return iter;
+
+	iter->format = data[0];
+	switch (iter->format)
+	{
+		case DATAPAGEMAP_ENC_BITMAP:
+			iter->bitmap.bitmap = (char *) data + 1;
+			iter->bitmap.bitmapsize = size - 1;
+			break;
+		case DATAPAGEMAP_ENC_BLOCKS:
+		case DATAPAGEMAP_ENC_RANGES:
+			iter->data = data + 1;
+			iter->size = size - 1;
+			break;
+		default:
+			elog(ERROR, "Unknown pagemap encoding: %d", iter->format);
+			break;
+	}
 
 	return iter;
 }
@@ -89,18 +153,59 @@ datapagemap_next(datapagemap_iterator_t *iter, BlockNumber *blkno)
 {
 	datapagemap_t *map = iter->map;
 
+	if (iter->format == DATAPAGEMAP_ENC_BLOCKS)
+	{
+		uint32		blk;
+
+		if (iter->pos + sizeof(uint32) > iter->size)
+			return false;
+
+		memcpy(&blk, iter->data + iter->pos, sizeof(uint32));
+		iter->pos += sizeof(uint32);
+		*blkno = blk;
+		return true;
+	}
+	else if (iter->format == DATAPAGEMAP_ENC_RANGES)
+	{
+		/* get next range, if current one is exhausted */
+		if (iter->nextblkno >= iter->range_end)
+		{
+			uint32		range[2];
+
+			if (iter->pos + sizeof(range) > iter->size)
+				return false;
+
+			memcpy(range, iter->data + iter->pos, sizeof(range));
+			iter->pos += sizeof(range);
+			iter->nextblkno = range[0];
+			iter->range_end = range[0] + range[1];
+		}
+
+		*blkno = iter->nextblkno++;
+		return true;
+	}
+
 	for (;;)
 	{
 		BlockNumber blk = iter->nextblkno;
 		int			nextoff = blk / 8;
 		int			bitno = blk % 8;
+		unsigned char byte;
 
 		if (nextoff >= map->bitmapsize)
 			break;
 
+		/* skip the rest of the byte at once, if there are no set bits */
+		byte = (unsigned char) map->bitmap[nextoff] >> bitno;
+		if (byte == 0)
+		{
+			iter->nextblkno = (nextoff + 1) * 8;
+			continue;
+		}
+
 		iter->nextblkno++;
 
-		if (map->bitmap[nextoff] & (1 << bitno))
+		if (byte & 1)
 		{
 			*blkno = blk;
 			return true;
@@ -111,3 +216,121 @@ datapagemap_next(datapagemap_iterator_t *iter, BlockNumber *blkno)
 	return false;
 }
 
+/*
+ * Encode the map for transfer, choosing the smallest of the formats.
+ * Returns palloc'd buffer, its size is stored in *size.
+ * Use datapagemap_iterate_encoded() to iterate through the result.
+ */
+char *
+datapagemap_encode(datapagemap_t *map, size_t *size)
+{
+	size_t		n_blocks = 0;
+	size_t		n_ranges = 0;
+	int			bitmap_len = 0;
+	bool		in_range = false;
+	size_t		bitmap_size;
+	size_t		blocks_size;
+	size_t		ranges_size;
+	char	   *result;
+	char	   *ptr;
+	int			i;
+	int			bitno;
+
+	/* count blocks and ranges */
+	for (i = 0; i < map->bitmapsize; i++)
+	{
+		unsigned char byte = (unsigned char) map->bitmap[i];
+
+		if (byte == 0)
+		{
+			in_range = false;
+			continue;
+		}
+
+		bitmap_len = i + 1;
+
+		for (bitno = 0; bitno < 8; bitno++)
+		{
+			if (byte & (1 << bitno))
+			{
+				n_blocks++;
+				if (!in_range)
+					n_ranges++;
+				in_range = true;
+			}
+			else
+				in_range = false;
+		}
+	}
+
+	bitmap_size = 1 + bitmap_len;
+	blocks_size = 1 + n_blocks * sizeof(uint32);
+	ranges_size = 1 + n_ranges * 2 * sizeof(uint32);
+
+	if (bitmap_size <= blocks_size && bitmap_size <= ranges_size)
+	{
+		result = pg_malloc(bitmap_size);
+		result[0] = DATAPAGEMAP_ENC_BITMAP;
+		memcpy(result + 1, map->bitmap, bitmap_len);
+		*size = bitmap_size;
+		return result;
+	}
+	else if (blocks_size <= ranges_size)
+	{
+		datapagemap_iterator_t *iter = datapagemap_iterate(map);
+		BlockNumber blkno;
+
+		result = pg_malloc(blocks_size);
+		result[0] = DATAPAGEMAP_ENC_BLOCKS;
+		ptr = result + 1;
+
+		while (datapagemap_next(iter, &blkno))
+		{
+			uint32		blk = blkno;
+
+			memcpy(ptr, &blk, sizeof(uint32));
+			ptr += sizeof(uint32);
+		}
+		pg_free(iter);
+
+		*size = blocks_size;
+		return result;
+	}
+	else
+	{
+		datapagemap_iterator_t *iter = datapagemap_iterate(map);
+		BlockNumber blkno;
+		uint32		range[2] = {0, 0};
+
+		result = pg_malloc(ranges_size);
+		result[0] = DATAPAGEMAP_ENC_RANGES;
+		ptr = result + 1;
+
+		while (datapagemap_next(iter, &blkno))
+		{
+			/* continue current range or start new one */
+			if (range[1] > 0 && range[0] + range[1] == blkno)
+				range[1]++;
+			else
+			{
+				if (range[1] > 0)
+				{
+					memcpy(ptr, range, sizeof(range));
+					ptr += sizeof(range);
+				}
+				range[0] = blkno;
+				range[1] = 1;
+			}
+		}
+		if (range[1] > 0)
+		{
+			memcpy(ptr, range, sizeof(range));
+			ptr += sizeof(range);
+		}
+		pg_free(iter);
+
+		*size = ranges_size;
+		return result;
+	}
+}
+
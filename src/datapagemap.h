@@ -26,4 +26,8 @@ extern void datapagemap_add(datapagemap_t *map, BlockNumber blkno);
 extern datapagemap_iterator_t *datapagemap_iterate(datapagemap_t *map);
 extern bool datapagemap_next(datapagemap_iterator_t *iter, BlockNumber *blkno);
 
+extern char *datapagemap_encode(datapagemap_t *map, size_t *size);
+extern datapagemap_iterator_t *datapagemap_iterate_encoded(const char *data,
+														   size_t size);
+
 #endif							/* DATAPAGEMAP_H */
@@ -14,8 +14,35 @@
 #include <time.h>
 #include <unistd.h>
 
+#include "instr_time.h"
+
+typedef struct
+{
+	const char *root;
+	FileQueue  *queue;
+	int			n_files;
+	const char *action;
+	int			thread_num;
+
+	/* files, which are shared with other backups via hard links */
+	int			n_shared;
+	int64		shared_bytes;
+
+	/*
+	 * Return value from the thread.
+	 * 0 means there is no error, 1 - there is an error.
+	 */
+	int			ret;
+} delete_files_arg;
+
 static void delete_walfiles_in_tli(XLogRecPtr keep_lsn, timelineInfo *tli,
 						uint32 xlog_seg_size, bool dry_run);
+static void add_walfile_to_delete(parray *files, timelineInfo *tlinfo, const char *wal_name,
+								  XLogSegNo segno, int64 size, uint32 xlog_seg_size);
+static void *delete_files_worker(void *arg);
+static void delete_files_parallel(const char *root, parray *files, const char *action);
+static void delete_directory(const char *root, const char *last_file, bool keep_root,
+							 bool skip_hidden, const char *action);
 static void do_retention_internal(parray *backup_list, parray *to_keep_list,
 									parray *to_purge_list);
 static void do_retention_merge(parray *backup_list, parray *to_keep_list,
@@ -720,16 +747,11 @@ do_retention_wal(bool dry_run)
 /*
  * Delete backup files of the backup and update the status of the backup to
  * BACKUP_STATUS_DELETED.
- * TODO: delete files on multiple threads
  */
 void
 delete_backup_files(pgBackup *backup)
 {
-	size_t		i;
 	char		timestamp[100];
-	parray		*files;
-	size_t		num_files;
-	char		full_path[MAXPGPATH];
 
 	/*
 	 * If the backup was deleted already, there is nothing to do.
@@ -752,31 +774,12 @@ delete_backup_files(pgBackup *backup)
 	 */
 	write_backup_status(backup, BACKUP_STATUS_DELETING, instance_name, false);
 
-	/* list files to be deleted */
-	files = parray_new();
-	dir_list_file(files, backup->root_dir, false, false, true, false, false, 0, FIO_BACKUP_HOST);
-
-	/* delete leaf node first */
-	parray_qsort(files, pgFileCompareRelPathWithExternalDesc);
-	num_files = parray_num(files);
-	for (i = 0; i < num_files; i++)
-	{
-		pgFile	   *file = (pgFile *) parray_get(files, i);
-
-		join_path_components(full_path, backup->root_dir, file->rel_path);
-
-		if (interrupted)
-			elog(ERROR, "interrupted during delete backup");
-
-		if (progress)
-			elog(INFO, "Progress: (%zd/%zd). Delete file \"%s\"",
-				 i + 1, num_files, full_path);
-
-		pgFileDelete(file->mode, full_path);
-	}
+	/*
+	 * Control file is deleted last, so that in case of failure the backup
+	 * is still shown in DELETING status.
+	 */
+	delete_directory(backup->root_dir, BACKUP_CONTROL_FILE, false, false, "delete backup");
 
-	parray_walk(files, pgFileFree);
-	parray_free(files);
 	backup->status = BACKUP_STATUS_DELETED;
 
 	return;
@@ -816,10 +819,12 @@ delete_walfiles_in_tli(XLogRecPtr keep_lsn, timelineInfo *tlinfo,
 	size_t		wal_size_actual = 0;
 	char		wal_pretty_size[20];
 	bool		purge_all = false;
+	parray	   *files;
 
 
 	/* Timeline is completely empty */
-	if (parray_num(tlinfo->xlog_filelist) == 0)
+	if (parray_num(tlinfo->xlog_ranges) == 0 &&
+		parray_num(tlinfo->xlog_filelist) == 0)
 	{
 		elog(INFO, "Timeline %i is empty, nothing to remove", tlinfo->tli);
 		return;
@@ -896,6 +901,18 @@ delete_walfiles_in_tli(XLogRecPtr keep_lsn, timelineInfo *tlinfo,
 	}
 
 	/* Calculate the actual size to delete */
+	for (i = 0; i < parray_num(tlinfo->xlog_ranges); i++)
+	{
+		xlogRange  *range = (xlogRange *) parray_get(tlinfo->xlog_ranges, i);
+
+		if (purge_all || range->end_segno < OldestToKeepSegNo)
+			wal_size_actual += range->size;
+		else if (range->begin_segno < OldestToKeepSegNo)
+			/* segments of the range have about the same size */
+			wal_size_actual += range->size / (range->end_segno - range->begin_segno + 1) *
+								(OldestToKeepSegNo - range->begin_segno);
+	}
+
 	for (i = 0; i < parray_num(tlinfo->xlog_filelist); i++)
 	{
 		xlogFile *wal_file = (xlogFile *) parray_get(tlinfo->xlog_filelist, i);
@@ -915,52 +932,283 @@ delete_walfiles_in_tli(XLogRecPtr keep_lsn, timelineInfo *tlinfo,
 	if (dry_run)
 		return;
 
+	/* collect files to delete */
+	files = parray_new();
+
+	for (i = 0; i < parray_num(tlinfo->xlog_ranges); i++)
+	{
+		xlogRange  *range = (xlogRange *) parray_get(tlinfo->xlog_ranges, i);
+		XLogSegNo	segno;
+
+		for (segno = range->begin_segno; segno <= range->end_segno; segno++)
+		{
+			char		wal_name[MAXFNAMELEN];
+
+			/* Any segment equal or greater than EndSegNo must be kept
+			 * unless it`s a 'purge all' scenario.
+			 */
+			if (!purge_all && segno >= OldestToKeepSegNo)
+				break;
+
+			GetXLogFileName(wal_name, tlinfo->tli, segno, xlog_seg_size);
+			if (range->suffix[0] != '\0')
+			{
+				strcat(wal_name, ".");
+				strcat(wal_name, range->suffix);
+			}
+
+			add_walfile_to_delete(files, tlinfo, wal_name, segno,
+								  range->size / (range->end_segno - range->begin_segno + 1),
+								  xlog_seg_size);
+		}
+	}
+
 	for (i = 0; i < parray_num(tlinfo->xlog_filelist); i++)
 	{
 		xlogFile *wal_file = (xlogFile *) parray_get(tlinfo->xlog_filelist, i);
 
-		if (interrupted)
-			elog(ERROR, "interrupted during WAL archive purge");
-
 		/* Any segment equal or greater than EndSegNo must be kept
 		 * unless it`s a 'purge all' scenario.
 		 */
 		if (purge_all || wal_file->segno < OldestToKeepSegNo)
-		{
-			char wal_fullpath[MAXPGPATH];
+			add_walfile_to_delete(files, tlinfo, wal_file->file.name,
+								  wal_file->segno, wal_file->file.size,
+								  xlog_seg_size);
+	}
 
-			join_path_components(wal_fullpath, instance_config.arclog_path, wal_file->file.name);
+	if (parray_num(files) > 0)
+	{
+		delete_files_parallel(instance_config.arclog_path, files, "WAL archive purge");
+		wal_deleted = true;
+	}
 
-			/* save segment from purging */
-			if (instance_config.wal_depth >= 0 && wal_file->keep)
-			{
-				elog(VERBOSE, "Retain WAL segment \"%s\"", wal_fullpath);
-				continue;
-			}
+	parray_walk(files, pgFileFree);
+	parray_free(files);
+}
 
-			/* unlink segment */
-			if (fio_unlink(wal_fullpath, FIO_BACKUP_HOST) < 0)
-			{
-				/* Missing file is not considered as error condition */
-				if (errno != ENOENT)
-					elog(ERROR, "Could not remove file \"%s\": %s",
-							wal_fullpath, strerror(errno));
-			}
-			else
-			{
-				if (wal_file->type == SEGMENT)
-					elog(VERBOSE, "Removed WAL segment \"%s\"", wal_fullpath);
-				else if (wal_file->type == TEMP_SEGMENT)
-					elog(VERBOSE, "Removed temp WAL segment \"%s\"", wal_fullpath);
-				else if (wal_file->type == PARTIAL_SEGMENT)
-					elog(VERBOSE, "Removed partial WAL segment \"%s\"", wal_fullpath);
-				else if (wal_file->type == BACKUP_HISTORY_FILE)
-					elog(VERBOSE, "Removed backup history file \"%s\"", wal_fullpath);
-			}
+/*
+ * Add file of WAL archive to the list of files to delete,
+ * unless it is protected by WAL retention.
+ */
+static void
+add_walfile_to_delete(parray *files, timelineInfo *tlinfo, const char *wal_name,
+					  XLogSegNo segno, int64 size, uint32 xlog_seg_size)
+{
+	pgFile	   *file;
+
+	/* save segment from purging */
+	if (instance_config.wal_depth >= 0 &&
+		timelineKeepsSegment(tlinfo, segno, xlog_seg_size))
+	{
+		elog(VERBOSE, "Retain WAL segment \"%s/%s\"",
+			 instance_config.arclog_path, wal_name);
+		return;
+	}
+
+	file = pgFileInit(wal_name);
+	file->mode = S_IFREG;
+	file->size = size;
+	parray_append(files, file);
+}
+
+/*
+ * Worker thread of delete_files_parallel()
+ */
+static void *
+delete_files_worker(void *arg)
+{
+	delete_files_arg *args = (delete_files_arg *) arg;
+	pgFile	   *file;
+	int			pos;
 
-			wal_deleted = true;
+	while ((file = file_queue_next(args->queue, args->thread_num, &pos)) != NULL)
+	{
+		char		full_path[MAXPGPATH];
+		struct stat	st;
+
+		if (interrupted || thread_interrupted)
+			elog(ERROR, "interrupted during %s", args->action);
+
+		join_path_components(full_path, args->root, file->rel_path);
+
+		if (progress)
+			elog(INFO, "Progress: (%d/%d). Delete file \"%s\"",
+				 pos, args->n_files, full_path);
+
+		/*
+		 * Unchanged files may be shared by several backups, see --dedup.
+		 * Removal of such file frees no space.
+		 */
+		if (fio_stat(full_path, &st, false, FIO_BACKUP_HOST) == 0 &&
+			st.st_nlink > 1)
+		{
+			args->n_shared++;
+			args->shared_bytes += st.st_size;
 		}
+
+		if (fio_unlink(full_path, FIO_BACKUP_HOST) < 0)
+		{
+			/* Missing file is not considered as error condition */
+			if (errno != ENOENT)
+				elog(ERROR, "Could not remove file \"%s\": %s",
+					 full_path, strerror(errno));
+		}
+		else
+			elog(VERBOSE, "Removed file \"%s\"", full_path);
 	}
+
+	/* close ssh connection */
+	fio_disconnect();
+
+	args->ret = 0;
+	return NULL;
+}
+
+/*
+ * Delete regular files from the list, relative to 'root', using
+ * num_threads threads. Report the throughput when done.
+ * 'action' is used for reporting.
+ */
+static void
+delete_files_parallel(const char *root, parray *files, const char *action)
+{
+	FileQueue  *queue;
+	pthread_t  *threads;
+	delete_files_arg *threads_args;
+	instr_time	start_time,
+				elapsed;
+	double		elapsed_sec;
+	char		pretty_time[20];
+	char		pretty_bytes[20];
+	int64		bytes = 0;
+	int64		shared_bytes = 0;
+	int			n_shared = 0;
+	bool		delete_isok = true;
+	int			n_threads;
+	int			i;
+
+	if (parray_num(files) == 0)
+		return;
+
+	for (i = 0; i < parray_num(files); i++)
+		bytes += ((pgFile *) parray_get(files, i))->size;
+
+	n_threads = Min(num_threads, parray_num(files));
+
+	INSTR_TIME_SET_CURRENT(start_time);
+
+	queue = file_queue_init(files, n_threads);
+	threads = (pthread_t *) palloc(sizeof(pthread_t) * n_threads);
+	threads_args = (delete_files_arg *) palloc(sizeof(delete_files_arg) * n_threads);
+
+	for (i = 0; i < n_threads; i++)
+	{
+		delete_files_arg *arg = &(threads_args[i]);
+
+		arg->root = root;
+		arg->queue = queue;
+		arg->n_files = parray_num(files);
+		arg->action = action;
+		arg->thread_num = i + 1;
+		arg->n_shared = 0;
+		arg->shared_bytes = 0;
+		/* By default there are some error */
+		arg->ret = 1;
+
+		pthread_create(&threads[i], NULL, delete_files_worker, arg);
+	}
+
+	/* Wait threads */
+	for (i = 0; i < n_threads; i++)
+	{
+		pthread_join(threads[i], NULL);
+		if (threads_args[i].ret == 1)
+			delete_isok = false;
+
+		n_shared += threads_args[i].n_shared;
+		shared_bytes += threads_args[i].shared_bytes;
+	}
+
+	if (!delete_isok)
+		elog(ERROR, "Failed to delete files during %s", action);
+
+	file_queue_report(queue, "deleted");
+	file_queue_free(queue);
+	pfree(threads);
+	pfree(threads_args);
+
+	INSTR_TIME_SET_CURRENT(elapsed);
+	INSTR_TIME_SUBTRACT(elapsed, start_time);
+	elapsed_sec = INSTR_TIME_GET_DOUBLE(elapsed);
+
+	pretty_time_interval(elapsed_sec, pretty_time, lengthof(pretty_time));
+	pretty_size(bytes, pretty_bytes, lengthof(pretty_bytes));
+
+	elog(LOG, "Finished %s: %zu files (%s) deleted in %s using %d threads, %.0f files/sec",
+		 action, parray_num(files), pretty_bytes, pretty_time, n_threads,
+		 elapsed_sec > 0 ? parray_num(files) / elapsed_sec : 0);
+
+	if (n_shared > 0)
+	{
+		pretty_size(shared_bytes, pretty_bytes, lengthof(pretty_bytes));
+		elog(LOG, "%d of deleted files (%s) are still used by other backups",
+			 n_shared, pretty_bytes);
+	}
+}
+
+/*
+ * Delete directory 'root' with its content. Regular files are deleted
+ * on num_threads threads, then directories and other entries are deleted
+ * leaf first. If 'last_file' is not NULL, this file is deleted only after
+ * the rest of content, so that it stays in place in case of failure.
+ * If 'keep_root' is true, only the content of the directory is deleted.
+ */
+static void
+delete_directory(const char *root, const char *last_file, bool keep_root,
+				 bool skip_hidden, const char *action)
+{
+	parray	   *files;
+	parray	   *regular_files;
+	size_t		i;
+
+	/* list files to be deleted */
+	files = parray_new();
+	dir_list_file(files, root, false, false, !keep_root, false, skip_hidden, 0, FIO_BACKUP_HOST);
+
+	regular_files = parray_new();
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+
+		if (S_ISREG(file->mode) &&
+			!(last_file && strcmp(file->rel_path, last_file) == 0))
+			parray_append(regular_files, file);
+	}
+
+	delete_files_parallel(root, regular_files, action);
+
+	/* delete leaf node first */
+	parray_qsort(files, pgFileCompareRelPathWithExternalDesc);
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+		char		full_path[MAXPGPATH];
+
+		/* already deleted */
+		if (S_ISREG(file->mode) &&
+			!(last_file && strcmp(file->rel_path, last_file) == 0))
+			continue;
+
+		if (interrupted)
+			elog(ERROR, "interrupted during %s", action);
+
+		join_path_components(full_path, root, file->rel_path);
+		pgFileDelete(file->mode, full_path);
+	}
+
+	parray_free(regular_files);
+	parray_walk(files, pgFileFree);
+	parray_free(files);
 }
 
 
@@ -989,7 +1237,10 @@ do_delete_instance(void)
 	parray_free(backup_list);
 
 	/* Delete all wal files. */
-	pgut_rmtree(arclog_path, false, true);
+	delete_directory(arclog_path, NULL, true, false, "delete instance");
+
+	/* Delete catalog index */
+	catalog_drop_index(instance_name, false);
 
 	/* Delete backup instance config file */
 	join_path_components(instance_config_path, backup_instance_path, BACKUP_CATALOG_CONF_FILE);
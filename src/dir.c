@@ -22,6 +22,7 @@
 #include <dirent.h>
 
 #include "utils/configuration.h"
+#include "instr_time.h"
 
 /*
  * The contents of these directories are removed or recreated during server
@@ -313,6 +314,9 @@ pgFileGetCRC(const char *file_path, bool use_crc32c, bool missing_ok)
 	}
 
 	FIN_FILE_CRC32(use_crc32c, crc);
+
+	if (io_mode != IO_MODE_BUFFERED)
+		fio_drop_cache(fileno(fp), 0, 0);
 	fclose(fp);
 	pg_free(buf);
 
@@ -388,6 +392,57 @@ pgFileGetCRCgz(const char *file_path, bool use_crc32c, bool missing_ok)
 	return crc;
 }
 
+typedef struct
+{
+	bool		use_crc32c;
+	pg_crc32	crc;
+} crc_stream_arg;
+
+static size_t
+crc_stream_write(void *arg, const void *buf, size_t size)
+{
+	crc_stream_arg *args = (crc_stream_arg *) arg;
+
+	if (interrupted)
+		elog(ERROR, "interrupted during CRC calculation");
+
+	COMP_FILE_CRC32(args->use_crc32c, args->crc, buf, size);
+
+	return size;
+}
+
+/*
+ * Compute CRC of decompressed content of the local file,
+ * compressed with zstd or lz4 streaming compression.
+ */
+pg_crc32
+pgFileGetCRCstream(const char *file_path, CompressAlg alg,
+				   bool use_crc32c, bool missing_ok)
+{
+	crc_stream_arg arg;
+	const char *errormsg = NULL;
+	int			rc;
+
+	arg.use_crc32c = use_crc32c;
+	INIT_FILE_CRC32(use_crc32c, arg.crc);
+
+	rc = decompress_file_stream(file_path, alg, crc_stream_write, &arg, &errormsg);
+
+	if (rc == FILE_MISSING)
+	{
+		if (!missing_ok)
+			elog(ERROR, "Cannot open file \"%s\": %s",
+				 file_path, strerror(ENOENT));
+	}
+	else if (rc != SEND_OK)
+		elog(ERROR, "Cannot read from compressed file \"%s\": %s",
+			 file_path, errormsg ? errormsg : "unknown error");
+
+	FIN_FILE_CRC32(use_crc32c, arg.crc);
+
+	return arg.crc;
+}
+
 void
 pgFileFree(void *file)
 {
@@ -520,7 +575,8 @@ db_map_entry_free(void *entry)
  * When follow_symlink is true, symbolic link is ignored and only file or
  * directory linked to will be listed.
  *
- * TODO: make it strictly local
+ * Remote directory is listed by the agent, which sends the whole list
+ * in one stream instead of a round trip per every directory entry.
  */
 void
 dir_list_file(parray *files, const char *root, bool exclude, bool follow_symlink,
@@ -529,6 +585,13 @@ dir_list_file(parray *files, const char *root, bool exclude, bool follow_symlink
 {
 	pgFile	   *file;
 
+	if (fio_is_remote(location))
+	{
+		fio_list_dir(files, root, exclude, follow_symlink, add_root,
+					 backup_logs, skip_hidden, external_dir_num, location);
+		return;
+	}
+
 	file = pgFileNew(root, "", follow_symlink, external_dir_num, location);
 	if (file == NULL)
 	{
@@ -1555,122 +1618,404 @@ bad_format:
 }
 
 /*
- * Construct parray of pgFile from the backup content list.
- * If root is not NULL, path will be absolute path.
+ * Construct pgFile from the line of backup content list in text format.
  */
-parray *
-dir_read_file_list(const char *root, const char *external_prefix,
-				   const char *file_txt, fio_location location, pg_crc32 expected_crc)
+static pgFile *
+parse_filelist_line(char *buf)
 {
-	FILE    *fp;
-	parray  *files;
-	char     buf[BLCKSZ];
-	char     stdio_buf[STDIO_BUFSIZE];
-	pg_crc32 content_crc = 0;
+	char		path[MAXPGPATH];
+	char		linked[MAXPGPATH];
+	char		compress_alg_string[MAXPGPATH];
+	int64		write_size,
+				mode,		/* bit length of mode_t depends on platforms */
+				is_datafile,
+				is_cfs,
+				external_dir_num,
+				crc,
+				segno,
+				n_blocks,
+				n_headers,
+				dbOid,		/* used for partial restore */
+				hdr_crc,
+				hdr_off,
+				hdr_size;
+	pgFile	   *file;
 
-	fp = fio_open_stream(file_txt, location);
-	if (fp == NULL)
+	get_control_value(buf, "path", path, NULL, true);
+	get_control_value(buf, "size", NULL, &write_size, true);
+	get_control_value(buf, "mode", NULL, &mode, true);
+	get_control_value(buf, "is_datafile", NULL, &is_datafile, true);
+	get_control_value(buf, "is_cfs", NULL, &is_cfs, false);
+	get_control_value(buf, "crc", NULL, &crc, true);
+	get_control_value(buf, "compress_alg", compress_alg_string, NULL, false);
+	get_control_value(buf, "external_dir_num", NULL, &external_dir_num, false);
+	get_control_value(buf, "dbOid", NULL, &dbOid, false);
+
+	file = pgFileInit(path);
+	file->write_size = (int64) write_size;
+	file->mode = (mode_t) mode;
+	file->is_datafile = is_datafile ? true : false;
+	file->is_cfs = is_cfs ? true : false;
+	file->crc = (pg_crc32) crc;
+	file->compress_alg = parse_compress_alg(compress_alg_string);
+	file->external_dir_num = external_dir_num;
+	file->dbOid = dbOid ? dbOid : 0;
+
+	/*
+	 * Optional fields
+	 */
+
+	if (get_control_value(buf, "linked", linked, NULL, false) && linked[0])
+	{
+		file->linked = pgut_strdup(linked);
+		canonicalize_path(file->linked);
+	}
+
+	if (get_control_value(buf, "segno", NULL, &segno, false))
+		file->segno = (int) segno;
+
+	if (get_control_value(buf, "n_blocks", NULL, &n_blocks, false))
+		file->n_blocks = (int) n_blocks;
+
+	if (get_control_value(buf, "n_headers", NULL, &n_headers, false))
+		file->n_headers = (int) n_headers;
+
+	if (get_control_value(buf, "hdr_crc", NULL, &hdr_crc, false))
+		file->hdr_crc = (pg_crc32) hdr_crc;
+
+	if (get_control_value(buf, "hdr_off", NULL, &hdr_off, false))
+		file->hdr_off = hdr_off;
+
+	if (get_control_value(buf, "hdr_size", NULL, &hdr_size, false))
+		file->hdr_size = (int) hdr_size;
+
+	return file;
+}
+
+/*
+ * Construct pgFile from the entry of backup content list in binary format.
+ * Optional fields are set only if they would be present in text format.
+ */
+static pgFile *
+filelist_entry_to_file(FileListEntry *entry, char *path, char *linked)
+{
+	pgFile	   *file = pgFileInit(path);
+
+	file->write_size = entry->write_size;
+	file->mode = (mode_t) entry->mode;
+	file->is_datafile = entry->is_datafile ? true : false;
+	file->is_cfs = entry->is_cfs ? true : false;
+	file->crc = entry->crc;
+	file->compress_alg = (CompressAlg) entry->compress_alg;
+	file->external_dir_num = entry->external_dir_num;
+	file->dbOid = entry->dbOid;
+
+	if (linked && linked[0])
+	{
+		file->linked = pgut_strdup(linked);
+		canonicalize_path(file->linked);
+	}
+
+	if (file->is_datafile)
+		file->segno = entry->segno;
+
+	if (entry->n_blocks > 0)
+		file->n_blocks = entry->n_blocks;
+
+	if (entry->n_headers > 0)
+	{
+		file->n_headers = entry->n_headers;
+		file->hdr_crc = entry->hdr_crc;
+		file->hdr_off = entry->hdr_off;
+		file->hdr_size = entry->hdr_size;
+	}
+
+	return file;
+}
+
+/*
+ * Reader of backup content list. It reads both text and binary formats,
+ * returning files one by one, so that the whole list does not have to be
+ * kept in memory.
+ */
+struct FileListReader
+{
+	FILE	   *fp;
+	char		path[MAXPGPATH];
+	bool		binary;
+	FileListHeader header;	/* only for binary format */
+	uint32		n_read;		/* number of files read so far */
+	bool		eof;
+	pg_crc32	crc;
+	char		stdio_buf[STDIO_BUFSIZE];
+};
+
+FileListReader *
+filelist_open(const char *file_txt, fio_location location)
+{
+	FileListReader *reader;
+	int			c;
+
+	reader = pgut_new(FileListReader);
+	MemSet(reader, 0, offsetof(FileListReader, stdio_buf));
+	strncpy(reader->path, file_txt, MAXPGPATH - 1);
+
+	reader->fp = fio_open_stream(file_txt, location);
+	if (reader->fp == NULL)
 		elog(ERROR, "cannot open \"%s\": %s", file_txt, strerror(errno));
 
 	/* enable stdio buffering for local file */
 	if (!fio_is_remote(location))
-		setvbuf(fp, stdio_buf, _IOFBF, STDIO_BUFSIZE);
+		setvbuf(reader->fp, reader->stdio_buf, _IOFBF, STDIO_BUFSIZE);
 
-	files = parray_new();
+	INIT_FILE_CRC32(true, reader->crc);
 
-	INIT_FILE_CRC32(true, content_crc);
-
-	while (fgets(buf, lengthof(buf), fp))
+	/* every line of text format starts with '{' */
+	c = fgetc(reader->fp);
+	if (c == EOF || c == '{')
 	{
-		char		path[MAXPGPATH];
-		char		linked[MAXPGPATH];
-		char		compress_alg_string[MAXPGPATH];
-		int64		write_size,
-					mode,		/* bit length of mode_t depends on platforms */
-					is_datafile,
-					is_cfs,
-					external_dir_num,
-					crc,
-					segno,
-					n_blocks,
-					n_headers,
-					dbOid,		/* used for partial restore */
-					hdr_crc,
-					hdr_off,
-					hdr_size;
-		pgFile	   *file;
+		if (c != EOF && ungetc(c, reader->fp) == EOF)
+			elog(ERROR, "Failed to read from file: \"%s\"", file_txt);
+		return reader;
+	}
 
-		COMP_FILE_CRC32(true, content_crc, buf, strlen(buf));
-
-		get_control_value(buf, "path", path, NULL, true);
-		get_control_value(buf, "size", NULL, &write_size, true);
-		get_control_value(buf, "mode", NULL, &mode, true);
-		get_control_value(buf, "is_datafile", NULL, &is_datafile, true);
-		get_control_value(buf, "is_cfs", NULL, &is_cfs, false);
-		get_control_value(buf, "crc", NULL, &crc, true);
-		get_control_value(buf, "compress_alg", compress_alg_string, NULL, false);
-		get_control_value(buf, "external_dir_num", NULL, &external_dir_num, false);
-		get_control_value(buf, "dbOid", NULL, &dbOid, false);
-
-		file = pgFileInit(path);
-		file->write_size = (int64) write_size;
-		file->mode = (mode_t) mode;
-		file->is_datafile = is_datafile ? true : false;
-		file->is_cfs = is_cfs ? true : false;
-		file->crc = (pg_crc32) crc;
-		file->compress_alg = parse_compress_alg(compress_alg_string);
-		file->external_dir_num = external_dir_num;
-		file->dbOid = dbOid ? dbOid : 0;
+	reader->binary = true;
+	reader->header.magic[0] = (char) c;
 
-		/*
-		 * Optional fields
-		 */
+	if (fread(reader->header.magic + 1, 1, sizeof(FileListHeader) - 1,
+			  reader->fp) != sizeof(FileListHeader) - 1 ||
+		memcmp(reader->header.magic, FILELIST_MAGIC, sizeof(FILELIST_MAGIC)) != 0)
+		elog(ERROR, "%s file has invalid format: \"%s\"", DATABASE_FILE_LIST, file_txt);
+
+	if (reader->header.version != FILELIST_VERSION)
+		elog(ERROR, "%s file \"%s\" has unsupported version %u",
+			 DATABASE_FILE_LIST, file_txt, reader->header.version);
+
+	return reader;
+}
+
+bool
+filelist_is_binary(FileListReader *reader)
+{
+	return reader->binary;
+}
+
+/*
+ * Read the next file from the list. Returns NULL when there are no files left.
+ */
+pgFile *
+filelist_next(FileListReader *reader)
+{
+	FileListEntry entry;
+	char		path[MAXPGPATH];
+	char		linked[MAXPGPATH];
+
+	if (reader->eof)
+		return NULL;
+
+	if (!reader->binary)
+	{
+		char		buf[BLCKSZ];
 
-		if (get_control_value(buf, "linked", linked, NULL, false) && linked[0])
+		if (!fgets(buf, lengthof(buf), reader->fp))
 		{
-			file->linked = pgut_strdup(linked);
-			canonicalize_path(file->linked);
+			reader->eof = true;
+			return NULL;
 		}
 
-		if (get_control_value(buf, "segno", NULL, &segno, false))
-			file->segno = (int) segno;
+		COMP_FILE_CRC32(true, reader->crc, buf, strlen(buf));
+		reader->n_read++;
 
-		if (get_control_value(buf, "n_blocks", NULL, &n_blocks, false))
-			file->n_blocks = (int) n_blocks;
+		return parse_filelist_line(buf);
+	}
 
-		if (get_control_value(buf, "n_headers", NULL, &n_headers, false))
-			file->n_headers = (int) n_headers;
+	if (reader->n_read >= reader->header.n_files)
+	{
+		uint64	   *index;
+		size_t		index_len = sizeof(uint64) * reader->header.n_files;
 
-		if (get_control_value(buf, "hdr_crc", NULL, &hdr_crc, false))
-			file->hdr_crc = (pg_crc32) hdr_crc;
+		/* the index is not needed here, but it is covered by CRC */
+		index = pgut_malloc(Max(index_len, 1));
+		if (fread(index, 1, index_len, reader->fp) != index_len)
+			elog(ERROR, "Cannot read index of file list \"%s\"", reader->path);
+		COMP_FILE_CRC32(true, reader->crc, index, index_len);
+		pg_free(index);
 
-		if (get_control_value(buf, "hdr_off", NULL, &hdr_off, false))
-			file->hdr_off = hdr_off;
+		reader->eof = true;
+		return NULL;
+	}
 
-		if (get_control_value(buf, "hdr_size", NULL, &hdr_size, false))
-			file->hdr_size = (int) hdr_size;
+	if (fread(&entry, 1, sizeof(entry), reader->fp) != sizeof(entry) ||
+		entry.path_len >= MAXPGPATH || entry.linked_len >= MAXPGPATH ||
+		fread(path, 1, entry.path_len, reader->fp) != entry.path_len ||
+		fread(linked, 1, entry.linked_len, reader->fp) != entry.linked_len)
+		elog(ERROR, "Cannot read entry %u of file list \"%s\"",
+			 reader->n_read, reader->path);
 
-		parray_append(files, file);
+	COMP_FILE_CRC32(true, reader->crc, &entry, sizeof(entry));
+	COMP_FILE_CRC32(true, reader->crc, path, entry.path_len);
+	COMP_FILE_CRC32(true, reader->crc, linked, entry.linked_len);
+	path[entry.path_len] = '\0';
+	linked[entry.linked_len] = '\0';
+
+	reader->n_read++;
+
+	return filelist_entry_to_file(&entry, path, linked);
+}
+
+/*
+ * Close the reader. If the whole list was read, check its CRC,
+ * in case of mismatch throw a WARNING and return false.
+ */
+bool
+filelist_close(FileListReader *reader, pg_crc32 expected_crc)
+{
+	bool		crc_ok = true;
+
+	if (ferror(reader->fp))
+		elog(ERROR, "Failed to read from file: \"%s\"", reader->path);
+
+	fio_close_stream(reader->fp);
+
+	if (reader->eof)
+	{
+		FIN_FILE_CRC32(true, reader->crc);
+
+		if (reader->binary && reader->crc != reader->header.crc)
+		{
+			elog(WARNING, "Invalid CRC of backup control file '%s': %u. Expected: %u",
+				 reader->path, reader->crc, reader->header.crc);
+			crc_ok = false;
+		}
+		else if (expected_crc != 0 && expected_crc != reader->crc)
+		{
+			elog(WARNING, "Invalid CRC of backup control file '%s': %u. Expected: %u",
+				 reader->path, reader->crc, expected_crc);
+			crc_ok = false;
+		}
 	}
 
-	FIN_FILE_CRC32(true, content_crc);
+	pfree(reader);
 
-	if (ferror(fp))
-		elog(ERROR, "Failed to read from file: \"%s\"", file_txt);
+	return crc_ok;
+}
 
-	fio_close_stream(fp);
+/*
+ * Construct parray of pgFile from the backup content list.
+ * If root is not NULL, path will be absolute path.
+ */
+parray *
+dir_read_file_list(const char *root, const char *external_prefix,
+				   const char *file_txt, fio_location location, pg_crc32 expected_crc)
+{
+	FileListReader *reader;
+	parray	   *files;
+	pgFile	   *file;
 
-	if (expected_crc != 0 &&
-		expected_crc != content_crc)
+	reader = filelist_open(file_txt, location);
+	files = parray_new();
+
+	while ((file = filelist_next(reader)) != NULL)
+		parray_append(files, file);
+
+	if (!filelist_close(reader, expected_crc))
 	{
-		elog(WARNING, "Invalid CRC of backup control file '%s': %u. Expected: %u",
-				file_txt, content_crc, expected_crc);
+		parray_walk(files, pgFileFree);
+		parray_free(files);
 		return NULL;
 	}
 
 	return files;
 }
 
+/*
+ * Find the file in the backup content list without reading the whole list.
+ * In binary format the index of the list is used for binary search,
+ * text format is scanned until the file is found.
+ * CRC of the list is not checked. Returns NULL if the file is not found.
+ */
+pgFile *
+filelist_lookup(const char *file_txt, const char *rel_path, int external_dir_num)
+{
+	FileListReader *reader;
+	FileListHeader header;
+	FILE	   *fp;
+	pgFile	   *file = NULL;
+	int64		low,
+				high;
+
+	reader = filelist_open(file_txt, FIO_BACKUP_HOST);
+
+	if (!filelist_is_binary(reader))
+	{
+		while ((file = filelist_next(reader)) != NULL)
+		{
+			if (file->external_dir_num == external_dir_num &&
+				strcmp(file->rel_path, rel_path) == 0)
+				break;
+			pgFileFree(file);
+		}
+
+		filelist_close(reader, 0);
+		return file;
+	}
+
+	header = reader->header;
+	filelist_close(reader, 0);
+
+	/* backup catalog is always local, so random access is cheap */
+	fp = fopen(file_txt, PG_BINARY_R);
+	if (fp == NULL)
+		elog(ERROR, "cannot open \"%s\": %s", file_txt, strerror(errno));
+
+	low = 0;
+	high = (int64) header.n_files - 1;
+
+	while (low <= high)
+	{
+		int64		mid = low + (high - low) / 2;
+		uint64		entry_off;
+		FileListEntry entry;
+		char		path[MAXPGPATH];
+		char		linked[MAXPGPATH];
+		int			res;
+
+		if (fseeko(fp, header.index_off + mid * sizeof(uint64), SEEK_SET) != 0 ||
+			fread(&entry_off, 1, sizeof(entry_off), fp) != sizeof(entry_off) ||
+			fseeko(fp, entry_off, SEEK_SET) != 0 ||
+			fread(&entry, 1, sizeof(entry), fp) != sizeof(entry) ||
+			entry.path_len >= MAXPGPATH || entry.linked_len >= MAXPGPATH ||
+			fread(path, 1, entry.path_len, fp) != entry.path_len ||
+			fread(linked, 1, entry.linked_len, fp) != entry.linked_len)
+			elog(ERROR, "Cannot read entry " INT64_FORMAT " of file list \"%s\"",
+				 mid, file_txt);
+
+		path[entry.path_len] = '\0';
+		linked[entry.linked_len] = '\0';
+
+		/* the same order as in pgFileCompareRelPathWithExternal */
+		res = strcmp(path, rel_path);
+		if (res == 0)
+			res = (entry.external_dir_num > external_dir_num) -
+				  (entry.external_dir_num < external_dir_num);
+
+		if (res == 0)
+		{
+			file = filelist_entry_to_file(&entry, path, linked);
+			break;
+		}
+		else if (res < 0)
+			low = mid + 1;
+		else
+			high = mid - 1;
+	}
+
+	if (fclose(fp) != 0)
+		elog(ERROR, "Cannot close file \"%s\": %s", file_txt, strerror(errno));
+
+	return file;
+}
+
 /*
  * Check if directory empty.
  */
@@ -1680,6 +2025,9 @@ dir_is_empty(const char *path, fio_location location)
 	DIR		   *dir;
 	struct dirent *dir_ent;
 
+	if (fio_is_remote(location))
+		return fio_dir_is_empty(path, location);
+
 	dir = fio_opendir(path, location);
 	if (dir == NULL)
 	{
@@ -1939,7 +2287,7 @@ cleanup_tablespace(const char *path)
 	char	fullpath[MAXPGPATH];
 	parray *files = parray_new();
 
-	fio_list_dir(files, path, false, false, false, false, false, 0);
+	fio_list_dir(files, path, false, false, false, false, false, 0, FIO_DB_HOST);
 
 	/* delete leaf node first */
 	parray_qsort(files, pgFileCompareRelPathWithExternalDesc);
@@ -1957,3 +2305,283 @@ cleanup_tablespace(const char *path)
 	parray_walk(files, pgFileFree);
 	parray_free(files);
 }
+
+/*
+ * Queue of files shared by worker threads.
+ *
+ * Files are handed out largest first, so that a big relation segment picked
+ * up at the very end of the run does not keep a single thread busy while all
+ * the others are already done.  A big data file may also be split into block
+ * ranges, which are handed out to different threads.  Every thread accounts
+ * the bytes and the time spent on the work it has done, the rest of the run
+ * is idle time.
+ */
+typedef struct FileQueueEntry
+{
+	pgFile	   *file;
+	BlockNumber	start_blk;	/* first block of the range */
+	BlockNumber	end_blk;	/* block next to the last one of the range,
+							 * InvalidBlockNumber if entry is a whole file */
+	int64		size;		/* size of the work to do */
+} FileQueueEntry;
+
+typedef struct FileQueueStat
+{
+	FileQueueEntry *entry;	/* entry being processed by the thread */
+	instr_time	start_time;	/* when processing of the entry was started */
+	int			n_files;	/* number of processed files */
+	int64		bytes;		/* size of processed files and ranges */
+	double		busy_time;	/* seconds spent processing files */
+} FileQueueStat;
+
+struct FileQueue
+{
+	FileQueueEntry *entries;
+	size_t		n_entries;
+	size_t		alloced;
+	bool		sorted;		/* are entries sorted by size, largest first? */
+	size_t		next;		/* position of the next entry to hand out */
+	pthread_mutex_t lock;
+	int			n_threads;
+	instr_time	start_time;
+	FileQueueStat *stats;	/* statistics of every thread */
+};
+
+static int
+FileQueueEntryCompareSizeDesc(const void *e1, const void *e2)
+{
+	const FileQueueEntry *e1p = (const FileQueueEntry *) e1;
+	const FileQueueEntry *e2p = (const FileQueueEntry *) e2;
+
+	if (e1p->size > e2p->size)
+		return -1;
+	else if (e1p->size < e2p->size)
+		return 1;
+	else
+		return 0;
+}
+
+static FileQueueEntry *
+file_queue_add(FileQueue *queue, pgFile *file,
+			   BlockNumber start_blk, BlockNumber end_blk)
+{
+	FileQueueEntry *entry;
+
+	if (queue->n_entries >= queue->alloced)
+	{
+		queue->alloced = Max(queue->alloced * 2, 64);
+		queue->entries = (FileQueueEntry *) pgut_realloc(queue->entries,
+									sizeof(FileQueueEntry) * queue->alloced);
+	}
+
+	entry = &queue->entries[queue->n_entries++];
+	entry->file = file;
+	entry->start_blk = start_blk;
+	entry->end_blk = end_blk;
+
+	if (end_blk == InvalidBlockNumber)
+		entry->size = file->size;
+	else
+		entry->size = (int64) (end_blk - start_blk) * BLCKSZ;
+
+	queue->sorted = false;
+
+	return entry;
+}
+
+/*
+ * Create queue of files for n_threads worker threads.
+ * The order of the 'files' list is not changed.
+ */
+FileQueue *
+file_queue_init(parray *files, int n_threads)
+{
+	FileQueue  *queue = pgut_new(FileQueue);
+	size_t		i;
+
+	queue->entries = NULL;
+	queue->n_entries = 0;
+	queue->alloced = 0;
+
+	for (i = 0; i < parray_num(files); i++)
+		file_queue_add(queue, (pgFile *) parray_get(files, i),
+					   0, InvalidBlockNumber);
+
+	queue->next = 0;
+	pthread_mutex_init(&queue->lock, NULL);
+	queue->n_threads = n_threads;
+	queue->stats = pgut_newarray(FileQueueStat, n_threads);
+	memset(queue->stats, 0, sizeof(FileQueueStat) * n_threads);
+	INSTR_TIME_SET_CURRENT(queue->start_time);
+
+	return queue;
+}
+
+/*
+ * Replace the file in the queue with ranges of 'range_blocks' blocks,
+ * covering first file->n_blocks blocks of the file.
+ * Must be called before worker threads are started.
+ */
+void
+file_queue_split(FileQueue *queue, pgFile *file, BlockNumber range_blocks)
+{
+	FileQueueEntry *entry = NULL;
+	BlockNumber	start_blk;
+	size_t		i;
+
+	Assert(range_blocks > 0 && file->n_blocks > 0);
+
+	for (i = 0; i < queue->n_entries; i++)
+	{
+		if (queue->entries[i].file == file &&
+			queue->entries[i].end_blk == InvalidBlockNumber)
+		{
+			entry = &queue->entries[i];
+			break;
+		}
+	}
+
+	if (!entry)
+		elog(ERROR, "File \"%s\" is not found in the queue", file->rel_path);
+
+	/* the first range takes place of the file itself */
+	entry->end_blk = Min(range_blocks, file->n_blocks);
+	entry->size = (int64) entry->end_blk * BLCKSZ;
+
+	for (start_blk = range_blocks; start_blk < file->n_blocks; start_blk += range_blocks)
+		file_queue_add(queue, file, start_blk,
+					   Min(start_blk + range_blocks, file->n_blocks));
+
+	queue->sorted = false;
+}
+
+/* Number of files and ranges in the queue */
+int
+file_queue_size(FileQueue *queue)
+{
+	return (int) queue->n_entries;
+}
+
+/*
+ * Get the next file to process by thread 'thread_num' (counting from 1).
+ * Returns NULL if there are no files left. If 'pos' is not NULL, it is set
+ * to the position of returned file in the queue (counting from 1), which is
+ * handy for progress reporting.
+ *
+ * If the file was split into ranges by file_queue_split(), then only
+ * blocks from *start_blk up to *end_blk (not inclusive) should be processed.
+ * For a whole file *start_blk is set to 0 and *end_blk to InvalidBlockNumber.
+ * Callers that never split files may pass NULL for both.
+ */
+pgFile *
+file_queue_next_range(FileQueue *queue, int thread_num, int *pos,
+					  BlockNumber *start_blk, BlockNumber *end_blk)
+{
+	FileQueueStat *stat;
+	FileQueueEntry *entry = NULL;
+	instr_time	now;
+
+	if (thread_num < 1 || thread_num > queue->n_threads)
+		elog(ERROR, "Invalid thread number %d", thread_num);
+
+	stat = &queue->stats[thread_num - 1];
+	INSTR_TIME_SET_CURRENT(now);
+
+	/* account the entry processed by this thread since the last call */
+	if (stat->entry)
+	{
+		instr_time	elapsed = now;
+
+		INSTR_TIME_SUBTRACT(elapsed, stat->start_time);
+		stat->busy_time += INSTR_TIME_GET_DOUBLE(elapsed);
+
+		if (S_ISREG(stat->entry->file->mode))
+		{
+			if (stat->entry->end_blk == InvalidBlockNumber)
+				stat->n_files++;
+			stat->bytes += stat->entry->size;
+		}
+		stat->entry = NULL;
+	}
+
+	pthread_lock(&queue->lock);
+
+	if (!queue->sorted)
+	{
+		qsort(queue->entries, queue->n_entries, sizeof(FileQueueEntry),
+			  FileQueueEntryCompareSizeDesc);
+		queue->sorted = true;
+	}
+
+	if (queue->next < queue->n_entries)
+	{
+		entry = &queue->entries[queue->next];
+		queue->next++;
+
+		if (pos)
+			*pos = (int) queue->next;
+	}
+	pthread_mutex_unlock(&queue->lock);
+
+	if (!entry)
+		return NULL;
+
+	if (start_blk && end_blk)
+	{
+		*start_blk = entry->start_blk;
+		*end_blk = entry->end_blk;
+	}
+	else if (entry->end_blk != InvalidBlockNumber)
+		elog(ERROR, "Unexpected block range of file \"%s\" in the queue",
+			 entry->file->rel_path);
+
+	stat->entry = entry;
+	stat->start_time = now;
+
+	return entry->file;
+}
+
+/* Same as file_queue_next_range() for the queue without ranges */
+pgFile *
+file_queue_next(FileQueue *queue, int thread_num, int *pos)
+{
+	return file_queue_next_range(queue, thread_num, pos, NULL, NULL);
+}
+
+/*
+ * Report how much work every thread has done and how long it was idle.
+ * Should be called after all threads are joined.
+ */
+void
+file_queue_report(FileQueue *queue, const char *action)
+{
+	instr_time	elapsed;
+	double		total_time;
+	int			i;
+
+	INSTR_TIME_SET_CURRENT(elapsed);
+	INSTR_TIME_SUBTRACT(elapsed, queue->start_time);
+	total_time = INSTR_TIME_GET_DOUBLE(elapsed);
+
+	for (i = 0; i < queue->n_threads; i++)
+	{
+		FileQueueStat *stat = &queue->stats[i];
+		char		pretty_bytes[20];
+		double		idle_time = total_time - stat->busy_time;
+
+		pretty_size(stat->bytes, pretty_bytes, lengthof(pretty_bytes));
+		elog(LOG, "Thread [%d]: %s %d files, %s, busy %.2f sec, idle %.2f sec",
+			 i + 1, action, stat->n_files, pretty_bytes,
+			 stat->busy_time, idle_time > 0 ? idle_time : 0);
+	}
+}
+
+/* Free the queue. Files themselves are owned by the caller's list */
+void
+file_queue_free(FileQueue *queue)
+{
+	pthread_mutex_destroy(&queue->lock);
+	pg_free(queue->entries);
+	pfree(queue->stats);
+	pfree(queue);
+}
@@ -24,6 +24,7 @@ static void help_del_instance(void);
 static void help_archive_push(void);
 static void help_archive_get(void);
 static void help_checkdb(void);
+static void help_index_wal(void);
 
 void
 help_command(char *command)
@@ -58,6 +59,8 @@ help_command(char *command)
 		help_archive_get();
 	else if (strcmp(command, "checkdb") == 0)
 		help_checkdb();
+	else if (strcmp(command, "index-wal") == 0)
+		help_index_wal();
 	else if (strcmp(command, "--help") == 0
 			 || strcmp(command, "help") == 0
 			 || strcmp(command, "-?") == 0
@@ -120,7 +123,7 @@ help_pg_probackup(void)
 	printf(_("                 [--backup-pg-log] [-j num-threads] [--progress]\n"));
 	printf(_("                 [--no-validate] [--skip-block-validation]\n"));
 	printf(_("                 [--external-dirs=external-directories-paths]\n"));
-	printf(_("                 [--no-sync]\n"));
+	printf(_("                 [--no-sync] [--io-mode=io-mode] [--io-depth=io-depth]\n"));
 	printf(_("                 [--log-level-console=log-level-console]\n"));
 	printf(_("                 [--log-level-file=log-level-file]\n"));
 	printf(_("                 [--log-filename=log-filename]\n"));
@@ -142,6 +145,8 @@ help_pg_probackup(void)
 	printf(_("                 [--remote-port] [--remote-path] [--remote-user]\n"));
 	printf(_("                 [--ssh-options]\n"));
 	printf(_("                 [--ttl=interval] [--expire-time=timestamp] [--note=text]\n"));
+	printf(_("                 [--binary-filelist] [--dedup=dedup-mode]\n"));
+	printf(_("                 [--resume -i backup-id]\n"));
 	printf(_("                 [--help]\n"));
 
 
@@ -158,9 +163,10 @@ help_pg_probackup(void)
 	printf(_("                 [--primary-conninfo=primary_conninfo]\n"));
 	printf(_("                 [-S | --primary-slot-name=slotname]\n"));
 	printf(_("                 [--no-validate] [--skip-block-validation]\n"));
+	printf(_("                 [--force-full-validate]\n"));
 	printf(_("                 [-T OLDDIR=NEWDIR] [--progress]\n"));
 	printf(_("                 [--external-mapping=OLDDIR=NEWDIR]\n"));
-	printf(_("                 [--skip-external-dirs] [--no-sync]\n"));
+	printf(_("                 [--skip-external-dirs] [--no-sync] [--io-mode=io-mode]\n"));
 	printf(_("                 [-I | --incremental-mode=none|checksum|lsn]\n"));
 	printf(_("                 [--db-include | --db-exclude]\n"));
 	printf(_("                 [--remote-proto] [--remote-host]\n"));
@@ -176,13 +182,15 @@ help_pg_probackup(void)
 	printf(_("                  |--recovery-target-lsn=lsn [--recovery-target-inclusive=boolean]]\n"));
 	printf(_("                 [--recovery-target-timeline=timeline]\n"));
 	printf(_("                 [--recovery-target-name=target-name]\n"));
-	printf(_("                 [--skip-block-validation]\n"));
+	printf(_("                 [--skip-block-validation] [--io-mode=io-mode]\n"));
+	printf(_("                 [--force-full-validate] [--validate-sample=percent]\n"));
+	printf(_("                 [--mode=validate-mode]\n"));
 	printf(_("                 [--help]\n"));
 
 	printf(_("\n  %s checkdb [-B backup-path] [--instance=instance_name]\n"), PROGRAM_NAME);
 	printf(_("                 [-D pgdata-path] [--progress] [-j num-threads]\n"));
 	printf(_("                 [--amcheck] [--skip-block-validation]\n"));
-	printf(_("                 [--heapallindexed]\n"));
+	printf(_("                 [--heapallindexed] [--io-mode=io-mode] [--io-depth=io-depth]\n"));
 	printf(_("                 [--help]\n"));
 
 	printf(_("\n  %s show -B backup-path\n"), PROGRAM_NAME);
@@ -213,7 +221,7 @@ help_pg_probackup(void)
 	printf(_("                 [--help]\n"));
 
 	printf(_("\n  %s del-instance -B backup-path\n"), PROGRAM_NAME);
-	printf(_("                 --instance=instance_name\n"));
+	printf(_("                 --instance=instance_name [-j num-threads]\n"));
 	printf(_("                 [--help]\n"));
 
 	printf(_("\n  %s archive-push -B backup-path --instance=instance_name\n"), PROGRAM_NAME);
@@ -239,6 +247,10 @@ help_pg_probackup(void)
 	printf(_("                 [--ssh-options]\n"));
 	printf(_("                 [--help]\n"));
 
+	printf(_("\n  %s index-wal -B backup-path --instance=instance_name\n"), PROGRAM_NAME);
+	printf(_("                 [-j num-threads]\n"));
+	printf(_("                 [--help]\n"));
+
 	if ((PROGRAM_URL || PROGRAM_EMAIL))
 	{
 		printf("\n");
@@ -266,7 +278,7 @@ help_backup(void)
 	printf(_("                 [--backup-pg-log] [-j num-threads] [--progress]\n"));
 	printf(_("                 [--no-validate] [--skip-block-validation]\n"));
 	printf(_("                 [-E external-directories-paths]\n"));
-	printf(_("                 [--no-sync]\n"));
+	printf(_("                 [--no-sync] [--io-mode=io-mode] [--io-depth=io-depth]\n"));
 	printf(_("                 [--log-level-console=log-level-console]\n"));
 	printf(_("                 [--log-level-file=log-level-file]\n"));
 	printf(_("                 [--log-filename=log-filename]\n"));
@@ -287,7 +299,9 @@ help_backup(void)
 	printf(_("                 [--remote-proto] [--remote-host]\n"));
 	printf(_("                 [--remote-port] [--remote-path] [--remote-user]\n"));
 	printf(_("                 [--ssh-options]\n"));
-	printf(_("                 [--ttl=interval] [--expire-time=timestamp] [--note=text]\n\n"));
+	printf(_("                 [--ttl=interval] [--expire-time=timestamp] [--note=text]\n"));
+	printf(_("                 [--binary-filelist] [--dedup=dedup-mode]\n"));
+	printf(_("                 [--resume -i backup-id]\n\n"));
 
 	printf(_("  -B, --backup-path=backup-path    location of the backup storage area\n"));
 	printf(_("  -b, --backup-mode=backup-mode    backup mode=FULL|PAGE|DELTA|PTRACK\n"));
@@ -306,8 +320,16 @@ help_backup(void)
 	printf(_("                                   backup some directories not from pgdata \n"));
 	printf(_("                                   (example: --external-dirs=/tmp/dir1:/tmp/dir2)\n"));
 	printf(_("      --no-sync                    do not sync backed up files to disk\n"));
+	printf(_("      --io-mode=io-mode            how to use OS page cache for data files (default: buffered)\n"));
+	printf(_("                                   available options: 'buffered', 'dontneed', 'direct'\n"));
+	printf(_("      --io-depth=io-depth          number of reads of data file to keep in flight\n"));
+	printf(_("                                   per thread (default: 1)\n"));
 	printf(_("      --note=text                  add note to backup\n"));
 	printf(_("                                   (example: --note='backup before app update to v13.1')\n"));
+	printf(_("      --binary-filelist            store list of backed up files in binary indexed format\n"));
+	printf(_("      --dedup=dedup-mode           share unchanged files with previous FULL backup\n"));
+	printf(_("                                   available options: 'none', 'reflink', 'hardlink'\n"));
+	printf(_("      --resume                     continue interrupted backup specified by -i\n"));
 
 	printf(_("\n  Logging options:\n"));
 	printf(_("      --log-level-console=log-level-console\n"));
@@ -354,9 +376,9 @@ help_backup(void)
 	printf(_("\n  Compression options:\n"));
 	printf(_("      --compress                   alias for --compress-algorithm='zlib' and --compress-level=1\n"));
 	printf(_("      --compress-algorithm=compress-algorithm\n"));
-	printf(_("                                   available options: 'zlib', 'pglz', 'none' (default: none)\n"));
+	printf(_("                                   available options: 'zlib', 'pglz', 'zstd', 'lz4', 'none' (default: none)\n"));
 	printf(_("      --compress-level=compress-level\n"));
-	printf(_("                                   level of compression [0-9] (default: 1)\n"));
+	printf(_("                                   level of compression [0-9], [0-22] for zstd (default: 1)\n"));
 
 	printf(_("\n  Archive options:\n"));
 	printf(_("      --archive-timeout=timeout    wait timeout for WAL segment archiving (default: 5min)\n"));
@@ -393,8 +415,9 @@ help_restore(void)
 {
 	printf(_("\n%s restore -B backup-path --instance=instance_name\n"), PROGRAM_NAME);
 	printf(_("                 [-D pgdata-path] [-i backup-id] [-j num-threads]\n"));
-	printf(_("                 [--progress] [--force] [--no-sync]\n"));
+	printf(_("                 [--progress] [--force] [--no-sync] [--io-mode=io-mode]\n"));
 	printf(_("                 [--no-validate] [--skip-block-validation]\n"));
+	printf(_("                 [--force-full-validate]\n"));
 	printf(_("                 [-T OLDDIR=NEWDIR]\n"));
 	printf(_("                 [--external-mapping=OLDDIR=NEWDIR]\n"));
 	printf(_("                 [--skip-external-dirs]\n"));
@@ -428,6 +451,10 @@ help_restore(void)
 	printf(_("      --no-sync                    do not sync restored files to disk\n"));
 	printf(_("      --no-validate                disable backup validation during restore\n"));
 	printf(_("      --skip-block-validation      set to validate only file-level checksum\n"));
+	printf(_("      --force-full-validate        validate files of backups, which are not changed\n"));
+	printf(_("                                   since the last successful validation\n"));
+	printf(_("      --io-mode=io-mode            how to use OS page cache for data files (default: buffered)\n"));
+	printf(_("                                   available options: 'buffered', 'dontneed', 'direct'\n"));
 
 	printf(_("  -T, --tablespace-mapping=OLDDIR=NEWDIR\n"));
 	printf(_("                                   relocate the tablespace from directory OLDDIR to NEWDIR\n"));
@@ -516,7 +543,9 @@ help_validate(void)
 	printf(_("                  |--recovery-target-lsn=lsn [--recovery-target-inclusive=boolean]]\n"));
 	printf(_("                 [--recovery-target-timeline=timeline]\n"));
 	printf(_("                 [--recovery-target-name=target-name]\n"));
-	printf(_("                 [--skip-block-validation]\n\n"));
+	printf(_("                 [--skip-block-validation] [--io-mode=io-mode]\n"));
+	printf(_("                 [--force-full-validate] [--validate-sample=percent]\n"));
+	printf(_("                 [--mode=validate-mode]\n\n"));
 
 	printf(_("  -B, --backup-path=backup-path    location of the backup storage area\n"));
 	printf(_("      --instance=instance_name     name of the instance\n"));
@@ -534,6 +563,15 @@ help_validate(void)
 	printf(_("      --recovery-target-name=target-name\n"));
 	printf(_("                                   the named restore point to which recovery will proceed\n"));
 	printf(_("      --skip-block-validation      set to validate only file-level checksum\n"));
+	printf(_("      --io-mode=io-mode            how to use OS page cache for data files (default: buffered)\n"));
+	printf(_("                                   available options: 'buffered', 'dontneed', 'direct'\n"));
+	printf(_("      --force-full-validate        validate files of backups, which are not changed\n"));
+	printf(_("                                   since the last successful validation\n"));
+	printf(_("      --validate-sample=percent    validate only this percent of files of backups,\n"));
+	printf(_("                                   which are not changed since the last successful\n"));
+	printf(_("                                   validation (default: 0)\n"));
+	printf(_("      --mode=validate-mode         how to check data files (default: deep)\n"));
+	printf(_("                                   available options: 'deep', 'quick'\n"));
 
 	printf(_("\n  Logging options:\n"));
 	printf(_("      --log-level-console=log-level-console\n"));
@@ -563,7 +601,7 @@ help_checkdb(void)
 	printf(_("\n%s checkdb [-B backup-path] [--instance=instance_name]\n"), PROGRAM_NAME);
 	printf(_("                 [-D pgdata-path] [-j num-threads] [--progress]\n"));
 	printf(_("                 [--amcheck] [--skip-block-validation]\n"));
-	printf(_("                 [--heapallindexed]\n\n"));
+	printf(_("                 [--heapallindexed] [--io-mode=io-mode] [--io-depth=io-depth]\n\n"));
 
 	printf(_("  -B, --backup-path=backup-path    location of the backup storage area\n"));
 	printf(_("      --instance=instance_name     name of the instance\n"));
@@ -578,6 +616,10 @@ help_checkdb(void)
 	printf(_("                                   using 'amcheck' or 'amcheck_next' extensions\n"));
 	printf(_("      --heapallindexed             also check that heap is indexed\n"));
 	printf(_("                                   can be used only with '--amcheck' option\n"));
+	printf(_("      --io-mode=io-mode            how to use OS page cache for data files (default: buffered)\n"));
+	printf(_("                                   available options: 'buffered', 'dontneed', 'direct'\n"));
+	printf(_("      --io-depth=io-depth          number of reads of data file to keep in flight\n"));
+	printf(_("                                   per thread (default: 1)\n"));
 
 	printf(_("\n  Logging options:\n"));
 	printf(_("      --log-level-console=log-level-console\n"));
@@ -799,9 +841,9 @@ help_set_config(void)
 	printf(_("\n  Compression options:\n"));
 	printf(_("      --compress                   alias for --compress-algorithm='zlib' and --compress-level=1\n"));
 	printf(_("      --compress-algorithm=compress-algorithm\n"));
-	printf(_("                                   available options: 'zlib','pglz','none' (default: 'none')\n"));
+	printf(_("                                   available options: 'zlib', 'pglz', 'zstd', 'lz4', 'none' (default: 'none')\n"));
 	printf(_("      --compress-level=compress-level\n"));
-	printf(_("                                   level of compression [0-9] (default: 1)\n"));
+	printf(_("                                   level of compression [0-9], [0-22] for zstd (default: 1)\n"));
 
 	printf(_("\n  Archive options:\n"));
 	printf(_("      --archive-timeout=timeout    wait timeout for WAL segment archiving (default: 5min)\n"));
@@ -880,9 +922,11 @@ static void
 help_del_instance(void)
 {
 	printf(_("\n%s del-instance -B backup-path --instance=instance_name\n"), PROGRAM_NAME);
+	printf(_("                 [-j num-threads]\n\n"));
 
 	printf(_("  -B, --backup-path=backup-path    location of the backup storage area\n"));
-	printf(_("      --instance=instance_name     name of the instance to delete\n\n"));
+	printf(_("      --instance=instance_name     name of the instance to delete\n"));
+	printf(_("  -j, --threads=NUM                number of parallel threads\n\n"));
 }
 
 static void
@@ -914,9 +958,9 @@ help_archive_push(void)
 	printf(_("\n  Compression options:\n"));
 	printf(_("      --compress                   alias for --compress-algorithm='zlib' and --compress-level=1\n"));
 	printf(_("      --compress-algorithm=compress-algorithm\n"));
-	printf(_("                                   available options: 'zlib','pglz','none' (default: 'none')\n"));
+	printf(_("                                   available options: 'zlib', 'pglz', 'zstd', 'lz4', 'none' (default: 'none')\n"));
 	printf(_("      --compress-level=compress-level\n"));
-	printf(_("                                   level of compression [0-9] (default: 1)\n"));
+	printf(_("                                   level of compression [0-9], [0-22] for zstd (default: 1)\n"));
 
 	printf(_("\n  Remote options:\n"));
 	printf(_("      --remote-proto=protocol      remote protocol to use\n"));
@@ -964,3 +1008,14 @@ help_archive_get(void)
 	printf(_("      --ssh-options=ssh_options    additional ssh options (default: none)\n"));
 	printf(_("                                   (example: --ssh-options='-c cipher_spec -F configfile')\n\n"));
 }
+
+static void
+help_index_wal(void)
+{
+	printf(_("\n%s index-wal -B backup-path --instance=instance_name\n"), PROGRAM_NAME);
+	printf(_("                 [-j num-threads]\n\n"));
+
+	printf(_("  -B, --backup-path=backup-path    location of the backup storage area\n"));
+	printf(_("      --instance=instance_name     name of the instance\n"));
+	printf(_("  -j, --threads=NUM                number of parallel threads\n\n"));
+}
@@ -14,10 +14,72 @@
 
 #include "utils/thread.h"
 
+/*
+ * Journal of merge, stored in FULL backup directory. Records of merged
+ * files are appended to it, so that retry of failed merge can skip
+ * files merged before the failure.
+ */
+#define MERGE_JOURNAL_MAGIC				0x4D524A4E	/* "MRJN" */
+/* how often to flush records of merged files to disk, in seconds */
+#define MERGE_JOURNAL_FLUSH_INTERVAL	10
+/* how often to report progress of merge, in seconds */
+#define MERGE_PROGRESS_INTERVAL			10
+
+typedef struct
+{
+	uint32		magic;
+	uint32		padding;
+	int64		dest_backup_id;	/* backup we are merging with */
+} MergeJournalHeader;
+
+typedef struct
+{
+	int64		write_size;
+	int64		uncompressed_size;
+	int64		hdr_off;
+	uint32		crc;
+	uint32		hdr_crc;
+	int32		n_blocks;
+	int32		n_headers;
+	int32		hdr_size;
+	int32		external_dir_num;
+	uint16		path_len;
+	uint8		compress_alg;
+	uint8		padding;
+	pg_crc32	entry_crc;		/* CRC of the record and path */
+} MergeJournalEntry;
+
+typedef struct
+{
+	FILE		*fp;
+	char		path[MAXPGPATH];
+	parray		*done_files;	/* files merged before the failure, sorted */
+	parray		*pending;		/* files merged since the last flush */
+	time_t		flush_time;
+
+	HeaderMap	*hdr_map;
+	const char	*full_database_dir;
+	const char	*full_external_prefix;
+
+	pthread_mutex_t mutex;
+} MergeJournal;
+
+typedef struct
+{
+	int64		total_bytes;
+	int64		done_bytes;
+	int64		skipped_bytes;	/* merged before the failure */
+	time_t		start_time;
+	time_t		report_time;
+
+	pthread_mutex_t mutex;
+} MergeProgress;
+
 typedef struct
 {
 	parray		*merge_filelist;
 	parray		*parent_chain;
+	FileQueue	*queue;
 
 	pgBackup	*dest_backup;
 	pgBackup	*full_backup;
@@ -30,6 +92,10 @@ typedef struct
 	bool		program_version_match;
 	bool        use_bitmap;
 	bool        is_retry;
+	int			thread_num;
+
+	MergeJournal *journal;
+	MergeProgress *progress;
 
 	/*
 	 * Return value from the thread.
@@ -60,6 +126,17 @@ merge_non_data_file(parray *parent_chain, pgBackup *full_backup,
 
 static bool is_forward_compatible(parray *parent_chain);
 
+static void merge_journal_open(MergeJournal *journal, pgBackup *full_backup,
+							   time_t dest_backup_id, bool is_retry);
+static bool merge_journal_lookup(MergeJournal *journal, pgFile *file);
+static void merge_journal_append(MergeJournal *journal, pgFile *file);
+static void merge_journal_flush(MergeJournal *journal);
+static void merge_journal_close(MergeJournal *journal);
+
+static int64 merge_file_size(pgFile *file);
+static void merge_progress_report(MergeProgress *state, int64 bytes,
+								  bool skipped);
+
 /*
  * Implementation of MERGE command.
  *
@@ -450,11 +527,16 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 
 	pthread_t	*threads = NULL;
 	merge_files_arg *threads_args = NULL;
+	FileQueue	*queue = NULL;
 	time_t		merge_time;
 	bool		merge_isok = true;
+	MergeJournal journal;
+	MergeProgress merge_progress;
 	/* for fancy reporting */
 	time_t		end_time;
 	char		pretty_time[20];
+	char		pretty_bytes[20];
+	double		elapsed_sec;
 	/* in-place merge flags */
 	bool		compression_match = false;
 	bool		program_version_match = false;
@@ -625,7 +707,7 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 	if (parse_program_version(dest_backup->program_version) < 20300)
 		use_bitmap = false;
 
-	/* Setup threads */
+	/* Create external directories */
 	for (i = 0; i < parray_num(dest_backup->files); i++)
 	{
 		pgFile	   *file = (pgFile *) parray_get(dest_backup->files, i);
@@ -641,21 +723,51 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 			join_path_components(dirpath, new_container, file->rel_path);
 			dir_create_dir(dirpath, DIR_PERMISSION, false);
 		}
-
-		pg_atomic_init_flag(&file->lock);
 	}
 
+	/*
+	 * Open merge journal. If this is a retry of failed merge, files
+	 * recorded in the journal are not merged again.
+	 */
+	journal.hdr_map = &(full_backup->hdr_map);
+	journal.full_database_dir = full_database_dir;
+	journal.full_external_prefix = full_external_prefix;
+	merge_journal_open(&journal, full_backup, dest_backup->start_time, is_retry);
+
+	/* headers of files from the journal must stay at their offsets */
+	if (parray_num(journal.done_files) > 0)
+		reopen_header_map(&(full_backup->hdr_map), true);
+
 	threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
 	threads_args = (merge_files_arg *) palloc(sizeof(merge_files_arg) * num_threads);
 
 	thread_interrupted = false;
 	merge_time = time(NULL);
-	elog(INFO, "Start merging backup files");
+
+	memset(&merge_progress, 0, sizeof(merge_progress));
+	for (i = 0; i < parray_num(dest_backup->files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(dest_backup->files, i);
+
+		if (S_ISREG(file->mode))
+			merge_progress.total_bytes += merge_file_size(file);
+	}
+	merge_progress.start_time = merge_time;
+	merge_progress.report_time = merge_time;
+	pthread_mutex_init(&merge_progress.mutex, NULL);
+
+	pretty_size(merge_progress.total_bytes, pretty_bytes, lengthof(pretty_bytes));
+	elog(INFO, "Start merging backup files, data size: %s", pretty_bytes);
+
+	/* largest files go first for load balancing */
+	queue = file_queue_init(dest_backup->files, num_threads);
+
 	for (i = 0; i < num_threads; i++)
 	{
 		merge_files_arg *arg = &(threads_args[i]);
 		arg->merge_filelist = parray_new();
 		arg->parent_chain = parent_chain;
+		arg->queue = queue;
 		arg->dest_backup = dest_backup;
 		arg->full_backup = full_backup;
 		arg->full_database_dir = full_database_dir;
@@ -665,6 +777,9 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 		arg->program_version_match = program_version_match;
 		arg->use_bitmap = use_bitmap;
 		arg->is_retry = is_retry;
+		arg->thread_num = i + 1;
+		arg->journal = &journal;
+		arg->progress = &merge_progress;
 		/* By default there are some error */
 		arg->ret = 1;
 
@@ -689,17 +804,40 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 		//total_in_place_merge_bytes += threads_args[i].in_place_merge_bytes;
 	}
 
+	file_queue_report(queue, "merged");
+	file_queue_free(queue);
+
 	time(&end_time);
-	pretty_time_interval(difftime(end_time, merge_time),
-						 pretty_time, lengthof(pretty_time));
+	elapsed_sec = difftime(end_time, merge_time);
+	pretty_time_interval(elapsed_sec, pretty_time, lengthof(pretty_time));
 
-	if (merge_isok)
-		elog(INFO, "Backup files are successfully merged, time elapsed: %s",
-				pretty_time);
-	else
+	if (!merge_isok)
 		elog(ERROR, "Backup files merging failed, time elapsed: %s",
 				pretty_time);
 
+	pretty_size(elapsed_sec > 0 ?
+				(int64) (merge_progress.done_bytes / elapsed_sec) :
+				merge_progress.done_bytes,
+				pretty_bytes, lengthof(pretty_bytes));
+	elog(INFO, "Backup files are successfully merged, time elapsed: %s, speed: %s/s",
+			pretty_time, pretty_bytes);
+
+	if (parray_num(journal.done_files) > 0)
+	{
+		pretty_size(merge_progress.skipped_bytes, pretty_bytes, lengthof(pretty_bytes));
+		elog(INFO, "%lu files (%s) merged before the failure were not merged again",
+			 parray_num(journal.done_files), pretty_bytes);
+	}
+
+	pthread_mutex_destroy(&merge_progress.mutex);
+
+	/*
+	 * All files are merged, the journal is not needed anymore. It must be
+	 * removed before the header map is replaced, because offsets of headers
+	 * in the journal are valid only for the temp header map.
+	 */
+	merge_journal_close(&journal);
+
 	/* If temp header map is open, then close it and make rename */
 	if (full_backup->hdr_map.fp)
 	{
@@ -765,6 +903,9 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 	/* FULL backup must inherit wal mode. */
 	full_backup->stream = dest_backup->stream;
 
+	/* and format of file list */
+	full_backup->binary_filelist = dest_backup->binary_filelist;
+
 	/* ARCHIVE backup must inherit wal_bytes too.
 	 * STREAM backup will have its wal_bytes calculated by
 	 * write_backup_filelist().
@@ -925,12 +1066,13 @@ static void *
 merge_files(void *arg)
 {
 	int		i;
+	int		pos;
 	merge_files_arg *arguments = (merge_files_arg *) arg;
 	size_t n_files = parray_num(arguments->dest_backup->files);
+	pgFile	   *dest_file;
 
-	for (i = 0; i < n_files; i++)
+	while ((dest_file = file_queue_next(arguments->queue, arguments->thread_num, &pos)) != NULL)
 	{
-		pgFile	   *dest_file = (pgFile *) parray_get(arguments->dest_backup->files, i);
 		pgFile	   *tmp_file;
 		bool		in_place = false; /* keep file as it is */
 
@@ -938,9 +1080,6 @@ merge_files(void *arg)
 		if (interrupted || thread_interrupted)
 			elog(ERROR, "Interrupted during merge");
 
-		if (!pg_atomic_test_set_flag(&dest_file->lock))
-			continue;
-
 		tmp_file = pgFileInit(dest_file->rel_path);
 		tmp_file->mode = dest_file->mode;
 		tmp_file->is_datafile = dest_file->is_datafile;
@@ -954,11 +1093,21 @@ merge_files(void *arg)
 
 		if (progress)
 			elog(INFO, "Progress: (%d/%lu). Merging file \"%s\"",
-				i + 1, n_files, dest_file->rel_path);
+				pos, n_files, dest_file->rel_path);
 
 		if (dest_file->is_datafile && !dest_file->is_cfs)
 			tmp_file->segno = dest_file->segno;
 
+		/* The file was merged before the failure of previous merge */
+		if (merge_journal_lookup(arguments->journal, tmp_file))
+		{
+			elog(VERBOSE, "The file was merged before the failure, skip merge: \"%s\"",
+				 dest_file->rel_path);
+			merge_progress_report(arguments->progress,
+								  merge_file_size(dest_file), true);
+			goto done;
+		}
+
 		// If destination file is 0 sized, then go for the next
 		if (dest_file->write_size == 0)
 		{
@@ -966,7 +1115,7 @@ merge_files(void *arg)
 				tmp_file->crc = dest_file->crc;
 
 			tmp_file->write_size = 0;
-			goto done;
+			goto merged;
 		}
 
 		/*
@@ -1091,7 +1240,7 @@ merge_files(void *arg)
 				pg_free(headers);
 
 				//TODO: report in_place merge bytes.
-				goto done;
+				goto merged;
 			}
 		}
 
@@ -1111,6 +1260,10 @@ merge_files(void *arg)
 								arguments->full_database_dir,
 								arguments->full_external_prefix);
 
+merged:
+		merge_journal_append(arguments->journal, tmp_file);
+		merge_progress_report(arguments->progress,
+							  merge_file_size(dest_file), false);
 done:
 		parray_append(arguments->merge_filelist, tmp_file);
 	}
@@ -1229,7 +1382,7 @@ merge_data_file(parray *parent_chain, pgBackup *full_backup,
 
 	/* restore file into temp file */
 	tmp_file->size = restore_data_file(parent_chain, dest_file, out, to_fullpath_tmp1,
-									   use_bitmap, NULL, InvalidXLogRecPtr, NULL,
+									   use_bitmap, InvalidXLogRecPtr, NULL,
 									   /* when retrying merge header map cannot be trusted */
 									   is_retry ? false : true);
 	if (fclose(out) != 0)
@@ -1250,7 +1403,7 @@ merge_data_file(parray *parent_chain, pgBackup *full_backup,
 				 InvalidXLogRecPtr, BACKUP_MODE_FULL,
 				 dest_backup->compress_alg, dest_backup->compress_level,
 				 dest_backup->checksum_version, 0, NULL,
-				 &(full_backup->hdr_map), true);
+				 &(full_backup->hdr_map), true, NULL);
 
 	/* drop restored temp file */
 	if (unlink(to_fullpath_tmp1) == -1)
@@ -1373,9 +1526,23 @@ merge_non_data_file(parray *parent_chain, pgBackup *full_backup,
 		join_path_components(from_fullpath, backup_database_dir, from_file->rel_path);
 	}
 
-	/* Copy file to FULL backup directory into temp file */
-	backup_non_data_file(tmp_file, NULL, from_fullpath,
-						 to_fullpath_tmp, BACKUP_MODE_FULL, 0, false);
+	/*
+	 * Backup files are never modified in place, so instead of copying the
+	 * file from incremental backup into FULL backup directory, it can be
+	 * shared by both of them via hard link. Otherwise copy file to
+	 * FULL backup directory into temp file.
+	 */
+	if (from_backup != full_backup &&
+		link_backup_file(from_fullpath, to_fullpath_tmp, DEDUP_HARDLINK))
+	{
+		tmp_file->crc = from_file->crc;
+		tmp_file->read_size = from_file->write_size;
+		tmp_file->write_size = from_file->write_size;
+		tmp_file->uncompressed_size = from_file->write_size;
+	}
+	else
+		backup_non_data_file(tmp_file, NULL, from_fullpath,
+							 to_fullpath_tmp, BACKUP_MODE_FULL, 0, false);
 
 	/* sync temp file to disk */
 	if (fio_sync(to_fullpath_tmp, FIO_BACKUP_HOST) != 0)
@@ -1389,6 +1556,423 @@ merge_non_data_file(parray *parent_chain, pgBackup *full_backup,
 
 }
 
+/*
+ * Open journal of merge with dest_backup_id in FULL backup directory.
+ * When retrying failed merge, read records of files merged before
+ * the failure into journal->done_files. Incomplete or corrupted records
+ * at the end of the journal are thrown away.
+ */
+static void
+merge_journal_open(MergeJournal *journal, pgBackup *full_backup,
+				   time_t dest_backup_id, bool is_retry)
+{
+	FILE	   *fp;
+	MergeJournalHeader header;
+	off_t		valid_len = 0;
+	struct stat st;
+	off_t		map_size = 0;
+	int			i;
+
+	join_path_components(journal->path, full_backup->root_dir, MERGE_JOURNAL);
+	journal->done_files = parray_new();
+	journal->pending = parray_new();
+	pthread_mutex_init(&journal->mutex, NULL);
+
+	if (!is_retry)
+		goto create;
+
+	fp = fopen(journal->path, PG_BINARY_R);
+	if (fp == NULL)
+	{
+		if (errno == ENOENT)
+			goto create;
+		elog(ERROR, "Cannot open merge journal \"%s\": %s",
+			 journal->path, strerror(errno));
+	}
+
+	if (fread(&header, 1, sizeof(header), fp) != sizeof(header) ||
+		header.magic != MERGE_JOURNAL_MAGIC)
+	{
+		elog(WARNING, "Merge journal \"%s\" is corrupted, ignore it", journal->path);
+		fclose(fp);
+		goto create;
+	}
+
+	if (header.dest_backup_id != (int64) dest_backup_id)
+	{
+		elog(WARNING, "Merge journal \"%s\" belongs to merge with backup %s, ignore it",
+			 journal->path, base36enc((time_t) header.dest_backup_id));
+		fclose(fp);
+		goto create;
+	}
+
+	valid_len = sizeof(header);
+
+	for (;;)
+	{
+		MergeJournalEntry entry;
+		char		path[MAXPGPATH];
+		pg_crc32	crc;
+		pgFile	   *file;
+
+		if (fread(&entry, 1, sizeof(entry), fp) != sizeof(entry) ||
+			entry.path_len >= MAXPGPATH ||
+			fread(path, 1, entry.path_len, fp) != entry.path_len)
+			break;
+
+		crc = entry.entry_crc;
+		entry.entry_crc = 0;
+		INIT_FILE_CRC32(true, entry.entry_crc);
+		COMP_FILE_CRC32(true, entry.entry_crc, &entry, sizeof(entry));
+		COMP_FILE_CRC32(true, entry.entry_crc, path, entry.path_len);
+		FIN_FILE_CRC32(true, entry.entry_crc);
+
+		if (entry.entry_crc != crc)
+			break;
+
+		path[entry.path_len] = '\0';
+
+		file = pgFileInit(path);
+		file->write_size = entry.write_size;
+		file->uncompressed_size = entry.uncompressed_size;
+		file->crc = entry.crc;
+		file->compress_alg = (CompressAlg) entry.compress_alg;
+		file->external_dir_num = entry.external_dir_num;
+		file->n_blocks = entry.n_blocks;
+		file->n_headers = entry.n_headers;
+		file->hdr_off = entry.hdr_off;
+		file->hdr_size = entry.hdr_size;
+		file->hdr_crc = entry.hdr_crc;
+		parray_append(journal->done_files, file);
+
+		valid_len += sizeof(entry) + entry.path_len;
+	}
+
+	if (ferror(fp))
+		elog(ERROR, "Cannot read merge journal \"%s\": %s",
+			 journal->path, strerror(errno));
+	fclose(fp);
+
+	/*
+	 * Headers of the merged files are stored in the temp header map,
+	 * which is always synced before the journal. If it is lost, all
+	 * files must be merged again.
+	 */
+	if (stat(journal->hdr_map->path_tmp, &st) == 0)
+		map_size = st.st_size;
+	else if (errno != ENOENT)
+		elog(ERROR, "Cannot stat header file \"%s\": %s",
+			 journal->hdr_map->path_tmp, strerror(errno));
+
+	for (i = 0; i < parray_num(journal->done_files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(journal->done_files, i);
+
+		if (file->n_headers > 0 && file->hdr_off + file->hdr_size > map_size)
+		{
+			elog(WARNING, "Header map \"%s\" does not contain headers of file \"%s\" "
+				 "from merge journal, ignore the journal",
+				 journal->hdr_map->path_tmp, file->rel_path);
+
+			parray_walk(journal->done_files, pgFileFree);
+			parray_free(journal->done_files);
+			journal->done_files = parray_new();
+			goto create;
+		}
+	}
+
+	/* throw away incomplete record, if any */
+	if (truncate(journal->path, valid_len) == -1)
+		elog(ERROR, "Cannot truncate merge journal \"%s\": %s",
+			 journal->path, strerror(errno));
+
+	journal->fp = fopen(journal->path, PG_BINARY_A);
+	if (journal->fp == NULL)
+		elog(ERROR, "Cannot open merge journal \"%s\": %s",
+			 journal->path, strerror(errno));
+
+	parray_qsort(journal->done_files, pgFileCompareRelPathWithExternal);
+
+	elog(INFO, "Merge journal contains %lu files merged before the failure",
+		 parray_num(journal->done_files));
+
+	journal->flush_time = time(NULL);
+	return;
+
+create:
+	journal->fp = fopen(journal->path, PG_BINARY_W);
+	if (journal->fp == NULL)
+		elog(ERROR, "Cannot open merge journal \"%s\": %s",
+			 journal->path, strerror(errno));
+
+	if (chmod(journal->path, FILE_PERMISSION) == -1)
+		elog(ERROR, "Cannot change mode of \"%s\": %s", journal->path,
+			 strerror(errno));
+
+	header.magic = MERGE_JOURNAL_MAGIC;
+	header.padding = 0;
+	header.dest_backup_id = (int64) dest_backup_id;
+
+	if (fwrite(&header, 1, sizeof(header), journal->fp) != sizeof(header) ||
+		fflush(journal->fp) != 0 ||
+		fsync(fileno(journal->fp)) < 0)
+		elog(ERROR, "Cannot write merge journal \"%s\": %s",
+			 journal->path, strerror(errno));
+
+	journal->flush_time = time(NULL);
+}
+
+/*
+ * If the file was merged before the failure, fill its metadata
+ * from the journal and return true.
+ */
+static bool
+merge_journal_lookup(MergeJournal *journal, pgFile *file)
+{
+	pgFile	  **res_file;
+	pgFile	   *done_file;
+
+	if (parray_num(journal->done_files) == 0)
+		return false;
+
+	res_file = parray_bsearch(journal->done_files, file,
+							  pgFileCompareRelPathWithExternal);
+	if (res_file == NULL)
+		return false;
+
+	done_file = *res_file;
+
+	file->write_size = done_file->write_size;
+	file->uncompressed_size = done_file->uncompressed_size;
+	file->crc = done_file->crc;
+	file->compress_alg = done_file->compress_alg;
+	file->n_blocks = done_file->n_blocks;
+	file->n_headers = done_file->n_headers;
+	file->hdr_off = done_file->hdr_off;
+	file->hdr_size = done_file->hdr_size;
+	file->hdr_crc = done_file->hdr_crc;
+
+	return true;
+}
+
+/*
+ * Remember the merged file. Records are written to the journal
+ * in batches, once in MERGE_JOURNAL_FLUSH_INTERVAL seconds.
+ */
+static void
+merge_journal_append(MergeJournal *journal, pgFile *file)
+{
+	pthread_lock(&journal->mutex);
+
+	parray_append(journal->pending, file);
+
+	if (difftime(time(NULL), journal->flush_time) >= MERGE_JOURNAL_FLUSH_INTERVAL)
+		merge_journal_flush(journal);
+
+	pthread_mutex_unlock(&journal->mutex);
+}
+
+/*
+ * Write records of pending files to the journal.
+ * Record of the file may reach the disk only after its content,
+ * headers and new directory entry, otherwise retry would trust
+ * the file which is not there. So sync the header map and
+ * directories of pending files first.
+ * Caller must hold journal->mutex.
+ */
+static void
+merge_journal_flush(MergeJournal *journal)
+{
+	parray	   *synced_dirs;
+	int			i;
+
+	if (parray_num(journal->pending) == 0)
+		return;
+
+	pthread_lock(&journal->hdr_map->mutex);
+	if (journal->hdr_map->fp &&
+		(fflush(journal->hdr_map->fp) != 0 ||
+		 fsync(fileno(journal->hdr_map->fp)) < 0))
+		elog(ERROR, "Cannot sync header file \"%s\": %s",
+			 journal->hdr_map->path_tmp, strerror(errno));
+	pthread_mutex_unlock(&journal->hdr_map->mutex);
+
+	synced_dirs = parray_new();
+	for (i = 0; i < parray_num(journal->pending); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(journal->pending, i);
+		char		dirpath[MAXPGPATH];
+		bool		synced = false;
+		int			j;
+		int			fd;
+
+		if (file->external_dir_num)
+		{
+			char		temp[MAXPGPATH];
+
+			makeExternalDirPathByNum(temp, journal->full_external_prefix,
+									 file->external_dir_num);
+			join_path_components(dirpath, temp, file->rel_path);
+		}
+		else
+			join_path_components(dirpath, journal->full_database_dir, file->rel_path);
+		get_parent_directory(dirpath);
+
+		for (j = 0; j < parray_num(synced_dirs); j++)
+		{
+			if (strcmp((char *) parray_get(synced_dirs, j), dirpath) == 0)
+			{
+				synced = true;
+				break;
+			}
+		}
+
+		if (synced)
+			continue;
+
+		fd = open(dirpath, O_RDONLY | PG_BINARY, 0);
+		if (fd < 0)
+			elog(ERROR, "Cannot open directory \"%s\": %s",
+				 dirpath, strerror(errno));
+
+		/* some platforms do not allow to fsync directories */
+		if (fsync(fd) < 0 && errno != EBADF && errno != EINVAL)
+			elog(ERROR, "Cannot sync directory \"%s\": %s",
+				 dirpath, strerror(errno));
+		close(fd);
+
+		parray_append(synced_dirs, pgut_strdup(dirpath));
+	}
+	parray_walk(synced_dirs, pfree);
+	parray_free(synced_dirs);
+
+	for (i = 0; i < parray_num(journal->pending); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(journal->pending, i);
+		MergeJournalEntry entry;
+
+		MemSet(&entry, 0, sizeof(entry));
+		entry.write_size = file->write_size;
+		entry.uncompressed_size = file->uncompressed_size;
+		entry.hdr_off = file->hdr_off;
+		entry.crc = file->crc;
+		entry.hdr_crc = file->hdr_crc;
+		entry.n_blocks = file->n_blocks;
+		entry.n_headers = file->n_headers;
+		entry.hdr_size = file->hdr_size;
+		entry.external_dir_num = file->external_dir_num;
+		entry.path_len = strlen(file->rel_path);
+		entry.compress_alg = (uint8) file->compress_alg;
+
+		INIT_FILE_CRC32(true, entry.entry_crc);
+		COMP_FILE_CRC32(true, entry.entry_crc, &entry, sizeof(entry));
+		COMP_FILE_CRC32(true, entry.entry_crc, file->rel_path, entry.path_len);
+		FIN_FILE_CRC32(true, entry.entry_crc);
+
+		if (fwrite(&entry, 1, sizeof(entry), journal->fp) != sizeof(entry) ||
+			fwrite(file->rel_path, 1, entry.path_len, journal->fp) != entry.path_len)
+			elog(ERROR, "Cannot write merge journal \"%s\": %s",
+				 journal->path, strerror(errno));
+	}
+
+	if (fflush(journal->fp) != 0 || fsync(fileno(journal->fp)) < 0)
+		elog(ERROR, "Cannot sync merge journal \"%s\": %s",
+			 journal->path, strerror(errno));
+
+	parray_free(journal->pending);
+	journal->pending = parray_new();
+	journal->flush_time = time(NULL);
+}
+
+/* Merge is finished, remove the journal */
+static void
+merge_journal_close(MergeJournal *journal)
+{
+	if (fclose(journal->fp) != 0)
+		elog(ERROR, "Cannot close merge journal \"%s\": %s",
+			 journal->path, strerror(errno));
+	journal->fp = NULL;
+
+	if (unlink(journal->path) == -1)
+		elog(ERROR, "Cannot remove merge journal \"%s\": %s",
+			 journal->path, strerror(errno));
+
+	parray_walk(journal->done_files, pgFileFree);
+	parray_free(journal->done_files);
+	/* pending files are owned by the result file list */
+	parray_free(journal->pending);
+	pthread_mutex_destroy(&journal->mutex);
+}
+
+/*
+ * Estimate the amount of data to be merged for the file:
+ * size of the data file in the destination backup, or size
+ * of the non-data file if it is copied.
+ */
+static int64
+merge_file_size(pgFile *file)
+{
+	if (file->is_datafile && !file->is_cfs && file->n_blocks > 0)
+		return (int64) file->n_blocks * BLCKSZ;
+
+	return file->write_size > 0 ? file->write_size : 0;
+}
+
+/*
+ * Account the merged file and report throughput and estimated time
+ * of merge once in MERGE_PROGRESS_INTERVAL seconds.
+ * Files merged before the failure are not taken into account
+ * in the throughput.
+ */
+static void
+merge_progress_report(MergeProgress *state, int64 bytes, bool skipped)
+{
+	time_t		now = time(NULL);
+	double		elapsed;
+	double		speed;
+	int64		merged;
+	int64		remaining;
+	char		pretty_done[20];
+	char		pretty_total[20];
+	char		pretty_speed[20];
+	char		pretty_eta[20];
+
+	pthread_lock(&state->mutex);
+
+	if (skipped)
+		state->skipped_bytes += bytes;
+	else
+		state->done_bytes += bytes;
+
+	if (difftime(now, state->report_time) < MERGE_PROGRESS_INTERVAL)
+	{
+		pthread_mutex_unlock(&state->mutex);
+		return;
+	}
+
+	state->report_time = now;
+	elapsed = difftime(now, state->start_time);
+	merged = state->done_bytes + state->skipped_bytes;
+	remaining = Max(state->total_bytes - merged, 0);
+	speed = elapsed > 0 ? state->done_bytes / elapsed : 0;
+
+	pretty_size(merged, pretty_done, lengthof(pretty_done));
+	pretty_size(state->total_bytes, pretty_total, lengthof(pretty_total));
+	pretty_size((int64) speed, pretty_speed, lengthof(pretty_speed));
+
+	if (speed > 0)
+		pretty_time_interval(remaining / speed, pretty_eta, lengthof(pretty_eta));
+	else
+		snprintf(pretty_eta, lengthof(pretty_eta), "unknown");
+
+	elog(progress ? INFO : LOG, "Merged %s of %s (%.0f%%), speed: %s/s, ETA: %s",
+		 pretty_done, pretty_total,
+		 state->total_bytes > 0 ? 100.0 * merged / state->total_bytes : 100.0,
+		 pretty_speed, pretty_eta);
+
+	pthread_mutex_unlock(&state->mutex);
+}
+
 /*
  * If file format in incremental chain is compatible
  * with current storage format.
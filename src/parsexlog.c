@@ -94,6 +94,46 @@ typedef struct XLogRecTarget
 	XLogRecPtr	rec_lsn;
 } XLogRecTarget;
 
+/*
+ * Summary of WAL segment from the archive, which was read up to its end.
+ *
+ * Archived segments are not changed after they are pushed, so a segment,
+ * which was read without errors, need not be read again to validate WAL
+ * or to look for a recovery target in it. Summaries are cached in
+ * WAL_SUMMARY_FILE in backup instance directory, near WAL_INDEX_FILE, so
+ * writing them does not modify the archive. Summary is used only if
+ * inode, size, mtime and ctime of the segment file were not changed: all
+ * uncompressed segments have the same size, inodes are reused after WAL
+ * purge, so a segment archived again is told apart by times. Summary is
+ * only a cache: failure to write it is not an error.
+ *
+ * Each summary is written as a line of text ended by CRC of the line, and
+ * the file is ended by a line with CRC of all the preceding lines. Summary
+ * with wrong CRC is not used, the whole file is ignored if its CRC is wrong.
+ */
+typedef struct WalSegmentSummary
+{
+	TimeLineID	tli;
+	XLogSegNo	segno;
+	uint64		ino;		/* identity of the segment file */
+	int64		size;
+	int64		mtime;
+	int64		mtime_nsec;
+	int64		ctime;
+	XLogRecPtr	from_lsn;	/* position reading was started from */
+	XLogRecPtr	first_lsn;	/* first and last records read */
+	XLogRecPtr	last_lsn;
+	TimestampTz	min_time;	/* timestamps of commit, abort and restore */
+	TimestampTz	max_time;	/* point records, zero if there are none */
+	TimestampTz	last_time;
+	TransactionId min_xid;	/* xids of the records */
+	TransactionId max_xid;
+	TransactionId last_xid;
+} WalSegmentSummary;
+
+#define WAL_SUMMARY_MAGIC		"PBKWSUM 3"
+#define WAL_SUMMARY_CRC			"crc"
+
 typedef struct XLogReaderData
 {
 	int			thread_num;
@@ -108,6 +148,10 @@ typedef struct XLogReaderData
 
 	bool		need_switch;
 
+	/* summary of the segment being read */
+	WalSegmentSummary summary;
+	bool		summary_valid;
+
 	int			xlogfile;
 	char		xlogpath[MAXPGPATH];
 
@@ -115,6 +159,11 @@ typedef struct XLogReaderData
 	gzFile		 gz_xlogfile;
 	char		 gz_xlogpath[MAXPGPATH];
 #endif
+
+	/* content of the segment compressed with zstd or lz4 */
+	char		*cmp_xlogbuf;
+	size_t		 cmp_xlogbuf_len;
+	char		 cmp_xlogpath[MAXPGPATH];
 } XLogReaderData;
 
 /* Function to process a WAL record */
@@ -187,6 +236,22 @@ static void validateXLogRecord(XLogReaderState *record,
 							   XLogReaderData *reader_data, bool *stop_reading);
 static bool getRecordTimestamp(XLogReaderState *record, TimestampTz *recordXtime);
 
+static bool load_wal_summaries(const char *archivedir);
+static void save_wal_summaries(void);
+static WalSegmentSummary *find_wal_summary(const char *archivedir,
+										   TimeLineID tli, XLogSegNo segno,
+										   uint32 segment_size);
+static XLogRecPtr skip_summarized_wal(const char *archivedir, TimeLineID tli,
+									  uint32 segment_size, XLogRecPtr startpoint,
+									  XLogRecPtr endpoint, time_t target_time,
+									  TransactionId target_xid,
+									  XLogRecPtr target_lsn,
+									  XLogRecTarget *last_rec);
+static void wal_summary_start(XLogReaderData *reader_data, XLogRecPtr startpoint);
+static void wal_summary_add_record(XLogReaderState *xlogreader,
+								   XLogReaderData *reader_data);
+static void wal_summary_finish(XLogReaderData *reader_data);
+
 static XLogSegNo segno_start = 0;
 /* Segment number where target record is located */
 static XLogSegNo segno_target = 0;
@@ -198,6 +263,13 @@ static uint32 segnum_read = 0;
 static uint32 segnum_corrupted = 0;
 static pthread_mutex_t wal_segment_mutex = PTHREAD_MUTEX_INITIALIZER;
 
+/* Summaries of the segments from the archive, loaded from WAL_SUMMARY_FILE */
+static char		wal_summary_archivedir[MAXPGPATH] = "";
+static parray  *wal_summaries = NULL;		/* sorted by tli and segno */
+/* New summaries, collected by reader threads under wal_segment_mutex */
+static parray  *wal_summaries_new = NULL;
+static bool		wal_summary_collect = false;
+
 /* copied from timestamp.c */
 static pg_time_t
 timestamptz_to_time_t(TimestampTz t)
@@ -372,12 +444,20 @@ validate_backup_wal_from_start_to_stop(pgBackup *backup,
 									   const char *archivedir, TimeLineID tli,
 									   uint32 xlog_seg_size)
 {
-	bool		got_endpoint;
+	bool		got_endpoint = true;
+	XLogRecPtr	startpoint;
+
+	/* Do not read again segments, which were read up to their end before */
+	startpoint = skip_summarized_wal(archivedir, tli, xlog_seg_size,
+									 backup->start_lsn, backup->stop_lsn,
+									 0, InvalidTransactionId,
+									 InvalidXLogRecPtr, NULL);
 
-	got_endpoint = RunXLogThreads(archivedir, 0, InvalidTransactionId,
-								  InvalidXLogRecPtr, tli, xlog_seg_size,
-								  backup->start_lsn, backup->stop_lsn,
-								  false, NULL, NULL, true);
+	if (!XLogRecPtrIsInvalid(startpoint))
+		got_endpoint = RunXLogThreads(archivedir, 0, InvalidTransactionId,
+									  InvalidXLogRecPtr, tli, xlog_seg_size,
+									  startpoint, backup->stop_lsn,
+									  false, NULL, NULL, true);
 
 	if (!got_endpoint)
 	{
@@ -487,10 +567,21 @@ validate_wal(pgBackup *backup, const char *archivedir,
 		|| (XRecOffIsValid(target_lsn) && last_rec.rec_lsn >= target_lsn))
 		all_wal = true;
 
-	all_wal = all_wal ||
-		RunXLogThreads(archivedir, target_time, target_xid, target_lsn,
-					   tli, wal_seg_size, backup->stop_lsn,
-					   InvalidXLogRecPtr, true, validateXLogRecord, &last_rec, true);
+	if (!all_wal)
+	{
+		XLogRecPtr	startpoint;
+
+		/* Do not read again segments, which cannot contain the target */
+		startpoint = skip_summarized_wal(archivedir, tli, wal_seg_size,
+										 backup->stop_lsn, InvalidXLogRecPtr,
+										 target_time, target_xid, target_lsn,
+										 &last_rec);
+
+		all_wal = RunXLogThreads(archivedir, target_time, target_xid,
+								 target_lsn, tli, wal_seg_size, startpoint,
+								 InvalidXLogRecPtr, true, validateXLogRecord,
+								 &last_rec, true);
+	}
 	if (last_rec.rec_time > 0)
 		time2iso(last_timestamp, lengthof(last_timestamp),
 				 timestamptz_to_time_t(last_rec.rec_time), false);
@@ -537,6 +628,7 @@ read_recovery_info(const char *archivedir, TimeLineID tli, uint32 wal_seg_size,
 	XLogRecPtr	startpoint = stop_lsn;
 	XLogReaderState *xlogreader;
 	XLogReaderData reader_data;
+	bool		use_summaries;
 	bool		res;
 
 	if (!XRecOffIsValid(start_lsn))
@@ -547,6 +639,8 @@ read_recovery_info(const char *archivedir, TimeLineID tli, uint32 wal_seg_size,
 		elog(ERROR, "Invalid stop_lsn value %X/%X",
 			 (uint32) (stop_lsn >> 32), (uint32) (stop_lsn));
 
+	use_summaries = load_wal_summaries(archivedir);
+
 	xlogreader = InitXLogPageRead(&reader_data, archivedir, tli, wal_seg_size,
 								  false, true, true);
 
@@ -556,6 +650,8 @@ read_recovery_info(const char *archivedir, TimeLineID tli, uint32 wal_seg_size,
 		XLogRecord *record;
 		TimestampTz last_time = 0;
 		char	   *errormsg;
+		XLogSegNo	segno;
+		XLogSegNo	prev_segno;
 
 #if PG_VERSION_NUM >= 130000
 		if (XLogRecPtrIsInvalid(startpoint))
@@ -590,6 +686,48 @@ read_recovery_info(const char *archivedir, TimeLineID tli, uint32 wal_seg_size,
 			res = true;
 			goto cleanup;
 		}
+
+		/*
+		 * Do not read previous segments backward, if they were read before
+		 * and their latest timestamp is known.
+		 */
+		GetXLogSegNo(xlogreader->ReadRecPtr, segno, wal_seg_size);
+		while (use_summaries && startpoint >= start_lsn)
+		{
+			WalSegmentSummary *summary;
+
+			GetXLogSegNo(startpoint, prev_segno, wal_seg_size);
+			if (prev_segno == segno)
+				break;
+
+			summary = find_wal_summary(archivedir, tli, prev_segno,
+									   wal_seg_size);
+			if (summary == NULL || summary->last_lsn != startpoint ||
+				summary->first_lsn < start_lsn)
+				break;
+
+			if (summary->last_time != 0)
+			{
+				*recovery_time = timestamptz_to_time_t(summary->last_time);
+				res = true;
+				goto cleanup;
+			}
+
+			/*
+			 * There are no timestamps in the segment. If it was read from
+			 * its beginning, continue from the last record of the previous
+			 * segment, if it is known.
+			 */
+			if (XRecOffIsNull(summary->from_lsn) &&
+				(summary = find_wal_summary(archivedir, tli, prev_segno - 1,
+											wal_seg_size)) != NULL)
+			{
+				startpoint = summary->last_lsn;
+				segno = prev_segno;
+			}
+			else
+				break;
+		}
 	} while (startpoint >= start_lsn);
 
 	/* Didn't find timestamp from WAL records between start_lsn and stop_lsn */
@@ -619,6 +757,23 @@ wal_contains_lsn(const char *archivedir, XLogRecPtr target_lsn,
 		elog(ERROR, "Invalid target_lsn value %X/%X",
 			 (uint32) (target_lsn >> 32), (uint32) (target_lsn));
 
+	/*
+	 * Summary of the segment, which was read before, knows where its first
+	 * and last records start. Any other position has to be read to make
+	 * sure that a record starts there.
+	 */
+	if (load_wal_summaries(archivedir))
+	{
+		WalSegmentSummary *summary;
+		XLogSegNo	segno;
+
+		GetXLogSegNo(target_lsn, segno, wal_seg_size);
+		summary = find_wal_summary(archivedir, target_tli, segno, wal_seg_size);
+		if (summary && (summary->first_lsn == target_lsn ||
+						summary->last_lsn == target_lsn))
+			return true;
+	}
+
 	xlogreader = InitXLogPageRead(&reader_data, archivedir, target_tli,
 								  wal_seg_size, false, false, true);
 
@@ -946,6 +1101,76 @@ get_gz_error(gzFile gzf)
 }
 #endif
 
+/* Write callback for decompression stream, used by read_compressed_xlogfile() */
+static size_t
+xlogbuf_write(void *arg, const void *buf, size_t size)
+{
+	XLogReaderData *reader_data = (XLogReaderData *) arg;
+
+	/* segment cannot be larger than wal_seg_size */
+	if (reader_data->cmp_xlogbuf_len + size > wal_seg_size)
+	{
+		errno = EFBIG;
+		return 0;
+	}
+
+	memcpy(reader_data->cmp_xlogbuf + reader_data->cmp_xlogbuf_len, buf, size);
+	reader_data->cmp_xlogbuf_len += size;
+
+	return size;
+}
+
+/*
+ * Try to open WAL segment compressed with zstd or lz4. Such segments
+ * do not support seeking, so the whole segment is decompressed into memory.
+ * Returns false if segment is missing or cannot be read.
+ */
+static bool
+read_compressed_xlogfile(XLogReaderData *reader_data)
+{
+	CompressAlg	algs[] = {ZSTD_COMPRESS, LZ4_COMPRESS};
+	int			i;
+
+	for (i = 0; i < lengthof(algs); i++)
+	{
+		const char *errormsg = NULL;
+		int			rc;
+
+		if (!compress_stream_supported(algs[i]))
+			continue;
+
+		snprintf(reader_data->cmp_xlogpath, MAXPGPATH, "%s.%s",
+				 reader_data->xlogpath, compress_stream_suffix(algs[i]));
+
+		if (!fileExists(reader_data->cmp_xlogpath, FIO_LOCAL_HOST))
+			continue;
+
+		elog(LOG, "Thread [%d]: Opening compressed WAL segment \"%s\"",
+			 reader_data->thread_num, reader_data->cmp_xlogpath);
+
+		if (reader_data->cmp_xlogbuf == NULL)
+			reader_data->cmp_xlogbuf = pgut_malloc(wal_seg_size);
+		reader_data->cmp_xlogbuf_len = 0;
+
+		rc = decompress_file_stream(reader_data->cmp_xlogpath, algs[i],
+									xlogbuf_write, reader_data, &errormsg);
+		if (rc == SEND_OK)
+			return true;
+
+		elog(WARNING, "Thread [%d]: Could not read compressed WAL segment \"%s\": %s",
+			 reader_data->thread_num, reader_data->cmp_xlogpath,
+			 rc == WRITE_FAILED ? strerror(errno) :
+			 errormsg ? errormsg : "unknown error");
+		break;
+	}
+
+	pg_free(reader_data->cmp_xlogbuf);
+	reader_data->cmp_xlogbuf = NULL;
+	reader_data->cmp_xlogbuf_len = 0;
+
+	return false;
+}
+
 /* XLogreader callback function, to read a WAL page */
 static int
 SimpleXLogPageRead(XLogReaderState *xlogreader, XLogRecPtr targetPagePtr,
@@ -1070,6 +1295,9 @@ SimpleXLogPageRead(XLogReaderState *xlogreader, XLogRecPtr targetPagePtr,
 			}
 		}
 #endif
+		/* Try to open WAL segment compressed with zstd or lz4 */
+		else if (read_compressed_xlogfile(reader_data))
+			reader_data->xlogexists = true;
 		/* Exit without error if WAL segment doesn't exist */
 		if (!reader_data->xlogexists)
 			return -1;
@@ -1110,6 +1338,18 @@ SimpleXLogPageRead(XLogReaderState *xlogreader, XLogRecPtr targetPagePtr,
 			return -1;
 		}
 	}
+	else if (reader_data->cmp_xlogbuf != NULL)
+	{
+		if (targetPageOff + XLOG_BLCKSZ > reader_data->cmp_xlogbuf_len)
+		{
+			elog(WARNING, "Thread [%d]: Could not read from compressed WAL segment \"%s\": "
+				 "segment is too short",
+				 reader_data->thread_num, reader_data->cmp_xlogpath);
+			return -1;
+		}
+
+		memcpy(readBuf, reader_data->cmp_xlogbuf + targetPageOff, XLOG_BLCKSZ);
+	}
 #ifdef HAVE_LIBZ
 	else
 	{
@@ -1238,6 +1478,9 @@ RunXLogThreads(const char *archivedir, time_t target_time,
 	segnum_read = 0;
 	segnum_corrupted = 0;
 
+	/* Collect summaries of segments from the archive, which are read fully */
+	wal_summary_collect = load_wal_summaries(archivedir);
+
 	threads = (pthread_t *) pgut_malloc(sizeof(pthread_t) * num_threads);
 	thread_args = (xlog_thread_arg *) pgut_malloc(sizeof(xlog_thread_arg) * num_threads);
 
@@ -1295,6 +1538,12 @@ RunXLogThreads(const char *archivedir, time_t target_time,
 	pfree(threads);
 	threads = NULL;
 
+	if (wal_summary_collect)
+	{
+		save_wal_summaries();
+		wal_summary_collect = false;
+	}
+
 	if (last_rec)
 	{
 		/*
@@ -1372,6 +1621,7 @@ XLogThreadWorker(void *arg)
 	XLogBeginRead(xlogreader, thread_arg->startpoint);
 #endif
 
+	wal_summary_start(reader_data, thread_arg->startpoint);
 	found = XLogFindNextRecord(xlogreader, thread_arg->startpoint);
 
 	/*
@@ -1501,6 +1751,7 @@ XLogThreadWorker(void *arg)
 		if (TransactionIdIsValid(XLogRecGetXid(xlogreader)))
 			reader_data->cur_rec.rec_xid = XLogRecGetXid(xlogreader);
 		reader_data->cur_rec.rec_lsn = xlogreader->ReadRecPtr;
+		wal_summary_add_record(xlogreader, reader_data);
 
 		if (thread_arg->process_record)
 			thread_arg->process_record(xlogreader, reader_data, &stop_reading);
@@ -1573,6 +1824,9 @@ SwitchThreadToNextWal(XLogReaderState *xlogreader, xlog_thread_arg *arg)
 	reader_data = (XLogReaderData *) xlogreader->private_data;
 	reader_data->need_switch = false;
 
+	/* The segment was read up to its end */
+	wal_summary_finish(reader_data);
+
 	/* Critical section */
 	pthread_lock(&wal_segment_mutex);
 	Assert(segno_next);
@@ -1589,6 +1843,7 @@ SwitchThreadToNextWal(XLogReaderState *xlogreader, xlog_thread_arg *arg)
 	GetXLogRecPtr(reader_data->xlogsegno, 0, wal_seg_size, arg->startpoint);
 	/* We need to close previously opened file if it wasn't closed earlier */
 	CleanupXLogPageRead(xlogreader);
+	wal_summary_start(reader_data, arg->startpoint);
 	/* Skip over the page header and contrecord if any */
 	found = XLogFindNextRecord(xlogreader, arg->startpoint);
 
@@ -1715,6 +1970,12 @@ CleanupXLogPageRead(XLogReaderState *xlogreader)
 		reader_data->gz_xlogfile = NULL;
 	}
 #endif
+	else if (reader_data->cmp_xlogbuf != NULL)
+	{
+		pg_free(reader_data->cmp_xlogbuf);
+		reader_data->cmp_xlogbuf = NULL;
+		reader_data->cmp_xlogbuf_len = 0;
+	}
 	reader_data->prev_page_off = 0;
 	reader_data->xlogexists = false;
 }
@@ -1741,6 +2002,10 @@ PrintXLogCorruptionMsg(XLogReaderData *reader_data, int elevel)
 						 "Error has occured during reading WAL segment \"%s\"",
 				 reader_data->thread_num, reader_data->gz_xlogpath);
 #endif
+		else if (reader_data->cmp_xlogbuf != NULL)
+			elog(elevel, "Thread [%d]: Possible WAL corruption. "
+						 "Error has occured during reading WAL segment \"%s\"",
+				 reader_data->thread_num, reader_data->cmp_xlogpath);
 	}
 	else
 	{
@@ -1880,6 +2145,687 @@ getRecordTimestamp(XLogReaderState *record, TimestampTz *recordXtime)
 	return false;
 }
 
+/*
+ * Get path of WAL_SUMMARY_FILE for WAL archive 'archivedir' of an instance.
+ * Returns false if 'archivedir' is not an archive of the catalog, e.g. it is
+ * pg_wal directory of a STREAM backup.
+ */
+static bool
+get_wal_summary_path(const char *archivedir, char *summary_path)
+{
+	char		wal_dir[MAXPGPATH];
+	const char *name;
+	size_t		len;
+
+	if (backup_path == NULL)
+		return false;
+
+	join_path_components(wal_dir, backup_path, "wal");
+	len = strlen(wal_dir);
+
+	if (strncmp(archivedir, wal_dir, len) != 0 || archivedir[len] != '/')
+		return false;
+
+	name = archivedir + len + 1;
+	if (*name == '\0' || strchr(name, '/') != NULL)
+		return false;
+
+	snprintf(summary_path, MAXPGPATH, "%s/%s/%s/%s",
+			 backup_path, BACKUPS_DIR, name, WAL_SUMMARY_FILE);
+	return true;
+}
+
+static int
+WalSegmentSummaryCompare(const void *s1, const void *s2)
+{
+	WalSegmentSummary *s1p = *(WalSegmentSummary **) s1;
+	WalSegmentSummary *s2p = *(WalSegmentSummary **) s2;
+
+	if (s1p->tli != s2p->tli)
+		return (s1p->tli > s2p->tli) ? 1 : -1;
+	if (s1p->segno != s2p->segno)
+		return (s1p->segno > s2p->segno) ? 1 : -1;
+	return 0;
+}
+
+/*
+ * Stat WAL segment in the archive, choosing the file in the same way
+ * as SimpleXLogPageRead() does. Returns false if there is no such segment
+ * or only its partial version exists, which is never summarized.
+ */
+static bool
+stat_wal_segment(const char *archivedir, TimeLineID tli, XLogSegNo segno,
+				 uint32 segment_size, struct stat *st)
+{
+	char		xlogfname[MAXFNAMELEN];
+	char		path[MAXPGPATH];
+	char		suffixed_path[MAXPGPATH];
+	CompressAlg	algs[] = {ZSTD_COMPRESS, LZ4_COMPRESS};
+	int			i;
+
+	GetXLogFileName(xlogfname, tli, segno, segment_size);
+	join_path_components(path, archivedir, xlogfname);
+
+	if (fio_stat(path, st, true, FIO_LOCAL_HOST) == 0)
+		return S_ISREG(st->st_mode);
+
+	snprintf(suffixed_path, MAXPGPATH, "%s.partial", path);
+	if (fileExists(suffixed_path, FIO_LOCAL_HOST))
+		return false;
+
+#ifdef HAVE_LIBZ
+	snprintf(suffixed_path, MAXPGPATH, "%s.gz", path);
+	if (fio_stat(suffixed_path, st, true, FIO_LOCAL_HOST) == 0)
+		return S_ISREG(st->st_mode);
+#endif
+
+	for (i = 0; i < lengthof(algs); i++)
+	{
+		if (!compress_stream_supported(algs[i]))
+			continue;
+
+		snprintf(suffixed_path, MAXPGPATH, "%s.%s",
+				 path, compress_stream_suffix(algs[i]));
+		if (fio_stat(suffixed_path, st, true, FIO_LOCAL_HOST) == 0)
+			return S_ISREG(st->st_mode);
+	}
+
+	return false;
+}
+
+/* Check that summary describes the current version of the segment file */
+static bool
+wal_summary_is_actual(WalSegmentSummary *summary, const char *archivedir,
+					  uint32 segment_size)
+{
+	struct stat st;
+
+	return stat_wal_segment(archivedir, summary->tli, summary->segno,
+							segment_size, &st) &&
+		summary->ino == (uint64) st.st_ino &&
+		summary->size == (int64) st.st_size &&
+		summary->mtime == (int64) st.st_mtime &&
+		summary->mtime_nsec == STAT_MTIME_NSEC(&st) &&
+		summary->ctime == (int64) st.st_ctime;
+}
+
+/*
+ * Read WAL_SUMMARY_FILE. Return list of summaries sorted by tli and segno,
+ * which is empty if the file is missing or invalid.
+ */
+static parray *
+read_wal_summaries(const char *summary_path)
+{
+	char		buf[1024];
+	FILE	   *fp;
+	parray	   *summaries = parray_new();
+	pg_crc32	file_crc;
+	bool		crc_found = false;
+
+	fp = fio_open_stream(summary_path, FIO_BACKUP_HOST);
+	if (fp == NULL)
+		return summaries;
+
+	if (!fgets(buf, lengthof(buf), fp) ||
+		strncmp(buf, WAL_SUMMARY_MAGIC "\n", sizeof(WAL_SUMMARY_MAGIC)) != 0)
+		goto invalid;
+
+	INIT_FILE_CRC32(true, file_crc);
+	COMP_FILE_CRC32(true, file_crc, buf, strlen(buf));
+
+	while (fgets(buf, lengthof(buf), fp))
+	{
+		WalSegmentSummary *summary;
+		uint32		tli;
+		uint64		segno;
+		uint64		min_xid;
+		uint64		max_xid;
+		uint64		last_xid;
+		char	   *crc_pos;
+		pg_crc32	crc;
+		pg_crc32	line_crc;
+
+		/* nothing may follow CRC of the file */
+		if (crc_found || strchr(buf, '\n') == NULL)
+			goto invalid;
+
+		if (sscanf(buf, WAL_SUMMARY_CRC " %u\n", &crc) == 1)
+		{
+			FIN_FILE_CRC32(true, file_crc);
+			if (!EQ_TRADITIONAL_CRC32(crc, file_crc))
+				goto invalid;
+			crc_found = true;
+			continue;
+		}
+
+		COMP_FILE_CRC32(true, file_crc, buf, strlen(buf));
+
+		/* the line is ended by CRC of the preceding text */
+		crc_pos = strrchr(buf, ' ');
+		if (crc_pos == NULL || sscanf(crc_pos, " %u\n", &crc) != 1)
+			goto invalid;
+
+		INIT_FILE_CRC32(true, line_crc);
+		COMP_FILE_CRC32(true, line_crc, buf, crc_pos - buf);
+		FIN_FILE_CRC32(true, line_crc);
+		if (!EQ_TRADITIONAL_CRC32(crc, line_crc))
+		{
+			elog(LOG, "Ignore WAL summary with wrong CRC in file \"%s\"",
+				 summary_path);
+			continue;
+		}
+
+		summary = pgut_new(WalSegmentSummary);
+		parray_append(summaries, summary);
+
+		if (sscanf(buf, "%u " UINT64_FORMAT " " UINT64_FORMAT " "
+				   INT64_FORMAT " " INT64_FORMAT " "
+				   INT64_FORMAT " " INT64_FORMAT " "
+				   UINT64_FORMAT " " UINT64_FORMAT " " UINT64_FORMAT " "
+				   INT64_FORMAT " " INT64_FORMAT " " INT64_FORMAT " "
+				   UINT64_FORMAT " " UINT64_FORMAT " " UINT64_FORMAT,
+				   &tli, &segno, &summary->ino, &summary->size,
+				   &summary->mtime, &summary->mtime_nsec, &summary->ctime,
+				   &summary->from_lsn, &summary->first_lsn, &summary->last_lsn,
+				   &summary->min_time, &summary->max_time, &summary->last_time,
+				   &min_xid, &max_xid, &last_xid) != 16 ||
+			summary->first_lsn > summary->last_lsn)
+			goto invalid;
+
+		summary->tli = tli;
+		summary->segno = segno;
+		summary->min_xid = (TransactionId) min_xid;
+		summary->max_xid = (TransactionId) max_xid;
+		summary->last_xid = (TransactionId) last_xid;
+	}
+
+	if (ferror(fp) || !crc_found)
+		goto invalid;
+
+	fio_close_stream(fp);
+	parray_qsort(summaries, WalSegmentSummaryCompare);
+
+	return summaries;
+
+invalid:
+	elog(LOG, "Ignore invalid WAL summary file \"%s\"", summary_path);
+	fio_close_stream(fp);
+	parray_walk(summaries, pg_free);
+	parray_free(summaries);
+
+	return parray_new();
+}
+
+/*
+ * Load summaries of segments from WAL archive 'archivedir', if they are
+ * not loaded yet. Returns false if summaries are not used for 'archivedir'.
+ */
+static bool
+load_wal_summaries(const char *archivedir)
+{
+	char		summary_path[MAXPGPATH];
+
+	/* user asked to read everything */
+	if (force_full_validate)
+		return false;
+
+	if (!get_wal_summary_path(archivedir, summary_path))
+		return false;
+
+	if (wal_summaries != NULL &&
+		strcmp(wal_summary_archivedir, archivedir) == 0)
+		return true;
+
+	if (wal_summaries != NULL)
+	{
+		parray_walk(wal_summaries, pg_free);
+		parray_free(wal_summaries);
+	}
+
+	wal_summaries = read_wal_summaries(summary_path);
+	strncpy(wal_summary_archivedir, archivedir, MAXPGPATH - 1);
+
+	if (wal_summaries_new == NULL)
+		wal_summaries_new = parray_new();
+
+	return true;
+}
+
+/*
+ * Add summaries collected by reader threads to the loaded ones and write
+ * WAL_SUMMARY_FILE. Summaries of removed or changed segments are dropped.
+ */
+static void
+save_wal_summaries(void)
+{
+	char		summary_path[MAXPGPATH];
+	char		tmp_path[MAXPGPATH];
+	char		line[1024];
+	parray	   *summaries;
+	FILE	   *out;
+	bool		failed = false;
+	pg_crc32	file_crc;
+	int			i;
+
+	if (parray_num(wal_summaries_new) == 0)
+		return;
+
+	/* Drop summaries of removed or replaced segments */
+	summaries = parray_new();
+	for (i = 0; i < parray_num(wal_summaries); i++)
+	{
+		WalSegmentSummary *summary = parray_get(wal_summaries, i);
+
+		if (wal_summary_is_actual(summary, wal_summary_archivedir, wal_seg_size))
+			parray_append(summaries, summary);
+		else
+			pg_free(summary);
+	}
+	parray_free(wal_summaries);
+	wal_summaries = summaries;
+
+	/* Each segment is read by one thread, so new summaries are unique */
+	summaries = parray_new();
+	for (i = 0; i < parray_num(wal_summaries_new); i++)
+	{
+		WalSegmentSummary *summary = parray_get(wal_summaries_new, i);
+		WalSegmentSummary **found;
+
+		found = (WalSegmentSummary **) parray_bsearch(wal_summaries, &summary,
+													  WalSegmentSummaryCompare);
+		if (found == NULL)
+		{
+			parray_append(summaries, summary);
+			continue;
+		}
+
+		/* Prefer summary of the larger part of the segment */
+		if ((*found)->from_lsn > summary->from_lsn)
+			**found = *summary;
+		pg_free(summary);
+	}
+	parray_free(wal_summaries_new);
+	wal_summaries_new = parray_new();
+
+	for (i = 0; i < parray_num(summaries); i++)
+		parray_append(wal_summaries, parray_get(summaries, i));
+	parray_free(summaries);
+	parray_qsort(wal_summaries, WalSegmentSummaryCompare);
+
+	get_wal_summary_path(wal_summary_archivedir, summary_path);
+	snprintf(tmp_path, MAXPGPATH, "%s.tmp.%d", summary_path, getpid());
+
+	out = fio_fopen(tmp_path, PG_BINARY_W, FIO_BACKUP_HOST);
+	if (out == NULL)
+	{
+		elog(LOG, "Cannot open WAL summary file \"%s\": %s",
+			 tmp_path, strerror(errno));
+		return;
+	}
+
+	snprintf(line, lengthof(line), "%s\n", WAL_SUMMARY_MAGIC);
+	INIT_FILE_CRC32(true, file_crc);
+	COMP_FILE_CRC32(true, file_crc, line, strlen(line));
+	if (fio_fprintf(out, "%s", line) < 0)
+		failed = true;
+
+	for (i = 0; i < parray_num(wal_summaries) && !failed; i++)
+	{
+		WalSegmentSummary *summary = parray_get(wal_summaries, i);
+		pg_crc32	line_crc;
+		int			len;
+
+		len = snprintf(line, lengthof(line), "%u " UINT64_FORMAT " " UINT64_FORMAT " "
+					   INT64_FORMAT " " INT64_FORMAT " "
+					   INT64_FORMAT " " INT64_FORMAT " "
+					   UINT64_FORMAT " " UINT64_FORMAT " " UINT64_FORMAT " "
+					   INT64_FORMAT " " INT64_FORMAT " " INT64_FORMAT " "
+					   UINT64_FORMAT " " UINT64_FORMAT " " UINT64_FORMAT,
+					   summary->tli, (uint64) summary->segno, summary->ino,
+					   summary->size, summary->mtime, summary->mtime_nsec,
+					   summary->ctime,
+					   (uint64) summary->from_lsn, (uint64) summary->first_lsn,
+					   (uint64) summary->last_lsn, (int64) summary->min_time,
+					   (int64) summary->max_time, (int64) summary->last_time,
+					   (uint64) summary->min_xid, (uint64) summary->max_xid,
+					   (uint64) summary->last_xid);
+
+		INIT_FILE_CRC32(true, line_crc);
+		COMP_FILE_CRC32(true, line_crc, line, len);
+		FIN_FILE_CRC32(true, line_crc);
+
+		snprintf(line + len, lengthof(line) - len, " %u\n", line_crc);
+		COMP_FILE_CRC32(true, file_crc, line, strlen(line));
+
+		if (fio_fprintf(out, "%s", line) < 0)
+			failed = true;
+	}
+
+	FIN_FILE_CRC32(true, file_crc);
+	if (!failed &&
+		fio_fprintf(out, WAL_SUMMARY_CRC " %u\n", file_crc) < 0)
+		failed = true;
+
+	if (fio_fclose(out) != 0)
+		failed = true;
+
+	if (!failed && fio_rename(tmp_path, summary_path, FIO_BACKUP_HOST) == 0)
+		return;
+
+	elog(LOG, "Cannot write WAL summary file \"%s\": %s",
+		 tmp_path, strerror(errno));
+	fio_unlink(tmp_path, FIO_BACKUP_HOST);
+}
+
+/*
+ * Find summary of the current version of WAL segment. Summaries must be
+ * loaded by load_wal_summaries().
+ */
+static WalSegmentSummary *
+find_wal_summary(const char *archivedir, TimeLineID tli, XLogSegNo segno,
+				 uint32 segment_size)
+{
+	WalSegmentSummary key;
+	WalSegmentSummary *key_ptr = &key;
+	WalSegmentSummary **found;
+
+	key.tli = tli;
+	key.segno = segno;
+	found = (WalSegmentSummary **) parray_bsearch(wal_summaries, &key_ptr,
+												  WalSegmentSummaryCompare);
+
+	if (found == NULL ||
+		!wal_summary_is_actual(*found, archivedir, segment_size))
+		return NULL;
+
+	return *found;
+}
+
+/*
+ * Skip segments of WAL archive, starting with the segment of 'startpoint',
+ * which were read up to their end before and cannot contain the recovery
+ * target. Returns position to continue reading from, which is 'startpoint'
+ * if nothing is skipped, or InvalidXLogRecPtr if all records up to
+ * 'endpoint' were read before. If 'last_rec' is given, it is set to the last
+ * record of the skipped segments.
+ */
+static XLogRecPtr
+skip_summarized_wal(const char *archivedir, TimeLineID tli,
+					uint32 segment_size, XLogRecPtr startpoint,
+					XLogRecPtr endpoint, time_t target_time,
+					TransactionId target_xid, XLogRecPtr target_lsn,
+					XLogRecTarget *last_rec)
+{
+	XLogSegNo	start_segno;
+	XLogSegNo	end_segno = 0;
+	XLogSegNo	segno;
+	XLogRecPtr	result;
+	char		start_fname[MAXFNAMELEN];
+	char		end_fname[MAXFNAMELEN];
+
+	if (!load_wal_summaries(archivedir))
+		return startpoint;
+
+	GetXLogSegNo(startpoint, start_segno, segment_size);
+	if (!XLogRecPtrIsInvalid(endpoint))
+		GetXLogSegNo(endpoint, end_segno, segment_size);
+
+	for (segno = start_segno; ; segno++)
+	{
+		WalSegmentSummary *summary;
+		XLogRecPtr	segment_start;
+
+		summary = find_wal_summary(archivedir, tli, segno, segment_size);
+		if (summary == NULL)
+			break;
+
+		/* The segment must be read from 'startpoint' or from its beginning */
+		GetXLogRecPtr(segno, 0, segment_size, segment_start);
+		if (summary->from_lsn > Max(segment_start, startpoint))
+			break;
+
+		if (!XLogRecPtrIsInvalid(endpoint) && segno == end_segno)
+		{
+			if (summary->last_lsn < endpoint)
+				break;
+
+			GetXLogFileName(start_fname, tli, start_segno, segment_size);
+			elog(LOG, "WAL segments from %s up to %X/%X were read before, skip them",
+				 start_fname, (uint32) (endpoint >> 32), (uint32) (endpoint));
+			return InvalidXLogRecPtr;
+		}
+
+		/* The segment may contain the recovery target */
+		if ((TransactionIdIsValid(target_xid) &&
+			 TransactionIdIsValid(summary->min_xid) &&
+			 summary->min_xid <= target_xid && target_xid <= summary->max_xid) ||
+			(target_time != 0 && summary->max_time != 0 &&
+			 timestamptz_to_time_t(summary->max_time) >= target_time) ||
+			(XRecOffIsValid(target_lsn) && target_lsn <= summary->last_lsn))
+			break;
+
+		if (last_rec)
+		{
+			last_rec->rec_lsn = summary->last_lsn;
+			if (summary->last_time != 0)
+				last_rec->rec_time = summary->last_time;
+			if (TransactionIdIsValid(summary->last_xid))
+				last_rec->rec_xid = summary->last_xid;
+		}
+	}
+
+	if (segno == start_segno)
+		return startpoint;
+
+	GetXLogFileName(start_fname, tli, start_segno, segment_size);
+	GetXLogFileName(end_fname, tli, segno - 1, segment_size);
+	elog(LOG, "WAL segments from %s to %s were read before, skip them",
+		 start_fname, end_fname);
+
+	GetXLogRecPtr(segno, 0, segment_size, result);
+	return result;
+}
+
+/*
+ * Start summary of the segment, which is read by the thread from
+ * 'startpoint'.
+ */
+static void
+wal_summary_start(XLogReaderData *reader_data, XLogRecPtr startpoint)
+{
+	WalSegmentSummary *summary = &reader_data->summary;
+	struct stat st;
+
+	reader_data->summary_valid = false;
+
+	if (!wal_summary_collect ||
+		!stat_wal_segment(wal_archivedir, reader_data->tli,
+						  reader_data->xlogsegno, wal_seg_size, &st))
+		return;
+
+	MemSet(summary, 0, sizeof(WalSegmentSummary));
+	summary->tli = reader_data->tli;
+	summary->segno = reader_data->xlogsegno;
+	summary->ino = (uint64) st.st_ino;
+	summary->size = (int64) st.st_size;
+	summary->mtime = (int64) st.st_mtime;
+	summary->mtime_nsec = STAT_MTIME_NSEC(&st);
+	summary->ctime = (int64) st.st_ctime;
+	summary->from_lsn = startpoint;
+	summary->first_lsn = InvalidXLogRecPtr;
+	summary->min_xid = InvalidTransactionId;
+	summary->max_xid = InvalidTransactionId;
+	summary->last_xid = InvalidTransactionId;
+
+	reader_data->summary_valid = true;
+}
+
+/* Add the record, which was just read, to the summary of its segment */
+static void
+wal_summary_add_record(XLogReaderState *xlogreader,
+					   XLogReaderData *reader_data)
+{
+	WalSegmentSummary *summary = &reader_data->summary;
+	TimestampTz rec_time;
+	TransactionId rec_xid = XLogRecGetXid(xlogreader);
+
+	if (!reader_data->summary_valid ||
+		!IsInXLogSeg(xlogreader->ReadRecPtr, summary->segno, wal_seg_size))
+		return;
+
+	if (XLogRecPtrIsInvalid(summary->first_lsn))
+		summary->first_lsn = xlogreader->ReadRecPtr;
+	summary->last_lsn = xlogreader->ReadRecPtr;
+
+	if (getRecordTimestamp(xlogreader, &rec_time))
+	{
+		if (summary->min_time == 0 || rec_time < summary->min_time)
+			summary->min_time = rec_time;
+		if (rec_time > summary->max_time)
+			summary->max_time = rec_time;
+		summary->last_time = rec_time;
+	}
+
+	if (TransactionIdIsValid(rec_xid))
+	{
+		if (!TransactionIdIsValid(summary->min_xid) ||
+			rec_xid < summary->min_xid)
+			summary->min_xid = rec_xid;
+		if (!TransactionIdIsValid(summary->max_xid) ||
+			rec_xid > summary->max_xid)
+			summary->max_xid = rec_xid;
+		summary->last_xid = rec_xid;
+	}
+}
+
+/*
+ * The thread has read its segment up to the end, pass the summary to
+ * save_wal_summaries(), if the segment file was not replaced meanwhile.
+ */
+static void
+wal_summary_finish(XLogReaderData *reader_data)
+{
+	WalSegmentSummary *summary;
+
+	if (!reader_data->summary_valid ||
+		XLogRecPtrIsInvalid(reader_data->summary.first_lsn))
+		return;
+	reader_data->summary_valid = false;
+
+	if (!wal_summary_is_actual(&reader_data->summary, wal_archivedir,
+							   wal_seg_size))
+		return;
+
+	summary = pgut_new(WalSegmentSummary);
+	*summary = reader_data->summary;
+
+	pthread_lock(&wal_segment_mutex);
+	parray_append(wal_summaries_new, summary);
+	pthread_mutex_unlock(&wal_segment_mutex);
+}
+
+/*
+ * Read segments of WAL archive 'archivedir' on timeline 'tli' from
+ * 'begin_segno' up to 'end_segno', which were not read up to their end
+ * before, to save their summaries. Every segment must exist, and the
+ * segment after 'end_segno' too, if the last record continues in it.
+ * Returns false if some of the segments cannot be read.
+ */
+bool
+summarize_wal(const char *archivedir, TimeLineID tli, uint32 wal_seg_size,
+			  XLogSegNo begin_segno, XLogSegNo end_segno)
+{
+	XLogSegNo	segno = begin_segno;
+	bool		result = true;
+
+	if (!load_wal_summaries(archivedir))
+		elog(ERROR, "Directory \"%s\" is not a WAL archive of the backup catalog",
+			 archivedir);
+
+	while (segno <= end_segno)
+	{
+		WalSegmentSummary *summary;
+		XLogSegNo	last_segno;
+		XLogRecPtr	startpoint;
+		XLogRecPtr	endpoint;
+		char		begin_fname[MAXFNAMELEN];
+		char		end_fname[MAXFNAMELEN];
+
+		summary = find_wal_summary(archivedir, tli, segno, wal_seg_size);
+		if (summary && XRecOffIsNull(summary->from_lsn))
+		{
+			segno++;
+			continue;
+		}
+
+		/* Find the end of sequence of segments, which are not summarized */
+		for (last_segno = segno; last_segno < end_segno; last_segno++)
+		{
+			summary = find_wal_summary(archivedir, tli, last_segno + 1,
+									   wal_seg_size);
+			if (summary && XRecOffIsNull(summary->from_lsn))
+				break;
+		}
+
+		GetXLogFileName(begin_fname, tli, segno, wal_seg_size);
+		GetXLogFileName(end_fname, tli, last_segno, wal_seg_size);
+		elog(INFO, "Indexing WAL segments from %s to %s", begin_fname, end_fname);
+
+		GetXLogRecPtr(segno, 0, wal_seg_size, startpoint);
+		GetXLogRecPtr(last_segno + 1, 0, wal_seg_size, endpoint);
+
+		if (!RunXLogThreads(archivedir, 0, InvalidTransactionId,
+							InvalidXLogRecPtr, tli, wal_seg_size,
+							startpoint, endpoint, false, NULL, NULL, false))
+		{
+			elog(WARNING, "Cannot read WAL segments from %s to %s",
+				 begin_fname, end_fname);
+			result = false;
+		}
+
+		segno = last_segno + 1;
+	}
+
+	return result;
+}
+
+/*
+ * Get number of segments of WAL archive 'archivedir' on timeline 'tli',
+ * which were read up to the end, and the range of commit timestamps in them.
+ * Identity of segment files is not checked, so it is cheap enough for show.
+ */
+void
+get_wal_summary_range(const char *archivedir, TimeLineID tli,
+					  size_t *n_segments, time_t *min_time, time_t *max_time)
+{
+	int			i;
+
+	*n_segments = 0;
+	*min_time = 0;
+	*max_time = 0;
+
+	if (!load_wal_summaries(archivedir))
+		return;
+
+	for (i = 0; i < parray_num(wal_summaries); i++)
+	{
+		WalSegmentSummary *summary = parray_get(wal_summaries, i);
+
+		if (summary->tli != tli || !XRecOffIsNull(summary->from_lsn))
+			continue;
+
+		(*n_segments)++;
+
+		if (summary->min_time != 0 &&
+			(*min_time == 0 ||
+			 timestamptz_to_time_t(summary->min_time) < *min_time))
+			*min_time = timestamptz_to_time_t(summary->min_time);
+		if (summary->max_time != 0 &&
+			timestamptz_to_time_t(summary->max_time) > *max_time)
+			*max_time = timestamptz_to_time_t(summary->max_time);
+	}
+}
+
 bool validate_wal_segment(TimeLineID tli, XLogSegNo segno, const char *prefetch_dir, uint32 wal_seg_size)
 {
 	XLogRecPtr startpoint;
@@ -44,7 +44,8 @@ typedef enum ProbackupSubcmd
 	SET_CONFIG_CMD,
 	SET_BACKUP_CMD,
 	SHOW_CONFIG_CMD,
-	CHECKDB_CMD
+	CHECKDB_CMD,
+	INDEX_WAL_CMD
 } ProbackupSubcmd;
 
 
@@ -82,6 +83,9 @@ bool         backup_logs = false;
 bool         smooth_checkpoint;
 char        *remote_agent;
 static char *backup_note = NULL;
+bool		binary_filelist = false;
+DedupMode	dedup_mode = DEDUP_NONE;
+static bool	resume = false;
 /* restore options */
 static char		   *target_time = NULL;
 static char		   *target_xid = NULL;
@@ -106,6 +110,11 @@ IncrRestoreMode incremental_mode = INCR_NONE;
 bool skip_block_validation = false;
 bool skip_external_dirs = false;
 
+/* validate options */
+bool force_full_validate = false;
+int validate_sample = 0;
+ValidateMode validate_mode = VALIDATE_DEEP;
+
 /* array for datnames, provided via db-include and db-exclude */
 static parray *datname_exclude_list = NULL;
 static parray *datname_include_list = NULL;
@@ -155,6 +164,9 @@ static ProbackupSubcmd backup_subcmd = NO_CMD;
 static bool help_opt = false;
 
 static void opt_incr_restore_mode(ConfigOption *opt, const char *arg);
+static void opt_dedup_mode(ConfigOption *opt, const char *arg);
+static void opt_io_mode(ConfigOption *opt, const char *arg);
+static void opt_validate_mode(ConfigOption *opt, const char *arg);
 static void opt_backup_mode(ConfigOption *opt, const char *arg);
 static void opt_show_format(ConfigOption *opt, const char *arg);
 
@@ -178,6 +190,8 @@ static ConfigOption cmd_options[] =
 	{ 'b', 132, "progress",			&progress,			SOURCE_CMD_STRICT },
 	{ 's', 'i', "backup-id",		&backup_id_string,	SOURCE_CMD_STRICT },
 	{ 'b', 133, "no-sync",			&no_sync,			SOURCE_CMD_STRICT },
+	{ 'f', 188, "io-mode",			opt_io_mode,		SOURCE_CMD_STRICT },
+	{ 'u', 189, "io-depth",			&io_depth,			SOURCE_CMD_STRICT },
 	/* backup options */
 	{ 'b', 180, "backup-pg-log",	&backup_logs,		SOURCE_CMD_STRICT },
 	{ 'f', 'b', "backup-mode",		opt_backup_mode,	SOURCE_CMD_STRICT },
@@ -188,6 +202,9 @@ static ConfigOption cmd_options[] =
 	{ 'b', 183, "delete-expired",	&delete_expired,	SOURCE_CMD_STRICT },
 	{ 'b', 184, "merge-expired",	&merge_expired,		SOURCE_CMD_STRICT },
 	{ 'b', 185, "dry-run",			&dry_run,			SOURCE_CMD_STRICT },
+	{ 'b', 186, "binary-filelist",	&binary_filelist,	SOURCE_CMD_STRICT },
+	{ 'f', 187, "dedup",			opt_dedup_mode,		SOURCE_CMD_STRICT },
+	{ 'b', 190, "resume",			&resume,			SOURCE_CMD_STRICT },
 	{ 's', 238, "note",				&backup_note,		SOURCE_CMD_STRICT },
 	/* restore options */
 	{ 's', 136, "recovery-target-time",	&target_time,	SOURCE_CMD_STRICT },
@@ -209,6 +226,10 @@ static ConfigOption cmd_options[] =
 	{ 's', 160, "primary-conninfo",	&primary_conninfo,	SOURCE_CMD_STRICT },
 	{ 's', 'S', "primary-slot-name",&replication_slot,	SOURCE_CMD_STRICT },
 	{ 'f', 'I', "incremental-mode", opt_incr_restore_mode,	SOURCE_CMD_STRICT },
+	/* validate options */
+	{ 'b', 191, "force-full-validate", &force_full_validate,	SOURCE_CMD_STRICT },
+	{ 'i', 192, "validate-sample",	&validate_sample,	SOURCE_CMD_STRICT },
+	{ 'f', 193, "mode",				opt_validate_mode,	SOURCE_CMD_STRICT },
 	/* checkdb options */
 	{ 'b', 195, "amcheck",			&need_amcheck,		SOURCE_CMD_STRICT },
 	{ 'b', 196, "heapallindexed",	&heapallindexed,	SOURCE_CMD_STRICT },
@@ -346,6 +367,8 @@ main(int argc, char *argv[])
 			backup_subcmd = SHOW_CONFIG_CMD;
 		else if (strcmp(argv[1], "checkdb") == 0)
 			backup_subcmd = CHECKDB_CMD;
+		else if (strcmp(argv[1], "index-wal") == 0)
+			backup_subcmd = INDEX_WAL_CMD;
 #ifdef WIN32
 		else if (strcmp(argv[1], "ssh") == 0)
 		    launch_ssh(argv);
@@ -665,7 +688,8 @@ main(int argc, char *argv[])
 			backup_subcmd != DELETE_CMD &&
 			backup_subcmd != MERGE_CMD &&
 			backup_subcmd != SET_BACKUP_CMD &&
-			backup_subcmd != SHOW_CMD)
+			backup_subcmd != SHOW_CMD &&
+			!(backup_subcmd == BACKUP_CMD && resume))
 			elog(ERROR, "Cannot use -i (--backup-id) option together with the \"%s\" command",
 				 command_name);
 
@@ -778,6 +802,16 @@ main(int argc, char *argv[])
 	if (batch_size < 1)
 		batch_size = 1;
 
+	if (validate_sample < 0 || validate_sample > 100)
+		elog(ERROR, "Invalid value for '--validate-sample' option: %d, "
+			 "must be between 0 and 100", validate_sample);
+
+	if (io_depth < 1)
+		io_depth = 1;
+	else if (io_depth > FIO_MAX_IO_DEPTH)
+		elog(ERROR, "Invalid value for '--io-depth' option: %d, maximum is %d",
+			 io_depth, FIO_MAX_IO_DEPTH);
+
 	compress_init();
 
 	/* do actual operation */
@@ -800,13 +834,19 @@ main(int argc, char *argv[])
 		case BACKUP_CMD:
 			{
 				current.stream = stream_wal;
+				current.binary_filelist = binary_filelist;
 
 				/* sanity */
-				if (current.backup_mode == BACKUP_MODE_INVALID)
+				if (resume && !backup_id_string)
+					elog(ERROR, "You must specify parameter (-i, --backup-id) for resume");
+
+				/* backup mode of resumed backup is already known */
+				if (current.backup_mode == BACKUP_MODE_INVALID && !resume)
 					elog(ERROR, "required parameter not specified: BACKUP_MODE "
 						 "(-b, --backup-mode)");
 
-				return do_backup(set_backup_params, no_validate, no_sync, backup_logs);
+				return do_backup(set_backup_params, no_validate, no_sync, backup_logs,
+								 resume);
 			}
 		case RESTORE_CMD:
 			return do_restore_or_validate(current.backup_id,
@@ -867,6 +907,9 @@ main(int argc, char *argv[])
 			do_checkdb(need_amcheck,
 					   instance_config.conn_opt, instance_config.pgdata);
 			break;
+		case INDEX_WAL_CMD:
+			do_index_wal(&instance_config);
+			break;
 		case NO_CMD:
 			/* Should not happen */
 			elog(ERROR, "Unknown subcommand");
@@ -898,6 +941,53 @@ opt_incr_restore_mode(ConfigOption *opt, const char *arg)
 	elog(ERROR, "Invalid value for '--incremental-mode' option: '%s'", arg);
 }
 
+static void
+opt_dedup_mode(ConfigOption *opt, const char *arg)
+{
+	dedup_mode = parse_dedup_mode(arg);
+}
+
+static void
+opt_io_mode(ConfigOption *opt, const char *arg)
+{
+	if (pg_strcasecmp(arg, "buffered") == 0)
+	{
+		io_mode = IO_MODE_BUFFERED;
+		return;
+	}
+	else if (pg_strcasecmp(arg, "dontneed") == 0)
+	{
+		io_mode = IO_MODE_DONTNEED;
+		return;
+	}
+	else if (pg_strcasecmp(arg, "direct") == 0)
+	{
+		io_mode = IO_MODE_DIRECT;
+		return;
+	}
+
+	/* I/O mode is invalid, so leave with an error */
+	elog(ERROR, "Invalid value for '--io-mode' option: '%s'", arg);
+}
+
+static void
+opt_validate_mode(ConfigOption *opt, const char *arg)
+{
+	if (pg_strcasecmp(arg, "deep") == 0)
+	{
+		validate_mode = VALIDATE_DEEP;
+		return;
+	}
+	else if (pg_strcasecmp(arg, "quick") == 0)
+	{
+		validate_mode = VALIDATE_QUICK;
+		return;
+	}
+
+	/* Validate mode is invalid, so leave with an error */
+	elog(ERROR, "Invalid value for '--mode' option: '%s'", arg);
+}
+
 static void
 opt_backup_mode(ConfigOption *opt, const char *arg)
 {
@@ -946,8 +1036,17 @@ compress_init(void)
 												"compress-algorithm option");
 	}
 
-	if (instance_config.compress_level < 0 || instance_config.compress_level > 9)
-		elog(ERROR, "--compress-level value must be in the range from 0 to 9");
+	if (instance_config.compress_alg == ZSTD_COMPRESS)
+	{
+		if (instance_config.compress_level < 0 ||
+			instance_config.compress_level > COMPRESS_LEVEL_MAX_ZSTD)
+			elog(ERROR, "--compress-level value must be in the range from 0 to %i",
+				 COMPRESS_LEVEL_MAX_ZSTD);
+	}
+	else if (instance_config.compress_level < 0 ||
+			 instance_config.compress_level > COMPRESS_LEVEL_MAX)
+		elog(ERROR, "--compress-level value must be in the range from 0 to %i",
+			 COMPRESS_LEVEL_MAX);
 
 	if (instance_config.compress_alg == ZLIB_COMPRESS && instance_config.compress_level == 0)
 		elog(WARNING, "Compression level 0 will lead to data bloat!");
@@ -958,6 +1057,16 @@ compress_init(void)
 		if (instance_config.compress_alg == ZLIB_COMPRESS)
 			elog(ERROR, "This build does not support zlib compression");
 		else
+#endif
+#ifndef HAVE_LIBZSTD
+		if (instance_config.compress_alg == ZSTD_COMPRESS)
+			elog(ERROR, "This build does not support zstd compression");
+		else
+#endif
+#ifndef HAVE_LIBLZ4
+		if (instance_config.compress_alg == LZ4_COMPRESS)
+			elog(ERROR, "This build does not support lz4 compression");
+		else
 #endif
 		if (instance_config.compress_alg == PGLZ_COMPRESS && num_threads > 1)
 			elog(ERROR, "Multithread backup does not support pglz compression");
@@ -75,6 +75,11 @@ extern const char  *PROGRAM_EMAIL;
 #define DATABASE_MAP			"database_map"
 #define HEADER_MAP  			"page_header_map"
 #define HEADER_MAP_TMP  		"page_header_map_tmp"
+#define MERGE_JOURNAL			"merge_journal"
+#define VALIDATION_LEDGER		"validation_ledger"
+#define BACKUP_INDEX_FILE		".backup.index"
+#define WAL_INDEX_FILE			".wal.index"
+#define WAL_SUMMARY_FILE		".wal.summary"
 
 /* Timeout defaults */
 #define ARCHIVE_TIMEOUT_DEFAULT		300
@@ -113,6 +118,15 @@ extern const char  *PROGRAM_EMAIL;
 #define XRecOffIsNull(xlrp) \
 		((xlrp) % XLOG_BLCKSZ == 0)
 
+/* Nanoseconds of file modification time, where the platform provides them */
+#if defined(WIN32)
+#define STAT_MTIME_NSEC(st) ((int64) 0)
+#elif defined(__APPLE__)
+#define STAT_MTIME_NSEC(st) ((int64) (st)->st_mtimespec.tv_nsec)
+#else
+#define STAT_MTIME_NSEC(st) ((int64) (st)->st_mtim.tv_nsec)
+#endif
+
 typedef struct RedoParams
 {
 	TimeLineID  tli;
@@ -149,6 +163,21 @@ typedef enum IncrRestoreMode
 	INCR_LSN
 } IncrRestoreMode;
 
+/* How FULL backup shares unchanged files with the previous FULL backup */
+typedef enum DedupMode
+{
+	DEDUP_NONE,
+	DEDUP_REFLINK,		/* clone the file, sharing its data blocks */
+	DEDUP_HARDLINK		/* make a hard link to the file */
+} DedupMode;
+
+/* How thoroughly validate checks data files */
+typedef enum ValidateMode
+{
+	VALIDATE_DEEP,		/* decompress and check every page */
+	VALIDATE_QUICK		/* check page headers and file CRC only */
+} ValidateMode;
+
 typedef enum PartialRestoreType
 {
 	NONE,
@@ -172,6 +201,8 @@ typedef enum CompressAlg
 	NONE_COMPRESS,
 	PGLZ_COMPRESS,
 	ZLIB_COMPRESS,
+	ZSTD_COMPRESS,
+	LZ4_COMPRESS,
 } CompressAlg;
 
 typedef enum ForkName
@@ -237,6 +268,8 @@ typedef struct pgFile
 	bool	is_database;	/* Flag used strictly by ptrack 1.x backup */
 	int		external_dir_num;	/* Number of external directory. 0 if not external */
 	bool	exists_in_prev;		/* Mark files, both data and regular, that exists in previous backup */
+	bool	resumed;		/* File was copied before the backup was interrupted,
+							 * must be verified before reuse */
 	CompressAlg		compress_alg;		/* compression algorithm applied to the file */
 	volatile 		pg_atomic_flag lock;/* lock for synchronization of parallel threads  */
 	datapagemap_t	pagemap;			/* bitmap of pages updated since previous backup
@@ -304,7 +337,9 @@ typedef enum ShowFormat
 #define FILE_NOT_FOUND		(-2) /* file disappeared during backup */
 #define BLOCKNUM_INVALID	(-1)
 #define PROGRAM_VERSION	"2.4.9"
-#define AGENT_PROTOCOL_VERSION 20409
+/* update when changing the protocol between pg_probackup and remote agent */
+#define AGENT_PROTOCOL_VERSION 20412
+#define AGENT_PROTOCOL_VERSION_STR "2.4.12"
 
 /* update only when changing storage format */
 #define STORAGE_FORMAT_VERSION "2.4.4"
@@ -405,6 +440,9 @@ typedef struct HeaderMap
 	FILE  *fp;                 /* used only for writing */
 	char  *buf;	               /* buffer */
 	off_t  offset;             /* current position in fp */
+	int    read_fd;            /* shared descriptor, used only for reading */
+	parray *cache;             /* recently read headers, see get_data_file_headers */
+	size_t cache_size;         /* total size of cached headers */
 	pthread_mutex_t mutex;
 
 } HeaderMap;
@@ -421,6 +459,9 @@ struct pgBackup
 	TimeLineID		tli; 		/* timeline of start and stop backup lsns */
 	XLogRecPtr		start_lsn;	/* backup's starting transaction log location */
 	XLogRecPtr		stop_lsn;	/* backup's finishing transaction log location */
+	XLogRecPtr		checkpoint_lsn;	/* location of the checkpoint record
+									 * with redo point at start_lsn,
+									 * needed to resume the backup */
 	time_t			start_time;	/* UTC time of backup creation */
 	time_t			merge_dest_backup;	/* start_time of incremental backup with
 									 * which this backup is merging with.
@@ -457,6 +498,7 @@ struct pgBackup
 
 	CompressAlg		compress_alg;
 	int				compress_level;
+	DedupMode		dedup_mode;	/* how files are shared with previous FULL */
 
 	/* Fields needed for compatibility check */
 	uint32			block_size;
@@ -485,6 +527,7 @@ struct pgBackup
 	char			*note;
 
 	pg_crc32         content_crc;
+	bool             binary_filelist; /* backup_content.control is binary */
 
 	/* map used for access to page headers */
 	HeaderMap       hdr_map;
@@ -547,6 +590,27 @@ typedef struct pgSetBackupParams
 	char   *note;
 } pgSetBackupParams;
 
+/*
+ * Time in seconds spent by the stages of data files backup, see send_pages().
+ * Reader stalls when compression can't keep up with reading and writer
+ * stalls when reading can't keep up with compression.
+ */
+typedef struct BackupStageStats
+{
+	double		read_time;		/* reading and validation of pages */
+	double		compress_time;	/* compression of pages */
+	double		write_time;		/* writing of pages to backup */
+	double		read_stall;		/* reader waiting for a free batch */
+	double		write_stall;	/* writer waiting for a filled batch */
+	int			n_pipelined;	/* number of files backed up by the pipeline */
+} BackupStageStats;
+
+/* Queue of files shared by worker threads, defined in dir.c */
+typedef struct FileQueue FileQueue;
+
+/* Reader of backup_content.control, defined in dir.c */
+typedef struct FileListReader FileListReader;
+
 typedef struct
 {
 	PGNodeInfo *nodeInfo;
@@ -556,6 +620,7 @@ typedef struct
 	const char *external_prefix;
 
 	parray	   *files_list;
+	FileQueue  *queue;
 	parray	   *prev_filelist;
 	parray	   *external_dirs;
 	XLogRecPtr	prev_start_lsn;
@@ -563,6 +628,18 @@ typedef struct
 	ConnectionArgs conn_arg;
 	int			thread_num;
 	HeaderMap   *hdr_map;
+	BackupStageStats stage_stats;
+
+	/* FULL backup to take unchanged non-data files from, see --dedup */
+	pgBackup   *dedup_backup;
+	parray	   *dedup_filelist;
+	bool		dedup_external_dirs;	/* external directories are the same */
+	int			n_dedup_files;
+	int64		dedup_bytes;
+
+	/* files copied before the backup was interrupted and reused */
+	int			n_resumed_files;
+	int64		resumed_bytes;
 
 	/*
 	 * Return value from the thread.
@@ -590,8 +667,10 @@ struct timelineInfo {
 	size_t	size;			/* space on disk taken by regular WAL files */
 	parray *backups;		/* array of pgBackup sturctures with info
 							 * about backups belonging to this timeline */
-	parray *xlog_filelist;	/* array of ordinary WAL segments, '.partial'
-							 * and '.backup' files belonging to this timeline */
+	parray *xlog_ranges;	/* array of ranges of ordinary WAL segments
+							 * belonging to this timeline */
+	parray *xlog_filelist;	/* array of '.partial', temp and '.backup' files
+							 * belonging to this timeline */
 	parray *lost_segments;	/* array of intervals of lost segments */
 	parray *keep_segments;	/* array of intervals of segments used by WAL retention */
 	pgBackup *closest_backup; /* link to valid backup, closest to timeline */
@@ -626,10 +705,21 @@ typedef struct xlogFile
 	pgFile       file;
 	XLogSegNo    segno;
 	xlogFileType type;
-	bool         keep; /* Used to prevent removal of WAL segments
-                        * required by ARCHIVE backups. */
 } xlogFile;
 
+/*
+ * Range of consecutive WAL segments with the same compression suffix.
+ * Archive usually contains long runs of segments, so they are stored as
+ * ranges instead of separate files. Gaps between ranges are lost segments.
+ */
+typedef struct xlogRange
+{
+	XLogSegNo	begin_segno;
+	XLogSegNo	end_segno;		/* inclusive */
+	size_t		size;			/* space on disk taken by segments of the range */
+	char		suffix[8];		/* "gz", "zst", "lz4" or empty */
+} xlogRange;
+
 
 /*
  * When copying datafiles to backup we validate and compress them block
@@ -650,6 +740,49 @@ typedef struct BackupPageHeader2
 	uint16      checksum;
 } BackupPageHeader2;
 
+/*
+ * Binary format of backup_content.control, used with --binary-filelist.
+ * The header is followed by file entries, each one followed by its rel_path
+ * and linked path (without trailing zeroes), and then by an index: array of
+ * uint64 offsets of entries. Entries are sorted by rel_path and
+ * external_dir_num (see pgFileCompareRelPathWithExternal), so the index
+ * allows binary search without reading the whole list.
+ * CRC covers everything after the header.
+ */
+#define FILELIST_MAGIC		"PBKFLST"
+#define FILELIST_VERSION	1
+
+typedef struct FileListHeader
+{
+	char		magic[8];
+	uint32		version;
+	uint32		n_files;
+	uint64		index_off;		/* offset of the index */
+	pg_crc32	crc;
+	uint32		padding;
+} FileListHeader;
+
+typedef struct FileListEntry
+{
+	int64		write_size;
+	int64		hdr_off;
+	uint32		mode;
+	uint32		crc;
+	uint32		dbOid;
+	uint32		hdr_crc;
+	int32		segno;
+	int32		n_blocks;
+	int32		n_headers;
+	int32		hdr_size;
+	int32		external_dir_num;
+	uint16		path_len;
+	uint16		linked_len;
+	uint8		is_datafile;
+	uint8		is_cfs;
+	uint8		compress_alg;
+	uint8		padding;
+} FileListEntry;
+
 /* Special value for compressed_size field */
 #define PageIsOk		 0
 #define SkipCurrentPage -1
@@ -673,10 +806,15 @@ typedef struct BackupPageHeader2
 #define XLogDataFromLSN(data, xlogid, xrecoff)		\
 	sscanf(data, "%X/%X", xlogid, xrecoff)
 
-#define IsCompressedXLogFileName(fname) \
-	(strlen(fname) == XLOG_FNAME_LEN + strlen(".gz") &&			\
+#define IsXLogFileNameWithSuffix(fname, suffix) \
+	(strlen(fname) == XLOG_FNAME_LEN + strlen(suffix) &&		\
 	 strspn(fname, "0123456789ABCDEF") == XLOG_FNAME_LEN &&		\
-	 strcmp((fname) + XLOG_FNAME_LEN, ".gz") == 0)
+	 strcmp((fname) + XLOG_FNAME_LEN, suffix) == 0)
+
+#define IsCompressedXLogFileName(fname) \
+	(IsXLogFileNameWithSuffix(fname, ".gz") ||	\
+	 IsXLogFileNameWithSuffix(fname, ".zst") ||	\
+	 IsXLogFileNameWithSuffix(fname, ".lz4"))
 
 #if PG_VERSION_NUM >= 110000
 
@@ -724,9 +862,9 @@ typedef struct BackupPageHeader2
 #endif
 
 #define IsPartialCompressXLogFileName(fname)	\
-	(strlen(fname) == XLOG_FNAME_LEN + strlen(".gz.partial") && \
-	 strspn(fname, "0123456789ABCDEF") == XLOG_FNAME_LEN &&		\
-	 strcmp((fname) + XLOG_FNAME_LEN, ".gz.partial") == 0)
+	(IsXLogFileNameWithSuffix(fname, ".gz.partial") ||	\
+	 IsXLogFileNameWithSuffix(fname, ".zst.partial") ||	\
+	 IsXLogFileNameWithSuffix(fname, ".lz4.partial"))
 
 #define IsTempXLogFileName(fname)	\
 	(strlen(fname) == XLOG_FNAME_LEN + strlen(".part") &&	\
@@ -734,9 +872,9 @@ typedef struct BackupPageHeader2
 	 strcmp((fname) + XLOG_FNAME_LEN, ".part") == 0)
 
 #define IsTempCompressXLogFileName(fname)	\
-	(strlen(fname) == XLOG_FNAME_LEN + strlen(".gz.part") && \
-	 strspn(fname, "0123456789ABCDEF") == XLOG_FNAME_LEN &&		\
-	 strcmp((fname) + XLOG_FNAME_LEN, ".gz.part") == 0)
+	(IsXLogFileNameWithSuffix(fname, ".gz.part") ||	\
+	 IsXLogFileNameWithSuffix(fname, ".zst.part") ||	\
+	 IsXLogFileNameWithSuffix(fname, ".lz4.part"))
 
 #define IsSshProtocol() (instance_config.remote.host && strcmp(instance_config.remote.proto, "ssh") == 0)
 
@@ -760,6 +898,8 @@ extern bool 	temp_slot;
 
 /* backup options */
 extern bool		smooth_checkpoint;
+extern bool		binary_filelist;
+extern DedupMode dedup_mode;
 
 /* remote probackup options */
 extern char* remote_agent;
@@ -785,6 +925,11 @@ extern ShowFormat show_format;
 extern bool heapallindexed;
 extern bool skip_block_validation;
 
+/* validate options */
+extern bool force_full_validate;
+extern int	validate_sample;
+extern ValidateMode validate_mode;
+
 /* current settings */
 extern pgBackup current;
 
@@ -797,11 +942,14 @@ extern const char *pgdata_exclude_dir[];
 
 /* in backup.c */
 extern int do_backup(pgSetBackupParams *set_backup_params,
-					 bool no_validate, bool no_sync, bool backup_logs);
+					 bool no_validate, bool no_sync, bool backup_logs,
+					 bool resume);
 extern void do_checkdb(bool need_amcheck, ConnectionOptions conn_opt,
 				  char *pgdata);
 extern BackupMode parse_backup_mode(const char *value);
 extern const char *deparse_backup_mode(BackupMode mode);
+extern DedupMode parse_dedup_mode(const char *value);
+extern const char *deparse_dedup_mode(DedupMode mode);
 extern void process_block_change(ForkNumber forknum, RelFileNode rnode,
 								 BlockNumber blkno);
 
@@ -827,6 +975,7 @@ extern parray *get_dbOid_exclude_list(pgBackup *backup, parray *datname_list,
 										PartialRestoreType partial_restore_type);
 
 extern parray *get_backup_filelist(pgBackup *backup, bool strict);
+extern pgFile *get_backup_file(pgBackup *backup, const char *rel_path, int external_dir_num);
 extern parray *read_timeline_history(const char *arclog_path, TimeLineID targetTLI, bool strict);
 extern bool tliIsPartOfHistory(const parray *timelines, TimeLineID tli);
 
@@ -848,6 +997,7 @@ extern void do_archive_push(InstanceConfig *instance, char *wal_file_path,
 						   bool no_sync, bool no_ready_rename);
 extern void do_archive_get(InstanceConfig *instance, const char *prefetch_dir_arg, char *wal_file_path,
 						   char *wal_file_name, int batch_size, bool validate_wal);
+extern void do_index_wal(InstanceConfig *instance);
 
 /* in configure.c */
 extern void do_show_config(void);
@@ -879,6 +1029,7 @@ extern void help_command(char *command);
 
 /* in validate.c */
 extern void pgBackupValidate(pgBackup* backup, pgRestoreParams *params);
+extern void pgBackupValidateList(parray *backups);
 extern int do_validate_all(void);
 extern int validate_one_page(Page page, BlockNumber absolute_blkno,
 							 XLogRecPtr stop_lsn, PageState *page_st,
@@ -906,6 +1057,7 @@ extern const char *pgBackupGetBackupMode(pgBackup *backup);
 
 extern parray *catalog_get_instance_list(void);
 extern parray *catalog_get_backup_list(const char *instance_name, time_t requested_backup_id);
+extern void catalog_drop_index(const char *instance_name, bool wal_only);
 extern void catalog_lock_backup_list(parray *backup_list, int from_idx,
 									 int to_idx, bool strict, bool exclusive);
 extern pgBackup *catalog_get_last_data_backup(parray *backup_list,
@@ -916,6 +1068,8 @@ extern pgBackup *get_multi_timeline_parent(parray *backup_list, parray *tli_list
 						  InstanceConfig *instance);
 extern void timelineInfoFree(void *tliInfo);
 extern parray *catalog_get_timelines(InstanceConfig *instance);
+extern bool timelineKeepsSegment(timelineInfo *tlinfo, XLogSegNo segno,
+								 uint32 xlog_seg_size);
 extern void do_set_backup(const char *instance_name, time_t backup_id,
 							pgSetBackupParams *set_backup_params);
 extern void pin_backup(pgBackup	*target_backup,
@@ -957,6 +1111,8 @@ extern void wait_ssh(void);
 
 #define COMPRESS_ALG_DEFAULT NOT_DEFINED_COMPRESS
 #define COMPRESS_LEVEL_DEFAULT 1
+#define COMPRESS_LEVEL_MAX 9
+#define COMPRESS_LEVEL_MAX_ZSTD 22
 
 extern CompressAlg parse_compress_alg(const char *arg);
 extern const char* deparse_compress_alg(int alg);
@@ -989,6 +1145,12 @@ extern void print_file_list(FILE *out, const parray *files, const char *root,
 							const char *external_prefix, parray *external_list);
 extern parray *dir_read_file_list(const char *root, const char *external_prefix,
 								  const char *file_txt, fio_location location, pg_crc32 expected_crc);
+extern FileListReader *filelist_open(const char *file_txt, fio_location location);
+extern pgFile *filelist_next(FileListReader *reader);
+extern bool filelist_is_binary(FileListReader *reader);
+extern bool filelist_close(FileListReader *reader, pg_crc32 expected_crc);
+extern pgFile *filelist_lookup(const char *file_txt, const char *rel_path,
+							   int external_dir_num);
 extern parray *make_external_directory_list(const char *colon_separated_dirs,
 											bool remap);
 extern void free_dir_list(parray *list);
@@ -1013,6 +1175,8 @@ extern void pgFileFree(void *file);
 
 extern pg_crc32 pgFileGetCRC(const char *file_path, bool use_crc32c, bool missing_ok);
 extern pg_crc32 pgFileGetCRCgz(const char *file_path, bool use_crc32c, bool missing_ok);
+extern pg_crc32 pgFileGetCRCstream(const char *file_path, CompressAlg alg,
+								   bool use_crc32c, bool missing_ok);
 
 extern int pgFileMapComparePath(const void *f1, const void *f2);
 extern int pgFileCompareName(const void *f1, const void *f2);
@@ -1022,6 +1186,16 @@ extern int pgFileCompareLinked(const void *f1, const void *f2);
 extern int pgFileCompareSize(const void *f1, const void *f2);
 extern int pgCompareOid(const void *f1, const void *f2);
 
+/* queue of files shared by worker threads */
+extern FileQueue *file_queue_init(parray *files, int n_threads);
+extern void file_queue_split(FileQueue *queue, pgFile *file, BlockNumber range_blocks);
+extern int file_queue_size(FileQueue *queue);
+extern pgFile *file_queue_next(FileQueue *queue, int thread_num, int *pos);
+extern pgFile *file_queue_next_range(FileQueue *queue, int thread_num, int *pos,
+									 BlockNumber *start_blk, BlockNumber *end_blk);
+extern void file_queue_report(FileQueue *queue, const char *action);
+extern void file_queue_free(FileQueue *queue);
+
 /* in data.c */
 extern bool check_data_file(ConnectionArgs *arguments, pgFile *file,
 							const char *from_fullpath, uint32 checksum_version);
@@ -1031,7 +1205,8 @@ extern void backup_data_file(ConnectionArgs* conn_arg, pgFile *file,
 								 XLogRecPtr prev_backup_start_lsn, BackupMode backup_mode,
 								 CompressAlg calg, int clevel, uint32 checksum_version,
 								 int ptrack_version_num, const char *ptrack_schema,
-								 HeaderMap *hdr_map, bool missing_ok);
+								 HeaderMap *hdr_map, bool missing_ok,
+								 BackupStageStats *stats);
 extern void backup_non_data_file(pgFile *file, pgFile *prev_file,
 								 const char *from_fullpath, const char *to_fullpath,
 								 BackupMode backup_mode, time_t parent_backup_time,
@@ -1040,13 +1215,22 @@ extern void backup_non_data_file_internal(const char *from_fullpath,
 										  fio_location from_location,
 										  const char *to_fullpath, pgFile *file,
 										  bool missing_ok);
+extern bool dedup_non_data_file(pgFile *file, pgFile *dedup_file,
+								const char *from_fullpath, const char *dedup_fullpath,
+								const char *to_fullpath, time_t dedup_backup_time,
+								DedupMode mode);
+extern bool link_backup_file(const char *from_fullpath, const char *to_fullpath,
+							 DedupMode mode);
 
 extern size_t restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
-								const char *to_fullpath, bool use_bitmap, PageState *checksum_map,
+								const char *to_fullpath, bool use_bitmap,
 								XLogRecPtr shift_lsn, datapagemap_t *lsn_map, bool use_headers);
+extern size_t restore_data_file_range(parray *parent_chain, pgFile *dest_file, FILE *out,
+									  const char *to_fullpath, bool use_bitmap,
+									  BlockNumber start_blk, BlockNumber end_blk);
 extern size_t restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_version,
 										 const char *from_fullpath, const char *to_fullpath, int nblocks,
-										 datapagemap_t *map, PageState *checksum_map, int checksum_version,
+										 datapagemap_t *map, int checksum_version,
 										 datapagemap_t *lsn_map, BackupPageHeader2 *headers);
 extern size_t restore_non_data_file(parray *parent_chain, pgBackup *dest_backup,
 									pgFile *dest_file, FILE *out, const char *to_fullpath,
@@ -1056,12 +1240,16 @@ extern void restore_non_data_file_internal(FILE *in, FILE *out, pgFile *file,
 extern bool create_empty_file(fio_location from_location, const char *to_root,
 							  fio_location to_location, pgFile *file);
 
-extern PageState *get_checksum_map(const char *fullpath, uint32 checksum_version,
-								int n_blocks, XLogRecPtr dest_stop_lsn, BlockNumber segmentno);
+extern PageState *get_checksum_map_from_headers(parray *parent_chain, pgFile *dest_file);
+extern datapagemap_t *get_checksum_diff_map(const char *fullpath, uint32 checksum_version,
+											int n_blocks, XLogRecPtr dest_stop_lsn,
+											BlockNumber segmentno, const PageState *checksum_map);
 extern datapagemap_t *get_lsn_map(const char *fullpath, uint32 checksum_version,
 								  int n_blocks, XLogRecPtr shift_lsn, BlockNumber segmentno);
 extern pid_t check_postmaster(const char *pgdata);
 
+extern bool validate_file_headers(pgFile *file, const char *fullpath,
+								  uint32 backup_version, HeaderMap *hdr_map);
 extern bool validate_file_pages(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
 							    uint32 checksum_version, uint32 backup_version, HeaderMap *hdr_map);
 
@@ -1069,6 +1257,7 @@ extern BackupPageHeader2* get_data_file_headers(HeaderMap *hdr_map, pgFile *file
 extern void write_page_headers(BackupPageHeader2 *headers, pgFile *file, HeaderMap *hdr_map, bool is_merge);
 extern void init_header_map(pgBackup *backup);
 extern void cleanup_header_map(HeaderMap *hdr_map);
+extern void reopen_header_map(HeaderMap *hdr_map, bool is_merge);
 /* parsexlog.c */
 extern bool extractPageMap(const char *archivedir, uint32 wal_seg_size,
 						   XLogRecPtr startpoint, TimeLineID start_tli,
@@ -1086,6 +1275,12 @@ extern bool read_recovery_info(const char *archivedir, TimeLineID tli,
 							   time_t *recovery_time);
 extern bool wal_contains_lsn(const char *archivedir, XLogRecPtr target_lsn,
 							 TimeLineID target_tli, uint32 seg_size);
+extern bool summarize_wal(const char *archivedir, TimeLineID tli,
+						  uint32 seg_size, XLogSegNo begin_segno,
+						  XLogSegNo end_segno);
+extern void get_wal_summary_range(const char *archivedir, TimeLineID tli,
+								  size_t *n_segments, time_t *min_time,
+								  time_t *max_time);
 extern XLogRecPtr get_prior_record_lsn(const char *archivedir, XLogRecPtr start_lsn,
 								   XLogRecPtr stop_lsn, TimeLineID tli,
 								   bool seek_prev_segment, uint32 seg_size);
@@ -1106,7 +1301,7 @@ extern pg_crc32c get_pgcontrol_checksum(const char *pgdata_path);
 extern uint32 get_xlog_seg_size(char *pgdata_path);
 extern void get_redo(const char *pgdata_path, RedoParams *redo);
 extern void set_min_recovery_point(pgFile *file, const char *backup_path,
-								   XLogRecPtr stop_backup_lsn);
+								   XLogRecPtr stop_backup_lsn, TimeLineID tli);
 extern void copy_pgcontrol_file(const char *from_fullpath, fio_location from_location,
 					const char *to_fullpath, fio_location to_location, pgFile *file);
 
@@ -1124,6 +1319,23 @@ extern int32  do_compress(void* dst, size_t dst_size, void const* src, size_t sr
 extern int32  do_decompress(void* dst, size_t dst_size, void const* src, size_t src_size,
 							CompressAlg alg, const char **errormsg);
 
+/* streaming compression of WAL segments, in data.c */
+typedef struct CompressStream CompressStream;
+typedef size_t (*compress_stream_write_cb) (void *arg, const void *buf, size_t size);
+
+extern const char *compress_stream_suffix(CompressAlg alg);
+extern CompressAlg compress_stream_alg_by_name(const char *path);
+extern bool compress_stream_supported(CompressAlg alg);
+extern CompressStream *compress_stream_init(CompressAlg alg, int level, bool decompress,
+											compress_stream_write_cb write_cb, void *write_arg,
+											const char **errormsg);
+extern int compress_stream_process(CompressStream *cs, const void *buf, size_t size,
+								   bool finish, const char **errormsg);
+extern void compress_stream_free(CompressStream *cs);
+extern int decompress_file_stream(const char *path, CompressAlg alg,
+								  compress_stream_write_cb write_cb, void *write_arg,
+								  const char **errormsg);
+
 extern void pretty_size(int64 size, char *buf, size_t len);
 extern void pretty_time_interval(double time, char *buf, size_t len);
 
@@ -1156,7 +1368,8 @@ extern FILE* open_local_file_rw(const char *to_fullpath, char **out_buf, uint32
 extern int send_pages(ConnectionArgs* conn_arg, const char *to_fullpath, const char *from_fullpath,
 					  pgFile *file, XLogRecPtr prev_backup_start_lsn, CompressAlg calg, int clevel,
 					  uint32 checksum_version, bool use_pagemap, BackupPageHeader2 **headers,
-					  BackupMode backup_mode, int ptrack_version_num, const char *ptrack_schema);
+					  BackupMode backup_mode, int ptrack_version_num, const char *ptrack_schema,
+					  BackupStageStats *stats);
 
 /* FIO */
 extern void fio_delete(mode_t mode, const char *fullpath, fio_location location);
@@ -1166,19 +1379,24 @@ extern int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pg
 	                      BackupPageHeader2 **headers);
 /* return codes for fio_send_pages */
 extern int fio_send_file_gz(const char *from_fullpath, const char *to_fullpath, FILE* out, char **errormsg);
+extern int fio_send_file_stream(const char *from_fullpath, const char *to_fullpath, FILE* out,
+								CompressAlg alg, char **errormsg);
 extern int fio_send_file(const char *from_fullpath, const char *to_fullpath, FILE* out,
 														pgFile *file, char **errormsg);
 
 extern void fio_list_dir(parray *files, const char *root, bool exclude, bool follow_symlink,
-						 bool add_root, bool backup_logs, bool skip_hidden, int external_dir_num);
+						 bool add_root, bool backup_logs, bool skip_hidden, int external_dir_num,
+						 fio_location location);
+extern bool fio_dir_is_empty(const char *path, fio_location location);
 
 extern bool pgut_rmtree(const char *path, bool rmtopdir, bool strict);
 
 extern void pgut_setenv(const char *key, const char *val);
 extern void pgut_unsetenv(const char *key);
 
-extern PageState *fio_get_checksum_map(const char *fullpath, uint32 checksum_version, int n_blocks,
-									XLogRecPtr dest_stop_lsn, BlockNumber segmentno, fio_location location);
+extern datapagemap_t *fio_get_checksum_diff_map(const char *fullpath, uint32 checksum_version,
+							int n_blocks, XLogRecPtr dest_stop_lsn, BlockNumber segmentno,
+							const PageState *checksum_map, fio_location location);
 
 extern datapagemap_t *fio_get_lsn_map(const char *fullpath, uint32 checksum_version,
 							int n_blocks, XLogRecPtr horizonLsn, BlockNumber segmentno,
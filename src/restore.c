@@ -17,10 +17,17 @@
 
 #include "utils/thread.h"
 
+/*
+ * Data files bigger than this number of blocks are split into ranges
+ * of this size, which are restored by different threads.
+ */
+#define RESTORE_RANGE_BLOCKS	(128 * 1024 * 1024 / BLCKSZ)
+
 typedef struct
 {
 	parray	   *pgdata_files;
 	parray	   *dest_files;
+	FileQueue  *queue;
 	pgBackup   *dest_backup;
 	parray	   *dest_external_dirs;
 	parray	   *parent_chain;
@@ -31,6 +38,7 @@ typedef struct
 	bool        use_bitmap;
 	IncrRestoreMode        incremental_mode;
 	XLogRecPtr  shift_lsn;    /* used only in LSN incremental_mode */
+	int			thread_num;
 
 	/*
 	 * Return value from the thread.
@@ -708,8 +716,10 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 	/* arrays with meta info for multi threaded backup */
 	pthread_t  *threads;
 	restore_files_arg *threads_args;
+	FileQueue  *queue;
 	bool		restore_isok = true;
 	bool        use_bitmap = true;
+	bool		use_ranges = false;
 
 	/* fancy reporting */
 	char		pretty_dest_bytes[20];
@@ -819,7 +829,7 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 	}
 
 	/*
-	 * Setup directory structure for external directories and file locks
+	 * Setup directory structure for external directories
 	 */
 	for (i = 0; i < parray_num(dest_files); i++)
 	{
@@ -843,9 +853,6 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 			elog(VERBOSE, "Create external directory \"%s\"", dirpath);
 			fio_mkdir(dirpath, file->mode, FIO_DB_HOST);
 		}
-
-		/* setup threads */
-		pg_atomic_clear_flag(&file->lock);
 	}
 
 	/* Get list of files in destination directory and remove redundant files */
@@ -856,7 +863,8 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 		elog(INFO, "Extracting the content of destination directory for incremental restore");
 
 		time(&start_time);
-		fio_list_dir(pgdata_files, pgdata_path, false, true, false, false, true, 0);
+		fio_list_dir(pgdata_files, pgdata_path, false, true, false, false, true, 0,
+					 FIO_DB_HOST);
 
 		/*
 		 * TODO:
@@ -877,7 +885,7 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 				parray	*external_files = parray_new();
 
 				fio_list_dir(external_files, external_path,
-							 false, true, false, false, true, i+1);
+							 false, true, false, false, true, i+1, FIO_DB_HOST);
 
 				parray_concat(pgdata_files, external_files);
 				parray_free(external_files);
@@ -940,6 +948,58 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 		elog(INFO, "Redundant files are removed, time elapsed: %s", pretty_time);
 	}
 
+	/* largest files go first for load balancing */
+	queue = file_queue_init(dest_files, num_threads);
+
+	/*
+	 * Big data files are restored by several threads at once, every one of
+	 * them restores its own range of blocks. It requires page headers, which
+	 * are available since 2.4.0, and is not used by incremental restore.
+	 */
+	use_ranges = num_threads > 1 && params->incremental_mode == INCR_NONE;
+	for (i = 0; use_ranges && i < parray_num(parent_chain); i++)
+	{
+		pgBackup   *backup = (pgBackup *) parray_get(parent_chain, i);
+
+		if (parse_program_version(backup->program_version) < 20400)
+			use_ranges = false;
+	}
+
+	for (i = 0; use_ranges && i < parray_num(dest_files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(dest_files, i);
+		char		to_fullpath[MAXPGPATH];
+		FILE	   *out;
+
+		if (!S_ISREG(file->mode) || !file->is_datafile || file->is_cfs ||
+			file->external_dir_num != 0 || file->write_size == 0 ||
+			file->n_blocks < 2 * RESTORE_RANGE_BLOCKS)
+			continue;
+
+		/* files excluded by partial restore are created empty by restore_files() */
+		if (dbOid_exclude_list &&
+			parray_bsearch(dbOid_exclude_list, &file->dbOid, pgCompareOid))
+			continue;
+
+		/* Create the file, so that threads could open it without truncation */
+		join_path_components(to_fullpath, pgdata_path, file->rel_path);
+
+		out = fio_fopen(to_fullpath, PG_BINARY_W, FIO_DB_HOST);
+		if (out == NULL)
+			elog(ERROR, "Cannot open restore target file \"%s\": %s",
+				 to_fullpath, strerror(errno));
+
+		if (fio_chmod(to_fullpath, file->mode, FIO_DB_HOST) == -1)
+			elog(ERROR, "Cannot change mode of \"%s\": %s", to_fullpath,
+				 strerror(errno));
+
+		if (fio_fclose(out) != 0)
+			elog(ERROR, "Cannot close file \"%s\": %s", to_fullpath,
+				 strerror(errno));
+
+		file_queue_split(queue, file, RESTORE_RANGE_BLOCKS);
+	}
+
 	/*
 	 * Close ssh connection belonging to the main thread
 	 * to avoid the possibility of been killed for idleness
@@ -965,6 +1025,7 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 		restore_files_arg *arg = &(threads_args[i]);
 
 		arg->dest_files = dest_files;
+		arg->queue = queue;
 		arg->pgdata_files = pgdata_files;
 		arg->dest_backup = dest_backup;
 		arg->dest_external_dirs = external_dirs;
@@ -975,6 +1036,7 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 		arg->use_bitmap = use_bitmap;
 		arg->incremental_mode = params->incremental_mode;
 		arg->shift_lsn = params->shift_lsn;
+		arg->thread_num = i + 1;
 		threads_args[i].restored_bytes = 0;
 		/* By default there are some error */
 		threads_args[i].ret = 1;
@@ -995,6 +1057,9 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 		total_bytes += threads_args[i].restored_bytes;
 	}
 
+	file_queue_report(queue, "restored");
+	file_queue_free(queue);
+
 	time(&end_time);
 	pretty_time_interval(difftime(end_time, start_time),
 						 pretty_time, lengthof(pretty_time));
@@ -1099,33 +1164,32 @@ restore_files(void *arg)
 	char        to_fullpath[MAXPGPATH];
 	FILE       *out = NULL;
 	char       *out_buf = pgut_malloc(STDIO_BUFSIZE);
+	pgFile	   *dest_file;
+	BlockNumber	start_blk;
+	BlockNumber	end_blk;
 
 	restore_files_arg *arguments = (restore_files_arg *) arg;
 
-	n_files = (unsigned long) parray_num(arguments->dest_files);
+	n_files = (unsigned long) file_queue_size(arguments->queue);
 
-	for (i = 0; i < parray_num(arguments->dest_files); i++)
+	while ((dest_file = file_queue_next_range(arguments->queue, arguments->thread_num,
+											  &i, &start_blk, &end_blk)) != NULL)
 	{
 		bool     already_exists = false;
-		PageState      *checksum_map = NULL; /* it should take ~1.5MB at most */
 		datapagemap_t  *lsn_map = NULL;      /* it should take 16kB at most */
 		char           *errmsg = NULL;       /* remote agent error message */
-		pgFile	*dest_file = (pgFile *) parray_get(arguments->dest_files, i);
 
 		/* Directories were created before */
 		if (S_ISDIR(dest_file->mode))
 			continue;
 
-		if (!pg_atomic_test_set_flag(&dest_file->lock))
-			continue;
-
 		/* check for interrupt */
 		if (interrupted || thread_interrupted)
 			elog(ERROR, "Interrupted during restore");
 
 		if (progress)
 			elog(INFO, "Progress: (%d/%lu). Restore file \"%s\"",
-				 i + 1, n_files, dest_file->rel_path);
+				 i, n_files, dest_file->rel_path);
 
 		/* Only files from pgdata can be skipped by partial restore */
 		if (arguments->dbOid_exclude_list && dest_file->external_dir_num == 0)
@@ -1177,6 +1241,39 @@ restore_files(void *arg)
 			join_path_components(to_fullpath, external_path, dest_file->rel_path);
 		}
 
+		/*
+		 * Restore a range of blocks of big data file. The file was already
+		 * created by restore_chain(), other ranges are restored by other
+		 * threads at the same time.
+		 */
+		if (end_blk != InvalidBlockNumber)
+		{
+			out = fio_fopen(to_fullpath, PG_BINARY_R "+", FIO_DB_HOST);
+			if (out == NULL)
+				elog(ERROR, "Cannot open restore target file \"%s\": %s",
+					 to_fullpath, strerror(errno));
+
+			/* enable stdio buffering for local destination data file */
+			if (!fio_is_remote_file(out))
+				setvbuf(out, out_buf, _IOFBF, STDIO_BUFSIZE);
+
+			elog(VERBOSE, "Restoring blocks %u-%u of data file: \"%s\"",
+				 start_blk, end_blk - 1, to_fullpath);
+
+			arguments->restored_bytes += restore_data_file_range(arguments->parent_chain,
+																  dest_file, out, to_fullpath,
+																  arguments->use_bitmap,
+																  start_blk, end_blk);
+
+			if (fio_check_error_file(out, &errmsg))
+				elog(ERROR, "Cannot write to the remote file \"%s\": %s", to_fullpath, errmsg);
+
+			if (fio_fclose(out) != 0)
+				elog(ERROR, "Cannot close file \"%s\": %s", to_fullpath,
+					 strerror(errno));
+			continue;
+		}
+
 		if (arguments->incremental_mode != INCR_NONE &&
 			parray_bsearch(arguments->pgdata_files, dest_file, pgFileCompareRelPathWithExternalDesc))
 		{
@@ -1186,8 +1283,8 @@ restore_files(void *arg)
 		/*
 		 * Handle incremental restore case for data files.
 		 * If file is already exists in pgdata, then
-		 * we scan it block by block and get
-		 * array of checksums for every page.
+		 * we scan it block by block and find pages,
+		 * which are the same as in backup.
 		 */
 		if (already_exists &&
 			dest_file->is_datafile && !dest_file->is_cfs &&
@@ -1201,9 +1298,40 @@ restore_files(void *arg)
 			}
 			else if (arguments->incremental_mode == INCR_CHECKSUM)
 			{
-				checksum_map = fio_get_checksum_map(to_fullpath, arguments->dest_backup->checksum_version,
-													dest_file->n_blocks, arguments->dest_backup->stop_lsn,
-													dest_file->segno * RELSEG_SIZE, FIO_DB_HOST);
+				PageState      *checksum_map = NULL;
+				datapagemap_t  *diff_map = NULL;
+				BlockNumber     blknum;
+
+				/*
+				 * Expected checksums and LSNs are taken from page headers,
+				 * pages can be skipped only if bitmap is used for restore.
+				 */
+				if (arguments->use_bitmap)
+					checksum_map = get_checksum_map_from_headers(arguments->parent_chain,
+																 dest_file);
+
+				/* pages are compared by the agent, only the difference is sent back */
+				diff_map = fio_get_checksum_diff_map(to_fullpath,
+													 arguments->dest_backup->checksum_version,
+													 dest_file->n_blocks,
+													 arguments->dest_backup->stop_lsn,
+													 dest_file->segno * RELSEG_SIZE,
+													 checksum_map, FIO_DB_HOST);
+
+				/* mark unchanged pages as already restored */
+				if (diff_map)
+				{
+					for (blknum = 0; blknum < dest_file->n_blocks; blknum++)
+					{
+						if (!datapagemap_is_set(diff_map, blknum))
+							datapagemap_add(&(dest_file->pagemap), blknum);
+					}
+
+					pg_free(diff_map->bitmap);
+					pg_free(diff_map);
+				}
+
+				pg_free(checksum_map);
 			}
 		}
 
@@ -1248,7 +1376,7 @@ restore_files(void *arg)
 			/* Destination file is data file */
 			arguments->restored_bytes += restore_data_file(arguments->parent_chain,
 														   dest_file, out, to_fullpath,
-														   arguments->use_bitmap, checksum_map,
+														   arguments->use_bitmap,
 														   arguments->shift_lsn, lsn_map, true);
 		}
 		else
@@ -1279,7 +1407,6 @@ done:
 			pg_free(lsn_map->bitmap);
 
 		pg_free(lsn_map);
-		pg_free(checksum_map);
 	}
 
 	free(out_buf);
@@ -1992,22 +2119,9 @@ get_dbOid_exclude_list(pgBackup *backup, parray *datname_list,
 	pgFile		*database_map_file = NULL;
 	char		path[MAXPGPATH];
 	char		database_map_path[MAXPGPATH];
-	parray		*files = NULL;
-
-	files = get_backup_filelist(backup, true);
 
 	/* look for 'database_map' file in backup_content.control */
-	for (i = 0; i < parray_num(files); i++)
-	{
-		pgFile	   *file = (pgFile *) parray_get(files, i);
-
-		if ((file->external_dir_num == 0) &&
-			strcmp(DATABASE_MAP, file->name) == 0)
-		{
-			database_map_file = file;
-			break;
-		}
-	}
+	database_map_file = get_backup_file(backup, DATABASE_MAP, 0);
 
 	if (!database_map_file)
 		elog(ERROR, "Backup %s doesn't contain a database_map, partial restore is impossible.",
@@ -2106,12 +2220,7 @@ get_dbOid_exclude_list(pgBackup *backup, parray *datname_list,
 		elog(ERROR, "Failed to find a match in database_map of backup %s for partial restore",
 					base36enc(backup->start_time));
 
-	/* clean backup filelist */
-	if (files)
-	{
-		parray_walk(files, pgFileFree);
-		parray_free(files);
-	}
+	pgFileFree(database_map_file);
 
 	/* sort dbOid array in ASC order */
 	parray_qsort(dbOid_exclude_list, pgCompareOid);
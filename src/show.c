@@ -64,8 +64,8 @@ static void show_instance_json(const char *instance_name, parray *backup_list);
 static void show_instance_archive(InstanceConfig *instance);
 static void show_archive_plain(const char *instance_name, uint32 xlog_seg_size,
 							   parray *timelines_list, bool show_name);
-static void show_archive_json(const char *instance_name, uint32 xlog_seg_size,
-							  parray *tli_list);
+static void show_archive_json(const char *instance_name, const char *arclog_path,
+							  uint32 xlog_seg_size, parray *tli_list);
 
 static PQExpBufferData show_buf;
 static bool first_instance = true;
@@ -777,13 +777,16 @@ static void
 show_instance_archive(InstanceConfig *instance)
 {
 	parray *timelineinfos;
+	char		arclog_path[MAXPGPATH];
 
 	timelineinfos = catalog_get_timelines(instance);
+	sprintf(arclog_path, "%s/%s/%s", backup_path, "wal", instance->name);
 
 	if (show_format == SHOW_PLAIN)
 		show_archive_plain(instance->name, instance->xlog_seg_size, timelineinfos, true);
 	else if (show_format == SHOW_JSON)
-		show_archive_json(instance->name, instance->xlog_seg_size, timelineinfos);
+		show_archive_json(instance->name, arclog_path,
+						  instance->xlog_seg_size, timelineinfos);
 	else
 		elog(ERROR, "Invalid show format %d", (int) show_format);
 }
@@ -977,8 +980,8 @@ show_archive_plain(const char *instance_name, uint32 xlog_seg_size,
 }
 
 static void
-show_archive_json(const char *instance_name, uint32 xlog_seg_size,
-				  parray *tli_list)
+show_archive_json(const char *instance_name, const char *arclog_path,
+				  uint32 xlog_seg_size, parray *tli_list)
 {
 	int			i,j;
 	PQExpBuffer	buf = &show_buf;
@@ -1013,7 +1016,11 @@ show_archive_json(const char *instance_name, uint32 xlog_seg_size,
 	{
 		timelineInfo  *tlinfo = (timelineInfo  *) parray_get(actual_tli_list, i);
 		char		tmp_buf[MAXFNAMELEN];
+		char		timestamp[100];
 		float		zratio = 0;
+		size_t		n_indexed;
+		time_t		min_time;
+		time_t		max_time;
 
 		if (i != (parray_num(actual_tli_list) - 1))
 			appendPQExpBufferChar(buf, ',');
@@ -1049,6 +1056,25 @@ show_archive_json(const char *instance_name, uint32 xlog_seg_size,
 			zratio = ((float)xlog_seg_size*tlinfo->n_xlog_files) / tlinfo->size;
 		appendPQExpBuffer(buf, "%.2f", zratio);
 
+		/* Segments indexed by index-wal, validate or restore */
+		get_wal_summary_range(arclog_path, tlinfo->tli, &n_indexed,
+							  &min_time, &max_time);
+
+		json_add_key(buf, "n-indexed-segments", json_level);
+		appendPQExpBuffer(buf, "%lu", (unsigned long) n_indexed);
+
+		if (min_time != 0)
+		{
+			time2iso(timestamp, lengthof(timestamp), min_time, false);
+			json_add_value(buf, "min-indexed-time", timestamp, json_level, true);
+		}
+
+		if (max_time != 0)
+		{
+			time2iso(timestamp, lengthof(timestamp), max_time, false);
+			json_add_value(buf, "max-indexed-time", timestamp, json_level, true);
+		}
+
 		if (tlinfo->closest_backup != NULL)
 			snprintf(tmp_buf, lengthof(tmp_buf), "%s",
 						base36enc(tlinfo->closest_backup->start_time));
@@ -173,6 +173,29 @@ StreamLog(void *arg)
 
     xlog_files_list = parray_new();
 
+	/*
+	 * When backup is resumed, segments between start_lsn and startpos
+	 * were streamed before the interruption, add them to the list as well.
+	 */
+	if (stream_arg->startpos > current.start_lsn)
+	{
+		XLogSegNo	segno;
+		XLogSegNo	startsegno;
+
+		GetXLogSegNo(current.start_lsn, segno, instance_config.xlog_seg_size);
+		GetXLogSegNo(stream_arg->startpos, startsegno, instance_config.xlog_seg_size);
+
+		for (; segno < startsegno; segno++)
+		{
+			XLogRecPtr	segend;
+
+			GetXLogRecPtr(segno + 1, 0, instance_config.xlog_seg_size, segend);
+			add_walsegment_to_filelist(xlog_files_list, stream_arg->starttli, segend,
+									   (char *) stream_arg->basedir,
+									   instance_config.xlog_seg_size);
+		}
+	}
+
 	/* Initialize timeout */
 	stream_stop_begin = 0;
 
@@ -380,8 +403,11 @@ start_WAL_streaming(PGconn *backup_conn, char *stream_dst_path, ConnectionOption
 
 	/* Set error exit code as default */
 	stream_thread_arg.ret = 1;
-	/* we must use startpos as start_lsn from start_backup */
-	stream_thread_arg.startpos = current.start_lsn;
+	/*
+	 * startpos is start_lsn from start_backup, or the last segment streamed
+	 * before the interruption if backup is resumed
+	 */
+	stream_thread_arg.startpos = startpos;
 	stream_thread_arg.starttli = current.tli;
 
 	thread_interrupted = false;
@@ -390,7 +390,7 @@ get_redo(const char *pgdata_path, RedoParams *redo)
  */
 void
 set_min_recovery_point(pgFile *file, const char *backup_path,
-					   XLogRecPtr stop_backup_lsn)
+					   XLogRecPtr stop_backup_lsn, TimeLineID tli)
 {
 	ControlFileData ControlFile;
 	char       *buffer;
@@ -411,6 +411,18 @@ set_min_recovery_point(pgFile *file, const char *backup_path,
 
 	ControlFile.minRecoveryPoint = stop_backup_lsn;
 
+	/*
+	 * backup_label of resumed backup taken from master claims that
+	 * it was taken from standby, and postgres expects pg_control of
+	 * such backup to be in recovery state.
+	 */
+	if (ControlFile.state != DB_IN_ARCHIVE_RECOVERY &&
+		ControlFile.state != DB_SHUTDOWNED_IN_RECOVERY)
+	{
+		ControlFile.state = DB_IN_ARCHIVE_RECOVERY;
+		ControlFile.minRecoveryPointTLI = tli;
+	}
+
 	/* Update checksum in pg_control header */
 	INIT_CRC32C(ControlFile.crc);
 	COMP_CRC32C(ControlFile.crc, (char *) &ControlFile,
@@ -481,6 +481,48 @@ config_get_opt(int argc, char **argv, ConfigOption cmd_options[],
 	return optind;
 }
 
+/*
+ * Parse single line of configuration file.
+ * Return true if the line contains an option.
+ */
+static bool
+config_parse_line(char *buf, const char *path, ConfigOption options[],
+				  int elevel, bool strict)
+{
+	char	key[1024];
+	char	value[2048];
+	size_t	i;
+
+	for (i = strlen(buf); i > 0 && IsSpace(buf[i - 1]); i--)
+		buf[i - 1] = '\0';
+
+	if (parse_pair(buf, key, value))
+	{
+		for (i = 0; options[i].type; i++)
+		{
+			ConfigOption *opt = &options[i];
+
+			if (key_equals(key, opt->lname))
+			{
+				if (opt->allowed < SOURCE_FILE &&
+					opt->allowed != SOURCE_FILE_STRICT)
+					elog(elevel, "Option %s cannot be specified in file",
+						 opt->lname);
+				else if (opt->source <= SOURCE_FILE)
+				{
+					assign_option(opt, value, SOURCE_FILE);
+					return true;
+				}
+				break;
+			}
+		}
+		if (strict && !options[i].type)
+			elog(elevel, "Invalid option \"%s\" in file \"%s\"", key, path);
+	}
+
+	return false;
+}
+
 /*
  * Get configuration from configuration file.
  * Return number of parsed options.
@@ -491,8 +533,6 @@ config_read_opt(const char *path, ConfigOption options[], int elevel,
 {
 	FILE   *fp;
 	char	buf[4096];
-	char	key[1024];
-	char	value[2048];
 	int		parsed_options = 0;
 
 	if (!options)
@@ -503,34 +543,8 @@ config_read_opt(const char *path, ConfigOption options[], int elevel,
 
 	while (fgets(buf, lengthof(buf), fp))
 	{
-		size_t		i;
-
-		for (i = strlen(buf); i > 0 && IsSpace(buf[i - 1]); i--)
-			buf[i - 1] = '\0';
-
-		if (parse_pair(buf, key, value))
-		{
-			for (i = 0; options[i].type; i++)
-			{
-				ConfigOption *opt = &options[i];
-
-				if (key_equals(key, opt->lname))
-				{
-					if (opt->allowed < SOURCE_FILE &&
-						opt->allowed != SOURCE_FILE_STRICT)
-						elog(elevel, "Option %s cannot be specified in file",
-							 opt->lname);
-					else if (opt->source <= SOURCE_FILE)
-					{
-						assign_option(opt, value, SOURCE_FILE);
-						parsed_options++;
-					}
-					break;
-				}
-			}
-			if (strict && !options[i].type)
-				elog(elevel, "Invalid option \"%s\" in file \"%s\"", key, path);
-		}
+		if (config_parse_line(buf, path, options, elevel, strict))
+			parsed_options++;
 	}
 
 	if (ferror(fp))
@@ -541,6 +555,41 @@ config_read_opt(const char *path, ConfigOption options[], int elevel,
 	return parsed_options;
 }
 
+/*
+ * Get configuration from the content of configuration file, which was
+ * already read into memory. Path is used only for reporting.
+ * Return number of parsed options.
+ */
+int
+config_read_opt_buffer(const char *path, const char *content,
+					   ConfigOption options[], int elevel, bool strict)
+{
+	char	buf[4096];
+	int		parsed_options = 0;
+
+	if (!options)
+		return parsed_options;
+
+	while (*content)
+	{
+		size_t	len = strcspn(content, "\n");
+
+		/* the same limit of line length, as for fgets() */
+		len = Min(len, lengthof(buf) - 1);
+		memcpy(buf, content, len);
+		buf[len] = '\0';
+
+		content += len;
+		if (*content == '\n')
+			content++;
+
+		if (config_parse_line(buf, path, options, elevel, strict))
+			parsed_options++;
+	}
+
+	return parsed_options;
+}
+
 /*
  * Process options passed as environment variables.
  */
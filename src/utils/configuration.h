@@ -79,6 +79,8 @@ extern int config_get_opt(int argc, char **argv, ConfigOption cmd_options[],
 						  ConfigOption options[]);
 extern int config_read_opt(const char *path, ConfigOption options[], int elevel,
 						   bool strict, bool missing_ok);
+extern int config_read_opt_buffer(const char *path, const char *content,
+								  ConfigOption options[], int elevel, bool strict);
 extern void config_get_opt_env(ConfigOption options[]);
 extern void config_set_opt(ConfigOption options[], void *var,
 						   OptionSource source);
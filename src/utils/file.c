@@ -1,5 +1,6 @@
 #include <stdio.h>
 #include <unistd.h>
+#include <fcntl.h>
 #include <sys/stat.h>
 
 #include "pg_probackup.h"
@@ -17,6 +18,90 @@ static __thread int fio_stderr = 0;
 static char *async_errormsg = NULL;
 
 fio_location MyLocation;
+IoMode io_mode = IO_MODE_BUFFERED;
+int    io_depth = 1;
+
+/*
+ * Buffer and file offset alignment required by O_DIRECT.
+ * 4kB is enough for all common filesystems and devices.
+ */
+#define FIO_DIRECT_ALIGN 4096
+
+/*
+ * Size of read window for sequential reading of relation files.
+ * Kernel readahead does not work for O_DIRECT, so direct reads are
+ * issued by larger chunks.
+ */
+#define FIO_READ_WINDOW			STDIO_BUFSIZE
+#define FIO_DIRECT_READ_WINDOW	(128 * BLCKSZ)
+
+/*
+ * Asynchronous reading of relation files is done with io_uring,
+ * if PostgreSQL is built with liburing, or with Linux native AIO
+ * otherwise. The latter is truly asynchronous only for O_DIRECT
+ * reads, buffered reads are mostly served by kernel readahead.
+ */
+#if defined(USE_LIBURING)
+#include <liburing.h>
+#define FIO_HAVE_ASYNC_READ
+#elif defined(__linux__)
+#include <sys/syscall.h>
+#include <linux/aio_abi.h>
+#if defined(__NR_io_setup) && defined(__NR_io_submit) && defined(__NR_io_getevents)
+#define FIO_HAVE_ASYNC_READ
+#define FIO_USE_LINUX_AIO
+#endif
+#endif
+
+/* One asynchronous read, issued by fio_block_reader */
+typedef struct
+{
+	char	   *buf;
+	off_t		offs;
+	size_t		size;		/* number of bytes requested */
+	ssize_t		len;		/* result of the read, negative errno on failure */
+	bool		in_flight;
+#ifdef FIO_USE_LINUX_AIO
+	struct iocb	iocb;
+#endif
+} fio_read_slot;
+
+struct fio_block_reader
+{
+	int		fd;
+	IoMode	mode;
+	char   *buf_raw;	/* allocated memory */
+	char   *buf;		/* read window, aligned for O_DIRECT */
+	size_t	buf_size;
+	off_t	buf_offs;	/* file offset of the read window */
+	size_t	buf_len;	/* number of valid bytes in the read window */
+
+	/* read-ahead state, used when io_depth > 1 */
+	int		depth;		/* number of slots, 0 if reading is synchronous */
+	fio_read_slot *slots;	/* ring of reads in file offset order */
+	char   *slots_raw;
+	int		head;		/* the oldest slot */
+	int		n_slots;	/* number of slots in use */
+	size_t	slot_size;
+	off_t	file_size;	/* reads beyond the size known at open are synchronous */
+	off_t	next_offs;	/* next window to read for sequential reading */
+	datapagemap_iterator_t *pagemap_iter;	/* blocks to read, if not sequential */
+	BlockNumber next_blknum;	/* the block taken from the pagemap, but not read yet */
+	bool	have_next_blknum;
+	bool	submit_failed;	/* stop reading ahead after submission failure */
+#if defined(USE_LIBURING)
+	struct io_uring ring;
+#elif defined(FIO_USE_LINUX_AIO)
+	aio_context_t aio_ctx;
+#endif
+};
+
+static void fio_block_reader_start_async(fio_block_reader *reader, int depth);
+static void fio_block_reader_stop_async(fio_block_reader *reader, bool wait);
+static int fio_block_reader_read_ahead(fio_block_reader *reader, off_t offs, char *page);
+#ifdef FIO_HAVE_ASYNC_READ
+static void fio_block_reader_prefetch(fio_block_reader *reader);
+#endif
 
 typedef struct
 {
@@ -28,6 +113,8 @@ typedef struct
 	int         clevel;
 	int         bitmapsize;
 	int         path_len;
+	int         io_mode;
+	int         io_depth;
 } fio_send_request;
 
 
@@ -56,6 +143,7 @@ typedef struct
 	ForkName   forkName;
 	int     segno;
 	int     external_dir_num;
+	int     path_len;
 	int     linked_len;
 } fio_pgFile;
 
@@ -65,6 +153,7 @@ typedef struct
 	BlockNumber segmentno;
 	XLogRecPtr  stop_lsn;
 	uint32      checksumVersion;
+	bool        with_checksum_map;	/* array of expected PageState follows */
 } fio_checksum_map_request;
 
 typedef struct
@@ -648,6 +737,523 @@ int fio_pread(FILE* f, void* buf, off_t offs)
 	}
 }
 
+/*
+ * Tell the kernel that cached pages of the file in the given range will
+ * not be needed anymore. Zero len means "up to the end of the file".
+ * Dirty pages are not dropped, so the file should be synced first.
+ */
+void
+fio_drop_cache(int fd, off_t offs, off_t len)
+{
+#if defined(HAVE_POSIX_FADVISE) && defined(POSIX_FADV_DONTNEED)
+	(void) posix_fadvise(fd, offs, len, POSIX_FADV_DONTNEED);
+#endif
+}
+
+/*
+ * Open local relation file for reading block by block.
+ *
+ * In IO_MODE_DIRECT file is opened with O_DIRECT, so neither reading
+ * pollutes the page cache, nor it is affected by cache state. If the
+ * filesystem doesn't support O_DIRECT (e.g. tmpfs), we fall back to
+ * IO_MODE_DONTNEED, when pages are evicted from the cache right after
+ * they were read.
+ *
+ * If 'pagemap_iter' is NULL, the file is read sequentially by chunks of
+ * FIO_READ_WINDOW (or FIO_DIRECT_READ_WINDOW) size. Otherwise only the
+ * blocks returned by the iterator are going to be read, and the reader
+ * takes ownership of the iterator.
+ * If 'depth' is greater than one, up to 'depth' reads are kept in flight
+ * ahead of the caller. If asynchronous I/O is not available, the file
+ * is read synchronously.
+ *
+ * Returns NULL and sets errno in case of error.
+ */
+fio_block_reader *
+fio_block_reader_open(char const* path, IoMode mode, int depth,
+					  datapagemap_iterator_t *pagemap_iter)
+{
+	fio_block_reader *reader;
+	bool	sequential = (pagemap_iter == NULL);
+	int		fd = -1;
+
+#ifdef O_DIRECT
+	if (mode == IO_MODE_DIRECT)
+	{
+		fd = open(path, O_RDONLY | PG_BINARY | O_DIRECT, 0);
+		if (fd < 0 && errno != EINVAL)
+			return NULL;
+	}
+#endif
+
+	if (fd < 0)
+	{
+		if (mode == IO_MODE_DIRECT)
+			mode = IO_MODE_DONTNEED;
+
+		fd = open(path, O_RDONLY | PG_BINARY, 0);
+		if (fd < 0)
+			return NULL;
+	}
+
+#if defined(HAVE_POSIX_FADVISE) && defined(POSIX_FADV_SEQUENTIAL)
+	if (mode == IO_MODE_DONTNEED && sequential)
+		(void) posix_fadvise(fd, 0, 0, POSIX_FADV_SEQUENTIAL);
+#endif
+
+	reader = pgut_new(fio_block_reader);
+	memset(reader, 0, sizeof(fio_block_reader));
+	reader->fd = fd;
+	reader->mode = mode;
+	reader->pagemap_iter = pagemap_iter;
+
+	if (!sequential)
+		reader->buf_size = BLCKSZ;
+	else if (mode == IO_MODE_DIRECT)
+		reader->buf_size = FIO_DIRECT_READ_WINDOW;
+	else
+		reader->buf_size = FIO_READ_WINDOW;
+
+	reader->buf_raw = pgut_malloc(reader->buf_size + FIO_DIRECT_ALIGN);
+	reader->buf = (char *) TYPEALIGN(FIO_DIRECT_ALIGN, reader->buf_raw);
+
+	if (depth > 1)
+		fio_block_reader_start_async(reader, depth);
+
+	return reader;
+}
+
+#ifdef FIO_HAVE_ASYNC_READ
+
+/*
+ * Set up asynchronous I/O context and start reading ahead.
+ * If the context cannot be created (e.g. io_uring is disabled
+ * or AIO limit is exhausted), the reader stays synchronous.
+ */
+static void
+fio_block_reader_start_async(fio_block_reader *reader, int depth)
+{
+	struct stat st;
+	int		i;
+
+	depth = Min(depth, FIO_MAX_IO_DEPTH);
+
+	if (fstat(reader->fd, &st) < 0)
+		return;
+
+#if defined(USE_LIBURING)
+	if (io_uring_queue_init(depth, &reader->ring, 0) < 0)
+		return;
+#else
+	reader->aio_ctx = 0;
+	if (syscall(__NR_io_setup, depth, &reader->aio_ctx) < 0)
+		return;
+#endif
+
+	reader->depth = depth;
+	reader->file_size = st.st_size;
+	reader->slot_size = reader->mode == IO_MODE_DIRECT ?
+		FIO_DIRECT_READ_WINDOW : FIO_READ_WINDOW;
+
+	reader->slots = pgut_newarray(fio_read_slot, depth);
+	memset(reader->slots, 0, sizeof(fio_read_slot) * depth);
+	reader->slots_raw = pgut_malloc(reader->slot_size * depth + FIO_DIRECT_ALIGN);
+
+	for (i = 0; i < depth; i++)
+		reader->slots[i].buf = (char *) TYPEALIGN(FIO_DIRECT_ALIGN, reader->slots_raw) +
+			reader->slot_size * i;
+
+	fio_block_reader_prefetch(reader);
+}
+
+/*
+ * Get the next range of the file to read ahead:
+ * the next window in case of sequential reading, or the next run
+ * of consecutive blocks from the pagemap, limited by the slot size.
+ */
+static bool
+fio_block_reader_next_range(fio_block_reader *reader, off_t *offs, size_t *size)
+{
+	BlockNumber	first;
+	BlockNumber	last;
+
+	if (!reader->pagemap_iter)
+	{
+		if (reader->next_offs >= reader->file_size)
+			return false;
+
+		*offs = reader->next_offs;
+		*size = reader->slot_size;
+		reader->next_offs += reader->slot_size;
+		return true;
+	}
+
+	if (!reader->have_next_blknum &&
+		!datapagemap_next(reader->pagemap_iter, &reader->next_blknum))
+		return false;
+
+	first = last = reader->next_blknum;
+	reader->have_next_blknum = false;
+
+	if ((off_t) first * BLCKSZ >= reader->file_size)
+		return false;
+
+	while ((last - first + 1) * BLCKSZ < reader->slot_size &&
+		   datapagemap_next(reader->pagemap_iter, &reader->next_blknum))
+	{
+		if (reader->next_blknum != last + 1)
+		{
+			reader->have_next_blknum = true;
+			break;
+		}
+		last++;
+	}
+
+	*offs = (off_t) first * BLCKSZ;
+	*size = (last - first + 1) * BLCKSZ;
+	return true;
+}
+
+/* Queue reads ahead, until all slots are in use */
+static void
+fio_block_reader_prefetch(fio_block_reader *reader)
+{
+	int		n_submit = 0;
+	int		n_submitted;
+	int		i;
+#ifdef FIO_USE_LINUX_AIO
+	struct iocb *iocbs[FIO_MAX_IO_DEPTH];
+#endif
+
+	while (!reader->submit_failed && reader->n_slots < reader->depth)
+	{
+		fio_read_slot *slot = &reader->slots[(reader->head + reader->n_slots) % reader->depth];
+
+		if (!fio_block_reader_next_range(reader, &slot->offs, &slot->size))
+			break;
+
+		slot->len = 0;
+		slot->in_flight = true;
+		reader->n_slots++;
+
+#if defined(USE_LIBURING)
+		{
+			struct io_uring_sqe *sqe = io_uring_get_sqe(&reader->ring);
+
+			io_uring_prep_read(sqe, reader->fd, slot->buf, slot->size, slot->offs);
+			io_uring_sqe_set_data(sqe, slot);
+		}
+#else
+		memset(&slot->iocb, 0, sizeof(slot->iocb));
+		slot->iocb.aio_data = (uint64) (uintptr_t) slot;
+		slot->iocb.aio_lio_opcode = IOCB_CMD_PREAD;
+		slot->iocb.aio_fildes = reader->fd;
+		slot->iocb.aio_buf = (uint64) (uintptr_t) slot->buf;
+		slot->iocb.aio_nbytes = slot->size;
+		slot->iocb.aio_offset = slot->offs;
+		iocbs[n_submit] = &slot->iocb;
+#endif
+		n_submit++;
+	}
+
+	if (n_submit == 0)
+		return;
+
+#if defined(USE_LIBURING)
+	n_submitted = io_uring_submit(&reader->ring);
+#else
+	n_submitted = syscall(__NR_io_submit, reader->aio_ctx, n_submit, iocbs);
+#endif
+
+	if (n_submitted == n_submit)
+		return;
+
+	/*
+	 * Submission failed. The slots which were not queued are marked
+	 * as failed, so they are read synchronously, and reading ahead
+	 * is stopped, when the caller gets to them.
+	 */
+	reader->submit_failed = true;
+
+	for (i = Max(n_submitted, 0); i < n_submit; i++)
+	{
+		fio_read_slot *slot = &reader->slots[(reader->head + reader->n_slots - n_submit + i) % reader->depth];
+
+		slot->in_flight = false;
+		slot->len = -EAGAIN;
+	}
+}
+
+/*
+ * Wait for completion of the given slot. Other reads, completed
+ * meanwhile, are marked as well. Returns false, if the wait failed.
+ */
+static bool
+fio_block_reader_wait(fio_block_reader *reader, fio_read_slot *target)
+{
+	while (target->in_flight)
+	{
+		fio_read_slot *slot;
+#if defined(USE_LIBURING)
+		struct io_uring_cqe *cqe;
+		int		rc = io_uring_wait_cqe(&reader->ring, &cqe);
+
+		if (rc == -EINTR)
+			continue;
+		if (rc < 0)
+			return false;
+
+		slot = (fio_read_slot *) io_uring_cqe_get_data(cqe);
+		slot->len = cqe->res;
+		io_uring_cqe_seen(&reader->ring, cqe);
+#else
+		struct io_event event;
+		long	rc = syscall(__NR_io_getevents, reader->aio_ctx, 1, 1, &event, NULL);
+
+		if (rc < 0 && errno == EINTR)
+			continue;
+		if (rc != 1)
+			return false;
+
+		slot = (fio_read_slot *) (uintptr_t) event.data;
+		slot->len = event.res;
+#endif
+		slot->in_flight = false;
+
+		/* see fio_block_reader_fill() */
+		if (reader->mode == IO_MODE_DONTNEED && slot->len > 0)
+			fio_drop_cache(reader->fd, 0, slot->offs + slot->len);
+	}
+
+	return true;
+}
+
+/*
+ * Stop reading ahead: wait for the reads in flight and release
+ * asynchronous I/O context. If 'wait' is false, or the wait fails,
+ * the buffers of the reads in flight are leaked, because the kernel
+ * may still write to them.
+ */
+static void
+fio_block_reader_stop_async(fio_block_reader *reader, bool wait)
+{
+	int		i;
+
+	if (reader->depth == 0)
+		return;
+
+	for (i = 0; i < reader->n_slots; i++)
+	{
+		fio_read_slot *slot = &reader->slots[(reader->head + i) % reader->depth];
+
+		if (slot->in_flight && (!wait || !fio_block_reader_wait(reader, slot)))
+		{
+			reader->slots_raw = NULL;
+			break;
+		}
+	}
+
+#if defined(USE_LIBURING)
+	io_uring_queue_exit(&reader->ring);
+#else
+	syscall(__NR_io_destroy, reader->aio_ctx);
+#endif
+
+	pg_free(reader->slots);
+	pg_free(reader->slots_raw);
+	reader->slots = NULL;
+	reader->slots_raw = NULL;
+	reader->depth = 0;
+	reader->n_slots = 0;
+}
+
+/*
+ * Try to take the block from the reads ahead.
+ * Returns number of bytes copied, or -1 if the block is not there.
+ */
+static int
+fio_block_reader_read_ahead(fio_block_reader *reader, off_t offs, char *page)
+{
+	fio_read_slot *slot;
+	size_t	len;
+
+	/* release the slots, which are behind the requested block */
+	while (reader->n_slots > 0)
+	{
+		slot = &reader->slots[reader->head];
+
+		if (offs < slot->offs + (off_t) slot->size)
+			break;
+
+		if (slot->in_flight && !fio_block_reader_wait(reader, slot))
+		{
+			fio_block_reader_stop_async(reader, false);
+			return -1;
+		}
+
+		reader->head = (reader->head + 1) % reader->depth;
+		reader->n_slots--;
+	}
+
+	/* the caller jumped ahead of the sequential read */
+	if (reader->n_slots == 0 && !reader->pagemap_iter &&
+		offs >= reader->next_offs)
+		reader->next_offs = offs - offs % reader->slot_size;
+
+	fio_block_reader_prefetch(reader);
+
+	if (reader->n_slots == 0)
+		return -1;
+
+	slot = &reader->slots[reader->head];
+	if (offs < slot->offs)
+		return -1;
+
+	if (slot->in_flight && !fio_block_reader_wait(reader, slot))
+	{
+		fio_block_reader_stop_async(reader, false);
+		return -1;
+	}
+
+	/* read failed, let the caller read it synchronously and report error */
+	if (slot->len < 0)
+	{
+		fio_block_reader_stop_async(reader, true);
+		return -1;
+	}
+
+	if (offs - slot->offs >= slot->len)
+		return 0;
+
+	len = Min(BLCKSZ, slot->len - (offs - slot->offs));
+	memcpy(page, slot->buf + (offs - slot->offs), len);
+
+	return len;
+}
+
+#else							/* !FIO_HAVE_ASYNC_READ */
+
+static void
+fio_block_reader_start_async(fio_block_reader *reader, int depth)
+{
+}
+
+static void
+fio_block_reader_stop_async(fio_block_reader *reader, bool wait)
+{
+}
+
+static int
+fio_block_reader_read_ahead(fio_block_reader *reader, off_t offs, char *page)
+{
+	return -1;
+}
+
+#endif							/* FIO_HAVE_ASYNC_READ */
+
+/* Fill the read window starting with the given offset */
+static ssize_t
+fio_block_reader_fill(fio_block_reader *reader, off_t offs)
+{
+	ssize_t	rc;
+
+	reader->buf_offs = offs;
+	reader->buf_len = 0;
+
+	for (;;)
+	{
+		rc = pread(reader->fd, reader->buf, reader->buf_size, offs);
+
+		if (rc >= 0)
+			break;
+
+		if (errno == EINTR)
+			continue;
+
+#if defined(O_DIRECT) && defined(F_SETFL)
+		/*
+		 * Some filesystems accept O_DIRECT on open, but fail
+		 * the read itself, switch to cached reading then.
+		 */
+		if (errno == EINVAL && reader->mode == IO_MODE_DIRECT &&
+			fcntl(reader->fd, F_SETFL, 0) == 0)
+		{
+			reader->mode = IO_MODE_DONTNEED;
+			continue;
+		}
+#endif
+		return -1;
+	}
+
+	reader->buf_len = rc;
+
+	/*
+	 * The data is in our buffer now, cached pages are useless.
+	 * Readahead may cache the pages in large chunks, crossing
+	 * the window boundaries, and such chunks are not dropped
+	 * partially, so pass the whole range read so far.
+	 */
+	if (reader->mode == IO_MODE_DONTNEED && rc > 0)
+		fio_drop_cache(reader->fd, 0, offs + rc);
+
+	return rc;
+}
+
+/*
+ * Read block 'blknum' into 'page' buffer.
+ *
+ * Block is taken from the reads ahead or from the read window, if it's
+ * already there, unless 'reread' is true. The latter is used to read
+ * the block again, when the previous copy turned out to be torn by
+ * concurrent write.
+ *
+ * Returns number of bytes read, which is less than BLCKSZ at the end
+ * of the file, or -1 with errno set in case of error.
+ */
+int
+fio_block_read(fio_block_reader *reader, BlockNumber blknum, char *page, bool reread)
+{
+	off_t	offs = (off_t) blknum * BLCKSZ;
+	size_t	len;
+
+	if (reader->depth > 0 && !reread)
+	{
+		int		rc = fio_block_reader_read_ahead(reader, offs, page);
+
+		if (rc >= 0)
+			return rc;
+	}
+
+	if (reread || offs < reader->buf_offs ||
+		offs + BLCKSZ > reader->buf_offs + reader->buf_len)
+	{
+		if (fio_block_reader_fill(reader, offs) < 0)
+			return -1;
+	}
+
+	if (offs - reader->buf_offs >= reader->buf_len)
+		return 0;
+
+	len = Min(BLCKSZ, reader->buf_len - (offs - reader->buf_offs));
+	memcpy(page, reader->buf + (offs - reader->buf_offs), len);
+
+	return len;
+}
+
+/* Close the reader and free its resources */
+void
+fio_block_reader_close(fio_block_reader *reader)
+{
+	if (!reader)
+		return;
+
+	fio_block_reader_stop_async(reader, true);
+	close(reader->fd);
+	pg_free(reader->pagemap_iter);
+	pg_free(reader->buf_raw);
+	pg_free(reader);
+}
+
 /* Set position in stdio file */
 int fio_fseek(FILE* f, off_t offs)
 {
@@ -1142,7 +1748,11 @@ int fio_rename(char const* old_path, char const* new_path, fio_location location
 	}
 }
 
-/* Sync file to disk */
+/*
+ * Sync file to disk.
+ * Unless io_mode is IO_MODE_BUFFERED, also evict pages of the file from
+ * the page cache, they are not going to be read soon.
+ */
 int fio_sync(char const* path, fio_location location)
 {
 	if (fio_is_remote(location))
@@ -1152,6 +1762,7 @@ int fio_sync(char const* path, fio_location location)
 		hdr.cop = FIO_SYNC;
 		hdr.handle = -1;
 		hdr.size = path_len;
+		hdr.arg = io_mode;
 
 		IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
 		IO_CHECK(fio_write_all(fio_stdout, path, path_len), path_len);
@@ -1178,12 +1789,31 @@ int fio_sync(char const* path, fio_location location)
 			close(fd);
 			return -1;
 		}
+
+		if (io_mode != IO_MODE_BUFFERED)
+			fio_drop_cache(fd, 0, 0);
+
 		close(fd);
 
 		return 0;
 	}
 }
 
+/*
+ * Get crc32 of decompressed content of compressed WAL file,
+ * compression algorithm is determined by file suffix.
+ */
+static pg_crc32
+get_crc32_decompressed(const char *file_path)
+{
+	CompressAlg alg = compress_stream_alg_by_name(file_path);
+
+	if (alg != NONE_COMPRESS)
+		return pgFileGetCRCstream(file_path, alg, true, true);
+
+	return pgFileGetCRCgz(file_path, true, true);
+}
+
 /* Get crc32 of file */
 pg_crc32 fio_get_crc32(const char *file_path, fio_location location, bool decompress)
 {
@@ -1209,7 +1839,7 @@ pg_crc32 fio_get_crc32(const char *file_path, fio_location location, bool decomp
 	else
 	{
 		if (decompress)
-			return pgFileGetCRCgz(file_path, true, true);
+			return get_crc32_decompressed(file_path);
 		else
 			return pgFileGetCRC(file_path, true, true);
 	}
@@ -1657,26 +2287,28 @@ int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *f
 	} req;
 	BlockNumber	n_blocks_read = 0;
 	BlockNumber blknum = 0;
+	char	   *pagemap = NULL;
+	size_t		pagemap_size = 0;
 
 	/* send message with header
 
 	  8bytes       24bytes             var        var
-	--------------------------------------------------------------
-	| fio_header | fio_send_request | FILE PATH | BITMAP(if any) |
-	--------------------------------------------------------------
+	-------------------------------------------------------------------
+	| fio_header | fio_send_request | FILE PATH | PAGEMAP(if any)     |
+	-------------------------------------------------------------------
+
+	  Pagemap is encoded by datapagemap_encode(), so that the map
+	  containing small number of blocks with big serial numbers
+	  takes a few bytes instead of the whole bitmap.
 	*/
 
 	req.hdr.cop = FIO_SEND_PAGES;
 
 	if (use_pagemap)
 	{
-		req.hdr.size = sizeof(fio_send_request) + (*file).pagemap.bitmapsize + strlen(from_fullpath) + 1;
-		req.arg.bitmapsize = (*file).pagemap.bitmapsize;
-
-		/* TODO: add optimization for the case of pagemap
-		 * containing small number of blocks with big serial numbers:
-		 * https://github.com/postgrespro/pg_probackup/blob/remote_page_backup/src/utils/file.c#L1211
-		 */
+		pagemap = datapagemap_encode(&file->pagemap, &pagemap_size);
+		req.hdr.size = sizeof(fio_send_request) + pagemap_size + strlen(from_fullpath) + 1;
+		req.arg.bitmapsize = pagemap_size;
 	}
 	else
 	{
@@ -1691,6 +2323,8 @@ int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *f
 	req.arg.calg = calg;
 	req.arg.clevel = clevel;
 	req.arg.path_len = strlen(from_fullpath) + 1;
+	req.arg.io_mode = io_mode;
+	req.arg.io_depth = io_depth;
 
 	file->compress_alg = calg; /* TODO: wtf? why here? */
 
@@ -1711,7 +2345,10 @@ int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *f
 
 	/* send pagemap if any */
 	if (use_pagemap)
-		IO_CHECK(fio_write_all(fio_stdout, (*file).pagemap.bitmap, (*file).pagemap.bitmapsize), (*file).pagemap.bitmapsize);
+	{
+		IO_CHECK(fio_write_all(fio_stdout, pagemap, pagemap_size), pagemap_size);
+		pg_free(pagemap);
+	}
 
 	while (true)
 	{
@@ -1806,13 +2443,11 @@ int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *f
  */
 static void fio_send_pages_impl(int out, char* buf)
 {
-	FILE        *in = NULL;
+	fio_block_reader *in = NULL;
 	BlockNumber  blknum = 0;
-	int          current_pos = 0;
 	BlockNumber  n_blocks_read = 0;
 	PageState    page_st;
 	char         read_buffer[BLCKSZ+1];
-	char         in_buf[STDIO_BUFSIZE];
 	fio_header   hdr;
 	fio_send_request *req = (fio_send_request*) buf;
 	char             *from_fullpath = (char*) buf + sizeof(fio_send_request);
@@ -1820,15 +2455,20 @@ static void fio_send_pages_impl(int out, char* buf)
 	/* error reporting */
 	char *errormsg = NULL;
 	/* parse buffer */
-	datapagemap_t *map = NULL;
 	datapagemap_iterator_t *iter = NULL;
 	/* page headers */
 	int32       hdr_num = -1;
 	int32       cur_pos_out = 0;
 	BackupPageHeader2 *headers = NULL;
 
-	/* open source file */
-	in = fopen(from_fullpath, PG_BINARY_R);
+	/*
+	 * Open source file, read it sequentially unless pagemap is used.
+	 * Reader gets its own iterator to read the pagemap blocks ahead.
+	 */
+	in = fio_block_reader_open(from_fullpath, req->io_mode, req->io_depth,
+							   with_pagemap ?
+							   datapagemap_iterate_encoded((char*) buf + sizeof(fio_send_request) + req->path_len,
+														   req->bitmapsize) : NULL);
 	if (!in)
 	{
 		hdr.cop = FIO_ERROR;
@@ -1862,18 +2502,11 @@ static void fio_send_pages_impl(int out, char* buf)
 
 	if (with_pagemap)
 	{
-		map = pgut_malloc(sizeof(datapagemap_t));
-		map->bitmapsize = req->bitmapsize;
-		map->bitmap = (char*) buf + sizeof(fio_send_request) + req->path_len;
-
 		/* get first block */
-		iter = datapagemap_iterate(map);
+		iter = datapagemap_iterate_encoded((char*) buf + sizeof(fio_send_request) + req->path_len,
+										   req->bitmapsize);
 		datapagemap_next(iter, &blknum);
-
-		setvbuf(in, NULL, _IONBF, BUFSIZ);
 	}
-	else
-		setvbuf(in, in_buf, _IOFBF, STDIO_BUFSIZE);
 
 	/* TODO: what is this barrier for? */
 	read_buffer[BLCKSZ] = 1; /* barrier */
@@ -1881,7 +2514,7 @@ static void fio_send_pages_impl(int out, char* buf)
 	while (blknum < req->nblocks)
 	{
 		int    rc = 0;
-		size_t read_len = 0;
+		int    read_len = 0;
 		int    retry_attempts = PAGE_READ_ATTEMPTS;
 
 		/* TODO: handle signals on the agent */
@@ -1892,23 +2525,14 @@ static void fio_send_pages_impl(int out, char* buf)
 		for (;;)
 		{
 			/*
-			 * Optimize stdio buffer usage, fseek only when current position
-			 * does not match the position of requested block.
+			 * Block is taken from the read window of the reader,
+			 * but retries must read it from the file again.
 			 */
-			if (current_pos != blknum*BLCKSZ)
-			{
-				current_pos = blknum*BLCKSZ;
-				if (fseek(in, current_pos, SEEK_SET) != 0)
-					elog(ERROR, "fseek to position %u is failed on remote file '%s': %s",
-							current_pos, from_fullpath, strerror(errno));
-			}
-
-			read_len = fread(read_buffer, 1, BLCKSZ, in);
-
-			current_pos += read_len;
+			read_len = fio_block_read(in, blknum, read_buffer,
+									  retry_attempts < PAGE_READ_ATTEMPTS);
 
 			/* report error */
-			if (ferror(in))
+			if (read_len < 0)
 			{
 				hdr.cop = FIO_ERROR;
 				hdr.arg = READ_FAILED;
@@ -1938,9 +2562,8 @@ static void fio_send_pages_impl(int out, char* buf)
 					break;
 			}
 
-			if (feof(in))
+			if (read_len < BLCKSZ)
 				goto eof;
-//		  	else /* readed less than BLKSZ bytes, retry */
 
 			/* File is either has insane header or invalid checksum,
 			 * retry. If retry attempts are exhausted, report corruption.
@@ -2055,12 +2678,10 @@ eof:
 		IO_CHECK(fio_write_all(out, headers, hdr.size), hdr.size);
 
 cleanup:
-	pg_free(map);
 	pg_free(iter);
 	pg_free(errormsg);
 	pg_free(headers);
-	if (in)
-		fclose(in);
+	fio_block_reader_close(in);
 	return;
 }
 
@@ -2223,6 +2844,102 @@ cleanup:
 	return exit_code;
 }
 
+/* Write callback for decompression stream */
+static size_t
+fio_stream_fwrite(void *arg, const void *buf, size_t size)
+{
+	return fwrite(buf, 1, size, (FILE *) arg);
+}
+
+/* Receive chunks of data compressed with zstd or lz4, decompress them
+ * and write to destination file.
+ * Return codes:
+ *   SEND_OK       (0)
+ *   FILE_MISSING (-1)
+ *   OPEN_FAILED  (-2)
+ *   READ_FAILED  (-3)
+ *   WRITE_FAILED (-4)
+ *   ZLIB_ERROR   (-5)
+ */
+int fio_send_file_stream(const char *from_fullpath, const char *to_fullpath, FILE* out,
+						 CompressAlg alg, char **errormsg)
+{
+	fio_header hdr;
+	int exit_code = SEND_OK;
+	size_t path_len = strlen(from_fullpath) + 1;
+	char *buf = pgut_malloc(CHUNK_SIZE);    /* buffer for compressed data */
+	const char *stream_errormsg = NULL;
+	CompressStream *cs;
+
+	cs = compress_stream_init(alg, 0, true, fio_stream_fwrite, out, &stream_errormsg);
+	if (cs == NULL)
+	{
+		*errormsg = pgut_strdup(stream_errormsg);
+		pg_free(buf);
+		return OPEN_FAILED;
+	}
+
+	hdr.cop = FIO_SEND_FILE;
+	hdr.size = path_len;
+
+	IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
+	IO_CHECK(fio_write_all(fio_stdout, from_fullpath, path_len), path_len);
+
+	for (;;)
+	{
+		bool eof = false;
+
+		IO_CHECK(fio_read_all(fio_stdin, &hdr, sizeof(hdr)), sizeof(hdr));
+
+		if (hdr.cop == FIO_SEND_FILE_EOF)
+		{
+			/* check that stream is complete */
+			hdr.size = 0;
+			eof = true;
+		}
+		else if (hdr.cop == FIO_ERROR)
+		{
+			/* handle error, reported by the agent */
+			if (hdr.size > 0)
+			{
+				IO_CHECK(fio_read_all(fio_stdin, buf, hdr.size), hdr.size);
+				*errormsg = pgut_malloc(hdr.size);
+				snprintf(*errormsg, hdr.size, "%s", buf);
+			}
+			exit_code = hdr.arg;
+			break;
+		}
+		else if (hdr.cop == FIO_PAGE)
+		{
+			Assert(hdr.size <= CHUNK_SIZE);
+			IO_CHECK(fio_read_all(fio_stdin, buf, hdr.size), hdr.size);
+		}
+		else
+			elog(ERROR, "Remote agent returned message of unexpected type: %i", hdr.cop);
+
+		/* We have received a chunk of compressed data, lets decompress it */
+		exit_code = compress_stream_process(cs, buf, hdr.size, eof, &stream_errormsg);
+
+		if (exit_code == ZLIB_ERROR)
+		{
+			*errormsg = pgut_malloc(ERRMSG_MAX_LEN);
+			snprintf(*errormsg, ERRMSG_MAX_LEN,
+					"Decompression failed for file '%s': %s",
+					from_fullpath, stream_errormsg);
+		}
+
+		if (exit_code != SEND_OK || eof)
+			break;
+	}
+
+	if (exit_code < OPEN_FAILED)
+		fio_disconnect(); /* discard possible pending data in pipe */
+
+	compress_stream_free(cs);
+	pg_free(buf);
+	return exit_code;
+}
+
 /* Receive chunks of data and write them to destination file.
  * Return codes:
  *   SEND_OK       (0)
@@ -2442,40 +3159,52 @@ static void fio_list_dir_internal(parray *files, const char *root, bool exclude,
 		}
 		else if (hdr.cop == FIO_SEND_FILE)
 		{
-			pgFile *file = NULL;
-			fio_pgFile  fio_file;
+			char	   *ptr = buf;
+			int			i;
 
-			/* receive rel_path */
+			if (hdr.size > CHUNK_SIZE)
+				elog(ERROR, "Remote agent returned too large file list chunk: %u bytes",
+					 hdr.size);
+
+			/* receive the chunk of packed file records */
 			IO_CHECK(fio_read_all(fio_stdin, buf, hdr.size), hdr.size);
-			file = pgFileInit(buf);
-
-			/* receive metainformation */
-			IO_CHECK(fio_read_all(fio_stdin, &fio_file, sizeof(fio_file)), sizeof(fio_file));
-
-			file->mode = fio_file.mode;
-			file->size = fio_file.size;
-			file->mtime = fio_file.mtime;
-			file->is_datafile = fio_file.is_datafile;
-			file->is_database = fio_file.is_database;
-			file->tblspcOid = fio_file.tblspcOid;
-			file->dbOid = fio_file.dbOid;
-			file->relOid = fio_file.relOid;
-			file->forkName = fio_file.forkName;
-			file->segno = fio_file.segno;
-			file->external_dir_num = fio_file.external_dir_num;
-
-			if (fio_file.linked_len > 0)
+
+			for (i = 0; i < (int) hdr.arg; i++)
 			{
-				IO_CHECK(fio_read_all(fio_stdin, buf, fio_file.linked_len), fio_file.linked_len);
+				pgFile *file = NULL;
+				fio_pgFile  fio_file;
+
+				/* metainformation goes first, then rel_path and link path */
+				memcpy(&fio_file, ptr, sizeof(fio_file));
+				ptr += sizeof(fio_file);
+
+				if (ptr + fio_file.path_len + fio_file.linked_len > buf + hdr.size)
+					elog(ERROR, "Remote agent returned corrupted file list chunk");
+
+				file = pgFileInit(ptr);
+				ptr += fio_file.path_len;
+
+				file->mode = fio_file.mode;
+				file->size = fio_file.size;
+				file->mtime = fio_file.mtime;
+				file->is_datafile = fio_file.is_datafile;
+				file->is_database = fio_file.is_database;
+				file->tblspcOid = fio_file.tblspcOid;
+				file->dbOid = fio_file.dbOid;
+				file->relOid = fio_file.relOid;
+				file->forkName = fio_file.forkName;
+				file->segno = fio_file.segno;
+				file->external_dir_num = fio_file.external_dir_num;
+
+				if (fio_file.linked_len > 0)
+				{
+					file->linked = pgut_malloc(fio_file.linked_len);
+					snprintf(file->linked, fio_file.linked_len, "%s", ptr);
+					ptr += fio_file.linked_len;
+				}
 
-				file->linked = pgut_malloc(fio_file.linked_len);
-				snprintf(file->linked, fio_file.linked_len, "%s", buf);
+				parray_append(files, file);
 			}
-
-//			elog(INFO, "Received file: %s, mode: %u, size: %lu, mtime: %lu",
-//				file->rel_path, file->mode, file->size, file->mtime);
-
-			parray_append(files, file);
 		}
 		else
 		{
@@ -2491,10 +3220,11 @@ static void fio_list_dir_internal(parray *files, const char *root, bool exclude,
 /*
  * To get the arrays of files we use the same function dir_list_file(),
  * that is used for local backup.
- * After that we iterate over arrays and for every file send at least
- * two messages to main process:
- * 1. rel_path
- * 2. metainformation (size, mtime, etc)
+ * After that we pack the records of files into chunks of CHUNK_SIZE
+ * and send every chunk to main process in one message. Every record
+ * consists of:
+ * 1. metainformation (size, mtime, etc)
+ * 2. rel_path
  * 3. link path (optional)
  *
  * TODO: replace FIO_SEND_FILE and FIO_SEND_FILE_EOF with dedicated messages
@@ -2505,6 +3235,9 @@ static void fio_list_dir_impl(int out, char* buf)
 	fio_header hdr;
 	fio_list_dir_request *req = (fio_list_dir_request*) buf;
 	parray *file_files = parray_new();
+	char   *chunk = pgut_malloc(CHUNK_SIZE);
+	size_t	chunk_len = 0;
+	int		n_records = 0;
 
 	/*
 	 * Disable logging into console any messages with exception of ERROR messages,
@@ -2524,6 +3257,7 @@ static void fio_list_dir_impl(int out, char* buf)
 	{
 		fio_pgFile  fio_file;
 		pgFile	   *file = (pgFile *) parray_get(file_files, i);
+		size_t		record_len;
 
 		fio_file.mode = file->mode;
 		fio_file.size = file->size;
@@ -2536,29 +3270,57 @@ static void fio_list_dir_impl(int out, char* buf)
 		fio_file.forkName = file->forkName;
 		fio_file.segno = file->segno;
 		fio_file.external_dir_num = file->external_dir_num;
+		fio_file.path_len = strlen(file->rel_path) + 1;
 
 		if (file->linked)
 			fio_file.linked_len = strlen(file->linked) + 1;
 		else
 			fio_file.linked_len = 0;
 
-		hdr.cop = FIO_SEND_FILE;
-		hdr.size = strlen(file->rel_path) + 1;
+		record_len = sizeof(fio_file) + fio_file.path_len + fio_file.linked_len;
 
-		/* send rel_path first */
-		IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
-		IO_CHECK(fio_write_all(out, file->rel_path, hdr.size), hdr.size);
+		/* send the chunk, if there is no room for the record */
+		if (chunk_len + record_len > CHUNK_SIZE)
+		{
+			hdr.cop = FIO_SEND_FILE;
+			hdr.size = chunk_len;
+			hdr.arg = n_records;
 
-		/* now send file metainformation */
-		IO_CHECK(fio_write_all(out, &fio_file, sizeof(fio_file)), sizeof(fio_file));
+			IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
+			IO_CHECK(fio_write_all(out, chunk, chunk_len), chunk_len);
+
+			chunk_len = 0;
+			n_records = 0;
+		}
+
+		memcpy(chunk + chunk_len, &fio_file, sizeof(fio_file));
+		chunk_len += sizeof(fio_file);
+		memcpy(chunk + chunk_len, file->rel_path, fio_file.path_len);
+		chunk_len += fio_file.path_len;
 
-		/* If file is a symlink, then send link path */
+		/* If file is a symlink, then add link path */
 		if (file->linked)
-			IO_CHECK(fio_write_all(out, file->linked, fio_file.linked_len), fio_file.linked_len);
+		{
+			memcpy(chunk + chunk_len, file->linked, fio_file.linked_len);
+			chunk_len += fio_file.linked_len;
+		}
+		n_records++;
 
 		pgFileFree(file);
 	}
 
+	/* send the rest */
+	if (n_records > 0)
+	{
+		hdr.cop = FIO_SEND_FILE;
+		hdr.size = chunk_len;
+		hdr.arg = n_records;
+
+		IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
+		IO_CHECK(fio_write_all(out, chunk, chunk_len), chunk_len);
+	}
+
+	pg_free(chunk);
 	parray_free(file_files);
 	hdr.cop = FIO_SEND_FILE_EOF;
 	IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
@@ -2567,9 +3329,9 @@ static void fio_list_dir_impl(int out, char* buf)
 /* Wrapper for directory listing */
 void fio_list_dir(parray *files, const char *root, bool exclude,
 				  bool follow_symlink, bool add_root, bool backup_logs,
-				  bool skip_hidden, int external_dir_num)
+				  bool skip_hidden, int external_dir_num, fio_location location)
 {
-	if (fio_is_remote(FIO_DB_HOST))
+	if (fio_is_remote(location))
 		fio_list_dir_internal(files, root, exclude, follow_symlink, add_root,
 							  backup_logs, skip_hidden, external_dir_num);
 	else
@@ -2577,66 +3339,145 @@ void fio_list_dir(parray *files, const char *root, bool exclude,
 					  backup_logs, skip_hidden, external_dir_num, FIO_LOCAL_HOST);
 }
 
-PageState *
-fio_get_checksum_map(const char *fullpath, uint32 checksum_version, int n_blocks,
-					 XLogRecPtr dest_stop_lsn, BlockNumber segmentno, fio_location location)
+/*
+ * Check if the directory is empty or does not exist.
+ * Remote directory is checked by the agent in one round trip.
+ */
+bool fio_dir_is_empty(const char *path, fio_location location)
+{
+	if (fio_is_remote(location))
+	{
+		fio_header hdr;
+
+		hdr.cop = FIO_DIR_IS_EMPTY;
+		hdr.size = strlen(path) + 1;
+
+		IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
+		IO_CHECK(fio_write_all(fio_stdout, path, hdr.size), hdr.size);
+
+		/* receive result */
+		IO_CHECK(fio_read_all(fio_stdin, &hdr, sizeof(hdr)), sizeof(hdr));
+		Assert(hdr.cop == FIO_DIR_IS_EMPTY);
+		return hdr.arg != 0;
+	}
+	else
+		return dir_is_empty(path, FIO_LOCAL_HOST);
+}
+
+static void fio_dir_is_empty_impl(int out, char *buf)
+{
+	fio_header  hdr;
+	char       *path = (char*) buf;
+
+	hdr.cop = FIO_DIR_IS_EMPTY;
+	hdr.size = 0;
+	hdr.arg = dir_is_empty(path, FIO_LOCAL_HOST);
+	IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
+}
+
+/*
+ * Compare blocks of data file with expected checksums and LSNs and get
+ * bitmap of blocks to be rewritten, see get_checksum_diff_map().
+ * In remote mode the expected values are sent to the agent, so
+ * the file is read locally on the remote host, and only the encoded
+ * bitmap comes back.
+ */
+datapagemap_t *
+fio_get_checksum_diff_map(const char *fullpath, uint32 checksum_version, int n_blocks,
+						  XLogRecPtr dest_stop_lsn, BlockNumber segmentno,
+						  const PageState *checksum_map, fio_location location)
 {
 	if (fio_is_remote(location))
 	{
 		fio_header hdr;
 		fio_checksum_map_request req_hdr;
-		PageState *checksum_map = NULL;
+		datapagemap_t *diff_map = NULL;
 		size_t path_len = strlen(fullpath) + 1;
+		size_t map_size = checksum_map ? n_blocks * sizeof(PageState) : 0;
 
 		req_hdr.n_blocks = n_blocks;
 		req_hdr.segmentno = segmentno;
 		req_hdr.stop_lsn = dest_stop_lsn;
 		req_hdr.checksumVersion = checksum_version;
+		req_hdr.with_checksum_map = checksum_map != NULL;
 
 		hdr.cop = FIO_GET_CHECKSUM_MAP;
-		hdr.size = sizeof(req_hdr) + path_len;
+		hdr.size = sizeof(req_hdr) + map_size + path_len;
 
 		IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
 		IO_CHECK(fio_write_all(fio_stdout, &req_hdr, sizeof(req_hdr)), sizeof(req_hdr));
+		if (map_size > 0)
+			IO_CHECK(fio_write_all(fio_stdout, checksum_map, map_size), map_size);
 		IO_CHECK(fio_write_all(fio_stdout, fullpath, path_len), path_len);
 
-		/* receive data */
+		/* receive encoded bitmap */
 		IO_CHECK(fio_read_all(fio_stdin, &hdr, sizeof(hdr)), sizeof(hdr));
 
-		if (hdr.size > 0)
+		if (hdr.arg)
 		{
-			checksum_map = pgut_malloc(n_blocks * sizeof(PageState));
-			memset(checksum_map, 0, n_blocks * sizeof(PageState));
-			IO_CHECK(fio_read_all(fio_stdin, checksum_map, hdr.size * sizeof(PageState)), hdr.size * sizeof(PageState));
+			char	   *buf = pgut_malloc(hdr.size);
+			datapagemap_iterator_t *iter;
+			BlockNumber blkno;
+
+			IO_CHECK(fio_read_all(fio_stdin, buf, hdr.size), hdr.size);
+
+			diff_map = pgut_malloc(sizeof(datapagemap_t));
+			memset(diff_map, 0, sizeof(datapagemap_t));
+
+			iter = datapagemap_iterate_encoded(buf, hdr.size);
+			while (datapagemap_next(iter, &blkno))
+				datapagemap_add(diff_map, blkno);
+
+			pg_free(iter);
+			pg_free(buf);
 		}
 
-		return checksum_map;
+		return diff_map;
 	}
 	else
 	{
-
-		return get_checksum_map(fullpath, checksum_version,
-								n_blocks, dest_stop_lsn, segmentno);
+		return get_checksum_diff_map(fullpath, checksum_version, n_blocks,
+									 dest_stop_lsn, segmentno, checksum_map);
 	}
 }
 
-static void fio_get_checksum_map_impl(int out, char *buf)
+static void fio_get_checksum_diff_map_impl(int out, char *buf)
 {
 	fio_header  hdr;
+	datapagemap_t *diff_map = NULL;
+	fio_checksum_map_request *req = (fio_checksum_map_request*) buf;
 	PageState  *checksum_map = NULL;
 	char       *fullpath = (char*) buf + sizeof(fio_checksum_map_request);
-	fio_checksum_map_request *req = (fio_checksum_map_request*) buf;
+	char       *encoded = NULL;
+	size_t      encoded_size = 0;
 
-	checksum_map = get_checksum_map(fullpath, req->checksumVersion,
-									req->n_blocks, req->stop_lsn, req->segmentno);
-	hdr.size = req->n_blocks;
+	if (req->with_checksum_map)
+	{
+		checksum_map = (PageState *) fullpath;
+		fullpath += req->n_blocks * sizeof(PageState);
+	}
+
+	diff_map = get_checksum_diff_map(fullpath, req->checksumVersion, req->n_blocks,
+									 req->stop_lsn, req->segmentno, checksum_map);
+
+	if (diff_map)
+		encoded = datapagemap_encode(diff_map, &encoded_size);
 
-	/* send array of PageState`s to main process */
+	hdr.cop = FIO_SEND;
+	hdr.arg = diff_map != NULL;
+	hdr.size = encoded_size;
+
+	/* send bitmap of blocks to be rewritten to main process */
 	IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
 	if (hdr.size > 0)
-		IO_CHECK(fio_write_all(out, checksum_map, hdr.size * sizeof(PageState)), hdr.size * sizeof(PageState));
+		IO_CHECK(fio_write_all(out, encoded, hdr.size), hdr.size);
 
-	pg_free(checksum_map);
+	pg_free(encoded);
+	if (diff_map)
+	{
+		pg_free(diff_map->bitmap);
+		pg_free(diff_map);
+	}
 }
 
 datapagemap_t *
@@ -2940,8 +3781,14 @@ void fio_communicate(int in, int out)
 				hdr.arg = errno;
 			else
 			{
+				IoMode sync_io_mode = hdr.arg;
+
 				if (fsync(tmp_fd) == 0)
+				{
+					if (sync_io_mode != IO_MODE_BUFFERED)
+						fio_drop_cache(tmp_fd, 0, 0);
 					hdr.arg = 0;
+				}
 				else
 					hdr.arg = errno;
 			}
@@ -2952,14 +3799,14 @@ void fio_communicate(int in, int out)
 		  case FIO_GET_CRC32:
 			/* calculate crc32 for a file */
 			if (hdr.arg == 1)
-				crc = pgFileGetCRCgz(buf, true, true);
+				crc = get_crc32_decompressed(buf);
 			else
 				crc = pgFileGetCRC(buf, true, true);
 			IO_CHECK(fio_write_all(out, &crc, sizeof(crc)), sizeof(crc));
 			break;
 		  case FIO_GET_CHECKSUM_MAP:
-			/* calculate crc32 for a file */
-			fio_get_checksum_map_impl(out, buf);
+			/* compare data file blocks with expected checksums */
+			fio_get_checksum_diff_map_impl(out, buf);
 			break;
 		  case FIO_GET_LSN_MAP:
 			/* calculate crc32 for a file */
@@ -2980,6 +3827,9 @@ void fio_communicate(int in, int out)
 		  case FIO_GET_ASYNC_ERROR:
 			fio_get_async_error_impl(out);
 			break;
+		  case FIO_DIR_IS_EMPTY:
+			fio_dir_is_empty_impl(out, buf);
+			break;
 		  default:
 			Assert(false);
 		}
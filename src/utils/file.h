@@ -55,7 +55,8 @@ typedef enum
 	FIO_LIST_DIR,
 	FIO_CHECK_POSTMASTER,
 	FIO_GET_ASYNC_ERROR,
-	FIO_WRITE_ASYNC
+	FIO_WRITE_ASYNC,
+	FIO_DIR_IS_EMPTY
 } fio_operations;
 
 typedef enum
@@ -66,6 +67,24 @@ typedef enum
 	FIO_REMOTE_HOST  /* date is located at remote host */
 } fio_location;
 
+/*
+ * How relation files are read and how written files are left in the OS
+ * page cache, set by --io-mode option.
+ */
+typedef enum
+{
+	IO_MODE_BUFFERED,	/* plain buffered I/O */
+	IO_MODE_DONTNEED,	/* buffered I/O, drop pages from cache after use */
+	IO_MODE_DIRECT		/* read with O_DIRECT, bypassing the page cache */
+} IoMode;
+
+/* Maximum number of reads kept in flight by one reader, see --io-depth */
+#define FIO_MAX_IO_DEPTH 64
+
+/* Reader of relation blocks, see fio_block_reader_open() */
+typedef struct fio_block_reader fio_block_reader;
+struct datapagemap_iterator;
+
 #define FIO_FDMAX 64
 #define FIO_PIPE_MARKER 0x40000000
 
@@ -83,6 +102,8 @@ typedef struct
 } fio_header;
 
 extern fio_location MyLocation;
+extern IoMode io_mode;
+extern int    io_depth;
 
 /* Check if FILE handle is local or remote (created by FIO) */
 #define fio_is_remote_file(file) ((size_t)(file) <= FIO_FDMAX)
@@ -119,6 +140,7 @@ extern int     fio_truncate(int fd, off_t size);
 extern int     fio_close(int fd);
 extern void    fio_disconnect(void);
 extern int     fio_sync(char const* path, fio_location location);
+extern void    fio_drop_cache(int fd, off_t offs, off_t len);
 extern pg_crc32 fio_get_crc32(const char *file_path, fio_location location, bool decompress);
 
 extern int     fio_rename(char const* old_path, char const* new_path, fio_location location);
@@ -131,6 +153,10 @@ extern int     fio_stat(char const* path, struct stat* st, bool follow_symlinks,
 extern DIR*    fio_opendir(char const* path, fio_location location);
 extern struct dirent * fio_readdir(DIR *dirp);
 extern int     fio_closedir(DIR *dirp);
+extern fio_block_reader *fio_block_reader_open(char const* path, IoMode mode, int depth,
+											   struct datapagemap_iterator *pagemap_iter);
+extern int     fio_block_read(fio_block_reader *reader, BlockNumber blknum, char *page, bool reread);
+extern void    fio_block_reader_close(fio_block_reader *reader);
 extern FILE*   fio_open_stream(char const* name, fio_location location);
 extern int     fio_close_stream(FILE* f);
 
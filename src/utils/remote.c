@@ -18,6 +18,7 @@
 #define MAX_CMDLINE_OPTIONS 256
 #define ERR_BUF_SIZE        4096
 #define PIPE_SIZE           (64*1024)
+#define SSH_CONTROL_PERSIST "60"	/* seconds master lives without sessions */
 
 static int split_options(int argc, char* argv[], int max_options, char* options)
 {
@@ -60,6 +61,19 @@ static int split_options(int argc, char* argv[], int max_options, char* options)
 
 static __thread int child_pid;
 
+/*
+ * All agents of the process share one SSH connection: the master connection
+ * is established by the first launch_agent() call, and every agent is
+ * started as a separate session (channel) multiplexed over it. It saves
+ * the handshake and authentication for every worker thread, and SSH flow
+ * control of every channel prevents one busy session from blocking others.
+ */
+#ifndef WIN32
+static pthread_mutex_t ssh_master_mutex = PTHREAD_MUTEX_INITIALIZER;
+static bool ssh_master_tried = false;
+#endif
+static char ssh_control_path[MAXPGPATH] = "";
+
 #if 0
 static void kill_child(void)
 {
@@ -108,23 +122,12 @@ static bool needs_quotes(char const* path)
 	return strchr(path, ' ') != NULL;
 }
 
-bool launch_agent(void)
+/*
+ * Add connection options common for master connection and agent sessions,
+ * up to the host name.
+ */
+static int append_ssh_options(int ssh_argc, char* ssh_argv[])
 {
-	char cmd[MAX_CMDLINE_LENGTH];
-	char* ssh_argv[MAX_CMDLINE_OPTIONS];
-	int ssh_argc;
-	int outfd[2];
-	int infd[2];
-	int errfd[2];
-	int agent_version;
-
-	ssh_argc = 0;
-#ifdef WIN32
-	ssh_argv[ssh_argc++] = PROGRAM_NAME_FULL;
-	ssh_argv[ssh_argc++] = "ssh";
-	ssh_argc += 2; /* reserve space for pipe descriptors */
-#endif
-	ssh_argv[ssh_argc++] = instance_config.remote.proto;
 	if (instance_config.remote.port != NULL) {
 		ssh_argv[ssh_argc++] = "-p";
 		ssh_argv[ssh_argc++] = instance_config.remote.port;
@@ -150,6 +153,157 @@ bool launch_agent(void)
 	ssh_argv[ssh_argc++] = "-o";
 	ssh_argv[ssh_argc++] = "LogLevel=error";
 
+	return ssh_argc;
+}
+
+#ifndef WIN32
+/* Run ssh with specified arguments and wait for its termination */
+static bool run_ssh(char* ssh_argv[])
+{
+	pid_t pid;
+	int status;
+
+	SYS_CHECK(pid = fork());
+
+	if (pid == 0) { /* child */
+		execvp(ssh_argv[0], ssh_argv);
+		_exit(EXIT_FAILURE);
+	}
+
+	if (waitpid(pid, &status, 0) < 0)
+		return false;
+
+	return WIFEXITED(status) && WEXITSTATUS(status) == 0;
+}
+
+/* Close the master connection at exit */
+static void stop_ssh_master(bool fatal, void *userdata)
+{
+	char* ssh_argv[MAX_CMDLINE_OPTIONS];
+	int ssh_argc = 0;
+
+	if (ssh_control_path[0] == '\0')
+		return;
+
+	ssh_argv[ssh_argc++] = instance_config.remote.proto;
+	ssh_argc = append_ssh_options(ssh_argc, ssh_argv);
+	ssh_argv[ssh_argc++] = "-o";
+	ssh_argv[ssh_argc++] = psprintf("ControlPath=%s", ssh_control_path);
+	ssh_argv[ssh_argc++] = "-O";
+	ssh_argv[ssh_argc++] = "exit";
+	ssh_argv[ssh_argc++] = instance_config.remote.host;
+	ssh_argv[ssh_argc] = NULL;
+
+	if (!run_ssh(ssh_argv))
+		elog(WARNING, "Cannot close SSH master connection \"%s\"", ssh_control_path);
+
+	ssh_control_path[0] = '\0';
+}
+
+/*
+ * Establish the master connection, shared by all agents of the process.
+ * It is not used, if ssh multiplexing is configured by the user via
+ * --ssh-options, or the master connection cannot be established.
+ */
+static void start_ssh_master(void)
+{
+	char* ssh_argv[MAX_CMDLINE_OPTIONS];
+	int ssh_argc = 0;
+	char control_path[MAXPGPATH];
+	const char *tmpdir;
+
+	pthread_lock(&ssh_master_mutex);
+
+	if (ssh_master_tried)
+	{
+		pthread_mutex_unlock(&ssh_master_mutex);
+		return;
+	}
+	ssh_master_tried = true;
+
+	if (strcmp(instance_config.remote.proto, "ssh") != 0 ||
+		(instance_config.remote.ssh_options != NULL &&
+		 (strstr(instance_config.remote.ssh_options, "ControlMaster") != NULL ||
+		  strstr(instance_config.remote.ssh_options, "ControlPath") != NULL)))
+	{
+		pthread_mutex_unlock(&ssh_master_mutex);
+		return;
+	}
+
+	tmpdir = getenv("TMPDIR");
+	if (tmpdir == NULL || tmpdir[0] == '\0')
+		tmpdir = "/tmp";
+
+	snprintf(control_path, sizeof(control_path), "%s/pg_probackup-ssh-%d",
+			 tmpdir, (int) getpid());
+
+	/* path of unix socket is limited */
+	if (strlen(control_path) >= 100)
+	{
+		elog(LOG, "SSH control path \"%s\" is too long, connection multiplexing is disabled",
+			 control_path);
+		pthread_mutex_unlock(&ssh_master_mutex);
+		return;
+	}
+
+	ssh_argv[ssh_argc++] = instance_config.remote.proto;
+	ssh_argc = append_ssh_options(ssh_argc, ssh_argv);
+	ssh_argv[ssh_argc++] = "-o";
+	ssh_argv[ssh_argc++] = psprintf("ControlPath=%s", control_path);
+	ssh_argv[ssh_argc++] = "-o";
+	ssh_argv[ssh_argc++] = "ControlPersist=" SSH_CONTROL_PERSIST;
+	/* go to background after authentication, without remote command */
+	ssh_argv[ssh_argc++] = "-M";
+	ssh_argv[ssh_argc++] = "-N";
+	ssh_argv[ssh_argc++] = "-f";
+	ssh_argv[ssh_argc++] = instance_config.remote.host;
+	ssh_argv[ssh_argc] = NULL;
+
+	if (run_ssh(ssh_argv))
+	{
+		strcpy(ssh_control_path, control_path);
+		pgut_atexit_push(stop_ssh_master, NULL);
+		elog(LOG, "SSH master connection is established, control path \"%s\"",
+			 ssh_control_path);
+	}
+	else
+		elog(WARNING, "Cannot establish SSH master connection, "
+			 "every thread will use its own connection");
+
+	pthread_mutex_unlock(&ssh_master_mutex);
+}
+#endif
+
+bool launch_agent(void)
+{
+	char cmd[MAX_CMDLINE_LENGTH];
+	char* ssh_argv[MAX_CMDLINE_OPTIONS];
+	int ssh_argc;
+	int outfd[2];
+	int infd[2];
+	int errfd[2];
+	int agent_version;
+
+	ssh_argc = 0;
+#ifdef WIN32
+	ssh_argv[ssh_argc++] = PROGRAM_NAME_FULL;
+	ssh_argv[ssh_argc++] = "ssh";
+	ssh_argc += 2; /* reserve space for pipe descriptors */
+#else
+	start_ssh_master();
+#endif
+	ssh_argv[ssh_argc++] = instance_config.remote.proto;
+	ssh_argc = append_ssh_options(ssh_argc, ssh_argv);
+
+	/* open new session over the master connection */
+	if (ssh_control_path[0] != '\0')
+	{
+		ssh_argv[ssh_argc++] = "-o";
+		ssh_argv[ssh_argc++] = psprintf("ControlPath=%s", ssh_control_path);
+		ssh_argv[ssh_argc++] = "-o";
+		ssh_argv[ssh_argc++] = "ControlMaster=no";
+	}
+
 	ssh_argv[ssh_argc++] = instance_config.remote.host;
 	ssh_argv[ssh_argc++] = cmd;
 	ssh_argv[ssh_argc] = NULL;
@@ -247,8 +401,9 @@ bool launch_agent(void)
 				(agent_version / 100) % 100,
 				agent_version % 100);
 
-		elog(ERROR, "Remote agent version %s does not match local program version %s",
-			agent_version_str, PROGRAM_VERSION);
+		elog(ERROR, "Remote agent protocol version %s does not match local program protocol version %s, "
+			 "consider to upgrade pg_probackup binary",
+			 agent_version_str, AGENT_PROTOCOL_VERSION_STR);
 	}
 
 	return true;
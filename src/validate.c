@@ -16,23 +16,75 @@
 #include "utils/thread.h"
 
 static void *pgBackupValidateFiles(void *arg);
-static void do_validate_instance(void);
+
+/*
+ * Result of the last successful validation of the backup files,
+ * stored in VALIDATION_LEDGER file in backup directory.
+ * Backup files are immutable, so if they are not changed since then,
+ * there is no need to read them again.
+ */
+typedef struct
+{
+	char		program_version[100];	/* version of validator */
+	pg_crc32	content_crc;	/* CRC of backup content list */
+	pg_crc32	files_crc;		/* CRC of names, sizes and mtimes of files */
+	bool		block_validation;	/* data files were checked block by block */
+	time_t		validate_time;	/* time of the last full validation */
+	uint32		sample_pos;		/* where the next sample starts */
+} ValidationLedger;
+
+static void comp_file_stat_crc(pg_crc32 *crc, struct stat *st);
+static bool get_backup_files_crc(pgBackup *backup, parray *files,
+								 const char *external_prefix,
+								 pg_crc32 *files_crc);
+static bool read_validation_ledger(pgBackup *backup, ValidationLedger *ledger);
+static void write_validation_ledger(pgBackup *backup, ValidationLedger *ledger);
+static void remove_validation_ledger(pgBackup *backup);
+static int	select_validation_sample(parray *files, ValidationLedger *ledger,
+									 int percent);
+
+/* Backups of the instance, validated by do_validate_all() */
+typedef struct
+{
+	char		arclog_path[MAXPGPATH];
+	uint32		xlog_seg_size;
+	parray	   *backups;		/* all backups of the instance */
+	parray	   *validate_list;	/* backups, which files are validated */
+} validate_instance_state;
+
+static validate_instance_state *validate_instance_start(void);
+static void validate_instance_finish(validate_instance_state *state);
 
 static bool corrupted_backup_found = false;
 static bool skipped_due_to_lock = false;
 
+/*
+ * Backup, which files are being validated. Files of several backups
+ * are validated by the same threads, see pgBackupValidateList().
+ */
 typedef struct
 {
-	const char *base_path;
-	parray		*files;
-	bool		corrupted;
-	XLogRecPtr 	stop_lsn;
-	uint32		checksum_version;
+	pgBackup   *backup;
+	parray	   *files;
+	char		external_prefix[MAXPGPATH];
 	uint32		backup_version;
-	BackupMode	backup_mode;
+
+	/*
+	 * Set by validation threads if some file is corrupted.
+	 * Threads only set it to true, so no locking is needed.
+	 */
+	volatile bool corrupted;
+
+	ValidationLedger ledger;
+	pg_crc32	files_crc;
+	bool		files_crc_ok;
+	bool		ledger_ok;
+} validate_backup_state;
+
+typedef struct
+{
+	parray		*backups;	/* list of validate_backup_state */
 	parray		*dbOid_exclude_list;
-	const char	*external_prefix;
-	HeaderMap   *hdr_map;
 
 	/*
 	 * Return value from the thread.
@@ -41,6 +93,17 @@ typedef struct
 	int			ret;
 } validate_files_arg;
 
+/*
+ * Maximum number of files of the backups validated together,
+ * to limit the memory used by their file lists.
+ */
+#define VALIDATE_BATCH_FILES	100000
+
+static validate_backup_state *validate_backup_start(pgBackup *backup);
+static void validate_backup_batch(parray *batch);
+static void validate_backup_finish(validate_backup_state *state);
+static void validate_backup_files(validate_backup_state *state);
+
 /*
  * Validate backup files.
  * TODO: partial validation.
@@ -48,13 +111,62 @@ typedef struct
 void
 pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 {
-	char		external_prefix[MAXPGPATH];
+	parray	   *backups = parray_new();
+
+	parray_append(backups, backup);
+	pgBackupValidateList(backups);
+	parray_free(backups);
+}
+
+/*
+ * Validate files of several backups.
+ * Files of all backups are validated by the common pool of threads,
+ * so many small backups keep all the threads busy. Every backup gets
+ * its status as in pgBackupValidate(), propagation of the status to
+ * descendants is up to the caller.
+ */
+void
+pgBackupValidateList(parray *backups)
+{
+	parray	   *batch = parray_new();
+	size_t		batch_files = 0;
+	int			i;
+
+	for (i = 0; i < parray_num(backups); i++)
+	{
+		pgBackup   *backup = (pgBackup *) parray_get(backups, i);
+		validate_backup_state *state;
+
+		state = validate_backup_start(backup);
+		if (!state)
+			continue;
+
+		parray_append(batch, state);
+		batch_files += parray_num(state->files);
+
+		if (batch_files >= VALIDATE_BATCH_FILES)
+		{
+			validate_backup_batch(batch);
+			parray_free(batch);
+			batch = parray_new();
+			batch_files = 0;
+		}
+	}
+
+	if (parray_num(batch) > 0)
+		validate_backup_batch(batch);
+	parray_free(batch);
+}
+
+/*
+ * Check that backup can be validated and read its file list.
+ * Return NULL if validation of the backup is skipped.
+ */
+static validate_backup_state *
+validate_backup_start(pgBackup *backup)
+{
+	validate_backup_state *state;
 	parray	   *files = NULL;
-	bool		corrupted = false;
-	bool		validation_isok = true;
-	/* arrays with meta info for multi threaded validate */
-	pthread_t  *threads;
-	validate_files_arg *threads_args;
 	int			i;
 //	parray		*dbOid_exclude_list = NULL;
 
@@ -77,7 +189,7 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 			 base36enc(backup->start_time), status2str(backup->status));
 		write_backup_status(backup, BACKUP_STATUS_ERROR, instance_name, true);
 		corrupted_backup_found = true;
-		return;
+		return NULL;
 	}
 
 	/* Revalidation is attempted for DONE, ORPHAN and CORRUPT backups */
@@ -90,7 +202,7 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 		elog(WARNING, "Backup %s has status %s. Skip validation.",
 					base36enc(backup->start_time), status2str(backup->status));
 		corrupted_backup_found = true;
-		return;
+		return NULL;
 	}
 
 	/* additional sanity */
@@ -99,7 +211,7 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 	{
 		elog(WARNING, "Full backup %s has status %s, skip validation",
 			base36enc(backup->start_time), status2str(backup->status));
-		return;
+		return NULL;
 	}
 
 	if (backup->status == BACKUP_STATUS_OK || backup->status == BACKUP_STATUS_DONE ||
@@ -114,7 +226,6 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 		backup->backup_mode != BACKUP_MODE_DIFF_DELTA)
 		elog(WARNING, "Invalid backup_mode of backup %s", base36enc(backup->start_time));
 
-	join_path_components(external_prefix, backup->root_dir, EXTERNAL_DIR);
 	files = get_backup_filelist(backup, false);
 
 	if (!files)
@@ -122,13 +233,20 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 		elog(WARNING, "Backup %s file list is corrupted", base36enc(backup->start_time));
 		backup->status = BACKUP_STATUS_CORRUPT;
 		write_backup_status(backup, BACKUP_STATUS_CORRUPT, instance_name, true);
-		return;
+		return NULL;
 	}
 
 //	if (params && params->partial_db_list)
 //		dbOid_exclude_list = get_dbOid_exclude_list(backup, files, params->partial_db_list,
 //														params->partial_restore_type);
 
+	state = pgut_new(validate_backup_state);
+	memset(state, 0, sizeof(validate_backup_state));
+	state->backup = backup;
+	state->files = files;
+	state->backup_version = parse_program_version(backup->program_version);
+	join_path_components(state->external_prefix, backup->root_dir, EXTERNAL_DIR);
+
 	/* setup threads */
 	for (i = 0; i < parray_num(files); i++)
 	{
@@ -136,7 +254,58 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 		pg_atomic_clear_flag(&file->lock);
 	}
 
-	/* init thread args with own file lists */
+	/*
+	 * If backup files are not changed since the last successful
+	 * validation, do not read them again, or read only a sample of them.
+	 */
+	state->files_crc_ok = get_backup_files_crc(backup, files,
+											   state->external_prefix,
+											   &state->files_crc);
+
+	if (state->files_crc_ok && !force_full_validate &&
+		read_validation_ledger(backup, &state->ledger) &&
+		strcmp(state->ledger.program_version, PROGRAM_VERSION) == 0 &&
+		state->ledger.content_crc == backup->content_crc &&
+		state->ledger.files_crc == state->files_crc &&
+		(state->ledger.block_validation || skip_block_validation ||
+		 validate_mode == VALIDATE_QUICK))
+	{
+		char		validate_time[100];
+		int			n_sampled;
+
+		state->ledger_ok = true;
+		time2iso(validate_time, lengthof(validate_time),
+				 state->ledger.validate_time, false);
+		n_sampled = select_validation_sample(files, &state->ledger,
+											 validate_sample);
+
+		if (n_sampled > 0)
+			elog(INFO, "Backup %s files are not changed since validation at %s, "
+				 "validate %d of them", base36enc(backup->start_time),
+				 validate_time, n_sampled);
+		else
+			elog(INFO, "Backup %s files are not changed since validation at %s, "
+				 "skip validation of files", base36enc(backup->start_time),
+				 validate_time);
+	}
+
+	return state;
+}
+
+/*
+ * Validate files of the backups in the batch, using common pool of threads,
+ * and finish validation of every backup.
+ */
+static void
+validate_backup_batch(parray *batch)
+{
+	bool		validation_isok = true;
+	/* arrays with meta info for multi threaded validate */
+	pthread_t  *threads;
+	validate_files_arg *threads_args;
+	int			i;
+
+	/* init thread args with common list of backups */
 	threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
 	threads_args = (validate_files_arg *)
 		palloc(sizeof(validate_files_arg) * num_threads);
@@ -147,15 +316,7 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 	{
 		validate_files_arg *arg = &(threads_args[i]);
 
-		arg->base_path = backup->database_dir;
-		arg->files = files;
-		arg->corrupted = false;
-		arg->backup_mode = backup->backup_mode;
-		arg->stop_lsn = backup->stop_lsn;
-		arg->checksum_version = backup->checksum_version;
-		arg->backup_version = parse_program_version(backup->program_version);
-		arg->external_prefix = external_prefix;
-		arg->hdr_map = &(backup->hdr_map);
+		arg->backups = batch;
 //		arg->dbOid_exclude_list = dbOid_exclude_list;
 		/* By default there are some error */
 		threads_args[i].ret = 1;
@@ -169,8 +330,6 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 		validate_files_arg *arg = &(threads_args[i]);
 
 		pthread_join(threads[i], NULL);
-		if (arg->corrupted)
-			corrupted = true;
 		if (arg->ret == 1)
 			validation_isok = false;
 	}
@@ -180,11 +339,50 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 	pfree(threads);
 	pfree(threads_args);
 
+	for (i = 0; i < parray_num(batch); i++)
+	{
+		validate_backup_state *state;
+
+		state = (validate_backup_state *) parray_get(batch, i);
+		validate_backup_finish(state);
+		pg_free(state);
+	}
+}
+
+/*
+ * Remember the result of backup validation and update backup status.
+ */
+static void
+validate_backup_finish(validate_backup_state *state)
+{
+	pgBackup   *backup = state->backup;
+	ValidationLedger *ledger = &state->ledger;
+	bool		corrupted = state->corrupted;
+
 	/* cleanup */
-	parray_walk(files, pgFileFree);
-	parray_free(files);
+	parray_walk(state->files, pgFileFree);
+	parray_free(state->files);
 	cleanup_header_map(&(backup->hdr_map));
 
+	/* Remember the result of validation */
+	if (corrupted)
+		remove_validation_ledger(backup);
+	else if (state->files_crc_ok && (!state->ledger_ok || validate_sample > 0))
+	{
+		if (!state->ledger_ok)
+		{
+			StrNCpy(ledger->program_version, PROGRAM_VERSION,
+					sizeof(ledger->program_version));
+			ledger->content_crc = backup->content_crc;
+			ledger->files_crc = state->files_crc;
+			ledger->block_validation = !skip_block_validation &&
+				validate_mode == VALIDATE_DEEP;
+			ledger->validate_time = time(NULL);
+			ledger->sample_pos = 0;
+		}
+		write_validation_ledger(backup, ledger);
+	}
+
 	/* Update backup status */
 	if (corrupted)
 		backup->status = BACKUP_STATUS_CORRUPT;
@@ -221,23 +419,44 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 }
 
 /*
- * Validate files in the backup.
- * NOTE: If file is not valid, do not use ERROR log message,
- * rather throw a WARNING and set arguments->corrupted = true.
- * This is necessary to update backup status.
+ * Validate files in the backups.
+ * Threads go through the backups in the same order and take their files
+ * one by one, so files of several backups are validated at the same time.
  */
 static void *
 pgBackupValidateFiles(void *arg)
 {
 	int			i;
 	validate_files_arg *arguments = (validate_files_arg *)arg;
-	int			num_files = parray_num(arguments->files);
+
+	for (i = 0; i < parray_num(arguments->backups); i++)
+		validate_backup_files((validate_backup_state *)
+							  parray_get(arguments->backups, i));
+
+	/* Data files validation is successful */
+	arguments->ret = 0;
+
+	return NULL;
+}
+
+/*
+ * Validate files in the backup.
+ * NOTE: If file is not valid, do not use ERROR log message,
+ * rather throw a WARNING and set state->corrupted = true.
+ * This is necessary to update backup status.
+ */
+static void
+validate_backup_files(validate_backup_state *state)
+{
+	int			i;
+	pgBackup   *backup = state->backup;
+	int			num_files = parray_num(state->files);
 	pg_crc32	crc;
 
 	for (i = 0; i < num_files; i++)
 	{
 		struct stat st;
-		pgFile	   *file = (pgFile *) parray_get(arguments->files, i);
+		pgFile	   *file = (pgFile *) parray_get(state->files, i);
 		char        file_fullpath[MAXPGPATH];
 
 		if (interrupted || thread_interrupted)
@@ -274,12 +493,12 @@ pgBackupValidateFiles(void *arg)
 		if (file->write_size == BYTES_INVALID)
 		{
 			/* TODO: lookup corresponding merge bug */
-			if (arguments->backup_mode == BACKUP_MODE_FULL)
+			if (backup->backup_mode == BACKUP_MODE_FULL)
 			{
 				/* It is illegal for file in FULL backup to have BYTES_INVALID */
 				elog(WARNING, "Backup file \"%s\" has invalid size. Possible metadata corruption.",
 					file->rel_path);
-				arguments->corrupted = true;
+				state->corrupted = true;
 				break;
 			}
 			else
@@ -294,11 +513,11 @@ pgBackupValidateFiles(void *arg)
 		{
 			char temp[MAXPGPATH];
 
-			makeExternalDirPathByNum(temp, arguments->external_prefix, file->external_dir_num);
+			makeExternalDirPathByNum(temp, state->external_prefix, file->external_dir_num);
 			join_path_components(file_fullpath, temp, file->rel_path);
 		}
 		else
-			join_path_components(file_fullpath, arguments->base_path, file->rel_path);
+			join_path_components(file_fullpath, backup->database_dir, file->rel_path);
 
 		/* TODO: it is redundant to check file existence using stat */
 		if (stat(file_fullpath, &st) == -1)
@@ -308,7 +527,7 @@ pgBackupValidateFiles(void *arg)
 			else
 				elog(WARNING, "Cannot stat backup file \"%s\": %s",
 					file_fullpath, strerror(errno));
-			arguments->corrupted = true;
+			state->corrupted = true;
 			break;
 		}
 
@@ -316,17 +535,26 @@ pgBackupValidateFiles(void *arg)
 		{
 			elog(WARNING, "Invalid size of backup file \"%s\" : " INT64_FORMAT ". Expected %lu",
 				 file_fullpath, (unsigned long) st.st_size, file->write_size);
-			arguments->corrupted = true;
+			state->corrupted = true;
 			break;
 		}
 
 		/*
 		 * If option skip-block-validation is set, compute only file-level CRC for
 		 * datafiles, otherwise check them block by block.
+		 * In quick mode check page headers of datafiles and their file-level CRC.
 		 * Currently we don't compute checksums for
 		 * cfs_compressed data files, so skip block validation for them.
 		 */
-		if (!file->is_datafile || skip_block_validation || file->is_cfs)
+		if (file->is_datafile && !file->is_cfs && !skip_block_validation &&
+			validate_mode == VALIDATE_QUICK)
+		{
+			if (!validate_file_headers(file, file_fullpath,
+									   state->backup_version,
+									   &(backup->hdr_map)))
+				state->corrupted = true;
+		}
+		else if (!file->is_datafile || skip_block_validation || file->is_cfs)
 		{
 			/*
 			 * Pre 2.0.22 we use CRC-32C, but in newer version of pg_probackup we
@@ -341,20 +569,20 @@ pgBackupValidateFiles(void *arg)
 			 *
 			 * Starting from 2.0.25 we calculate crc of pg_control differently.
 			 */
-			if (arguments->backup_version >= 20025 &&
+			if (state->backup_version >= 20025 &&
 				strcmp(file->name, "pg_control") == 0 &&
 				!file->external_dir_num)
-				crc = get_pgcontrol_checksum(arguments->base_path);
+				crc = get_pgcontrol_checksum(backup->database_dir);
 			else
 				crc = pgFileGetCRC(file_fullpath,
-								   arguments->backup_version <= 20021 ||
-								   arguments->backup_version >= 20025,
+								   state->backup_version <= 20021 ||
+								   state->backup_version >= 20025,
 								   false);
 			if (crc != file->crc)
 			{
 				elog(WARNING, "Invalid CRC of backup file \"%s\" : %X. Expected %X",
 						file_fullpath, crc, file->crc);
-				arguments->corrupted = true;
+				state->corrupted = true;
 			}
 		}
 		else
@@ -364,18 +592,13 @@ pgBackupValidateFiles(void *arg)
 			 * check page headers, checksums (if enabled)
 			 * and compute checksum of the file
 			 */
-			if (!validate_file_pages(file, file_fullpath, arguments->stop_lsn,
-								  arguments->checksum_version,
-								  arguments->backup_version,
-								  arguments->hdr_map))
-				arguments->corrupted = true;
+			if (!validate_file_pages(file, file_fullpath, backup->stop_lsn,
+								  backup->checksum_version,
+								  state->backup_version,
+								  &(backup->hdr_map)))
+				state->corrupted = true;
 		}
 	}
-
-	/* Data files validation is successful */
-	arguments->ret = 0;
-
-	return NULL;
 }
 
 /*
@@ -385,6 +608,10 @@ pgBackupValidateFiles(void *arg)
 int
 do_validate_all(void)
 {
+	parray	   *instances = parray_new();
+	parray	   *validate_list = parray_new();
+	int			i;
+
 	corrupted_backup_found = false;
 	skipped_due_to_lock = false;
 
@@ -438,14 +665,36 @@ do_validate_all(void)
 				continue;
 			}
 
-			do_validate_instance();
+			parray_append(instances, validate_instance_start());
 		}
 	}
 	else
 	{
-		do_validate_instance();
+		parray_append(instances, validate_instance_start());
+	}
+
+	/* Validate files of the backups of all instances at once */
+	for (i = 0; i < parray_num(instances); i++)
+	{
+		validate_instance_state *state;
+
+		state = (validate_instance_state *) parray_get(instances, i);
+		parray_concat(validate_list, state->validate_list);
+	}
+
+	pgBackupValidateList(validate_list);
+
+	for (i = 0; i < parray_num(instances); i++)
+	{
+		validate_instance_state *state;
+
+		state = (validate_instance_state *) parray_get(instances, i);
+		validate_instance_finish(state);
 	}
 
+	parray_free(validate_list);
+	parray_free(instances);
+
 	/* TODO: Probably we should have different exit code for every condition
 	 * and they combination:
 	 *  0 - all backups are valid
@@ -470,13 +719,15 @@ do_validate_all(void)
 }
 
 /*
- * Validate all backups in the given instance of the backup catalog.
+ * Check backup chains of the instance and lock the backups, which can be
+ * validated. Return the state to be passed to validate_instance_finish()
+ * after validation of the files of the locked backups.
  */
-static void
-do_validate_instance(void)
+static validate_instance_state *
+validate_instance_start(void)
 {
 	int			i;
-	int			j;
+	validate_instance_state *state;
 	parray	   *backups;
 	pgBackup   *current_backup = NULL;
 
@@ -485,7 +736,13 @@ do_validate_instance(void)
 	/* Get list of all backups sorted in order of descending start time */
 	backups = catalog_get_backup_list(instance_name, INVALID_BACKUP_ID);
 
-	/* Examine backups one by one and validate them */
+	state = pgut_new(validate_instance_state);
+	strcpy(state->arclog_path, arclog_path);
+	state->xlog_seg_size = instance_config.xlog_seg_size;
+	state->backups = backups;
+	state->validate_list = parray_new();
+
+	/* Examine backups one by one and choose backups to validate */
 	for (i = 0; i < parray_num(backups); i++)
 	{
 		pgBackup   *base_full_backup;
@@ -575,14 +832,40 @@ do_validate_instance(void)
 			skipped_due_to_lock = true;
 			continue;
 		}
-		/* Valiate backup files*/
-		pgBackupValidate(current_backup, NULL);
+
+		parray_append(state->validate_list, current_backup);
+	}
+
+	return state;
+}
+
+/*
+ * Validate WAL of the backups of the instance, which files are validated,
+ * and propagate their status to descendants. Backups are examined in the same
+ * order as by validate_instance_start(), so the result is the same as if they
+ * were validated one by one.
+ */
+static void
+validate_instance_finish(validate_instance_state *state)
+{
+	int			i;
+	int			j;
+	parray	   *backups = state->backups;
+	pgBackup   *current_backup = NULL;
+
+	for (i = 0; i < parray_num(backups); i++)
+	{
+		current_backup = (pgBackup *) parray_get(backups, i);
+
+		/* Validation of the backup was skipped */
+		if (!parray_contains(state->validate_list, current_backup))
+			continue;
 
 		/* Validate corresponding WAL files */
 		if (current_backup->status == BACKUP_STATUS_OK)
-			validate_wal(current_backup, arclog_path, 0,
+			validate_wal(current_backup, state->arclog_path, 0,
 						 0, 0, current_backup->tli,
-						 instance_config.xlog_seg_size);
+						 state->xlog_seg_size);
 
 		/*
 		 * Mark every descendant of corrupted backup as orphan
@@ -677,9 +960,9 @@ do_validate_instance(void)
 							{
 
 								/* Revalidation successful, validate corresponding WAL files */
-								validate_wal(backup, arclog_path, 0,
+								validate_wal(backup, state->arclog_path, 0,
 											 0, 0, backup->tli,
-											 instance_config.xlog_seg_size);
+											 state->xlog_seg_size);
 							}
 						}
 
@@ -697,37 +980,29 @@ do_validate_instance(void)
 	/* cleanup */
 	parray_walk(backups, pgBackupFree);
 	parray_free(backups);
+	parray_free(state->validate_list);
+	pg_free(state);
 }
 
 /*
  * Validate tablespace_map checksum.
  * Error out in case of checksum mismatch.
  * Return 'false' if there are no tablespaces in backup.
- *
- * TODO: it is a bad, that we read the whole filelist just for
- * the sake of tablespace_map. Probably pgBackup should come with
- * already filled pgBackup.files
  */
 bool
 validate_tablespace_map(pgBackup *backup)
 {
 	char        map_path[MAXPGPATH];
-	pgFile     *dummy = NULL;
-	pgFile    **tablespace_map = NULL;
+	pgFile     *tablespace_map = NULL;
 	pg_crc32    crc;
-	parray     *files = get_backup_filelist(backup, true);
 
-	parray_qsort(files, pgFileCompareRelPathWithExternal);
 	join_path_components(map_path, backup->database_dir, PG_TABLESPACE_MAP_FILE);
 
-	dummy = pgFileInit(PG_TABLESPACE_MAP_FILE);
-	tablespace_map = (pgFile **) parray_bsearch(files, dummy, pgFileCompareRelPathWithExternal);
+	tablespace_map = get_backup_file(backup, PG_TABLESPACE_MAP_FILE, 0);
 
 	if (!tablespace_map)
 	{
 		elog(LOG, "there is no file tablespace_map");
-		parray_walk(files, pgFileFree);
-		parray_free(files);
 		return false;
 	}
 
@@ -740,13 +1015,238 @@ validate_tablespace_map(pgBackup *backup)
 	/* check tablespace map checksumms */
 	crc = pgFileGetCRC(map_path, true, false);
 
-	if ((*tablespace_map)->crc != crc)
+	if (tablespace_map->crc != crc)
 		elog(ERROR, "Invalid CRC of tablespace map file \"%s\" : %X. Expected %X, "
 					"probably backup %s is corrupt, validate it",
-				map_path, crc, (*tablespace_map)->crc, base36enc(backup->backup_id));
+				map_path, crc, tablespace_map->crc, base36enc(backup->backup_id));
 
-	pgFileFree(dummy);
-	parray_walk(files, pgFileFree);
-	parray_free(files);
+	pgFileFree(tablespace_map);
 	return true;
 }
+
+/*
+ * Add identity of file to CRC: inode, size, modification time with
+ * nanoseconds and change time. Change time cannot be set back by utime(),
+ * so the file cannot be overwritten unnoticed, even within the same second
+ * and with the same size.
+ */
+static void
+comp_file_stat_crc(pg_crc32 *crc, struct stat *st)
+{
+	uint64		ino = (uint64) st->st_ino;
+	int64		size = (int64) st->st_size;
+	int64		mtime = (int64) st->st_mtime;
+	int64		mtime_nsec = STAT_MTIME_NSEC(st);
+	int64		ctime = (int64) st->st_ctime;
+
+	COMP_FILE_CRC32(true, *crc, &ino, sizeof(ino));
+	COMP_FILE_CRC32(true, *crc, &size, sizeof(size));
+	COMP_FILE_CRC32(true, *crc, &mtime, sizeof(mtime));
+	COMP_FILE_CRC32(true, *crc, &mtime_nsec, sizeof(mtime_nsec));
+	COMP_FILE_CRC32(true, *crc, &ctime, sizeof(ctime));
+}
+
+/*
+ * Compute CRC of names and identities of backup files, which are read
+ * during validation, and of the page header map.
+ * Return false if some file cannot be accessed.
+ */
+static bool
+get_backup_files_crc(pgBackup *backup, parray *files,
+					 const char *external_prefix, pg_crc32 *files_crc)
+{
+	char		path[MAXPGPATH];
+	struct stat st;
+	int			i;
+
+	INIT_FILE_CRC32(true, *files_crc);
+
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+
+		if (!S_ISREG(file->mode) || file->write_size <= 0)
+			continue;
+
+		if (file->external_dir_num)
+		{
+			char		temp[MAXPGPATH];
+
+			makeExternalDirPathByNum(temp, external_prefix, file->external_dir_num);
+			join_path_components(path, temp, file->rel_path);
+		}
+		else
+			join_path_components(path, backup->database_dir, file->rel_path);
+
+		if (stat(path, &st) == -1)
+			return false;
+
+		COMP_FILE_CRC32(true, *files_crc, file->rel_path, strlen(file->rel_path));
+		COMP_FILE_CRC32(true, *files_crc, &file->external_dir_num,
+						sizeof(file->external_dir_num));
+		comp_file_stat_crc(files_crc, &st);
+	}
+
+	if (stat(backup->hdr_map.path, &st) == 0)
+		comp_file_stat_crc(files_crc, &st);
+	else if (errno != ENOENT)
+		return false;
+
+	FIN_FILE_CRC32(true, *files_crc);
+
+	return true;
+}
+
+/*
+ * Read VALIDATION_LEDGER of the backup.
+ * Return false if there is no ledger or it is corrupted.
+ */
+static bool
+read_validation_ledger(pgBackup *backup, ValidationLedger *ledger)
+{
+	char		path[MAXPGPATH];
+	char	   *program_version = NULL;
+	int			parsed_options;
+
+	ConfigOption options[] =
+	{
+		{'s', 0, "program-version",		&program_version, SOURCE_FILE_STRICT},
+		{'u', 0, "content-crc",			&ledger->content_crc, SOURCE_FILE_STRICT},
+		{'u', 0, "files-crc",			&ledger->files_crc, SOURCE_FILE_STRICT},
+		{'b', 0, "block-validation",	&ledger->block_validation, SOURCE_FILE_STRICT},
+		{'t', 0, "validate-time",		&ledger->validate_time, SOURCE_FILE_STRICT},
+		{'u', 0, "sample-position",		&ledger->sample_pos, SOURCE_FILE_STRICT},
+		{0}
+	};
+
+	MemSet(ledger, 0, sizeof(ValidationLedger));
+	join_path_components(path, backup->root_dir, VALIDATION_LEDGER);
+
+	parsed_options = config_read_opt(path, options, WARNING, true, true);
+
+	if (parsed_options == 0 || program_version == NULL)
+	{
+		pg_free(program_version);
+		return false;
+	}
+
+	StrNCpy(ledger->program_version, program_version,
+			sizeof(ledger->program_version));
+	pg_free(program_version);
+
+	return true;
+}
+
+/*
+ * Write VALIDATION_LEDGER of the backup. The ledger is just a cache,
+ * if it is lost, backup files are validated again, so it is not synced.
+ */
+static void
+write_validation_ledger(pgBackup *backup, ValidationLedger *ledger)
+{
+	FILE	   *fp;
+	char		path[MAXPGPATH];
+	char		path_temp[MAXPGPATH];
+	char		timestamp[100];
+
+	join_path_components(path, backup->root_dir, VALIDATION_LEDGER);
+	/* backup may be validated by several processes at once */
+	snprintf(path_temp, sizeof(path_temp), "%s.tmp.%d", path, (int) getpid());
+
+	fp = fopen(path_temp, PG_BINARY_W);
+	if (fp == NULL)
+	{
+		elog(WARNING, "Cannot open validation ledger \"%s\": %s",
+			 path_temp, strerror(errno));
+		return;
+	}
+
+	time2iso(timestamp, lengthof(timestamp), ledger->validate_time, true);
+
+	fprintf(fp, "#Validation ledger\n");
+	fprintf(fp, "program-version = %s\n", ledger->program_version);
+	fprintf(fp, "content-crc = %u\n", ledger->content_crc);
+	fprintf(fp, "files-crc = %u\n", ledger->files_crc);
+	fprintf(fp, "block-validation = %s\n",
+			ledger->block_validation ? "true" : "false");
+	fprintf(fp, "validate-time = '%s'\n", timestamp);
+	fprintf(fp, "sample-position = %u\n", ledger->sample_pos);
+
+	if (fflush(fp) != 0)
+	{
+		elog(WARNING, "Cannot flush validation ledger \"%s\": %s",
+			 path_temp, strerror(errno));
+		fclose(fp);
+		unlink(path_temp);
+		return;
+	}
+
+	if (fclose(fp) != 0 ||
+		chmod(path_temp, FILE_PERMISSION) == -1 ||
+		rename(path_temp, path) < 0)
+	{
+		elog(WARNING, "Cannot write validation ledger \"%s\": %s",
+			 path, strerror(errno));
+		unlink(path_temp);
+	}
+}
+
+/* Forget the result of previous validation of the backup */
+static void
+remove_validation_ledger(pgBackup *backup)
+{
+	char		path[MAXPGPATH];
+
+	join_path_components(path, backup->root_dir, VALIDATION_LEDGER);
+
+	if (unlink(path) == -1 && errno != ENOENT)
+		elog(WARNING, "Cannot remove validation ledger \"%s\": %s",
+			 path, strerror(errno));
+}
+
+/*
+ * Select files of backup validated before to be validated again.
+ * The sample is 'percent' of files, starting from the file, where the
+ * previous sample ended, so that all files are checked after enough runs.
+ * Other files are marked as processed, so validation threads skip them.
+ * Return the number of files in the sample.
+ */
+static int
+select_validation_sample(parray *files, ValidationLedger *ledger, int percent)
+{
+	int			n_files = 0;
+	int			n_sampled;
+	int			start;
+	int			pos = 0;
+	int			i;
+
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+
+		if (S_ISREG(file->mode) && file->write_size > 0)
+			n_files++;
+	}
+
+	if (n_files == 0)
+		return 0;
+
+	n_sampled = (int) (((int64) n_files * percent + 99) / 100);
+	start = ledger->sample_pos % n_files;
+
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+
+		if (!S_ISREG(file->mode) || file->write_size <= 0)
+			continue;
+
+		if ((pos - start + n_files) % n_files >= n_sampled)
+			pg_atomic_test_set_flag(&file->lock);
+		pos++;
+	}
+
+	ledger->sample_pos = (start + n_sampled) % n_files;
+
+	return n_sampled;
+}
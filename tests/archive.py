@@ -2474,6 +2474,197 @@ class ArchiveTest(ProbackupTest, unittest.TestCase):
         # Clean after yourself
         self.del_test_dir(module_name, fname)
 
+    # @unittest.skip("skip")
+    def test_archive_push_stream_compression(self):
+        """
+        push WAL with zstd and lz4 streaming compression,
+        make sure that compressed segments are used by backup,
+        'show --archive' and archive-get
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node, compress=False)
+        self.set_config(
+            backup_dir, 'node', options=['--compress-algorithm=zstd'])
+        node.slow_start()
+
+        wals_dir = os.path.join(backup_dir, 'wal', 'node')
+
+        node.pgbench_init(scale=5)
+
+        self.backup_node(backup_dir, 'node', node)
+
+        self.set_config(
+            backup_dir, 'node',
+            options=['--compress-algorithm=lz4', '--compress-level=9'])
+
+        pgbench = node.pgbench(options=['-T', '10', '--no-vacuum'])
+        pgbench.wait()
+
+        self.backup_node(backup_dir, 'node', node, backup_type='page')
+
+        result = node.safe_psql("postgres", "select * from pgbench_accounts")
+
+        target_lsn = node.safe_psql(
+            "postgres", "select pg_current_wal_lsn()").decode('utf-8').rstrip()
+        self.switch_wal_segment(node)
+
+        wals = [f for f in os.listdir(wals_dir) if not f.endswith('.backup')]
+        self.assertTrue(any(f.endswith('.zst') for f in wals))
+        self.assertTrue(any(f.endswith('.lz4') for f in wals))
+
+        show = self.show_archive(backup_dir, 'node', tli=1)
+        self.assertEqual(show['status'], 'OK')
+
+        node.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node,
+            options=[
+                '--recovery-target-lsn={0}'.format(target_lsn),
+                '--recovery-target-action=promote'])
+
+        node.slow_start()
+
+        self.assertEqual(
+            result, node.safe_psql("postgres", "select * from pgbench_accounts"))
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname, [node])
+
+    # @unittest.skip("skip")
+    def test_archive_purge_segment_ranges(self):
+        """
+        WAL archive with runs of plain and compressed segments
+        must be correctly shown and purged
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node, compress=False)
+        node.slow_start()
+
+        wals_dir = os.path.join(backup_dir, 'wal', 'node')
+
+        full_id = self.backup_node(backup_dir, 'node', node)
+
+        for i in range(3):
+            self.switch_wal_segment(node)
+
+        self.set_config(
+            backup_dir, 'node', options=['--compress-algorithm=zstd'])
+
+        for i in range(3):
+            self.switch_wal_segment(node)
+
+        self.set_config(
+            backup_dir, 'node', options=['--compress-algorithm=none'])
+
+        for i in range(3):
+            self.switch_wal_segment(node)
+
+        self.backup_node(backup_dir, 'node', node)
+
+        wals = [f for f in os.listdir(wals_dir) if not f.endswith('.backup')]
+        self.assertTrue(any(f.endswith('.zst') for f in wals))
+        self.assertTrue(any(len(f) == 24 for f in wals))
+
+        timeline = self.show_archive(backup_dir, 'node', tli=1)
+        self.assertEqual(timeline['status'], 'OK')
+        self.assertEqual(timeline['n-segments'], len(wals))
+
+        # purge WAL, older than the second FULL backup
+        self.delete_pb(backup_dir, 'node', full_id, options=['--wal'])
+
+        start_lsn = self.show_pb(backup_dir, 'node')[0]['start-lsn']
+        xlogid, xrecoff = [int(x, 16) for x in start_lsn.split('/')]
+        segno = ((xlogid << 32) + xrecoff) // (16 * 1024 * 1024)
+        backup_start_segno = '{0:08X}{1:08X}{2:08X}'.format(
+            1, segno // 256, segno % 256)
+
+        wals = [f for f in os.listdir(wals_dir) if not f.endswith('.backup')]
+        self.assertEqual(min(f[:24] for f in wals), backup_start_segno)
+
+        timeline = self.show_archive(backup_dir, 'node', tli=1)
+        self.assertEqual(timeline['status'], 'OK')
+        self.assertEqual(timeline['min-segno'], backup_start_segno)
+        self.assertEqual(timeline['n-segments'], len(wals))
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_archive_index_wal(self):
+        """
+        index-wal must summarize all archived segments except the last one,
+        show must report them and validate to xid must skip them
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node, compress=False)
+        node.slow_start()
+
+        node.safe_psql("postgres", "create table t1 (a text)")
+
+        self.backup_node(backup_dir, 'node', node)
+
+        for i in range(3):
+            node.safe_psql("postgres", "insert into t1 values ('before')")
+            self.switch_wal_segment(node)
+
+        target_xid = node.safe_psql(
+            "postgres",
+            "insert into t1 values ('target') returning (xmin)").decode('utf-8').rstrip()
+        self.switch_wal_segment(node)
+
+        for i in range(3):
+            node.safe_psql("postgres", "insert into t1 values ('after')")
+            self.switch_wal_segment(node)
+
+        sleep(5)
+
+        output = self.run_pb([
+            'index-wal', '-B', backup_dir, '--instance=node', '-j', '4'])
+        self.assertIn("WAL archive of instance 'node' is indexed", output)
+
+        timeline = self.show_archive(backup_dir, 'node', tli=1)
+        self.assertEqual(
+            timeline['n-indexed-segments'], timeline['n-segments'] - 1)
+        self.assertIn('max-indexed-time', timeline)
+
+        # all segments are indexed already
+        output = self.run_pb([
+            'index-wal', '-B', backup_dir, '--instance=node'])
+        self.assertNotIn('Indexing WAL segments', output)
+
+        output = self.validate_pb(
+            backup_dir, 'node',
+            options=['--xid={0}'.format(target_xid),
+                     '--log-level-console=LOG'])
+        self.assertIn('were read before, skip them', output)
+        self.assertIn('INFO: Backup validation completed successfully', output)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
 # TODO test with multiple not archived segments.
 # TODO corrupted file in archive.
 
@@ -3027,3 +3027,520 @@ class BackupTest(ProbackupTest, unittest.TestCase):
 
         # Clean after yourself
         self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_backup_threads_load_balancing(self):
+        """
+        Make sure that files are distributed among threads
+        and per thread statistics is reported for backup and restore
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=10)
+
+        out = self.backup_node(
+            backup_dir, 'node', node, return_id=False,
+            options=['--stream', '-j4', '--log-level-console=LOG'])
+
+        for thread_num in range(1, 5):
+            self.assertIn('Thread [{0}]: backed up'.format(thread_num), out)
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node_restored = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node_restored'))
+        node_restored.cleanup()
+
+        out = self.restore_node(
+            backup_dir, 'node', node_restored,
+            options=['-j4', '--log-level-console=LOG'])
+
+        self.assertIn('Thread [4]: restored', out)
+
+        pgdata_restored = self.pgdata_content(node_restored.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_backup_binary_filelist(self):
+        """
+        Make sure that backups with binary file list
+        can be validated, merged and restored
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        full_id = self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--binary-filelist'])
+
+        filelist_path = os.path.join(
+            backup_dir, 'backups', 'node', full_id, 'backup_content.control')
+
+        with open(filelist_path, 'rb') as f:
+            self.assertEqual(f.read(7), b'PBKFLST')
+
+        pgbench = node.pgbench(options=['-T', '10', '-c', '2', '--no-vacuum'])
+        pgbench.wait()
+
+        # text and binary file lists can be mixed in one chain
+        self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream'])
+
+        page_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='page',
+            options=['--stream', '--binary-filelist'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        self.validate_pb(backup_dir, 'node')
+
+        self.merge_backup(backup_dir, 'node', page_id)
+
+        # merged backup takes id of destination backup
+        filelist_path = os.path.join(
+            backup_dir, 'backups', 'node', page_id, 'backup_content.control')
+
+        with open(filelist_path, 'rb') as f:
+            self.assertEqual(f.read(7), b'PBKFLST')
+
+        self.validate_pb(backup_dir, 'node')
+
+        node_restored = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node_restored'))
+        node_restored.cleanup()
+
+        self.restore_node(backup_dir, 'node', node_restored, options=['-j4'])
+
+        pgdata_restored = self.pgdata_content(node_restored.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_backup_big_non_data_files(self):
+        """
+        Make sure that big non-data files are copied correctly
+        during backup and restore and their checksums are valid
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        external_dir = self.get_tblspace_path(node, 'external_dir')
+        os.mkdir(external_dir)
+
+        # files of different size around the minimal size copied
+        # inside the kernel, which is one chunk
+        for size in [131071, 131072, 131073, 1024 * 1024 * 20 + 1]:
+            with open(os.path.join(external_dir, str(size)), 'wb') as f:
+                f.write(os.urandom(size))
+
+        self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '-j2', '-E', external_dir])
+
+        self.validate_pb(backup_dir, 'node')
+
+        pgdata = self.pgdata_content(
+            node.base_dir, exclude_dirs=['logs'])
+
+        node.cleanup()
+        shutil.rmtree(external_dir, ignore_errors=True)
+
+        self.restore_node(backup_dir, 'node', node, options=['-j2'])
+
+        pgdata_restored = self.pgdata_content(
+            node.base_dir, exclude_dirs=['logs'])
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_backup_dedup_hardlink(self):
+        """
+        Make sure that unchanged files of FULL backup are shared
+        with previous FULL backup and backup stays valid
+        after the previous one is deleted
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=1)
+
+        full_id_1 = self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+
+        full_id_2 = self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--dedup=hardlink'])
+
+        version_path = os.path.join(
+            backup_dir, 'backups', 'node', full_id_2, 'database', 'PG_VERSION')
+
+        self.assertEqual(os.stat(version_path).st_nlink, 2)
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        self.delete_pb(backup_dir, 'node', full_id_1)
+
+        self.assertEqual(os.stat(version_path).st_nlink, 1)
+
+        self.validate_pb(backup_dir, 'node', full_id_2)
+
+        node_restored = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node_restored'))
+        node_restored.cleanup()
+
+        self.restore_node(backup_dir, 'node', node_restored)
+
+        pgdata_restored = self.pgdata_content(node_restored.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_backup_io_mode(self):
+        """
+        Make sure that backups taken with every --io-mode
+        are valid and can be restored with it
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--io-mode=direct'])
+
+        pgbench = node.pgbench(options=['-T', '3', '-c', '2', '--no-vacuum'])
+        pgbench.wait()
+
+        self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '-j2', '--io-mode=dontneed'])
+
+        pgbench = node.pgbench(options=['-T', '3', '-c', '2', '--no-vacuum'])
+        pgbench.wait()
+
+        page_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='page',
+            options=['--stream', '--io-mode=buffered'])
+
+        self.checkdb_node(
+            backup_dir, 'node',
+            options=['-d', 'postgres', '-p', str(node.port), '--io-mode=direct'])
+
+        for io_mode in ['buffered', 'dontneed', 'direct']:
+            self.validate_pb(
+                backup_dir, 'node', options=['--io-mode={0}'.format(io_mode)])
+
+        pgdata = self.pgdata_content(node.data_dir)
+        node.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node, backup_id=page_id,
+            options=['-j2', '--io-mode=direct'])
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        try:
+            self.backup_node(
+                backup_dir, 'node', node,
+                options=['--stream', '--io-mode=mmap'])
+            # we should die here because exception is what we expect to happen
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because of invalid io-mode.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                "ERROR: Invalid value for '--io-mode' option: 'mmap'",
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_backup_io_depth(self):
+        """
+        Make sure that data files read ahead asynchronously
+        are backed up correctly, both sequentially and by pagemap
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        self.backup_node(
+            backup_dir, 'node', node,
+            options=['--io-depth=16', '--io-mode=direct'])
+
+        pgbench = node.pgbench(options=['-T', '3', '-c', '2', '--no-vacuum'])
+        pgbench.wait()
+
+        self.backup_node(
+            backup_dir, 'node', node, backup_type='page',
+            options=['-j2', '--io-depth=16', '--io-mode=direct'])
+
+        pgbench = node.pgbench(options=['-T', '3', '-c', '2', '--no-vacuum'])
+        pgbench.wait()
+
+        delta_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--io-depth=4'])
+
+        self.checkdb_node(
+            backup_dir, 'node',
+            options=['-d', 'postgres', '-p', str(node.port), '--io-depth=8'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+        node.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node, backup_id=delta_id, options=['-j2'])
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        try:
+            self.backup_node(
+                backup_dir, 'node', node,
+                options=['--io-depth=65'])
+            # we should die here because exception is what we expect to happen
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because of too big io-depth.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                "ERROR: Invalid value for '--io-depth' option: 65, maximum is 64",
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_backup_resume(self):
+        """
+        Interrupt FULL and PAGE backups, resume them
+        and make sure that restored data is correct
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        if self.get_version(node) < 90600:
+            return unittest.skip(
+                'Skipped because resume requires PG >= 9.6')
+
+        node.pgbench_init(scale=5)
+
+        for backup_type in ['full', 'page']:
+            gdb = self.backup_node(
+                backup_dir, 'node', node, backup_type=backup_type,
+                gdb=True, options=['--log-level-file=LOG'])
+
+            gdb.set_breakpoint('backup_non_data_file')
+            gdb.run_until_break()
+            gdb.continue_execution_until_break(20)
+
+            # file list is flushed to disk once a minute
+            sleep(61)
+            gdb.continue_execution_until_break()
+            gdb.remove_all_breakpoints()
+            gdb.kill()
+
+            backup_id = self.show_pb(backup_dir, 'node')[-1]['id']
+            self.assertEqual(
+                'RUNNING',
+                self.show_pb(backup_dir, 'node', backup_id)['status'])
+
+            pgbench = node.pgbench(options=['-T', '3', '-c', '2', '--no-vacuum'])
+            pgbench.wait()
+
+            output = self.backup_node(
+                backup_dir, 'node', node, backup_type=None,
+                options=['--resume', '-i', backup_id], return_id=False)
+
+            self.assertIn(
+                'Resuming backup {0}'.format(backup_id), output)
+            self.assertIn(
+                'copied before the backup was interrupted are reused', output)
+
+            self.assertEqual(
+                'OK', self.show_pb(backup_dir, 'node', backup_id)['status'])
+
+        try:
+            self.backup_node(
+                backup_dir, 'node', node, backup_type=None,
+                options=['--resume', '-i', backup_id])
+            # we should die here because exception is what we expect to happen
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because backup is already completed.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                "ERROR: Backup {0} has status OK, only interrupted backups "
+                "with status RUNNING or ERROR can be resumed".format(backup_id),
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        self.validate_pb(backup_dir, 'node')
+
+        node.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node, backup_id=backup_id,
+            options=['--recovery-target=immediate',
+                     '--recovery-target-action=promote'])
+
+        node.slow_start()
+
+        self.assertEqual(
+            node.safe_psql(
+                'postgres',
+                'select sum(abalance) from pgbench_accounts'),
+            node.safe_psql(
+                'postgres',
+                'select sum(delta) from pgbench_history'))
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_backup_resume_dedup(self):
+        """
+        Interrupt FULL backup taken with --dedup=hardlink, resume it
+        without --dedup and make sure that it keeps sharing files
+        and the previous FULL backup is not damaged
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        if self.get_version(node) < 90600:
+            return unittest.skip(
+                'Skipped because resume requires PG >= 9.6')
+
+        node.pgbench_init(scale=1)
+
+        full_id_1 = self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+
+        gdb = self.backup_node(
+            backup_dir, 'node', node, gdb=True,
+            options=['--stream', '--dedup=hardlink'])
+
+        gdb.set_breakpoint('dedup_non_data_file')
+        gdb.run_until_break()
+        gdb.continue_execution_until_break(20)
+        gdb.remove_all_breakpoints()
+        gdb.kill()
+
+        full_id_2 = self.show_pb(backup_dir, 'node')[-1]['id']
+
+        self.backup_node(
+            backup_dir, 'node', node, backup_type=None,
+            options=['--stream', '--resume', '-i', full_id_2])
+
+        with open(os.path.join(
+                backup_dir, 'backups', 'node',
+                full_id_2, 'backup.control')) as f:
+            self.assertIn('dedup = hardlink', f.read())
+
+        version_path = os.path.join(
+            backup_dir, 'backups', 'node', full_id_2, 'database', 'PG_VERSION')
+
+        self.assertEqual(os.stat(version_path).st_nlink, 2)
+
+        self.validate_pb(backup_dir, 'node', full_id_1)
+        self.validate_pb(backup_dir, 'node', full_id_2)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
@@ -520,3 +520,233 @@ class CompressionTest(ProbackupTest, unittest.TestCase):
 
         # Clean after yourself
         self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_compression_stream_zstd(self):
+        """
+        make node, make full, page and delta stream backups with
+        zstd compression, check data correctness in restored instance
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=3)
+
+        self.backup_node(
+            backup_dir, 'node', node,
+            options=[
+                '--stream',
+                '--compress-algorithm=zstd',
+                '--compress-level=19'])
+
+        pgbench = node.pgbench(options=['-T', '10', '--no-vacuum'])
+        pgbench.wait()
+
+        self.backup_node(
+            backup_dir, 'node', node, backup_type='page',
+            options=['--stream', '--compress-algorithm=zstd'])
+
+        pgbench = node.pgbench(options=['-T', '10', '--no-vacuum'])
+        pgbench.wait()
+
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '--compress-algorithm=zstd'])
+
+        self.assertEqual(
+            self.show_pb(backup_dir, 'node', backup_id)['compress-alg'],
+            'zstd')
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node.cleanup()
+
+        self.restore_node(backup_dir, 'node', node, options=['-j', '4'])
+
+        # Physical comparison
+        if self.paranoia:
+            pgdata_restored = self.pgdata_content(node.data_dir)
+            self.compare_pgdata(pgdata, pgdata_restored)
+
+        node.slow_start()
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname, [node])
+
+    # @unittest.skip("skip")
+    def test_compression_stream_lz4(self):
+        """
+        make node, make full and delta stream backups with
+        lz4 compression, check data correctness in restored instance
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=3)
+
+        self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--compress-algorithm=lz4'])
+
+        pgbench = node.pgbench(options=['-T', '10', '--no-vacuum'])
+        pgbench.wait()
+
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=[
+                '--stream',
+                '--compress-algorithm=lz4',
+                '--compress-level=9'])
+
+        self.assertEqual(
+            self.show_pb(backup_dir, 'node', backup_id)['compress-alg'],
+            'lz4')
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node.cleanup()
+
+        self.restore_node(backup_dir, 'node', node, options=['-j', '4'])
+
+        # Physical comparison
+        if self.paranoia:
+            pgdata_restored = self.pgdata_content(node.data_dir)
+            self.compare_pgdata(pgdata, pgdata_restored)
+
+        node.slow_start()
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname, [node])
+
+    # @unittest.skip("skip")
+    def test_compression_pipeline(self):
+        """
+        make full and delta stream backups of big relations with
+        compression, check that pages are compressed in the pipeline
+        and data correctness in restored instance
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        output = self.backup_node(
+            backup_dir, 'node', node, return_id=False,
+            options=[
+                '--stream', '-j', '2',
+                '--compress-algorithm=zlib',
+                '--log-level-console=LOG'])
+
+        self.assertIn('waiting for compression', output)
+        self.assertRegex(output, r'pipelined [1-9][0-9]* files')
+
+        pgbench = node.pgbench(options=['-T', '10', '--no-vacuum'])
+        pgbench.wait()
+
+        self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '-j', '2', '--compress-algorithm=zlib'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node.cleanup()
+
+        self.restore_node(backup_dir, 'node', node, options=['-j', '4'])
+
+        # Physical comparison
+        if self.paranoia:
+            pgdata_restored = self.pgdata_content(node.data_dir)
+            self.compare_pgdata(pgdata, pgdata_restored)
+
+        node.slow_start()
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname, [node])
+
+    # @unittest.skip("skip")
+    def test_compression_mixed_chain(self):
+        """
+        make chain of backups compressed with different
+        algorithms, restore and merge it, check data correctness
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=3)
+
+        self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--compress-algorithm=zlib'])
+
+        for alg in ['zstd', 'lz4', 'pglz']:
+            pgbench = node.pgbench(options=['-T', '5', '--no-vacuum'])
+            pgbench.wait()
+
+            backup_id = self.backup_node(
+                backup_dir, 'node', node, backup_type='delta',
+                options=['--stream', '--compress-algorithm={0}'.format(alg)])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node.cleanup()
+
+        self.restore_node(backup_dir, 'node', node, options=['-j', '4'])
+
+        # Physical comparison
+        if self.paranoia:
+            pgdata_restored = self.pgdata_content(node.data_dir)
+            self.compare_pgdata(pgdata, pgdata_restored)
+
+        node.cleanup()
+
+        self.merge_backup(backup_dir, 'node', backup_id)
+
+        self.assertEqual(
+            self.show_pb(backup_dir, 'node', backup_id)['compress-alg'],
+            'pglz')
+
+        self.validate_pb(backup_dir, 'node', backup_id)
+
+        self.restore_node(backup_dir, 'node', node, options=['-j', '4'])
+
+        if self.paranoia:
+            pgdata_restored = self.pgdata_content(node.data_dir)
+            self.compare_pgdata(pgdata, pgdata_restored)
+
+        node.slow_start()
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname, [node])
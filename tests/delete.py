@@ -54,6 +54,76 @@ class DeleteTest(ProbackupTest, unittest.TestCase):
         # Clean after yourself
         self.del_test_dir(module_name, fname)
 
+    # @unittest.skip("skip")
+    def test_delete_multithreaded(self):
+        """delete backup and purge WAL archive using multiple threads"""
+        fname = self.id().split('.')[3]
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        # full backup
+        backup_id_1 = self.backup_node(backup_dir, 'node', node)
+
+        for i in range(5):
+            node.safe_psql('postgres', 'select pg_switch_wal()')
+
+        pgbench = node.pgbench(
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        pgbench.wait()
+        pgbench.stdout.close()
+
+        backup_id_2 = self.backup_node(backup_dir, 'node', node)
+
+        output = self.delete_pb(
+            backup_dir, 'node', backup_id_1,
+            options=['-j', '4', '--log-level-console=LOG'])
+
+        self.assertIn('Thread [', output)
+        self.assertIn('deleted', output)
+
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(backup_dir, 'backups', 'node', backup_id_1)))
+
+        show_backups = self.show_pb(backup_dir, 'node')
+        self.assertEqual(len(show_backups), 1)
+        self.assertEqual(show_backups[0]['id'], backup_id_2)
+
+        # purge WAL older than the remaining backup
+        wals_dir = os.path.join(backup_dir, 'wal', 'node')
+        wals_before = len(os.listdir(wals_dir))
+
+        output = self.delete_pb(
+            backup_dir, 'node',
+            options=['--delete-wal', '-j', '4', '--log-level-console=LOG'])
+
+        self.assertIn('WAL archive purge', output)
+        self.assertLess(len(os.listdir(wals_dir)), wals_before)
+
+        self.assertEqual(
+            self.show_pb(backup_dir, 'node', backup_id_2)['status'], 'OK')
+        self.validate_pb(backup_dir, 'node')
+
+        # delete the whole instance
+        node.stop()
+        self.del_instance(backup_dir, 'node')
+
+        self.assertFalse(os.path.exists(wals_dir))
+        self.assertFalse(
+            os.path.exists(os.path.join(backup_dir, 'backups', 'node')))
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
     # @unittest.skip("skip")
     # @unittest.expectedFailure
     def test_del_instance_archive(self):
@@ -2829,5 +2829,82 @@ class MergeTest(ProbackupTest, unittest.TestCase):
 
         self.del_test_dir(module_name, fname)
 
+    # @unittest.skip("skip")
+    def test_continue_failed_merge_journal(self):
+        """
+        Check that retry of failed MERGE does not merge again
+        files recorded in merge journal
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        # FULL backup
+        self.backup_node(backup_dir, 'node', node)
+
+        pgbench = node.pgbench(options=['-T', '5', '-c', '2', '--no-vacuum'])
+        pgbench.wait()
+
+        # PAGE backup
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='page')
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        gdb = self.merge_backup(
+            backup_dir, "node", backup_id, gdb=True,
+            options=['--log-level-file=VERBOSE'])
+
+        gdb.set_breakpoint('merge_data_file')
+        gdb.run_until_break()
+        gdb.continue_execution_until_break(5)
+
+        # let the journal be flushed after the next file
+        time.sleep(11)
+        gdb.continue_execution_until_break()
+
+        gdb._execute('signal SIGKILL')
+        gdb._execute('detach')
+        time.sleep(1)
+
+        full_id = self.show_pb(backup_dir, "node")[0]["id"]
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(
+                    backup_dir, 'backups', 'node', full_id, 'merge_journal')))
+
+        # Try to continue failed MERGE
+        output = self.merge_backup(backup_dir, "node", backup_id)
+
+        self.assertIn(
+            'merged before the failure were not merged again', output)
+
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(
+                    backup_dir, 'backups', 'node', backup_id, 'merge_journal')))
+
+        self.validate_pb(backup_dir, 'node')
+
+        # Drop node and restore it
+        node.cleanup()
+        self.restore_node(backup_dir, 'node', node)
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
 # 1. Need new test with corrupted FULL backup
 # 2. different compression levels
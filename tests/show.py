@@ -1,5 +1,6 @@
 import os
 import unittest
+import time
 from .helpers.ptrack_helpers import ProbackupTest, ProbackupException
 
 
@@ -538,3 +539,71 @@ class ShowTest(ProbackupTest, unittest.TestCase):
 
         # Clean after yourself
         self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_show_catalog_index(self):
+        """
+        Make sure that catalog index is created by show
+        and stays consistent with backup catalog and WAL archive
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        self.backup_node(backup_dir, 'node', node)
+        page_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='page')
+
+        # index is not used for recently modified files
+        time.sleep(3)
+
+        show = self.show_pb(backup_dir, 'node')
+        timeline = self.show_archive(backup_dir, 'node', tli=1)
+
+        instance_dir = os.path.join(backup_dir, 'backups', 'node')
+        self.assertTrue(
+            os.path.isfile(os.path.join(instance_dir, '.backup.index')))
+        self.assertTrue(
+            os.path.isfile(os.path.join(instance_dir, '.wal.index')))
+
+        # cached catalog must produce the same output
+        self.assertEqual(show, self.show_pb(backup_dir, 'node'))
+        self.assertEqual(
+            timeline, self.show_archive(backup_dir, 'node', tli=1))
+
+        # modification of control file must be noticed
+        control_path = os.path.join(instance_dir, page_id, 'backup.control')
+        with open(control_path, 'rt') as f:
+            control = f.read()
+
+        with open(control_path, 'wt') as f:
+            f.write(control.replace('status = OK', 'status = ERROR'))
+
+        self.assertEqual(
+            self.show_pb(backup_dir, 'node', page_id)['status'], 'ERROR')
+
+        # deleted backup must be noticed
+        self.delete_pb(backup_dir, 'node', page_id)
+        self.assertEqual(len(self.show_pb(backup_dir, 'node')), 1)
+
+        # new WAL segments must be noticed,
+        # backup waits for its WAL to be archived
+        node.safe_psql(
+            "postgres",
+            "create table t_heap as select generate_series(0,100000) i")
+        self.backup_node(backup_dir, 'node', node, backup_type='page')
+
+        self.assertNotEqual(
+            timeline['max-segno'],
+            self.show_archive(backup_dir, 'node', tli=1)['max-segno'])
+        self.assertEqual(len(self.show_pb(backup_dir, 'node')), 2)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
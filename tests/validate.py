@@ -6,6 +6,7 @@ import subprocess
 from sys import exit
 import time
 import hashlib
+import re
 
 
 module_name = 'validate'
@@ -3967,6 +3968,404 @@ class ValidateTest(ProbackupTest, unittest.TestCase):
         # Clean after yourself
         self.del_test_dir(module_name, fname, [node])
 
+    # @unittest.skip("skip")
+    def test_validation_ledger(self):
+        """
+        Check that unchanged backup is not read again on repeated
+        validation, unless forced, and that changed backup is
+        validated in full
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=1)
+
+        file_path = node.safe_psql(
+            "postgres",
+            "select pg_relation_filepath('pgbench_accounts')").decode('utf-8').rstrip()
+
+        # validation after backup would create the ledger
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, options=['--stream', '--no-validate'])
+
+        self.assertFalse(
+            os.path.isfile(os.path.join(
+                backup_dir, 'backups', 'node', backup_id, 'validation_ledger')))
+
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id=backup_id, options=['--log-level-console=LOG'])
+        self.assertNotIn('files are not changed since validation', output)
+        self.assertIn(
+            'INFO: Backup {0} data files are valid'.format(backup_id), output)
+
+        self.assertTrue(
+            os.path.isfile(os.path.join(
+                backup_dir, 'backups', 'node', backup_id, 'validation_ledger')))
+
+        output = self.validate_pb(backup_dir, 'node', backup_id=backup_id)
+        self.assertIn(
+            'INFO: Backup {0} files are not changed since validation'.format(backup_id),
+            output)
+        self.assertIn('skip validation of files', output)
+
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id=backup_id,
+            options=['--validate-sample=50'])
+        self.assertIn(
+            'INFO: Backup {0} files are not changed since validation'.format(backup_id),
+            output)
+        self.assertIn('of them', output)
+        self.assertNotIn('skip validation of files', output)
+
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id=backup_id,
+            options=['--force-full-validate'])
+        self.assertNotIn('files are not changed since validation', output)
+
+        # change the size of data file
+        file = os.path.join(
+            backup_dir, 'backups', 'node', backup_id, 'database', file_path)
+        with open(file, 'ab') as f:
+            f.write(b'garbage')
+            f.flush()
+
+        try:
+            self.validate_pb(backup_dir, 'node', backup_id=backup_id)
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because data file is corrupted.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    self.output, self.cmd))
+        except ProbackupException as e:
+            self.assertNotIn('files are not changed since validation', e.message)
+            self.assertIn(
+                'WARNING: Backup {0} data files are corrupted'.format(backup_id),
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        self.assertFalse(
+            os.path.isfile(os.path.join(
+                backup_dir, 'backups', 'node', backup_id, 'validation_ledger')))
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname, [node])
+
+    # @unittest.skip("skip")
+    def test_validate_quick_mode(self):
+        """
+        Check that validate in quick mode detects corruption
+        of data file and page_header_map without decompressing pages
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=1)
+
+        file_path = node.safe_psql(
+            "postgres",
+            "select pg_relation_filepath('pgbench_accounts')").decode('utf-8').rstrip()
+
+        # validation after backup would create the ledger,
+        # then quick validation would skip the files
+        ok_id = self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--compress', '--no-validate'])
+
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id=ok_id,
+            options=['--mode=quick', '--log-level-console=VERBOSE'])
+        self.assertIn('Validate page headers for file', output)
+        self.assertNotIn('Validate relation blocks for file', output)
+        self.assertIn(
+            'INFO: Backup {0} data files are valid'.format(ok_id), output)
+
+        # corrupt data file without changing its size
+        backup_id = self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--compress', '--no-validate'])
+
+        file = os.path.join(
+            backup_dir, 'backups', 'node', backup_id, 'database', file_path)
+        with open(file, "r+b", 0) as f:
+            f.seek(8192)
+            f.write(b"bla")
+            f.flush()
+
+        try:
+            self.validate_pb(
+                backup_dir, 'node', backup_id=backup_id,
+                options=['--mode=quick'])
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because data file is corrupted.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    self.output, self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'Invalid CRC of backup file', e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+            self.assertIn(
+                'WARNING: Backup {0} data files are corrupted'.format(backup_id),
+                e.message)
+
+        # corrupt page_header_map
+        backup_id = self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--compress', '--no-validate'])
+
+        page_header_map = os.path.join(
+            backup_dir, 'backups', 'node', backup_id, 'page_header_map')
+
+        with open(page_header_map, "rb+", 0) as f:
+            f.seek(42)
+            f.write(b"blahblahblahblah")
+            f.flush()
+
+        try:
+            self.validate_pb(
+                backup_dir, 'node', backup_id=backup_id,
+                options=['--mode=quick'])
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because page_header_map is corrupted.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    self.output, self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'WARNING: Backup {0} data files are corrupted'.format(backup_id),
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname, [node])
+
+    # @unittest.skip("skip")
+    def test_validate_all_backups_in_parallel(self):
+        """
+        make two nodes, take FULL and several DELTA backups of each,
+        corrupt file in DELTA1 backup of node1,
+        run validate of all instances, expect DELTA1 of node1
+        to gain status CORRUPT, its descendants to gain status ORPHAN
+        and backups of node2 to stay OK
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        self.init_pb(backup_dir)
+
+        nodes = []
+        backups = {}
+        for name in ['node1', 'node2']:
+            node = self.make_simple_node(
+                base_dir=os.path.join(module_name, fname, name),
+                set_replication=True,
+                initdb_params=['--data-checksums'])
+            self.add_instance(backup_dir, name, node)
+            node.slow_start()
+            nodes.append(node)
+
+            node.safe_psql(
+                "postgres",
+                "create table t_heap as select i as id, md5(i::text) as text "
+                "from generate_series(0,10000) i")
+
+            backups[name] = [self.backup_node(
+                backup_dir, name, node, options=['--stream'])]
+
+            for i in range(3):
+                node.safe_psql(
+                    "postgres",
+                    "insert into t_heap select i as id, md5(i::text) as text "
+                    "from generate_series(0,10000) i")
+                backups[name].append(self.backup_node(
+                    backup_dir, name, node,
+                    backup_type='delta', options=['--stream']))
+
+        file_path = nodes[0].safe_psql(
+            "postgres",
+            "select pg_relation_filepath('t_heap')").decode('utf-8').rstrip()
+
+        # Corrupt some file in DELTA1 backup of node1
+        file = os.path.join(
+            backup_dir, 'backups', 'node1',
+            backups['node1'][1], 'database', file_path)
+        with open(file, "r+b", 0) as f:
+            f.seek(42)
+            f.write(b"blah")
+            f.flush()
+
+        try:
+            self.validate_pb(backup_dir, options=["-j", "4"])
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because of data files corruption.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'WARNING: Backup {0} data files are corrupted'.format(
+                    backups['node1'][1]), e.message)
+            for backup_id in backups['node1'][2:]:
+                self.assertIn(
+                    'WARNING: Backup {0} is orphaned because '
+                    'his parent {1} has status: CORRUPT'.format(
+                        backup_id, backups['node1'][1]), e.message)
+            for backup_id in backups['node2']:
+                self.assertIn(
+                    'INFO: Backup {0} data files are valid'.format(
+                        backup_id), e.message)
+            self.assertIn('WARNING: Some backups are not valid', e.message)
+
+        self.assertEqual(
+            'OK',
+            self.show_pb(backup_dir, 'node1', backups['node1'][0])['status'])
+        self.assertEqual(
+            'CORRUPT',
+            self.show_pb(backup_dir, 'node1', backups['node1'][1])['status'])
+        for backup_id in backups['node1'][2:]:
+            self.assertEqual(
+                'ORPHAN',
+                self.show_pb(backup_dir, 'node1', backup_id)['status'])
+        for backup_id in backups['node2']:
+            self.assertEqual(
+                'OK',
+                self.show_pb(backup_dir, 'node2', backup_id)['status'])
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname, nodes)
+
+    # @unittest.skip("skip")
+    def test_validate_wal_summary(self):
+        """
+        make node with archiving, make archive backup, generate
+        several WAL segments, validate to xid twice and check that
+        segments read by first validation are not read again,
+        corrupt one of them and check that corruption is detected
+        """
+        fname = self.id().split('.')[3]
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.safe_psql("postgres", "CREATE TABLE tbl0005 (a text)")
+
+        self.backup_node(backup_dir, 'node', node)
+
+        for i in range(3):
+            node.safe_psql(
+                "postgres", "INSERT INTO tbl0005 VALUES ('before target')")
+            self.switch_wal_segment(node)
+
+        with node.connect("postgres") as con:
+            res = con.execute(
+                "INSERT INTO tbl0005 VALUES ('target') RETURNING (xmin)")
+            con.commit()
+            target_xid = res[0][0]
+        self.switch_wal_segment(node)
+
+        node.safe_psql(
+            "postgres", "INSERT INTO tbl0005 VALUES ('after target')")
+        self.switch_wal_segment(node)
+        time.sleep(5)
+
+        output = self.validate_pb(
+            backup_dir, 'node',
+            options=["--xid={0}".format(target_xid), "-j", "4",
+                     "--log-level-console=LOG"])
+        self.assertIn("INFO: Backup validation completed successfully", output)
+        self.assertNotIn("were read before, skip them", output)
+
+        self.assertTrue(
+            os.path.isfile(os.path.join(
+                backup_dir, 'backups', 'node', '.wal.summary')))
+
+        output = self.validate_pb(
+            backup_dir, 'node',
+            options=["--xid={0}".format(target_xid), "-j", "4",
+                     "--log-level-console=LOG"])
+        self.assertIn("INFO: Backup validation completed successfully", output)
+        self.assertIn("were read before, skip them", output)
+
+        # Summaries are not used by full validation
+        full_output = self.validate_pb(
+            backup_dir, 'node',
+            options=["--xid={0}".format(target_xid), "-j", "4",
+                     "--force-full-validate", "--log-level-console=LOG"])
+        self.assertIn(
+            "INFO: Backup validation completed successfully", full_output)
+        self.assertNotIn("were read before, skip them", full_output)
+
+        # Summary file with wrong checksum is ignored
+        summary_file = os.path.join(
+            backup_dir, 'backups', 'node', '.wal.summary')
+        with open(summary_file, "r+b", 0) as f:
+            f.seek(len("PBKWSUM 3\n"))
+            f.write(b"9")
+            f.flush()
+
+        full_output = self.validate_pb(
+            backup_dir, 'node',
+            options=["--xid={0}".format(target_xid), "-j", "4",
+                     "--log-level-console=LOG"])
+        self.assertIn(
+            "INFO: Backup validation completed successfully", full_output)
+        self.assertIn("Ignore invalid WAL summary file", full_output)
+        self.assertNotIn("were read before, skip them", full_output)
+
+        # Corrupt the last skipped segment
+        skipped = re.search(
+            r'WAL segments from \S+ to (\S+) were read before', output)
+        self.assertIsNotNone(skipped)
+
+        wal_file = os.path.join(backup_dir, 'wal', 'node', skipped.group(1))
+        with open(wal_file, "r+b", 0) as f:
+            f.seek(8192 + 100)
+            f.write(b"blahblahblahblah")
+            f.flush()
+
+        try:
+            self.validate_pb(
+                backup_dir, 'node',
+                options=["--xid={0}".format(target_xid), "-j", "4"])
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because of WAL segment corruption.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'ERROR: Not enough WAL records to xid',
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname, [node])
+
 # validate empty backup list
 # page from future during validate
 # page from future during backup